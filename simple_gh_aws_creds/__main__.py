@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+from .cli import main
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
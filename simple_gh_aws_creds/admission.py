@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+Quota aware admission control before a fleet apply starts.
+
+A run creating users or keys could fail at repo 4,990 when it hits the account's
+IAM user quota, leaving a half applied fleet. :func:`admit` calls
+``get_account_summary`` once per account, counts the creations the run plans to
+make, and decides which repos can proceed, before any mutation.
+
+Two modes:
+
+- :data:`MODE_REFUSE`: if any repo can't be admitted, refuse the whole run
+  by raising :class:`AdmissionError`.
+- :data:`MODE_PARTITION`: admit as many repos as the quotas allow, in order,
+  and report the others as rejected.
+
+The per user quotas are checked against what the user will hold after the
+run: its existing access keys and attached policies, see :class:`UserUsage`,
+plus the ones the plan adds.
+"""
+
+import typing as T
+import dataclasses
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_iam.client import IAMClient
+    from .impl import SetupGitHubRepo
+
+MODE_OFF = "off"
+MODE_REFUSE = "refuse"
+MODE_PARTITION = "partition"
+
+# plan action names, see simple_gh_aws_creds.fleet.plan_setup
+ACTION_CREATE_IAM_USER = "create_iam_user"
+ACTION_CREATE_ACCESS_KEY = "create_access_key"
+ACTION_ATTACH_PREFIXES = ("attach_policy:", "attach_shared_policy:")
+
+
+class AdmissionError(Exception):
+    """
+    Raised in refuse mode when the planned run would exceed an account quota.
+    """
+
+
+@dataclasses.dataclass
+class AccountQuota:
+    """
+    Current usage and quotas of an AWS account, from ``get_account_summary``.
+    """
+
+    users: int = dataclasses.field()
+    users_quota: int = dataclasses.field()
+    access_keys_per_user_quota: int = dataclasses.field()
+    attached_policies_per_user_quota: int = dataclasses.field()
+
+    @classmethod
+    def from_summary_map(cls, summary_map: dict[str, int]) -> "AccountQuota":
+        return cls(
+            users=summary_map.get("Users", 0),
+            users_quota=summary_map.get("UsersQuota", 5000),
+            access_keys_per_user_quota=summary_map.get("AccessKeysPerUserQuota", 2),
+            attached_policies_per_user_quota=summary_map.get(
+                "AttachedPoliciesPerUserQuota", 10
+            ),
+        )
+
+    @classmethod
+    def from_iam(cls, iam_client: "IAMClient") -> "AccountQuota":
+        res = iam_client.get_account_summary()
+        return cls.from_summary_map(res["SummaryMap"])
+
+    @property
+    def users_available(self) -> int:
+        return max(0, self.users_quota - self.users)
+
+
+@dataclasses.dataclass
+class UserUsage:
+    """
+    What an IAM user already uses, all 0 for a user the run creates.
+
+    :param access_keys: number of access keys, active or not.
+    :param attached_policies: number of attached managed policies, including
+        the ones the fleet spec doesn't know about.
+    """
+
+    access_keys: int = dataclasses.field(default=0)
+    attached_policies: int = dataclasses.field(default=0)
+
+
+@dataclasses.dataclass
+class AdmissionDecision:
+    """
+    :param admitted: setups allowed to proceed, in input order.
+    :param rejected: ``(setup, reason)`` pairs.
+    :param planned_user_creations: number of users the admitted repos create.
+    """
+
+    quota: AccountQuota = dataclasses.field()
+    admitted: T.List["SetupGitHubRepo"] = dataclasses.field(default_factory=list)
+    rejected: T.List[T.Tuple["SetupGitHubRepo", str]] = dataclasses.field(
+        default_factory=list
+    )
+    planned_user_creations: int = dataclasses.field(default=0)
+
+
+class AdmissionBudget:
+    """
+    Running quota budget, repos are admitted one at a time as their plans
+    arrive, so a streamed run never holds all of them.
+    """
+
+    def __init__(self, quota: AccountQuota):
+        self.quota = quota
+        self.users_available = quota.users_available
+        self.planned_user_creations = 0
+        self.n_admitted = 0
+        self.n_rejected = 0
+        self.first_rejection: T.Optional[T.Tuple[str, str]] = None
+
+    def _check(
+        self,
+        actions: T.List[str],
+        usage: UserUsage,
+    ) -> T.Optional[str]:
+        quota = self.quota
+        n_attach = usage.attached_policies + sum(
+            action.startswith(ACTION_ATTACH_PREFIXES) for action in actions
+        )
+        if n_attach > quota.attached_policies_per_user_quota:
+            return (
+                f"{n_attach} attached policies exceed the per user quota "
+                f"of {quota.attached_policies_per_user_quota}"
+            )
+        if ACTION_CREATE_ACCESS_KEY in actions and (
+            usage.access_keys + 1 > quota.access_keys_per_user_quota
+        ):
+            return (
+                f"{usage.access_keys + 1} access keys exceed the per user quota "
+                f"of {quota.access_keys_per_user_quota}"
+            )
+        if ACTION_CREATE_IAM_USER in actions and self.users_available <= 0:
+            return (
+                f"IAM user quota of {quota.users_quota} reached "
+                f"({quota.users} existing users)"
+            )
+        return None
+
+    def admit(
+        self,
+        setup: "SetupGitHubRepo",
+        actions: T.List[str],
+        usage: T.Optional[UserUsage] = None,
+    ) -> T.Optional[str]:
+        """
+        Admit one repo and take its creations from the budget.
+
+        :param actions: the planned actions, see
+            :func:`~simple_gh_aws_creds.fleet.plan_setup`.
+        :param usage: what the repo's IAM user already uses.
+
+        :return: ``None`` if admitted, otherwise the reason of the rejection.
+        """
+        reason = self._check(actions, usage or UserUsage())
+        if reason is None:
+            if ACTION_CREATE_IAM_USER in actions:
+                self.users_available -= 1
+                self.planned_user_creations += 1
+            self.n_admitted += 1
+        else:
+            self.n_rejected += 1
+            if self.first_rejection is None:
+                self.first_rejection = (setup.iam_user_name, reason)
+        return reason
+
+    def refuse_if_rejected(self):
+        """
+        :raises AdmissionError: if any repo was rejected.
+        """
+        if self.n_rejected:
+            iam_user_name, reason = self.first_rejection
+            raise AdmissionError(
+                f"{self.n_rejected} of {self.n_rejected + self.n_admitted} repos "
+                f"would exceed account quotas, nothing was changed. "
+                f"First rejection: {iam_user_name}: {reason}"
+            )
+
+
+def admit(
+    plans: T.Iterable[
+        T.Tuple["SetupGitHubRepo", T.List[str], T.Optional[UserUsage]]
+    ],
+    quota: AccountQuota,
+    mode: str = MODE_REFUSE,
+) -> AdmissionDecision:
+    """
+    Decide which repos can proceed given their plans and the account quota.
+    List version of :class:`AdmissionBudget`.
+
+    :param plans: ``(setup, planned actions, usage)`` triples, as returned by
+        :func:`~simple_gh_aws_creds.fleet.plan_setup_with_usage`.
+
+    :raises AdmissionError: in refuse mode, if any repo is rejected.
+    """
+    if mode not in (MODE_REFUSE, MODE_PARTITION):
+        raise ValueError(f"unknown admission mode {mode!r}")
+    decision = AdmissionDecision(quota=quota)
+    budget = AdmissionBudget(quota)
+    for setup, actions, usage in plans:
+        reason = budget.admit(setup, actions, usage)
+        if reason is None:
+            decision.admitted.append(setup)
+        else:
+            decision.rejected.append((setup, reason))
+    decision.planned_user_creations = budget.planned_user_creations
+    if mode == MODE_REFUSE:
+        budget.refuse_if_rejected()
+    return decision
@@ -1,3 +1,86 @@
 # -*- coding: utf-8 -*-
 
 from .impl import SetupGitHubRepo
+from .github_client import ETagCache
+from .github_client import GitHubClient
+from .inventory import AccessKeyRecord
+from .inventory import UserInventory
+from .inventory import iter_inventory
+from .inventory import write_jsonl as write_inventory_jsonl
+from .inventory import write_csv as write_inventory_csv
+from .concurrency import RateLimiter
+from .rotation import RotationResult
+from .rotation import rotate_access_key
+from .rotation import RotationScheduler
+from .verify import VerificationResult
+from .verify import wait_until_credential_usable
+from .verify import verify_many
+from .fleet import SecretNames
+from .fleet import PolicyTemplate
+from .fleet import RepoSpec
+from .fleet import FleetConfig
+from .fleet import RepoResult
+from .fleet import run_fleet
+from .drift import RepoDrift
+from .drift import scan_drift
+from .fleet import scan_fleet_drift
+from .policy import PolicyValidationError
+from .policy import CompiledPolicy
+from .policy import compile_policy
+from .policy import canonical_policy_hash
+from .admission import AdmissionError
+from .admission import AccountQuota
+from .admission import AdmissionDecision
+from .admission import AdmissionBudget
+from .admission import UserUsage
+from .admission import admit
+from .single_flight import SingleFlight
+from .policy_arn import InvalidPolicyArnError
+from .policy_arn import PolicyArnInfo
+from .policy_arn import PolicyArnResolver
+from .shared_policy import SharedPolicyState
+from .shared_policy import SharedPolicyManager
+from .shared_policy import shared_policy_name_for
+from .fleet import TemplateRule
+from .daemon import ProvisioningDaemon
+from .daemon import DaemonMetrics
+from .daemon import compute_signature
+from .daemon import verify_signature
+from .state import ApplyState
+from .state import spec_hash
+from .sharding import Shard
+from .sharding import shard_of
+from .sharding import merge_results
+from .sharding import merge_states
+from .compact import Interner
+from .fleet import parse_repo_spec
+from .fleet import iter_repo_specs_jsonl
+from .github_http2 import Http2GitHubClient
+from .impl import REGION_AS_SECRET
+from .impl import REGION_AS_VARIABLE
+from .impl import REGION_AS_ORG_VARIABLE
+from .fleet import sync_org_region_variables
+from .github_client import SECRET_STORE_ACTIONS
+from .github_client import SECRET_STORE_DEPENDABOT
+from .github_client import SECRET_STORE_CODESPACES
+from .github_client import SecretTarget
+from .secret_ledger import SecretLedger
+from .circuit_breaker import CircuitOpenError
+from .circuit_breaker import CircuitBreaker
+from .circuit_breaker import attach_to_boto_client
+from .concurrency import pipeline_imap_unordered
+from .oidc import OidcProviderManager
+from .oidc import SetupGitHubOidcRole
+from .oidc import trust_policy_document
+from .tracing import Span
+from .tracing import Tracer
+from .tracing import InMemoryExporter
+from .tracing import ChromeTraceExporter
+from .tracing import OtlpHttpExporter
+from .tracing import get_tracer
+from .tracing import set_tracer
+from .profiling import profile_run
+from .profiling import import_time_breakdown
+from .orphans import ManagedUser
+from .orphans import find_orphans
+from .orphans import delete_orphans
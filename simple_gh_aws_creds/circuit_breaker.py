@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+Circuit breakers for the IAM and GitHub backends of a fleet run.
+
+During a GitHub incident every remaining repo of a fleet run used to call the
+API anyway, each call slowly timing out. A :class:`CircuitBreaker` watches the
+outcome of the last calls to one backend, IAM of one account or GitHub for one
+host and token:
+
+- **closed**: calls go through. When at least ``min_calls`` of the last
+  ``window`` calls failed at ``failure_rate`` or more, the breaker opens.
+- **open**: calls fail fast with :class:`CircuitOpenError`, without touching
+  the network, for ``cooldown`` seconds.
+- **half open**: after the cooldown one probe call goes through, its success
+  closes the breaker, its failure opens it for another cooldown.
+
+Only backend failures count: 5xx replies, throttling, rate limits, timeouts and
+connection errors. A ``NoSuchEntity`` or a ``404`` is the backend working.
+
+:func:`attach_to_boto_client` hooks a breaker into a boto3 client with botocore
+events, :class:`~simple_gh_aws_creds.github_client.GitHubClient` takes one as
+its ``circuit_breaker``. Fleet runs create one breaker per backend, see
+:func:`~simple_gh_aws_creds.fleet.run_fleet`, and run the IAM and GitHub steps
+of ``apply`` in separate worker pools, so a slow backend can't take the workers
+the other one needs.
+"""
+
+import typing as T
+import time
+import threading
+import collections
+import dataclasses
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from botocore.client import BaseClient
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+#: error codes of AWS replies meaning the backend is overloaded
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "ServiceUnavailable",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    The call was not made, the breaker of its backend is open.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(
+            f"circuit {name!r} is open, retry in {retry_after:.1f} seconds"
+        )
+
+
+@dataclasses.dataclass
+class CircuitBreaker:
+    """
+    Thread safe circuit breaker of one backend, see the module docstring.
+
+    :param name: backend name, used in messages.
+    :param failure_rate: open when this share of the recent calls failed.
+    :param window: number of recent calls considered.
+    :param min_calls: don't open on fewer recent calls than this.
+    :param cooldown: seconds the breaker stays open before a probe call.
+    """
+
+    name: str = dataclasses.field()
+    failure_rate: float = dataclasses.field(default=0.5)
+    window: int = dataclasses.field(default=20)
+    min_calls: int = dataclasses.field(default=5)
+    cooldown: float = dataclasses.field(default=30.0)
+    clock: T.Callable[[], float] = dataclasses.field(default=time.monotonic)
+
+    def __post_init__(self):
+        if not (0 < self.failure_rate <= 1):
+            raise ValueError(f"failure_rate must be in (0, 1], got {self.failure_rate}")
+        self._outcomes: T.Deque[bool] = collections.deque(maxlen=self.window)
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at: T.Optional[float] = None
+        self.n_rejected = 0
+        self.n_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(self.clock())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == STATE_OPEN and now - self._opened_at >= self.cooldown:
+            self._state = STATE_HALF_OPEN
+            self._probe_started_at = None
+        return self._state
+
+    def _open(self, now: float):
+        self._state = STATE_OPEN
+        self._opened_at = now
+        self._probe_started_at = None
+        self._outcomes.clear()
+        self.n_opened += 1
+
+    def is_open(self) -> bool:
+        """
+        Read-only check, ``True`` while calls are rejected.
+        """
+        return self.state == STATE_OPEN
+
+    def before_call(self):
+        """
+        Call before each backend call.
+
+        :raises CircuitOpenError: if the call must not be made.
+        """
+        with self._lock:
+            now = self.clock()
+            state = self._current_state(now)
+            if state == STATE_CLOSED:
+                return
+            if state == STATE_HALF_OPEN:
+                # one probe at a time, a probe that never reported back is
+                # given up after a cooldown
+                if (
+                    self._probe_started_at is None
+                    or now - self._probe_started_at >= self.cooldown
+                ):
+                    self._probe_started_at = now
+                    return
+                retry_after = self.cooldown - (now - self._probe_started_at)
+            else:
+                retry_after = self.cooldown - (now - self._opened_at)
+            self.n_rejected += 1
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, ok: bool):
+        """
+        Call after each backend call with its outcome.
+        """
+        with self._lock:
+            now = self.clock()
+            state = self._current_state(now)
+            if state == STATE_HALF_OPEN:
+                if ok:
+                    self._state = STATE_CLOSED
+                    self._probe_started_at = None
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            if state == STATE_OPEN:
+                # a call started before the breaker opened
+                return
+            self._outcomes.append(ok)
+            n_calls = len(self._outcomes)
+            n_failed = n_calls - sum(self._outcomes)
+            if n_calls >= self.min_calls and n_failed / n_calls >= self.failure_rate:
+                self._open(now)
+
+
+def is_aws_backend_failure(status_code: int, error_code: T.Optional[str]) -> bool:
+    return (
+        status_code >= 500
+        or status_code == 429
+        or (error_code is not None and error_code in THROTTLING_ERROR_CODES)
+    )
+
+
+def attach_to_boto_client(client: "BaseClient", breaker: CircuitBreaker):
+    """
+    Guard every call of a boto3 client with the breaker. The outcome is
+    recorded once per API call, after botocore's own retries.
+    """
+    service_id = client.meta.service_model.service_id.hyphenize()
+
+    def before_call(**kwargs):
+        breaker.before_call()
+
+    def after_call(http_response, parsed, **kwargs):
+        error_code = parsed.get("Error", {}).get("Code")
+        breaker.record(
+            not is_aws_backend_failure(http_response.status_code, error_code)
+        )
+
+    def after_call_error(**kwargs):
+        # connection error or timeout, no reply at all
+        breaker.record(False)
+
+    events = client.meta.events
+    events.register(f"before-call.{service_id}", before_call)
+    events.register(f"after-call.{service_id}", after_call)
+    events.register(f"after-call-error.{service_id}", after_call_error)
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command line interface for fleet operations.
+
+Usage::
+
+    simple-gh-aws-creds plan -c fleet.toml
+    simple-gh-aws-creds plan -c fleet.toml --destroy
+    simple-gh-aws-creds apply -c fleet.toml --parallel 16 --only "MacHu-GWU/*"
+    simple-gh-aws-creds apply -c fleet.toml --changed-only
+    simple-gh-aws-creds destroy -c fleet.toml --only MacHu-GWU/old-repo --output jsonl
+    simple-gh-aws-creds drift -c fleet.toml --parallel 32
+    simple-gh-aws-creds serve -c fleet.toml --port 8080 --workers 4
+    simple-gh-aws-creds apply -c fleet.toml --shard 0/4 --output jsonl > results-0.jsonl
+    simple-gh-aws-creds merge results-*.jsonl
+    simple-gh-aws-creds apply -c fleet.toml --trace trace.json
+    simple-gh-aws-creds apply -c fleet.toml --only MacHu-GWU/repo --profile profile/
+    simple-gh-aws-creds gc -c fleet.toml
+    simple-gh-aws-creds gc -c fleet.toml --delete
+
+With ``--output jsonl`` one JSON object per repo is written to stdout and the
+step by step log goes to stderr, so the output can be piped to other tools.
+The exit code is 1 if any repo failed (or drifted, for ``drift``).
+``serve`` runs the webhook daemon, see :mod:`simple_gh_aws_creds.daemon`.
+``--shard`` and ``merge`` split a fleet across machines, see
+:mod:`simple_gh_aws_creds.sharding`. ``--trace`` and ``--otlp-endpoint`` record
+a span per repo, step and API call, see :mod:`simple_gh_aws_creds.tracing`.
+``--profile`` writes a cProfile dump, collapsed stacks of wall time per step and
+an import time breakdown, see :mod:`simple_gh_aws_creds.profiling`.
+``gc`` reports the IAM users whose GitHub repo no longer exists, exit code 1 if
+any, ``gc --delete`` deletes them, see :mod:`simple_gh_aws_creds.orphans`.
+"""
+
+import typing as T
+import sys
+import json
+import argparse
+import contextlib
+from pathlib import Path
+
+from ._version import __version__
+from .fleet import (
+    COMMAND_PLAN,
+    COMMAND_APPLY,
+    COMMAND_DESTROY,
+    COMMAND_PLAN_DESTROY,
+    COMMAND_DRIFT,
+    FleetConfig,
+    RepoResult,
+    run_fleet,
+    scan_fleet_drift,
+)
+from .drift import RepoDrift
+from .tracing import Tracer, ChromeTraceExporter, OtlpHttpExporter, set_tracer
+from .profiling import profile_run
+from .daemon import ProvisioningDaemon
+from .orphans import STATUS_ALIVE, STATUS_ORPHAN, find_orphans, delete_orphans
+from .sharding import Shard, merge_results, merge_states
+from .policy import PolicyValidationError
+from .policy_arn import InvalidPolicyArnError
+from .admission import (
+    MODE_OFF,
+    MODE_REFUSE,
+    MODE_PARTITION,
+    AdmissionError,
+)
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    import boto3
+
+COMMAND_SERVE = "serve"
+COMMAND_MERGE = "merge"
+COMMAND_GC = "gc"
+
+OUTPUT_TEXT = "text"
+OUTPUT_JSONL = "jsonl"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="simple-gh-aws-creds",
+        description="Set up AWS credentials for GitHub Actions across a fleet of repos.",
+    )
+    parser.add_argument("--version", action="version", version=__version__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common_arguments(subparser: argparse.ArgumentParser):
+        subparser.add_argument(
+            "-c",
+            "--config",
+            type=Path,
+            required=True,
+            help="path to the fleet config file (.toml, .yml, .yaml, .json)",
+        )
+        subparser.add_argument(
+            "--parallel",
+            type=int,
+            default=4,
+            help="number of repos processed concurrently (default: 4)",
+        )
+        subparser.add_argument(
+            "--only",
+            action="append",
+            default=[],
+            metavar="PATTERN",
+            help="only process repos whose owner/repo or policy template name "
+            "matches this glob pattern, can be repeated",
+        )
+        subparser.add_argument(
+            "--shard",
+            type=Shard.parse,
+            default=None,
+            metavar="I/K",
+            help="only process shard I of K (0 <= I < K), repos are assigned by "
+            "a stable hash of owner/repo",
+        )
+        subparser.add_argument(
+            "--output",
+            choices=[OUTPUT_TEXT, OUTPUT_JSONL],
+            default=OUTPUT_TEXT,
+            help="output format (default: text)",
+        )
+        subparser.add_argument(
+            "--trace",
+            type=Path,
+            default=None,
+            metavar="PATH",
+            help="write a Chrome trace event JSON file of the run, a span per "
+            "repo, step and API call",
+        )
+        subparser.add_argument(
+            "--otlp-endpoint",
+            default=None,
+            metavar="URL",
+            help="send the spans to this OpenTelemetry collector traces "
+            "endpoint, OTLP/HTTP with JSON encoding",
+        )
+        subparser.add_argument(
+            "--profile",
+            type=Path,
+            default=None,
+            metavar="DIR",
+            help="write a cProfile dump, collapsed stacks of wall time per step "
+            "and an import time breakdown of the run to this directory",
+        )
+        return subparser
+
+    subparser = add_common_arguments(
+        subparsers.add_parser(COMMAND_PLAN, help="show what apply would change")
+    )
+    subparser.add_argument(
+        "--destroy",
+        action="store_true",
+        help="show what destroy would delete instead",
+    )
+    subparser = add_common_arguments(
+        subparsers.add_parser(COMMAND_APPLY, help="create or update resources")
+    )
+    subparser.add_argument(
+        "--admission",
+        choices=[MODE_REFUSE, MODE_PARTITION, MODE_OFF],
+        default=MODE_REFUSE,
+        help="check IAM quotas before any change: refuse the whole run, "
+        "or only apply the repos that fit (default: refuse)",
+    )
+    subparser.add_argument(
+        "--github-parallel",
+        type=int,
+        default=None,
+        help="number of repos writing GitHub secrets concurrently, in a worker "
+        "pool separate from the IAM one (default: --parallel)",
+    )
+    subparser.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="only apply the repos whose resolved spec changed since their "
+        "last successful apply",
+    )
+    add_common_arguments(
+        subparsers.add_parser(COMMAND_DESTROY, help="delete all resources")
+    )
+    add_common_arguments(
+        subparsers.add_parser(
+            COMMAND_DRIFT,
+            help="compare actual IAM and GitHub state with the config (read-only)",
+        )
+    )
+    subparser = add_common_arguments(
+        subparsers.add_parser(
+            COMMAND_GC,
+            help="find the IAM users whose GitHub repo no longer exists",
+        )
+    )
+    subparser.add_argument(
+        "--delete",
+        action="store_true",
+        help="delete the orphan IAM users, their access keys and policies, "
+        "instead of only reporting them",
+    )
+    subparser = subparsers.add_parser(
+        COMMAND_SERVE,
+        help="provision new repos from GitHub repository webhooks",
+    )
+    subparser.add_argument(
+        "-c",
+        "--config",
+        type=Path,
+        required=True,
+        help="path to the fleet config file (.toml, .yml, .yaml, .json)",
+    )
+    subparser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="address to listen on (default: 127.0.0.1)",
+    )
+    subparser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="port to listen on (default: 8080)",
+    )
+    subparser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="number of repos provisioned concurrently (default: 4)",
+    )
+    subparser = subparsers.add_parser(
+        COMMAND_MERGE,
+        help="merge per shard result (.jsonl) and state (.json) files",
+    )
+    subparser.add_argument(
+        "files",
+        type=Path,
+        nargs="+",
+        help="--output jsonl result files and per shard state files",
+    )
+    subparser.add_argument(
+        "--state-out",
+        type=Path,
+        default=None,
+        help="where to write the merged state file",
+    )
+    subparser.add_argument(
+        "--output",
+        choices=[OUTPUT_TEXT, OUTPUT_JSONL],
+        default=OUTPUT_TEXT,
+        help="output format (default: text)",
+    )
+    return parser
+
+
+def format_text(result: RepoResult) -> str:
+    icon = "✅" if result.ok else "❌"
+    line = f"{icon} {result.repo} [{result.command}] ({result.elapsed:.2f}s)"
+    if result.actions:
+        line += ": " + ", ".join(result.actions)
+    elif result.ok:
+        line += ": no change"
+    if result.error:
+        line += f" | error: {result.error}"
+    return line
+
+
+def format_drift_text(drift: RepoDrift) -> str:
+    if drift.error:
+        return f"❌ {drift.repo}: error: {drift.error}"
+    if drift.issues:
+        return f"⚠️ {drift.repo}: " + ", ".join(drift.issues)
+    return f"✅ {drift.repo}: no drift"
+
+
+def run_merge(
+    args: argparse.Namespace,
+    stdout: T.TextIO,
+) -> int:
+    result_files = [path for path in args.files if path.suffix == ".jsonl"]
+    state_files = [path for path in args.files if path.suffix != ".jsonl"]
+    if state_files:
+        if args.state_out is None:
+            sys.stderr.write("❌ merging state files requires --state-out\n")
+            return 2
+        merge_states(state_files, args.state_out)
+    n_total = 0
+    n_failed = 0
+    for data in merge_results(result_files):
+        n_total += 1
+        if "issues" in data:
+            failed = bool(data["issues"] or data["error"])
+            line = format_drift_text(RepoDrift(**data))
+        else:
+            failed = not data["ok"]
+            line = format_text(RepoResult(**data))
+        if failed:
+            n_failed += 1
+        if args.output == OUTPUT_JSONL:
+            stdout.write(json.dumps(data) + "\n")
+        else:
+            stdout.write(line + "\n")
+    if args.output == OUTPUT_TEXT:
+        stdout.write(f"{n_total} repos, {n_failed} failed or drifted\n")
+    return 1 if n_failed else 0
+
+
+def run_drift(
+    args: argparse.Namespace,
+    config: FleetConfig,
+    stdout: T.TextIO,
+    **kwargs,
+) -> int:
+    n_total = 0
+    n_drifted = 0
+    for drift in scan_fleet_drift(
+        config,
+        only=args.only,
+        parallel=args.parallel,
+        shard=args.shard,
+        **kwargs,
+    ):
+        n_total += 1
+        if drift.drifted or drift.error:
+            n_drifted += 1
+        if args.output == OUTPUT_JSONL:
+            stdout.write(json.dumps(drift.to_dict()) + "\n")
+        else:
+            stdout.write(format_drift_text(drift) + "\n")
+    if args.output == OUTPUT_TEXT:
+        stdout.write(f"{n_total} repos, {n_drifted} drifted or failed\n")
+    return 1 if n_drifted else 0
+
+
+def run_gc(
+    args: argparse.Namespace,
+    config: FleetConfig,
+    stdout: T.TextIO,
+    boto_ses: T.Optional["boto3.Session"] = None,
+    github_token: T.Optional[str] = None,
+    **kwargs,
+) -> int:
+    if boto_ses is None:  # pragma: no cover
+        boto_ses = config.new_boto_session()
+    if github_token is None:  # pragma: no cover
+        github_token = config.get_github_token()
+    iam_client = config.new_iam_client(boto_ses)
+    github_client = config.new_github_client(github_token)
+    n_total = 0
+    orphans = list()
+    renamed = list()
+    for managed_user in find_orphans(
+        iam_client,
+        github_client,
+        only=args.only,
+        shard=args.shard,
+        parallel=args.parallel,
+    ):
+        n_total += 1
+        if managed_user.status == STATUS_ALIVE:
+            continue
+        if managed_user.status == STATUS_ORPHAN:
+            orphans.append(managed_user)
+        else:
+            renamed.append(managed_user)
+        if args.output == OUTPUT_JSONL:
+            stdout.write(json.dumps(managed_user.to_dict()) + "\n")
+        elif managed_user.status == STATUS_ORPHAN:
+            stdout.write(
+                f"🗑️ {managed_user.iam_user_name}: "
+                f"{managed_user.github_full_name} no longer exists\n"
+            )
+        else:
+            stdout.write(
+                f"⚠️ {managed_user.iam_user_name}: "
+                f"{managed_user.github_full_name} was renamed to "
+                f"{managed_user.current_full_name}, kept\n"
+            )
+    if args.output == OUTPUT_TEXT:
+        stdout.write(
+            f"{n_total} managed users, {len(orphans)} orphans, "
+            f"{len(renamed)} renamed\n"
+        )
+    if not args.delete:
+        return 1 if orphans else 0
+    n_failed = 0
+    for result in delete_orphans(
+        iam_client,
+        orphans,
+        parallel=args.parallel,
+        dir_access_key=config.dir_access_key,
+    ):
+        if not result.ok:
+            n_failed += 1
+        if args.output == OUTPUT_JSONL:
+            stdout.write(json.dumps(result.to_dict()) + "\n")
+        elif result.ok:
+            stdout.write(
+                f"✅ deleted {result.iam_user_name} ({result.repo}): "
+                + ", ".join(result.actions or ["already gone"])
+                + "\n"
+            )
+        else:
+            stdout.write(
+                f"❌ {result.iam_user_name} ({result.repo}) | error: {result.error}\n"
+            )
+        stdout.flush()
+    if args.output == OUTPUT_TEXT:
+        stdout.write(f"{len(orphans) - n_failed} deleted, {n_failed} failed\n")
+    return 1 if n_failed else 0
+
+
+def run_serve(
+    args: argparse.Namespace,
+    config: FleetConfig,
+) -> int:  # pragma: no cover
+    webhook_secret = config.get_webhook_secret()
+    if not webhook_secret:
+        sys.stderr.write(f"❌ env var {config.webhook_secret_env} is not set\n")
+        return 2
+    daemon = ProvisioningDaemon(
+        config=config,
+        boto_ses=config.new_boto_session(),
+        github_token=config.get_github_token(),
+        webhook_secret=webhook_secret,
+        host=args.host,
+        port=args.port,
+        n_workers=args.workers,
+    )
+    daemon.serve_forever()
+    return 0
+
+
+@contextlib.contextmanager
+def tracing_from_args(args: argparse.Namespace) -> T.Iterator[T.Optional[Tracer]]:
+    """
+    Set a tracer exporting to ``--trace`` and ``--otlp-endpoint`` in the
+    ``with`` block, flush the exporters after.
+    """
+    exporters = list()
+    if getattr(args, "trace", None) is not None:
+        exporters.append(ChromeTraceExporter(args.trace))
+    if getattr(args, "otlp_endpoint", None):
+        exporters.append(OtlpHttpExporter(endpoint=args.otlp_endpoint))
+    if not exporters:
+        yield None
+        return
+    tracer = Tracer(exporters)
+    previous = set_tracer(tracer)
+    try:
+        yield tracer
+    finally:
+        set_tracer(previous)
+        tracer.shutdown()
+
+
+def run(
+    args: argparse.Namespace,
+    stdout: T.TextIO,
+    **kwargs,
+) -> int:
+    """
+    Execute parsed arguments, write results to ``stdout``, return the exit code.
+
+    ``kwargs`` are passed to :func:`~simple_gh_aws_creds.fleet.run_fleet`.
+    """
+    if args.command == COMMAND_MERGE:
+        return run_merge(args, stdout)
+    config = FleetConfig.from_file(args.config)
+    if args.command == COMMAND_SERVE:  # pragma: no cover
+        return run_serve(args, config)
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(tracing_from_args(args))
+        if getattr(args, "profile", None) is not None:
+            stack.enter_context(profile_run(args.profile, name=args.command))
+        return run_fleet_command(args, config, stdout, **kwargs)
+
+
+def run_fleet_command(
+    args: argparse.Namespace,
+    config: FleetConfig,
+    stdout: T.TextIO,
+    **kwargs,
+) -> int:
+    if args.command == COMMAND_DRIFT:
+        return run_drift(args, config, stdout, **kwargs)
+    if args.command == COMMAND_GC:
+        return run_gc(args, config, stdout, **kwargs)
+    command = args.command
+    if command == COMMAND_PLAN and args.destroy:
+        command = COMMAND_PLAN_DESTROY
+    if command == COMMAND_APPLY:
+        kwargs.setdefault("admission", args.admission)
+        kwargs.setdefault("changed_only", args.changed_only)
+        kwargs.setdefault("github_parallel", args.github_parallel)
+    n_total = 0
+    n_failed = 0
+    for result in run_fleet(
+        command,
+        config,
+        only=args.only,
+        parallel=args.parallel,
+        shard=args.shard,
+        **kwargs,
+    ):
+        n_total += 1
+        if not result.ok:
+            n_failed += 1
+        if args.output == OUTPUT_JSONL:
+            stdout.write(json.dumps(result.to_dict()) + "\n")
+        else:
+            stdout.write(format_text(result) + "\n")
+        stdout.flush()
+    if args.output == OUTPUT_TEXT:
+        stdout.write(f"{n_total} repos, {n_total - n_failed} ok, {n_failed} failed\n")
+    return 1 if n_failed else 0
+
+
+def main(argv: T.Optional[T.List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    stdout = sys.stdout
+    # the step by step log is printed to stdout by SetupGitHubRepo, send it
+    # to stderr so stdout only carries the results
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            return run(args, stdout)
+        except PolicyValidationError as e:
+            sys.stderr.write(f"❌ invalid policy: {e}\n")
+            return 2
+        except InvalidPolicyArnError as e:
+            sys.stderr.write(f"❌ {e}\n")
+            return 2
+        except AdmissionError as e:
+            sys.stderr.write(f"❌ refused by admission control: {e}\n")
+            return 2
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
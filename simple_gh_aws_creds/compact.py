@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Interning of the values repeated across the repos of a large fleet.
+
+A 50k repo fleet spec has a few distinct owners, policy documents, managed
+policy ARN lists, tag sets and secret naming conventions, repeated 50k times.
+:class:`Interner` returns one shared, read-only instance per distinct value, so
+memory is proportional to the number of distinct values, not to the number of
+repos. Used by :class:`~simple_gh_aws_creds.fleet.FleetConfig` when loading
+``repos`` and the streamed ``repos_file``.
+"""
+
+import typing as T
+import sys
+import json
+import types
+
+
+class Interner:
+    """
+    One shared instance per distinct value. Not thread safe, intern while
+    loading, share the results afterwards.
+    """
+
+    def __init__(self):
+        self._tags: dict[tuple, T.Mapping[str, str]] = dict()
+        self._arn_lists: dict[tuple, T.Tuple[str, ...]] = dict()
+        self._documents: dict[str, dict[str, T.Any]] = dict()
+        self._objects: dict[T.Hashable, T.Any] = dict()
+        # keeps the interned strings alive between two passes over a stream,
+        # sys.intern drops a string once nothing else refers to it
+        self._strings: dict[str, str] = dict()
+
+    def string(self, value: str) -> str:
+        try:
+            return self._strings[value]
+        except KeyError:
+            value = sys.intern(value)
+            self._strings[value] = value
+            return value
+
+    def tags(self, tags: T.Optional[T.Mapping[str, str]]) -> T.Mapping[str, str]:
+        """
+        Shared read-only mapping, changing the tags of one repo must not
+        change the tags of the others.
+        """
+        key = tuple(sorted((tags or {}).items()))
+        try:
+            return self._tags[key]
+        except KeyError:
+            value = types.MappingProxyType(
+                {self.string(k): self.string(v) for k, v in key}
+            )
+            self._tags[key] = value
+            return value
+
+    def arn_list(self, arns: T.Iterable[str]) -> T.Tuple[str, ...]:
+        key = tuple(self.string(arn) for arn in arns)
+        return self._arn_lists.setdefault(key, key)
+
+    def policy_document(self, document: dict[str, T.Any]) -> dict[str, T.Any]:
+        """
+        Byte identical documents, after key sorting, share one dict.
+        """
+        key = json.dumps(document, sort_keys=True, separators=(",", ":"))
+        return self._documents.setdefault(key, document)
+
+    def object(self, key: T.Hashable, value: T.Any) -> T.Any:
+        """
+        Generic interning, ``value`` is returned for the first ``key``, the
+        same object afterwards.
+        """
+        return self._objects.setdefault(key, value)
+
+    @property
+    def n_distinct(self) -> int:
+        return (
+            len(self._tags)
+            + len(self._arn_lists)
+            + len(self._documents)
+            + len(self._objects)
+        )
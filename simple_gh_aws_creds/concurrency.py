@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+Concurrency helpers shared by the fleet level features.
+
+Boto3 clients and ``requests`` sessions are thread safe once created, and the
+work is dominated by network waits, so a thread pool is all we need. Work items
+run in a copy of the submitting thread's :mod:`contextvars` context, so the
+current tracing span follows them, see :mod:`simple_gh_aws_creds.tracing`, and
+so does an active :func:`~simple_gh_aws_creds.profiling.profile_run`.
+"""
+
+import typing as T
+import time
+import contextvars
+import threading
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .profiling import profile_work_item
+
+ItemT = T.TypeVar("ItemT")
+ResultT = T.TypeVar("ResultT")
+
+
+def _run_item(func: T.Callable, item: T.Any):
+    with profile_work_item():
+        return func(item)
+
+
+def _submit(executor: ThreadPoolExecutor, func: T.Callable, item: T.Any):
+    return executor.submit(contextvars.copy_context().run, _run_item, func, item)
+
+
+def bounded_imap_unordered(
+    func: T.Callable[[ItemT], ResultT],
+    iterable: T.Iterable[ItemT],
+    max_workers: int = 8,
+) -> T.Iterator[ResultT]:
+    """
+    Apply ``func`` to each item concurrently and yield results as they complete.
+
+    Unlike :meth:`concurrent.futures.Executor.map`, the input iterable is
+    consumed lazily and at most ``max_workers`` items are in flight, so memory
+    stays flat no matter how long the input is. Exceptions raised by ``func``
+    propagate to the caller.
+    """
+    if max_workers < 1:
+        raise ValueError(f"max_workers must be >= 1, got {max_workers}")
+    iterator = iter(iterable)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        for item in iterator:
+            in_flight.add(_submit(executor, func, item))
+            if len(in_flight) >= max_workers:
+                break
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                for item in iterator:
+                    in_flight.add(_submit(executor, func, item))
+                    break
+                yield future.result()
+
+
+def pipeline_imap_unordered(
+    first: T.Callable[[ItemT], T.Any],
+    second: T.Callable[[T.Any], ResultT],
+    iterable: T.Iterable[ItemT],
+    max_workers_first: int = 8,
+    max_workers_second: int = 8,
+) -> T.Iterator[ResultT]:
+    """
+    Two stage version of :func:`bounded_imap_unordered`, ``second`` is applied
+    to the result of ``first`` of each item, and the two stages run in separate
+    thread pools, bulkheads: a slow second stage can't take the workers of the
+    first one, and the other way around.
+
+    The input is consumed lazily. At most ``max_workers_first`` items are in the
+    first stage, and new items are only started while fewer than twice
+    ``max_workers_second`` items wait for or run in the second stage, so
+    memory stays flat.
+    """
+    if max_workers_first < 1 or max_workers_second < 1:
+        raise ValueError("max_workers_first and max_workers_second must be >= 1")
+    iterator = iter(iterable)
+    max_pending = 2 * max_workers_second
+    with ThreadPoolExecutor(max_workers=max_workers_first) as executor_first:
+        with ThreadPoolExecutor(max_workers=max_workers_second) as executor_second:
+            in_first = set()
+            in_second = set()
+
+            def refill():
+                while len(in_first) < max_workers_first and len(in_second) < max_pending:
+                    for item in iterator:
+                        in_first.add(_submit(executor_first, first, item))
+                        break
+                    else:
+                        return
+
+            refill()
+            while in_first or in_second:
+                done, _ = wait(in_first | in_second, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in in_first:
+                        in_first.discard(future)
+                        in_second.add(
+                            _submit(executor_second, second, future.result())
+                        )
+                    else:
+                        in_second.discard(future)
+                        yield future.result()
+                refill()
+
+
+@dataclasses.dataclass
+class RateLimiter:
+    """
+    Thread safe token bucket limiting the number of API calls per minute.
+
+    The bucket starts full, so up to ``burst`` calls go through immediately,
+    after that calls are spread evenly at ``calls_per_minute``.
+
+    :param calls_per_minute: sustained call rate.
+    :param burst: bucket capacity, defaults to one second worth of calls
+        (at least 1).
+    """
+
+    calls_per_minute: float = dataclasses.field()
+    burst: T.Optional[float] = dataclasses.field(default=None)
+    clock: T.Callable[[], float] = dataclasses.field(default=time.monotonic)
+    sleep: T.Callable[[float], None] = dataclasses.field(default=time.sleep)
+
+    def __post_init__(self):
+        if self.calls_per_minute <= 0:
+            raise ValueError(
+                f"calls_per_minute must be > 0, got {self.calls_per_minute}"
+            )
+        if self.burst is None:
+            self.burst = max(1.0, self.calls_per_minute / 60)
+        self._tokens = self.burst
+        self._updated_at = self.clock()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        """
+        Tokens per second.
+        """
+        return self.calls_per_minute / 60
+
+    def acquire(self, n: float = 1):
+        """
+        Block until ``n`` calls are allowed.
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            # reserve the tokens even if the bucket goes negative, the wait
+            # time is computed from the debt, so callers are served in order
+            self._tokens -= n
+            wait_seconds = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_seconds > 0:
+            self.sleep(wait_seconds)
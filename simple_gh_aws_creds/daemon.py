@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+"""
+Long running provisioning daemon driven by GitHub ``repository`` webhooks.
+
+New repos used to wait for someone to run the setup by hand before their CI
+worked. :class:`ProvisioningDaemon` runs a local HTTP server:
+
+- ``POST /webhook`` accepts GitHub webhook deliveries up to
+  :data:`MAX_BODY_SIZE`, the body is validated with the
+  ``X-Hub-Signature-256`` HMAC. A ``repository`` event with action
+  ``created``, or ``edited`` with changed topics, is put on a work queue.
+  Redeliveries of a repo already waiting are dropped.
+- a pool of worker threads matches each queued repo against the fleet config,
+  the repo's own entry in ``repos`` or the first matching ``[[rules]]`` by
+  topic or name pattern, see
+  :meth:`~simple_gh_aws_creds.fleet.FleetConfig.match_repo`, and runs
+  ``apply`` on it, sharing one IAM client, one GitHub client and the per
+  account caches. Matching can scan a large ``repos_file``, it never runs in
+  the HTTP handler.
+- ``GET /metrics`` returns counters, queue depth and time to provision, from
+  webhook receipt to working credentials, in the Prometheus text format.
+- ``GET /healthz`` returns ``ok``.
+
+Usage::
+
+    export GITHUB_TOKEN=... GITHUB_WEBHOOK_SECRET=...
+    simple-gh-aws-creds serve -c fleet.toml --port 8080 --workers 4
+"""
+
+import typing as T
+import hmac
+import json
+import time
+import queue
+import hashlib
+import threading
+import dataclasses
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .impl import SetupGitHubRepo
+from .fleet import COMMAND_APPLY, FleetConfig, RepoResult, RepoSpec, run_repo
+from .policy_arn import PolicyArnResolver
+from .shared_policy import SharedPolicyManager
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    import boto3
+
+printer = print
+
+HEADER_SIGNATURE = "X-Hub-Signature-256"
+HEADER_EVENT = "X-GitHub-Event"
+
+#: GitHub caps webhook payloads at 25 MB, larger bodies are refused unread
+MAX_BODY_SIZE = 25 * 1024 * 1024
+
+STATUS_QUEUED = "queued"
+STATUS_IGNORED = "ignored"
+STATUS_DUPLICATE = "duplicate"
+
+
+def compute_signature(secret: str, body: bytes) -> str:
+    """
+    The ``X-Hub-Signature-256`` header value GitHub sends for this body.
+    """
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def verify_signature(secret: str, body: bytes, signature: T.Optional[str]) -> bool:
+    """
+    Constant time check of the ``X-Hub-Signature-256`` header.
+    """
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(compute_signature(secret, body), signature)
+
+
+@dataclasses.dataclass
+class ProvisionJob:
+    """
+    A repo waiting to be matched against the fleet config and provisioned.
+
+    :param topics: the repo's topics from the webhook payload.
+    :param received_at: ``time.monotonic()`` when the webhook was received.
+    """
+
+    github_user_name: str = dataclasses.field()
+    github_repo_name: str = dataclasses.field()
+    topics: T.List[str] = dataclasses.field()
+    received_at: float = dataclasses.field()
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.github_user_name}/{self.github_repo_name}"
+
+
+@dataclasses.dataclass
+class DaemonMetrics:
+    """
+    Thread safe counters of the daemon.
+    """
+
+    webhooks_received: int = dataclasses.field(default=0)
+    webhooks_rejected: int = dataclasses.field(default=0)
+    jobs_queued: int = dataclasses.field(default=0)
+    jobs_succeeded: int = dataclasses.field(default=0)
+    jobs_failed: int = dataclasses.field(default=0)
+    jobs_ignored: int = dataclasses.field(default=0)
+    provision_seconds_sum: float = dataclasses.field(default=0.0)
+    provision_seconds_max: float = dataclasses.field(default=0.0)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def observe(self, result: RepoResult, seconds: float):
+        with self._lock:
+            if result.ok:
+                self.jobs_succeeded += 1
+            else:
+                self.jobs_failed += 1
+            self.provision_seconds_sum += seconds
+            self.provision_seconds_max = max(self.provision_seconds_max, seconds)
+
+    def to_prometheus(self, queue_depth: int, in_flight: int) -> str:
+        prefix = "simple_gh_aws_creds"
+        with self._lock:
+            n_done = self.jobs_succeeded + self.jobs_failed
+            lines = [
+                f"{prefix}_webhooks_received_total {self.webhooks_received}",
+                f"{prefix}_webhooks_rejected_total {self.webhooks_rejected}",
+                f"{prefix}_jobs_queued_total {self.jobs_queued}",
+                f'{prefix}_jobs_done_total{{result="ok"}} {self.jobs_succeeded}',
+                f'{prefix}_jobs_done_total{{result="failed"}} {self.jobs_failed}',
+                f"{prefix}_jobs_ignored_total {self.jobs_ignored}",
+                f"{prefix}_queue_depth {queue_depth}",
+                f"{prefix}_jobs_in_flight {in_flight}",
+                f"{prefix}_time_to_provision_seconds_sum {self.provision_seconds_sum:.6f}",
+                f"{prefix}_time_to_provision_seconds_count {n_done}",
+                f"{prefix}_time_to_provision_seconds_max {self.provision_seconds_max:.6f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+
+    def log_message(self, format: str, *args):  # pragma: no cover
+        pass
+
+    def _reply(self, code: int, text: str, content_type: str = "text/plain"):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        daemon = self.server.provisioning_daemon
+        if self.path == "/metrics":
+            self._reply(
+                200,
+                daemon.metrics.to_prometheus(
+                    queue_depth=daemon.queue.qsize(),
+                    in_flight=daemon.in_flight,
+                ),
+                content_type="text/plain; version=0.0.4",
+            )
+        elif self.path == "/healthz":
+            self._reply(200, "ok\n")
+        else:
+            self._reply(404, "not found\n")
+
+    def do_POST(self):
+        daemon = self.server.provisioning_daemon
+        if self.path != "/webhook":
+            self._reply(404, "not found\n")
+            return
+        daemon.metrics.incr("webhooks_received")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY_SIZE:
+            daemon.metrics.incr("webhooks_rejected")
+            # the body is left unread, the connection can't be reused
+            self.close_connection = True
+            if length < 0:
+                self._reply(400, "invalid Content-Length\n")
+            else:
+                self._reply(413, "payload too large\n")
+            return
+        body = self.rfile.read(length)
+        if not verify_signature(
+            daemon.webhook_secret, body, self.headers.get(HEADER_SIGNATURE)
+        ):
+            daemon.metrics.incr("webhooks_rejected")
+            self._reply(401, "invalid signature\n")
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._reply(400, "invalid JSON\n")
+            return
+        status = daemon.handle_event(self.headers.get(HEADER_EVENT, ""), payload)
+        self._reply(202 if status == STATUS_QUEUED else 200, f"{status}\n")
+
+
+class _Server(ThreadingHTTPServer):
+    provisioning_daemon: "ProvisioningDaemon"
+
+
+@dataclasses.dataclass
+class ProvisioningDaemon:
+    """
+    Webhook server plus worker pool, see the module docstring.
+
+    :param webhook_secret: the secret configured on the GitHub webhook.
+    :param port: ``0`` picks a free port, see :attr:`server_address`.
+    :param n_workers: number of repos provisioned concurrently.
+    """
+
+    config: FleetConfig = dataclasses.field()
+    boto_ses: "boto3.Session" = dataclasses.field()
+    github_token: str = dataclasses.field()
+    webhook_secret: str = dataclasses.field()
+    host: str = dataclasses.field(default="127.0.0.1")
+    port: int = dataclasses.field(default=8080)
+    n_workers: int = dataclasses.field(default=4)
+
+    def __post_init__(self):
+        if not self.webhook_secret:
+            raise ValueError("webhook secret is required")
+        self.config.preflight()
+        self.config.dir_access_key.mkdir(parents=True, exist_ok=True)
+        self.metrics = DaemonMetrics()
+        self.queue: "queue.Queue[T.Optional[ProvisionJob]]" = queue.Queue()
+        self.in_flight = 0
+        self._pending: T.Set[str] = set()
+        self._lock = threading.Lock()
+        self._server: T.Optional[_Server] = None
+        self._threads: T.List[threading.Thread] = list()
+        # clients and per account caches are shared by all workers
+        self._iam_client = self.config.new_iam_client(self.boto_ses)
+        self._github_client = self.config.new_github_client(self.github_token)
+        self._policy_arn_resolver = PolicyArnResolver(iam_client=self._iam_client)
+        self._shared_policy_manager = SharedPolicyManager(iam_client=self._iam_client)
+
+    @property
+    def server_address(self) -> T.Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def handle_event(self, event: str, payload: dict[str, T.Any]) -> str:
+        """
+        Queue a newly created repo, or a repo whose topics changed. Cheap, runs
+        in the HTTP handler, the repo is matched against the config by the
+        worker, see :meth:`provision`.
+
+        :return: :data:`STATUS_QUEUED`, :data:`STATUS_DUPLICATE` or
+            :data:`STATUS_IGNORED`.
+        """
+        if event != "repository":
+            return STATUS_IGNORED
+        action = payload.get("action")
+        if action == "created":
+            pass
+        elif action == "edited" and "topics" in (payload.get("changes") or {}):
+            pass
+        else:
+            return STATUS_IGNORED
+        data = payload.get("repository", {})
+        owner, _, name = data.get("full_name", "").partition("/")
+        if not owner or not name:
+            return STATUS_IGNORED
+        job = ProvisionJob(
+            github_user_name=owner,
+            github_repo_name=name,
+            topics=list(data.get("topics") or []),
+            received_at=time.monotonic(),
+        )
+        with self._lock:
+            if job.full_name in self._pending:
+                return STATUS_DUPLICATE
+            self._pending.add(job.full_name)
+        self.queue.put(job)
+        self.metrics.incr("jobs_queued")
+        return STATUS_QUEUED
+
+    def to_setup(self, repo: RepoSpec) -> SetupGitHubRepo:
+        setup = self.config.to_setup(
+            repo,
+            boto_ses=self.boto_ses,
+            github_token=self.github_token,
+        )
+        setup.iam_client = self._iam_client
+        setup.github_client = self._github_client
+        setup.policy_arn_resolver = self._policy_arn_resolver
+        setup.shared_policy_manager = self._shared_policy_manager
+        return setup
+
+    def provision(self, job: ProvisionJob) -> T.Optional[RepoResult]:
+        """
+        Match one queued repo against the fleet config, run ``apply`` on it and
+        record the time to provision.
+
+        :return: ``None`` if nothing in the config matches the repo.
+        """
+        with self._lock:
+            self.in_flight += 1
+        try:
+            try:
+                repo = self.config.match_repo(
+                    job.github_user_name, job.github_repo_name, topics=job.topics
+                )
+            except ValueError as e:  # e.g. an invalid line in repos_file
+                repo = None
+                result = RepoResult(
+                    repo=job.full_name,
+                    iam_user_name="",
+                    command=COMMAND_APPLY,
+                    error=f"{type(e).__name__}: {e}",
+                )
+            else:
+                result = None
+            if repo is not None:
+                result = run_repo(COMMAND_APPLY, self.to_setup(repo))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self._pending.discard(job.full_name)
+        if result is None:
+            self.metrics.incr("jobs_ignored")
+            printer(f"⏭ ignored {job.full_name}: no matching repo or rule")
+            return None
+        self.metrics.observe(result, time.monotonic() - job.received_at)
+        icon = "✅" if result.ok else "❌"
+        printer(f"{icon} provisioned {result.repo}: {result.error or 'ok'}")
+        return result
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self.provision(job)
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        """
+        Start the HTTP server and the workers in background threads.
+        """
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.provisioning_daemon = self
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(self.n_workers)
+        ]
+        self._threads.append(
+            threading.Thread(target=self._server.serve_forever, daemon=True)
+        )
+        for thread in self._threads:
+            thread.start()
+        host, port = self.server_address
+        printer(f"🚀 listening on http://{host}:{port}/webhook")
+
+    def stop(self):
+        """
+        Stop accepting webhooks, finish the queued jobs, stop the workers.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        for _ in range(self.n_workers):
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def serve_forever(self):  # pragma: no cover
+        """
+        :meth:`start`, then block until interrupted with Ctrl+C.
+        """
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            printer("🛑 stopping, waiting for queued jobs ...")
+        finally:
+            self.stop()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read-only drift detection across all managed users and repos.
+
+Compares the desired state of each :class:`~simple_gh_aws_creds.impl.SetupGitHubRepo`
+(inline ``policy_document``, ``attached_policy_arn_list``, tags and the expected
+GitHub secret names) against the actual IAM and GitHub state.
+
+The IAM side is read in bulk with ``get_account_authorization_details``, one
+paginated call returns the inline policies, attached policies and tags of up to
+1,000 users per page, instead of four calls per user. The GitHub side is read
+concurrently, one (ETag cached) secret listing per repo.
+"""
+
+import typing as T
+import dataclasses
+
+from .concurrency import bounded_imap_unordered
+from .github_client import SecretTarget
+from .policy import canonical_policy_hash
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_iam.client import IAMClient
+    from .impl import SetupGitHubRepo
+
+
+@dataclasses.dataclass
+class UserState:
+    """
+    The part of an IAM user's actual state drift detection cares about.
+
+    Only hashes are kept for inline policies, so the index of thousands of users
+    stays small.
+    """
+
+    iam_user_name: str = dataclasses.field()
+    inline_policy_hashes: dict[str, str] = dataclasses.field(default_factory=dict)
+    attached_policy_arns: T.Set[str] = dataclasses.field(default_factory=set)
+    tags: T.Optional[dict[str, str]] = dataclasses.field(default=None)
+
+
+def iter_user_states(iam_client: "IAMClient") -> T.Iterator[UserState]:
+    """
+    Read all IAM users in bulk with ``get_account_authorization_details``.
+    """
+    paginator = iam_client.get_paginator("get_account_authorization_details")
+    for page in paginator.paginate(Filter=["User"]):
+        for detail in page.get("UserDetailList", []):
+            tags = detail.get("Tags")
+            yield UserState(
+                iam_user_name=detail["UserName"],
+                inline_policy_hashes={
+                    dct["PolicyName"]: canonical_policy_hash(dct["PolicyDocument"])
+                    for dct in detail.get("UserPolicyList", [])
+                },
+                attached_policy_arns={
+                    dct["PolicyArn"]
+                    for dct in detail.get("AttachedManagedPolicies", [])
+                },
+                tags=(
+                    None
+                    if tags is None
+                    else {tag["Key"]: tag["Value"] for tag in tags}
+                ),
+            )
+
+
+@dataclasses.dataclass
+class RepoDrift:
+    """
+    Drift report of one repo, an empty ``issues`` list means no drift.
+
+    Issue format is ``<kind>`` or ``<kind>:<detail>``, for example
+    ``inline_policy_changed`` or ``missing_secret:AWS_ACCESS_KEY_ID``.
+    """
+
+    repo: str = dataclasses.field()
+    iam_user_name: str = dataclasses.field()
+    issues: list[str] = dataclasses.field(default_factory=list)
+    error: T.Optional[str] = dataclasses.field(default=None)
+
+    @property
+    def drifted(self) -> bool:
+        return bool(self.issues)
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return dataclasses.asdict(self)
+
+
+def diff_user_state(
+    setup: "SetupGitHubRepo",
+    state: T.Optional[UserState],
+) -> list[str]:
+    """
+    Compare the desired IAM state of a repo with its actual state.
+    """
+    if state is None:
+        return ["missing_iam_user"]
+    issues = list()
+    desired_arns = set(setup.attached_policy_arn_list)
+    if setup.use_shared_policy:
+        # the policy document lives in a shared managed policy, no inline policy
+        shared_policy = setup.shared_policy_manager.describe(
+            setup.resolved_shared_policy_name
+        )
+        if shared_policy is None:
+            issues.append(f"missing_shared_policy:{setup.resolved_shared_policy_name}")
+        else:
+            if shared_policy.document_hash != canonical_policy_hash(
+                setup.policy_document
+            ):
+                issues.append(
+                    f"shared_policy_changed:{setup.resolved_shared_policy_name}"
+                )
+            desired_arns.add(shared_policy.arn)
+        expected_inline_names = set()
+    else:
+        actual_hash = state.inline_policy_hashes.get(setup.policy_document_name)
+        if actual_hash is None:
+            issues.append("missing_inline_policy")
+        elif actual_hash != canonical_policy_hash(setup.policy_document):
+            issues.append("inline_policy_changed")
+        expected_inline_names = {setup.policy_document_name}
+    issues.extend(
+        f"extra_inline_policy:{name}"
+        for name in sorted(state.inline_policy_hashes)
+        if name not in expected_inline_names
+    )
+    issues.extend(
+        f"missing_attached_policy:{arn}"
+        for arn in sorted(desired_arns - state.attached_policy_arns)
+    )
+    issues.extend(
+        f"extra_attached_policy:{arn}"
+        for arn in sorted(state.attached_policy_arns - desired_arns)
+    )
+    if state.tags is not None:
+        for key, value in setup.user_tags.items():
+            if key not in state.tags:
+                issues.append(f"missing_tag:{key}")
+            elif state.tags[key] != value:
+                issues.append(f"tag_changed:{key}")
+    return issues
+
+
+def scan_drift(
+    setups: T.Iterable["SetupGitHubRepo"],
+    iam_client: "IAMClient",
+    max_workers: int = 16,
+    check_github: bool = True,
+) -> T.Iterator[RepoDrift]:
+    """
+    Scan many repos for drift, yield one :class:`RepoDrift` per repo as the
+    per repo reads complete.
+
+    :param iam_client: IAM client of the account, used for the bulk read.
+    :param max_workers: concurrency of the per repo reads (GitHub secret
+        listings, and tags when the bulk read doesn't include them).
+    :param check_github: also check that the expected GitHub secrets exist.
+    """
+    states = {state.iam_user_name: state for state in iter_user_states(iam_client)}
+
+    def scan_one(setup: "SetupGitHubRepo") -> RepoDrift:
+        drift = RepoDrift(
+            repo=f"{setup.github_user_name}/{setup.github_repo_name}",
+            iam_user_name=setup.iam_user_name,
+        )
+        try:
+            state = states.get(setup.iam_user_name)
+            if state is not None and state.tags is None:
+                res = iam_client.list_user_tags(UserName=setup.iam_user_name)
+                state.tags = {tag["Key"]: tag["Value"] for tag in res.get("Tags", [])}
+            drift.issues.extend(diff_user_state(setup, state))
+            if check_github:  # pragma: no cover
+                for target in setup.github_secret_targets:
+                    existing = set(
+                        setup.github_client.list_secret_names(
+                            setup.github_user_name,
+                            setup.github_repo_name,
+                            target.environment,
+                            target.store,
+                        )
+                    )
+                    prefix = "" if target == SecretTarget() else f"{target}/"
+                    drift.issues.extend(
+                        f"missing_secret:{prefix}{name}"
+                        for name in setup.github_secret_name_list
+                        if name not in existing
+                    )
+                for name in setup.github_variable_name_list:
+                    value = setup.github_client.get_variable(
+                        setup.github_user_name, setup.github_repo_name, name
+                    )
+                    if value is None:
+                        drift.issues.append(f"missing_variable:{name}")
+                    elif value != setup.aws_region:
+                        drift.issues.append(f"variable_changed:{name}")
+        except Exception as e:
+            drift.error = f"{type(e).__name__}: {e}"
+        return drift
+
+    yield from bounded_imap_unordered(scan_one, setups, max_workers=max_workers)
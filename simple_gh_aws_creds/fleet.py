@@ -0,0 +1,1262 @@
+# -*- coding: utf-8 -*-
+
+"""
+Declarative fleet configuration, many repos in one file.
+
+A fleet config file (TOML, YAML or JSON) describes shared settings, policy
+templates, secret name conventions and the list of repos. Example (TOML)::
+
+    aws_region = "us-east-1"
+    aws_profile = "my-aws-profile"         # optional, default credential chain
+    github_token_env = "GITHUB_TOKEN"      # env var holding the GitHub token
+    webhook_secret_env = "GITHUB_WEBHOOK_SECRET"  # for the webhook daemon
+    github_http2 = false                   # needs the http2 extra
+    github_region_mode = "secret"          # or "variable", "org-variable"
+    github_environments = []               # e.g. ["dev", "prod"], default repo secrets
+    github_secret_stores = ["actions"]     # and / or "dependabot", "codespaces"
+    circuit_breaker_failure_rate = 0.5     # open a backend's breaker at this error rate
+    circuit_breaker_cooldown = 30          # seconds before probing a broken backend
+    dir_access_key = ".access_keys"        # relative to the config file
+    state_file = ".fleet_state.json"       # last applied spec hashes
+    repos_file = "repos.jsonl"             # optional, more repos, one JSON object per line
+    iam_user_name_template = "gh-ci-{github_repo_name}"
+    shared_policies = false                # one managed policy per template
+
+    [tags]
+    "tech:use_case" = "GitHub Actions CI"
+
+    [secret_names]
+    aws_default_region = "AWS_DEFAULT_REGION"
+    aws_access_key_id = "AWS_ACCESS_KEY_ID"
+    aws_secret_access_key = "AWS_SECRET_ACCESS_KEY"
+
+    [policies.list_aliases]
+    attached_policy_arn_list = []
+
+    [policies.list_aliases.policy_document]
+    Version = "2012-10-17"
+
+    [[policies.list_aliases.policy_document.Statement]]
+    Effect = "Allow"
+    Action = ["iam:ListAccountAliases"]
+    Resource = "*"
+
+    [[repos]]
+    github_user_name = "MacHu-GWU"
+    github_repo_name = "simple_gh_aws_creds-project"
+    policy = "list_aliases"
+    # optional per repo overrides: iam_user_name, aws_region, tags, secret_names,
+    # environments
+
+    # used by the webhook daemon for repos not listed above, first match wins
+    [[rules]]
+    policy = "list_aliases"
+    topic = "aws-ci"                       # repo has this topic, and / or
+    pattern = "MacHu-GWU/aws_*"            # owner/repo matches this glob
+
+:func:`run_fleet` runs ``plan``, ``apply`` or ``destroy`` for the selected repos
+concurrently, see :mod:`simple_gh_aws_creds.cli` for the command line interface.
+"""
+
+import typing as T
+import os
+import json
+import time
+import types
+import collections
+import fnmatch
+import dataclasses
+from pathlib import Path
+
+import boto3
+import botocore.exceptions
+
+from .impl import (
+    REGION_AS_SECRET,
+    REGION_AS_VARIABLE,
+    REGION_AS_ORG_VARIABLE,
+    REGION_MODES,
+    SetupGitHubRepo,
+)
+from .concurrency import bounded_imap_unordered, pipeline_imap_unordered
+from .circuit_breaker import CircuitBreaker, attach_to_boto_client
+from .github_client import (
+    GRAPHQL_MAX_REPOS,
+    SECRET_STORES,
+    SECRET_STORE_ACTIONS,
+    ETagCache,
+    GitHubClient,
+)
+from .github_http2 import Http2GitHubClient
+from .policy_arn import PolicyArnResolver
+from .shared_policy import SHARED_POLICY_NAME_PREFIX, SharedPolicyManager
+from .drift import RepoDrift, scan_drift
+from .state import ApplyState, spec_hash
+from .sharding import Shard
+from .compact import Interner
+from .policy import PolicyValidationError, compile_policy, canonical_policy_hash
+from .admission import (
+    MODE_OFF,
+    MODE_REFUSE,
+    MODE_PARTITION,
+    AccountQuota,
+    AdmissionBudget,
+    UserUsage,
+)
+from . import tracing
+
+COMMAND_PLAN = "plan"
+COMMAND_APPLY = "apply"
+COMMAND_DESTROY = "destroy"
+COMMAND_PLAN_DESTROY = "plan-destroy"
+COMMAND_DRIFT = "drift"
+
+
+def _load_toml(text: str) -> dict[str, T.Any]:
+    try:
+        import tomllib
+    except ImportError:  # pragma: no cover
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ImportError(
+                "TOML fleet config on Python < 3.11 requires tomli, "
+                "run: pip install tomli"
+            )
+    return tomllib.loads(text)
+
+
+def _load_yaml(text: str) -> dict[str, T.Any]:  # pragma: no cover
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("YAML fleet config requires PyYAML, run: pip install pyyaml")
+    return yaml.safe_load(text)
+
+
+def load_config_data(path: Path) -> dict[str, T.Any]:
+    """
+    Read a ``.toml``, ``.yml`` / ``.yaml`` or ``.json`` file into a dict.
+    """
+    text = path.read_text()
+    suffix = path.suffix.lower()
+    if suffix == ".toml":
+        return _load_toml(text)
+    elif suffix in (".yml", ".yaml"):
+        return _load_yaml(text)
+    elif suffix == ".json":
+        return json.loads(text)
+    else:
+        raise ValueError(f"unsupported fleet config file type: {path}")
+
+
+@dataclasses.dataclass
+class SecretNames:
+    """
+    GitHub secret naming convention.
+    """
+
+    aws_default_region: str = dataclasses.field(default="AWS_DEFAULT_REGION")
+    aws_access_key_id: str = dataclasses.field(default="AWS_ACCESS_KEY_ID")
+    aws_secret_access_key: str = dataclasses.field(default="AWS_SECRET_ACCESS_KEY")
+
+
+_EMPTY_TAGS: T.Mapping[str, str] = types.MappingProxyType({})
+
+
+@dataclasses.dataclass
+class PolicyTemplate:
+    """
+    A named inline policy document plus managed policy ARNs shared by many repos.
+    """
+
+    name: str = dataclasses.field()
+    policy_document: dict[str, T.Any] = dataclasses.field()
+    attached_policy_arn_list: T.Sequence[str] = dataclasses.field(default_factory=list)
+
+
+class RepoSpec:
+    """
+    One repo of the fleet, fields not set fall back to the fleet level defaults.
+
+    A fleet may hold tens of thousands of these, ``__slots__`` drops the per
+    instance ``__dict__``, and the loader shares ``tags`` and ``secret_names``
+    between repos with the same values, see :class:`~simple_gh_aws_creds.compact.Interner`.
+    """
+
+    __slots__ = (
+        "github_user_name",
+        "github_repo_name",
+        "policy",
+        "iam_user_name",
+        "aws_region",
+        "tags",
+        "secret_names",
+        "environments",
+    )
+
+    def __init__(
+        self,
+        github_user_name: str,
+        github_repo_name: str,
+        policy: str,
+        iam_user_name: T.Optional[str] = None,
+        aws_region: T.Optional[str] = None,
+        tags: T.Optional[T.Mapping[str, str]] = None,
+        secret_names: T.Optional[SecretNames] = None,
+        environments: T.Optional[T.Sequence[str]] = None,
+    ):
+        self.github_user_name = github_user_name
+        self.github_repo_name = github_repo_name
+        self.policy = policy
+        self.iam_user_name = iam_user_name
+        self.aws_region = aws_region
+        self.tags = _EMPTY_TAGS if tags is None else tags
+        self.secret_names = secret_names
+        self.environments = environments
+
+    def _astuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, RepoSpec):
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    def __repr__(self) -> str:
+        args = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"RepoSpec({args})"
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.github_user_name}/{self.github_repo_name}"
+
+
+@dataclasses.dataclass
+class TemplateRule:
+    """
+    Pick a policy template for a repo not listed in the config, used by
+    :mod:`simple_gh_aws_creds.daemon`. A rule with both ``topic`` and
+    ``pattern`` requires both to match.
+    """
+
+    policy: str = dataclasses.field()
+    topic: T.Optional[str] = dataclasses.field(default=None)
+    pattern: T.Optional[str] = dataclasses.field(default=None)
+
+    def __post_init__(self):
+        if self.topic is None and self.pattern is None:
+            raise ValueError(f"rule for policy {self.policy!r} needs topic or pattern")
+
+    def match(self, full_name: str, topics: T.Iterable[str]) -> bool:
+        if self.topic is not None and self.topic not in topics:
+            return False
+        if self.pattern is not None and not fnmatch.fnmatchcase(
+            full_name, self.pattern
+        ):
+            return False
+        return True
+
+
+def parse_repo_spec(
+    data: dict[str, T.Any],
+    policies: dict[str, PolicyTemplate],
+    interner: Interner,
+) -> RepoSpec:
+    """
+    Build a :class:`RepoSpec` from one ``[[repos]]`` entry, repeated values are
+    shared through ``interner``.
+
+    :raises ValueError: if the repo uses an undefined policy template.
+    """
+    data = dict(data)
+    secret_names = data.pop("secret_names", None)
+    if secret_names is not None:
+        key = tuple(sorted(secret_names.items()))
+        secret_names = interner.object(("secret_names", key), SecretNames(**secret_names))
+    environments = data.pop("environments", None)
+    if environments is not None:
+        key = tuple(interner.string(name) for name in environments)
+        environments = interner.object(("environments", key), key)
+    repo = RepoSpec(
+        github_user_name=interner.string(data.pop("github_user_name")),
+        github_repo_name=data.pop("github_repo_name"),
+        policy=interner.string(data.pop("policy")),
+        tags=interner.tags(data.pop("tags", None)),
+        secret_names=secret_names,
+        environments=environments,
+        **data,
+    )
+    if repo.policy not in policies:
+        raise ValueError(
+            f"repo {repo.full_name!r} uses undefined policy {repo.policy!r}"
+        )
+    return repo
+
+
+def iter_repo_specs_jsonl(
+    path: Path,
+    policies: dict[str, PolicyTemplate],
+    interner: Interner,
+) -> T.Iterator[RepoSpec]:
+    """
+    Stream repos from a JSON lines file, one ``[[repos]]`` entry per line, so
+    memory doesn't grow with the number of repos. Blank lines and lines
+    starting with ``#`` are skipped.
+    """
+    with Path(path).open() as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                repo = parse_repo_spec(json.loads(line), policies, interner)
+            except (ValueError, TypeError, KeyError) as e:
+                raise ValueError(f"{path}:{lineno}: invalid repo spec: {e}")
+            yield repo
+
+
+def _is_new_repo(repo: RepoSpec, seen: dict[str, tuple]) -> bool:
+    """
+    :param seen: full name -> settings of each repo seen so far, updated.
+
+    :raises ValueError: if the repo was seen with different settings.
+    """
+    settings = seen.get(repo.full_name)
+    if settings is None:
+        seen[repo.full_name] = repo._astuple()
+        return True
+    if settings != repo._astuple():
+        raise ValueError(
+            f"repo {repo.full_name!r} is listed twice with different settings"
+        )
+    return False
+
+
+@dataclasses.dataclass
+class FleetConfig:
+    """
+    Parsed fleet config file, see the module docstring for the format.
+    """
+
+    aws_region: str = dataclasses.field()
+    dir_access_key: Path = dataclasses.field()
+    state_file: T.Optional[Path] = dataclasses.field(default=None)
+    aws_profile: T.Optional[str] = dataclasses.field(default=None)
+    github_token_env: str = dataclasses.field(default="GITHUB_TOKEN")
+    webhook_secret_env: str = dataclasses.field(default="GITHUB_WEBHOOK_SECRET")
+    github_cache_dir: T.Optional[Path] = dataclasses.field(default=None)
+    github_http2: bool = dataclasses.field(default=False)
+    github_region_mode: str = dataclasses.field(default=REGION_AS_SECRET)
+    github_environments: list[str] = dataclasses.field(default_factory=list)
+    github_secret_stores: list[str] = dataclasses.field(
+        default_factory=lambda: [SECRET_STORE_ACTIONS]
+    )
+    circuit_breaker_failure_rate: float = dataclasses.field(default=0.5)
+    circuit_breaker_cooldown: float = dataclasses.field(default=30.0)
+    iam_user_name_template: str = dataclasses.field(default="gh-ci-{github_repo_name}")
+    shared_policies: bool = dataclasses.field(default=False)
+    tags: dict[str, str] = dataclasses.field(default_factory=dict)
+    secret_names: SecretNames = dataclasses.field(default_factory=SecretNames)
+    policies: dict[str, PolicyTemplate] = dataclasses.field(default_factory=dict)
+    repos: list[RepoSpec] = dataclasses.field(default_factory=list)
+    repos_file: T.Optional[Path] = dataclasses.field(default=None)
+    rules: list[TemplateRule] = dataclasses.field(default_factory=list)
+    interner: Interner = dataclasses.field(
+        default_factory=Interner,
+        repr=False,
+        compare=False,
+    )
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: dict[str, T.Any],
+        dir_root: T.Optional[Path] = None,
+    ) -> "FleetConfig":
+        """
+        :param dir_root: relative paths in the config are resolved against it,
+            usually the folder of the config file.
+        """
+        if dir_root is None:
+            dir_root = Path.cwd()
+        data = dict(data)
+        interner = Interner()
+        policies = dict()
+        for name, dct in data.pop("policies", {}).items():
+            dct = dict(dct)
+            dct["policy_document"] = interner.policy_document(dct["policy_document"])
+            dct["attached_policy_arn_list"] = interner.arn_list(
+                dct.get("attached_policy_arn_list", [])
+            )
+            policies[name] = PolicyTemplate(name=name, **dct)
+        repos = [
+            parse_repo_spec(dct, policies, interner) for dct in data.pop("repos", [])
+        ]
+        rules = [TemplateRule(**dct) for dct in data.pop("rules", [])]
+        for rule in rules:
+            if rule.policy not in policies:
+                raise ValueError(f"rule uses undefined policy {rule.policy!r}")
+        region_mode = data.get("github_region_mode", REGION_AS_SECRET)
+        if region_mode not in REGION_MODES:
+            raise ValueError(
+                f"github_region_mode must be one of {REGION_MODES}, got {region_mode!r}"
+            )
+        if data.get("github_secret_stores") == []:
+            raise ValueError(
+                f"github_secret_stores must name at least one of {SECRET_STORES}"
+            )
+        for store in data.get("github_secret_stores", []):
+            if store not in SECRET_STORES:
+                raise ValueError(
+                    f"github_secret_stores must be in {SECRET_STORES}, got {store!r}"
+                )
+        data["secret_names"] = SecretNames(**data.get("secret_names", {}))
+        data["dir_access_key"] = dir_root.joinpath(data.get("dir_access_key", ".access_keys"))
+        data["state_file"] = dir_root.joinpath(data.get("state_file", ".fleet_state.json"))
+        if data.get("github_cache_dir"):
+            data["github_cache_dir"] = dir_root.joinpath(data["github_cache_dir"])
+        if data.get("repos_file"):
+            data["repos_file"] = dir_root.joinpath(data["repos_file"])
+        config = cls(
+            policies=policies,
+            repos=repos,
+            rules=rules,
+            interner=interner,
+            **data,
+        )
+        config._dedupe_repos()
+        return config
+
+    def _dedupe_repos(self):
+        """
+        Drop the repos listed more than once in ``repos`` with the same
+        settings, the first entry is kept. The duplicates of ``repos_file`` are
+        dropped while it is streamed, see :meth:`iter_select`.
+
+        :raises ValueError: if a repo is listed twice with different settings.
+        """
+        seen: dict[str, tuple] = dict()
+        self.repos = [repo for repo in self.repos if _is_new_repo(repo, seen)]
+
+    @classmethod
+    def from_file(cls, path: Path) -> "FleetConfig":
+        path = Path(path).absolute()
+        return cls.from_dict(load_config_data(path), dir_root=path.parent)
+
+    def iter_repos(self) -> T.Iterator[RepoSpec]:
+        """
+        The repos of ``repos``, then the repos streamed from ``repos_file``,
+        see :func:`iter_repo_specs_jsonl`. A repo listed twice is yielded once.
+        """
+        return self.iter_select()
+
+    def iter_select(
+        self,
+        only: T.Optional[T.Iterable[str]] = None,
+        shard: T.Optional[Shard] = None,
+    ) -> T.Iterator[RepoSpec]:
+        """
+        Select repos by ``fnmatch`` patterns matched against ``owner/repo``
+        and the policy template name, e.g. ``MacHu-GWU/*``.
+        No pattern means all repos.
+
+        A repo listed in ``repos_file`` and before, inline or in the file, is
+        yielded once. To find these duplicates, the full name and the settings
+        of each selected repo are kept until the end of the stream, a few
+        hundred bytes per repo, ``only`` and ``shard`` narrow it.
+
+        :param shard: only keep the repos of this shard, see
+            :mod:`simple_gh_aws_creds.sharding`.
+
+        :raises ValueError: if a repo of ``repos_file`` was listed before with
+            different settings.
+        """
+        only = list(only or [])
+
+        def is_selected(repo: RepoSpec) -> bool:
+            if shard is not None and not shard.contains(repo.full_name):
+                return False
+            return not only or any(
+                fnmatch.fnmatchcase(repo.full_name, pattern)
+                or fnmatch.fnmatchcase(repo.policy, pattern)
+                for pattern in only
+            )
+
+        for repo in self.repos:
+            if is_selected(repo):
+                yield repo
+        if self.repos_file is None:
+            return
+        seen = {repo.full_name: repo._astuple() for repo in self.repos}
+        for repo in iter_repo_specs_jsonl(
+            self.repos_file,
+            policies=self.policies,
+            interner=self.interner,
+        ):
+            if is_selected(repo) and _is_new_repo(repo, seen):
+                yield repo
+
+    def select(
+        self,
+        only: T.Optional[T.Iterable[str]] = None,
+        shard: T.Optional[Shard] = None,
+    ) -> list[RepoSpec]:
+        """
+        List version of :meth:`iter_select`.
+        """
+        return list(self.iter_select(only, shard=shard))
+
+    def match_repo(
+        self,
+        github_user_name: str,
+        github_repo_name: str,
+        topics: T.Iterable[str] = (),
+    ) -> T.Optional[RepoSpec]:
+        """
+        Find the spec of a repo, the repo's own entry if listed in ``repos``,
+        otherwise built from the first matching rule, ``None`` if nothing matches.
+        """
+        full_name = f"{github_user_name}/{github_repo_name}"
+        for repo in self.iter_repos():
+            if repo.full_name == full_name:
+                return repo
+        topics = set(topics)
+        for rule in self.rules:
+            if rule.match(full_name, topics):
+                return RepoSpec(
+                    github_user_name=github_user_name,
+                    github_repo_name=github_repo_name,
+                    policy=rule.policy,
+                )
+        return None
+
+    def preflight(self):
+        """
+        Compile every policy template locally, before any API call.
+
+        :raises PolicyValidationError: if a template is malformed or too large,
+            the message names the template.
+        """
+        for name, template in self.policies.items():
+            try:
+                compile_policy(template.policy_document)
+            except PolicyValidationError as e:
+                raise PolicyValidationError(f"policy template {name!r}: {e}")
+
+    def get_iam_user_name(self, repo: RepoSpec) -> str:
+        if repo.iam_user_name:
+            return repo.iam_user_name
+        return self.iam_user_name_template.format(
+            github_user_name=repo.github_user_name,
+            github_repo_name=repo.github_repo_name,
+        )
+
+    def new_boto_session(self) -> "boto3.Session":
+        return boto3.Session(profile_name=self.aws_profile, region_name=self.aws_region)
+
+    def get_github_token(self) -> str:
+        return os.environ.get(self.github_token_env, "")
+
+    def get_webhook_secret(self) -> str:
+        return os.environ.get(self.webhook_secret_env, "")
+
+    def new_github_client(self, github_token: str) -> GitHubClient:
+        """
+        One GitHub client shared by all repos of a run, so the connection pool,
+        the ETag cache, the single flight coalescing and the circuit breaker
+        are shared too. With ``github_http2``, the requests of all workers are
+        multiplexed over a few HTTP/2 connections.
+        """
+        if self.github_cache_dir is None:
+            cache = None
+        else:
+            cache = ETagCache(dir_root=self.github_cache_dir)
+        circuit_breaker = self.new_circuit_breaker("github")
+        if self.github_http2:
+            return Http2GitHubClient(
+                token=github_token,
+                cache=cache,
+                circuit_breaker=circuit_breaker,
+            )
+        return GitHubClient(token=github_token, cache=cache, circuit_breaker=circuit_breaker)
+
+    def new_circuit_breaker(self, name: str) -> CircuitBreaker:
+        return CircuitBreaker(
+            name=name,
+            failure_rate=self.circuit_breaker_failure_rate,
+            cooldown=self.circuit_breaker_cooldown,
+        )
+
+    def new_iam_client(self, boto_ses: "boto3.Session"):
+        """
+        One IAM client shared by all repos of a run, guarded by a circuit
+        breaker for the account, and traced, see :mod:`simple_gh_aws_creds.tracing`.
+        """
+        iam_client = boto_ses.client("iam")
+        attach_to_boto_client(iam_client, self.new_circuit_breaker("iam"))
+        tracing.attach_to_boto_client(iam_client)
+        return iam_client
+
+    def to_setup(
+        self,
+        repo: RepoSpec,
+        boto_ses: "boto3.Session",
+        github_token: str,
+    ) -> SetupGitHubRepo:
+        """
+        Build the :class:`~simple_gh_aws_creds.impl.SetupGitHubRepo` of a repo.
+        """
+        template = self.policies[repo.policy]
+        secret_names = repo.secret_names or self.secret_names
+        aws_region = repo.aws_region or self.aws_region
+        github_region_mode = self.github_region_mode
+        # the org variable holds the fleet region, a repo overriding it
+        # gets its own repository variable
+        if github_region_mode == REGION_AS_ORG_VARIABLE and aws_region != self.aws_region:
+            github_region_mode = REGION_AS_VARIABLE
+        return SetupGitHubRepo(
+            boto_ses=boto_ses,
+            aws_region=aws_region,
+            iam_user_name=self.get_iam_user_name(repo),
+            tags={**self.tags, **repo.tags},
+            policy_document=template.policy_document,
+            attached_policy_arn_list=template.attached_policy_arn_list,
+            path_access_key_json=self.dir_access_key.joinpath(
+                f"{repo.github_user_name}__{repo.github_repo_name}.json"
+            ),
+            github_user_name=repo.github_user_name,
+            github_repo_name=repo.github_repo_name,
+            github_token=github_token,
+            github_secret_name_aws_default_region=secret_names.aws_default_region,
+            github_secret_name_aws_access_key_id=secret_names.aws_access_key_id,
+            github_secret_name_aws_secret_access_key=secret_names.aws_secret_access_key,
+            github_cache_dir=self.github_cache_dir,
+            github_region_mode=github_region_mode,
+            github_environments=list(
+                self.github_environments
+                if repo.environments is None
+                else repo.environments
+            ),
+            github_secret_stores=list(self.github_secret_stores),
+            use_shared_policy=self.shared_policies,
+            shared_policy_name=f"{SHARED_POLICY_NAME_PREFIX}{template.name}",
+        )
+
+
+@dataclasses.dataclass
+class RepoResult:
+    """
+    Machine readable outcome of running a command on one repo.
+
+    :param actions: for ``plan`` / ``plan-destroy``, what ``apply`` / ``destroy``
+        would change, for ``apply`` / ``destroy``, what the plan said before
+        the run.
+    """
+
+    repo: str = dataclasses.field()
+    iam_user_name: str = dataclasses.field()
+    command: str = dataclasses.field()
+    ok: bool = dataclasses.field(default=False)
+    actions: list[str] = dataclasses.field(default_factory=list)
+    error: T.Optional[str] = dataclasses.field(default=None)
+    elapsed: float = dataclasses.field(default=0.0)
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return dataclasses.asdict(self)
+
+
+def _full_name(setup: SetupGitHubRepo) -> str:
+    return f"{setup.github_user_name}/{setup.github_repo_name}"
+
+
+def _is_no_such_entity(e: botocore.exceptions.ClientError) -> bool:
+    return e.response["Error"]["Code"] == "NoSuchEntity"
+
+
+def plan_setup(
+    setup: SetupGitHubRepo,
+    check_github: bool = True,
+) -> list[str]:
+    """
+    Read-only: list what :meth:`~simple_gh_aws_creds.impl.SetupGitHubRepo.setup_all`
+    would change.
+    """
+    actions, _ = plan_setup_with_usage(setup, check_github=check_github)
+    return actions
+
+
+def plan_setup_with_usage(
+    setup: SetupGitHubRepo,
+    check_github: bool = True,
+) -> T.Tuple[list[str], UserUsage]:
+    """
+    :func:`plan_setup`, and what the IAM user already uses, read by the same
+    calls, for :mod:`simple_gh_aws_creds.admission`.
+    """
+    iam_client = setup.iam_client
+    actions = list()
+    usage = UserUsage()
+    try:
+        iam_client.get_user(UserName=setup.iam_user_name)
+        user_exists = True
+    except botocore.exceptions.ClientError as e:
+        if not _is_no_such_entity(e):  # pragma: no cover
+            raise e
+        user_exists = False
+
+    if setup.use_shared_policy:
+        shared_policy = setup.shared_policy_manager.describe(
+            setup.resolved_shared_policy_name
+        )
+        if shared_policy is None or shared_policy.document_hash != (
+            canonical_policy_hash(setup.policy_document)
+        ):
+            actions.append(f"put_shared_policy:{setup.resolved_shared_policy_name}")
+    else:
+        shared_policy = None
+
+    if user_exists is False:
+        actions.append("create_iam_user")
+        if setup.use_shared_policy:
+            actions.append(
+                f"attach_shared_policy:{setup.resolved_shared_policy_name}"
+            )
+        else:
+            actions.append("put_inline_policy")
+        actions.extend(
+            f"attach_policy:{arn}" for arn in setup.attached_policy_arn_list
+        )
+        actions.append("create_access_key")
+        actions.append("put_github_secrets")
+        return actions, usage
+
+    try:
+        res = iam_client.get_user_policy(
+            UserName=setup.iam_user_name,
+            PolicyName=setup.policy_document_name,
+        )
+        if setup.use_shared_policy:
+            actions.append("delete_inline_policy")
+        elif canonical_policy_hash(res["PolicyDocument"]) != canonical_policy_hash(
+            setup.policy_document
+        ):
+            actions.append("put_inline_policy")
+    except botocore.exceptions.ClientError as e:
+        if not _is_no_such_entity(e):  # pragma: no cover
+            raise e
+        if not setup.use_shared_policy:
+            actions.append("put_inline_policy")
+
+    res = iam_client.list_attached_user_policies(UserName=setup.iam_user_name)
+    attached = {dct["PolicyArn"] for dct in res.get("AttachedPolicies", [])}
+    usage.attached_policies = len(attached)
+    if setup.use_shared_policy and (
+        shared_policy is None or shared_policy.arn not in attached
+    ):
+        actions.append(f"attach_shared_policy:{setup.resolved_shared_policy_name}")
+    actions.extend(
+        f"attach_policy:{arn}"
+        for arn in setup.attached_policy_arn_list
+        if arn not in attached
+    )
+
+    res = iam_client.list_access_keys(UserName=setup.iam_user_name)
+    usage.access_keys = len(res.get("AccessKeyMetadata", []))
+    if not usage.access_keys:
+        actions.append("create_access_key")
+        actions.append("put_github_secrets")
+    elif not setup.path_access_key_json.exists():
+        actions.append("missing_local_access_key_json")
+    elif check_github:  # pragma: no cover
+        for target in setup.github_secret_targets:
+            existing = set(
+                setup.github_client.list_secret_names(
+                    setup.github_user_name,
+                    setup.github_repo_name,
+                    target.environment,
+                    target.store,
+                )
+            )
+            if not set(setup.github_secret_name_list).issubset(existing):
+                actions.append("put_github_secrets")
+                break
+        actions.extend(
+            f"put_github_variable:{name}"
+            for name in setup.github_variable_name_list
+            if setup.github_client.get_variable(
+                setup.github_user_name, setup.github_repo_name, name
+            )
+            != setup.aws_region
+        )
+    return actions, usage
+
+
+def plan_teardown(
+    setup: SetupGitHubRepo,
+    check_github: bool = True,
+) -> list[str]:
+    """
+    Read-only: list what :meth:`~simple_gh_aws_creds.impl.SetupGitHubRepo.teardown_all`
+    would delete.
+    """
+    iam_client = setup.iam_client
+    actions = list()
+    if check_github:  # pragma: no cover
+        for target in setup.github_secret_targets:
+            existing = set(
+                setup.github_client.list_secret_names(
+                    setup.github_user_name,
+                    setup.github_repo_name,
+                    target.environment,
+                    target.store,
+                )
+            )
+            if existing.intersection(setup.github_secret_name_list):
+                actions.append("delete_github_secrets")
+                break
+        actions.extend(
+            f"delete_github_variable:{name}"
+            for name in setup.github_variable_name_list
+            if setup.github_client.get_variable(
+                setup.github_user_name, setup.github_repo_name, name
+            )
+            is not None
+        )
+    try:
+        res = iam_client.list_access_keys(UserName=setup.iam_user_name)
+    except botocore.exceptions.ClientError as e:
+        if not _is_no_such_entity(e):  # pragma: no cover
+            raise e
+        return actions
+    if res.get("AccessKeyMetadata", []):
+        actions.append("delete_access_key")
+    res = iam_client.list_attached_user_policies(UserName=setup.iam_user_name)
+    actions.extend(
+        f"detach_policy:{dct['PolicyArn']}"
+        for dct in res.get("AttachedPolicies", [])
+    )
+    res = iam_client.list_user_policies(UserName=setup.iam_user_name)
+    if setup.policy_document_name in res.get("PolicyNames", []):
+        actions.append("delete_inline_policy")
+    actions.append("delete_iam_user")
+    return actions
+
+
+def run_repo(
+    command: str,
+    setup: SetupGitHubRepo,
+    check_github: bool = True,
+) -> RepoResult:
+    """
+    Run ``plan``, ``plan-destroy``, ``apply`` or ``destroy`` on one repo,
+    never raises.
+    """
+    start = time.monotonic()
+    result = RepoResult(
+        repo=_full_name(setup),
+        iam_user_name=setup.iam_user_name,
+        command=command,
+    )
+    with tracing.get_tracer().span(
+        f"{command} {result.repo}",
+        attributes=_span_attributes(result),
+        parent=None,
+    ) as span:
+        _run_repo(command, setup, result, check_github)
+        if result.error is not None:
+            span.set_status(tracing.STATUS_ERROR, result.error)
+    result.elapsed = time.monotonic() - start
+    return result
+
+
+def _span_attributes(result: RepoResult) -> dict[str, str]:
+    return {
+        "repo": result.repo,
+        "iam_user_name": result.iam_user_name,
+        "command": result.command,
+    }
+
+
+def _run_repo(
+    command: str,
+    setup: SetupGitHubRepo,
+    result: RepoResult,
+    check_github: bool,
+):
+    try:
+        if command == COMMAND_PLAN:
+            result.actions = plan_setup(setup, check_github=check_github)
+            result.ok = True
+        elif command == COMMAND_PLAN_DESTROY:
+            result.actions = plan_teardown(setup, check_github=check_github)
+            result.ok = True
+        elif command == COMMAND_APPLY:
+            result.actions = plan_setup(setup, check_github=False)
+            result.ok = setup.setup_all() is not False
+            if result.ok is False:
+                result.error = "failed to setup GitHub secrets"
+        elif command == COMMAND_DESTROY:
+            result.actions = plan_teardown(setup, check_github=False)
+            setup.teardown_all()
+            result.ok = True
+        else:
+            raise ValueError(f"unknown command {command!r}")
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+
+@dataclasses.dataclass
+class _IamPhase:
+    """
+    A repo between the IAM and the GitHub part of ``apply``.
+    """
+
+    setup: SetupGitHubRepo = dataclasses.field()
+    result: RepoResult = dataclasses.field()
+    start: float = dataclasses.field()
+    span: T.Any = dataclasses.field(default=tracing.NOOP_SPAN)
+    iam_end: T.Optional[float] = dataclasses.field(default=None)
+    access_key: T.Optional[str] = dataclasses.field(default=None)
+    secret_key: T.Optional[str] = dataclasses.field(default=None)
+
+
+def _apply_iam(
+    planned: T.Tuple[SetupGitHubRepo, T.Optional[list[str]]],
+) -> _IamPhase:
+    """
+    :param planned: the setup and its plan, ``None`` to plan it here.
+    """
+    setup, actions = planned
+    result = RepoResult(
+        repo=_full_name(setup),
+        iam_user_name=setup.iam_user_name,
+        command=COMMAND_APPLY,
+    )
+    phase = _IamPhase(
+        setup=setup,
+        result=result,
+        start=time.monotonic(),
+        # the repo span is ended by the GitHub part, in another worker
+        span=tracing.get_tracer().start_span(
+            f"{COMMAND_APPLY} {result.repo}",
+            attributes=_span_attributes(result),
+            parent=None,
+        ),
+    )
+    with tracing.use_span(phase.span):
+        try:
+            if actions is None:
+                actions = plan_setup(setup, check_github=False)
+            phase.result.actions = actions
+            phase.access_key, phase.secret_key = setup.setup_iam()
+        except Exception as e:
+            phase.result.error = f"{type(e).__name__}: {e}"
+    phase.iam_end = time.monotonic()
+    return phase
+
+
+def _apply_github(phase: _IamPhase) -> RepoResult:
+    span = phase.span
+    span.set_attribute(
+        "github.queue_wait_ms",
+        round((time.monotonic() - phase.iam_end) * 1000, 3),
+    )
+    with tracing.use_span(span):
+        result = _apply_github_in_span(phase)
+    if result.error is not None:
+        span.set_status(tracing.STATUS_ERROR, result.error)
+    span.end()
+    return result
+
+
+def _apply_github_in_span(phase: _IamPhase) -> RepoResult:
+    result = phase.result
+    breaker = phase.setup.github_client.circuit_breaker
+    if result.error is not None:
+        pass
+    elif breaker is not None and breaker.is_open():
+        # shed, the IAM part is done, the next apply only writes the secrets
+        result.error = (
+            f"deferred, circuit {breaker.name!r} is open, "
+            f"IAM is up to date, run apply again"
+        )
+    else:
+        try:
+            result.ok = (
+                phase.setup.put_github_secrets(phase.access_key, phase.secret_key)
+                is not False
+            )
+            if result.ok is False:
+                result.error = "failed to setup GitHub secrets"
+        except Exception as e:  # pragma: no cover
+            result.error = f"{type(e).__name__}: {e}"
+    result.elapsed = time.monotonic() - phase.start
+    return result
+
+
+def sync_org_region_variables(
+    config: FleetConfig,
+    github_client: GitHubClient,
+    repos: T.Iterable[RepoSpec],
+) -> dict[str, bool]:
+    """
+    ``github_region_mode = "org-variable"``: one organization variable per
+    owner holds the fleet region, visible to the selected repos of that owner.
+    Repos overriding ``aws_region`` are left out, they get a repository
+    variable, see :meth:`FleetConfig.to_setup`.
+
+    Repository ids are resolved with batched GraphQL lookups, see
+    :meth:`~simple_gh_aws_creds.github_client.GitHubClient.resolve_repo_ids`.
+    Reconciles, the variable is only written if its value or its repository
+    selection is missing something, see
+    :meth:`~simple_gh_aws_creds.github_client.GitHubClient.put_org_variable`.
+
+    :return: ``{owner: written}``.
+
+    :raises ValueError: if a repo doesn't exist or the token can't see it.
+    """
+    # (owner, variable name) -> repo full names
+    groups: dict[T.Tuple[str, str], list[str]] = dict()
+    for repo in repos:
+        if (repo.aws_region or config.aws_region) != config.aws_region:
+            continue
+        secret_names = repo.secret_names or config.secret_names
+        key = (repo.github_user_name, secret_names.aws_default_region)
+        groups.setdefault(key, []).append(repo.full_name)
+    # repository ids, GRAPHQL_MAX_REPOS repos per request
+    full_names = sorted({name for names in groups.values() for name in names})
+    repo_ids: dict[str, T.Optional[int]] = dict()
+    for i in range(0, len(full_names), GRAPHQL_MAX_REPOS):
+        repo_ids.update(
+            github_client.resolve_repo_ids(full_names[i : i + GRAPHQL_MAX_REPOS])
+        )
+    missing = [full_name for full_name in full_names if repo_ids[full_name] is None]
+    if missing:
+        raise ValueError(
+            f"{len(missing)} repos not found on GitHub, first: {missing[0]!r}"
+        )
+    written = dict()
+    for (owner, name), names in groups.items():
+        changed = github_client.put_org_variable(
+            owner,
+            name,
+            value=config.aws_region,
+            repo_ids=[repo_ids[full_name] for full_name in names],
+        )
+        written[owner] = written.get(owner, False) or changed
+    return written
+
+
+def run_fleet(
+    command: str,
+    config: FleetConfig,
+    only: T.Optional[T.Iterable[str]] = None,
+    parallel: int = 4,
+    boto_ses: T.Optional["boto3.Session"] = None,
+    github_token: T.Optional[str] = None,
+    check_github: bool = True,
+    admission: str = MODE_OFF,
+    changed_only: bool = False,
+    shard: T.Optional[Shard] = None,
+    github_parallel: T.Optional[int] = None,
+) -> T.Iterator[RepoResult]:
+    """
+    Run a command on the selected repos, ``parallel`` repos at a time, yield
+    results as they complete.
+
+    All repos share one IAM client and one GitHub client, each guarded by a
+    circuit breaker, see :mod:`simple_gh_aws_creds.circuit_breaker`. ``apply``
+    runs the IAM part of each repo in a pool of ``parallel`` workers, and the
+    GitHub part in a separate pool of ``github_parallel`` workers (default
+    ``parallel``), a slow backend can't take the workers of the other one.
+    While the GitHub breaker is open, the GitHub part is skipped, the repo
+    fails as deferred and isn't recorded in the state file.
+
+    :param admission: for ``apply`` only, ``"refuse"`` or ``"partition"``
+        to check the plan of each repo against the account quotas before it
+        is applied, see :mod:`simple_gh_aws_creds.admission`. Repos are
+        admitted against a running budget as their plans arrive, the IAM part
+        reuses the plan. ``"refuse"`` first plans every repo in a read-only
+        pass, and changes nothing if one doesn't fit.
+    :param changed_only: for ``apply`` only, skip the repos whose resolved spec
+        didn't change since their last successful apply, see
+        :mod:`simple_gh_aws_creds.state`. ``apply`` and ``destroy`` always
+        update the state file when ``config.state_file`` is set.
+    :param shard: only run the repos of this shard, with a per shard state
+        file, see :mod:`simple_gh_aws_creds.sharding`.
+
+    :raises PolicyValidationError: before any API call, if a policy template
+        is invalid, see :meth:`FleetConfig.preflight`.
+    :raises AdmissionError: in ``"refuse"`` admission mode, before any
+        mutation, if the run would exceed an account quota.
+    :raises InvalidPolicyArnError: for ``apply``, before any repo is touched,
+        if a managed policy ARN of the selected repos is malformed or missing.
+        Each distinct ARN is looked up once, the result is shared by all repos.
+    """
+    config.preflight()
+    if boto_ses is None:  # pragma: no cover
+        boto_ses = config.new_boto_session()
+    if github_token is None:  # pragma: no cover
+        github_token = config.get_github_token()
+    config.dir_access_key.mkdir(parents=True, exist_ok=True)
+    iam_client = config.new_iam_client(boto_ses)
+    github_client = config.new_github_client(github_token)
+    policy_arn_resolver = PolicyArnResolver(iam_client=iam_client)
+    shared_policy_manager = SharedPolicyManager(iam_client=iam_client)
+
+    def to_setup(repo: RepoSpec) -> SetupGitHubRepo:
+        setup = config.to_setup(repo, boto_ses=boto_ses, github_token=github_token)
+        setup.iam_client = iam_client
+        setup.github_client = github_client
+        setup.policy_arn_resolver = policy_arn_resolver
+        setup.shared_policy_manager = shared_policy_manager
+        return setup
+
+    if config.state_file is None:
+        if changed_only:
+            raise ValueError("changed_only requires config.state_file")
+        state = None
+    elif shard is None:
+        state = ApplyState.load(config.state_file)
+    else:
+        state = ApplyState.load(shard.state_file(config.state_file))
+
+    if command == COMMAND_APPLY:
+        # a first pass over the (possibly streamed) specs finds the distinct
+        # templates, setups are only built lazily, a few at a time, below
+        policy_names = {repo.policy for repo in config.iter_select(only, shard=shard)}
+        policy_arn_resolver.validate(
+            arn
+            for name in policy_names
+            for arn in config.policies[name].attached_policy_arn_list
+        )
+        if config.github_region_mode == REGION_AS_ORG_VARIABLE:
+            sync_org_region_variables(
+                config,
+                github_client,
+                config.iter_select(only, shard=shard),
+            )
+
+    def iter_setups() -> T.Iterator[SetupGitHubRepo]:
+        setups = (to_setup(repo) for repo in config.iter_select(only, shard=shard))
+        if command == COMMAND_APPLY and changed_only:
+            setups = (
+                setup
+                for setup in setups
+                if state.is_changed(_full_name(setup), spec_hash(setup))
+            )
+        return setups
+
+    def plan(setup: SetupGitHubRepo):
+        return setup, *plan_setup_with_usage(setup, check_github=False)
+
+    # repos rejected by admission control, yielded between the apply results
+    rejected: T.Deque[RepoResult] = collections.deque()
+
+    def iter_admitted(
+        budget: AdmissionBudget,
+    ) -> T.Iterator[T.Tuple[SetupGitHubRepo, list[str]]]:
+        planned = bounded_imap_unordered(plan, iter_setups(), max_workers=parallel)
+        for setup, actions, usage in planned:
+            reason = budget.admit(setup, actions, usage)
+            if reason is None:
+                yield setup, actions
+            else:
+                rejected.append(
+                    RepoResult(
+                        repo=_full_name(setup),
+                        iam_user_name=setup.iam_user_name,
+                        command=command,
+                        error=f"rejected by admission control: {reason}",
+                    )
+                )
+
+    if command != COMMAND_APPLY:
+        setups = iter_setups()
+    elif admission == MODE_OFF:
+        setups = ((setup, None) for setup in iter_setups())
+    elif admission in (MODE_REFUSE, MODE_PARTITION):
+        quota = AccountQuota.from_iam(iam_client)
+        if admission == MODE_REFUSE:
+            # the whole run must fit before the first mutation, a read-only
+            # pass only keeps the counts
+            budget = AdmissionBudget(quota)
+            for _ in iter_admitted(budget):
+                pass
+            rejected.clear()
+            budget.refuse_if_rejected()
+        # admitted as their plans arrive, the plan is reused by the IAM part
+        setups = iter_admitted(AdmissionBudget(quota))
+    else:
+        raise ValueError(f"unknown admission mode {admission!r}")
+
+    def run_one(setup: SetupGitHubRepo) -> RepoResult:
+        result = run_repo(command, setup, check_github=check_github)
+        if state is not None and result.ok and command == COMMAND_DESTROY:
+            state.forget(result.repo)
+        return result
+
+    def apply_github(phase: _IamPhase) -> RepoResult:
+        result = _apply_github(phase)
+        if state is not None and result.ok:
+            state.record(result.repo, spec_hash(phase.setup))
+        return result
+
+    try:
+        if command == COMMAND_APPLY:
+            # bulkheads, the IAM and the GitHub part of each repo run in
+            # separate worker pools
+            for result in pipeline_imap_unordered(
+                _apply_iam,
+                apply_github,
+                setups,
+                max_workers_first=parallel,
+                max_workers_second=github_parallel or parallel,
+            ):
+                while rejected:
+                    yield rejected.popleft()
+                yield result
+            while rejected:
+                yield rejected.popleft()
+        else:
+            yield from bounded_imap_unordered(run_one, setups, max_workers=parallel)
+    finally:
+        if state is not None and command in (COMMAND_APPLY, COMMAND_DESTROY):
+            state.save()
+
+
+def scan_fleet_drift(
+    config: FleetConfig,
+    only: T.Optional[T.Iterable[str]] = None,
+    parallel: int = 16,
+    boto_ses: T.Optional["boto3.Session"] = None,
+    github_token: T.Optional[str] = None,
+    check_github: bool = True,
+    shard: T.Optional[Shard] = None,
+) -> T.Iterator[RepoDrift]:
+    """
+    Read-only drift scan of the selected repos, see
+    :func:`~simple_gh_aws_creds.drift.scan_drift`.
+    """
+    if boto_ses is None:  # pragma: no cover
+        boto_ses = config.new_boto_session()
+    if github_token is None:  # pragma: no cover
+        github_token = config.get_github_token()
+    iam_client = config.new_iam_client(boto_ses)
+    github_client = config.new_github_client(github_token)
+    shared_policy_manager = SharedPolicyManager(iam_client=iam_client)
+
+    def to_setup(repo: RepoSpec) -> SetupGitHubRepo:
+        setup = config.to_setup(repo, boto_ses=boto_ses, github_token=github_token)
+        setup.iam_client = iam_client
+        setup.github_client = github_client
+        setup.shared_policy_manager = shared_policy_manager
+        return setup
+
+    yield from scan_drift(
+        (to_setup(repo) for repo in config.iter_select(only, shard=shard)),
+        iam_client=iam_client,
+        max_workers=parallel,
+        check_github=check_github,
+    )
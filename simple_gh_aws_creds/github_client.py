@@ -0,0 +1,736 @@
+# -*- coding: utf-8 -*-
+
+"""
+Thin GitHub REST client with a persistent ETag cache.
+
+Repository metadata, secret public keys and secret listings rarely change between
+runs. GitHub returns an ``ETag`` header on every ``GET`` response, and a
+``304 Not Modified`` reply to a conditional request does not count against the
+primary rate limit. :class:`GitHubClient` stores ``ETag`` and body of each
+``GET`` response on disk via :class:`ETagCache`, and automatically sends
+``If-None-Match`` on the next request for the same url.
+
+Only the handful of endpoints this library needs are implemented. The
+:attr:`~simple_gh_aws_creds.impl.SetupGitHubRepo.repo` property still returns a
+PyGithub ``Repository`` object, built from the cached repository payload.
+"""
+
+import typing as T
+import os
+import base64
+import json
+import time
+import hashlib
+import threading
+import dataclasses
+from pathlib import Path
+from functools import cached_property
+
+import requests
+import nacl.public
+import nacl.encoding
+from github import GithubException
+from github.PublicKey import encrypt
+
+from .single_flight import SingleFlight
+from .circuit_breaker import CircuitBreaker
+from .tracing import SPAN_KIND_CLIENT, STATUS_ERROR, get_tracer
+
+GITHUB_API_URL = "https://api.github.com"
+
+#: secret stores, each with its own public key and secrets
+SECRET_STORE_ACTIONS = "actions"
+SECRET_STORE_DEPENDABOT = "dependabot"
+SECRET_STORE_CODESPACES = "codespaces"
+SECRET_STORES = (SECRET_STORE_ACTIONS, SECRET_STORE_DEPENDABOT, SECRET_STORE_CODESPACES)
+
+#: max repositories looked up by one GraphQL request
+GRAPHQL_MAX_REPOS = 100
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    """
+    A cached ``GET`` response.
+    """
+
+    url: str = dataclasses.field()
+    etag: str = dataclasses.field()
+    body: T.Any = dataclasses.field()
+
+
+@dataclasses.dataclass
+class ETagCache:
+    """
+    Disk backed ``ETag`` cache, one JSON file per (token, url) pair.
+
+    The token is part of the cache key because two tokens may see different
+    content for the same url. Only a fingerprint of the token is used, the
+    token itself never touches the disk.
+
+    :param dir_root: directory where the cache files are stored.
+    """
+
+    dir_root: Path = dataclasses.field()
+
+    def _path(self, key: str) -> Path:
+        return self.dir_root.joinpath(
+            hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def get(self, key: str) -> T.Optional[CacheEntry]:
+        path = self._path(key)
+        try:
+            data = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        return CacheEntry(**data)
+
+    def put(self, key: str, entry: CacheEntry):
+        self.dir_root.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        # write to a temp file then rename, so concurrent readers never see
+        # a partially written file
+        path_tmp = path.with_name(
+            f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        path_tmp.write_text(json.dumps(dataclasses.asdict(entry)))
+        os.replace(path_tmp, path)
+
+    def delete(self, key: str):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        if self.dir_root.exists():
+            for path in self.dir_root.glob("*.json"):
+                path.unlink()
+
+
+@dataclasses.dataclass
+class PublicKey:
+    """
+    Public key used to encrypt secret values before upload.
+    """
+
+    key_id: str = dataclasses.field()
+    key: str = dataclasses.field()
+
+    def encrypt(self, value: str) -> str:
+        return encrypt(self.key, value)
+
+    def encrypt_many(self, values: T.Iterable[str]) -> list[str]:
+        """
+        Encrypt a batch of values, the key is decoded once for the batch.
+        """
+        sealed_box = nacl.public.SealedBox(
+            nacl.public.PublicKey(self.key.encode("utf-8"), nacl.encoding.Base64Encoder)
+        )
+        return [
+            base64.b64encode(sealed_box.encrypt(value.encode("utf-8"))).decode("utf-8")
+            for value in values
+        ]
+
+
+@dataclasses.dataclass(frozen=True)
+class SecretTarget:
+    """
+    Where a set of secrets is written, a secret store of the repository, or
+    the Actions secrets of one deployment environment.
+    """
+
+    store: str = dataclasses.field(default=SECRET_STORE_ACTIONS)
+    environment: T.Optional[str] = dataclasses.field(default=None)
+
+    def __str__(self) -> str:
+        if self.environment is None:
+            return self.store
+        return f"{self.store}@{self.environment}"
+
+
+@dataclasses.dataclass
+class GitHubClient:
+    """
+    Minimal GitHub REST client used by :class:`~simple_gh_aws_creds.impl.SetupGitHubRepo`.
+
+    :param token: GitHub personal access token.
+    :param cache: optional :class:`ETagCache`, when given every ``GET`` request
+        becomes a conditional request.
+    :param base_url: GitHub API base url, change it for GitHub Enterprise.
+    :param timeout: per request timeout in seconds.
+    :param single_flight: concurrent identical ``GET`` requests issued by
+        workers sharing this client are coalesced into one request.
+    :param circuit_breaker: optional breaker guarding every request, 5xx replies,
+        rate limits and transport errors count as failures, see
+        :mod:`simple_gh_aws_creds.circuit_breaker`.
+    :param max_retries: max retries of a rate limited request, only when the
+        reply has a ``Retry-After`` header of at most ``max_retry_after``
+        seconds, the time to sleep before retrying.
+    """
+
+    token: str = dataclasses.field()
+    cache: T.Optional[ETagCache] = dataclasses.field(default=None)
+    base_url: str = dataclasses.field(default=GITHUB_API_URL)
+    timeout: int = dataclasses.field(default=30)
+    single_flight: SingleFlight = dataclasses.field(default_factory=SingleFlight)
+    circuit_breaker: T.Optional[CircuitBreaker] = dataclasses.field(default=None)
+    max_retries: int = dataclasses.field(default=2)
+    max_retry_after: float = dataclasses.field(default=60.0)
+
+    @property
+    def default_headers(self) -> dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+
+    @cached_property
+    def session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers.update(self.default_headers)
+        return session
+
+    @cached_property
+    def token_fingerprint(self) -> str:
+        return hashlib.sha256(self.token.encode("utf-8")).hexdigest()[:16]
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def _cache_key(self, url: str) -> str:
+        return f"{self.token_fingerprint} {url}"
+
+    @staticmethod
+    def _raise_for_status(res: requests.Response):
+        if res.status_code >= 400:
+            try:
+                data = res.json()
+            except ValueError:
+                data = {"message": res.text}
+            raise GithubException(res.status_code, data, dict(res.headers))
+
+    @staticmethod
+    def _is_backend_failure(res) -> bool:
+        return (
+            res.status_code >= 500
+            or res.status_code == 429
+            or (
+                res.status_code == 403
+                and res.headers.get("x-ratelimit-remaining") == "0"
+            )
+        )
+
+    def _retry_after(self, res) -> T.Optional[float]:
+        """
+        Seconds to sleep before retrying a rate limited request, as asked by
+        GitHub, ``None`` if the request is not retried.
+        """
+        if res.status_code not in (403, 429):
+            return None
+        try:
+            seconds = float(res.headers["retry-after"])
+        except (KeyError, ValueError):
+            return None
+        if not 0 <= seconds <= self.max_retry_after:
+            return None
+        return seconds
+
+    def _send_with_retries(self, method: str, url: str, **kwargs):
+        """
+        :return: the last response, the number of retries and the seconds
+            slept between them.
+        """
+        n_retries = 0
+        backoff = 0.0
+        while True:
+            res = self._send_guarded(method, url, **kwargs)
+            if n_retries >= self.max_retries:
+                return res, n_retries, backoff
+            seconds = self._retry_after(res)
+            if seconds is None:
+                return res, n_retries, backoff
+            time.sleep(seconds)
+            n_retries += 1
+            backoff += seconds
+
+    def _send(self, method: str, url: str, **kwargs):
+        tracer = get_tracer()
+        if not tracer.enabled:
+            return self._send_with_retries(method, url, **kwargs)[0]
+        with tracer.span(
+            f"github.{method}",
+            attributes={"http.method": method, "http.url": url},
+            kind=SPAN_KIND_CLIENT,
+        ) as span:
+            res, n_retries, backoff = self._send_with_retries(method, url, **kwargs)
+            span.set_attribute("http.status_code", res.status_code)
+            span.set_attribute("github.retry_attempts", n_retries)
+            if n_retries:
+                span.set_attribute("github.retry_backoff_ms", round(backoff * 1000, 3))
+            if self._is_backend_failure(res):
+                span.set_status(STATUS_ERROR)
+            remaining = res.headers.get("x-ratelimit-remaining")
+            if remaining is not None:
+                span.set_attribute("github.ratelimit_remaining", int(remaining))
+            return res
+
+    def _send_guarded(self, method: str, url: str, **kwargs):
+        if self.circuit_breaker is None:
+            return self.session.request(method, url, **kwargs)
+        self.circuit_breaker.before_call()
+        try:
+            res = self.session.request(method, url, **kwargs)
+        except Exception:
+            self.circuit_breaker.record(False)
+            raise
+        self.circuit_breaker.record(not self._is_backend_failure(res))
+        return res
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        json_data: T.Optional[dict] = None,
+    ) -> requests.Response:
+        res = self._send(
+            method,
+            self._url(path),
+            json=json_data,
+            timeout=self.timeout,
+        )
+        self._raise_for_status(res)
+        return res
+
+    def get_json(self, path: str) -> T.Any:
+        """
+        Send a ``GET`` request and return the JSON body.
+
+        When a cache is configured, the stored ``ETag`` is sent with
+        ``If-None-Match``, a ``304`` reply is served from the cache.
+        Concurrent calls for the same path share one request.
+        """
+        return self.single_flight.do(path, lambda: self._get_json(path))
+
+    def _get_json(self, path: str) -> T.Any:
+        url = self._url(path)
+        if self.cache is None:
+            res = self._send("GET", url, timeout=self.timeout)
+            self._raise_for_status(res)
+            return res.json()
+
+        key = self._cache_key(url)
+        entry = self.cache.get(key)
+        headers = {}
+        if entry is not None:
+            headers["If-None-Match"] = entry.etag
+        res = self._send("GET", url, headers=headers, timeout=self.timeout)
+        if res.status_code == 304 and entry is not None:
+            return entry.body
+        self._raise_for_status(res)
+        body = res.json()
+        etag = res.headers.get("ETag")
+        if etag:
+            self.cache.put(key, CacheEntry(url=url, etag=etag, body=body))
+        return body
+
+    # --------------------------------------------------------------------------
+    # Repository
+    # --------------------------------------------------------------------------
+    def get_repo(self, owner: str, repo: str) -> dict[str, T.Any]:
+        return self.get_json(f"/repos/{owner}/{repo}")
+
+    @property
+    def graphql_url(self) -> str:
+        # GitHub Enterprise serves REST at /api/v3 and GraphQL at /api/graphql
+        if self.base_url.endswith("/api/v3"):
+            return self.base_url[: -len("/v3")] + "/graphql"
+        return f"{self.base_url}/graphql"
+
+    def graphql(
+        self,
+        query: str,
+        variables: T.Optional[dict[str, T.Any]] = None,
+    ) -> dict[str, T.Any]:
+        """
+        Send a GraphQL query, return the whole reply, ``data`` and ``errors``.
+        """
+        res = self._send(
+            "POST",
+            self.graphql_url,
+            json={"query": query, "variables": variables or {}},
+            timeout=self.timeout,
+        )
+        self._raise_for_status(res)
+        return res.json()
+
+    def _lookup_repos(
+        self,
+        full_names: T.Sequence[str],
+        selection: str,
+    ) -> list[T.Optional[dict[str, T.Any]]]:
+        """
+        One GraphQL request with a ``repository`` lookup per repo.
+
+        :param selection: the fields of each repository, e.g. ``nameWithOwner``.
+
+        :return: the fields of each repo, in order, ``None`` for a repo that
+            doesn't exist or the token can't see.
+        """
+        if len(full_names) > GRAPHQL_MAX_REPOS:
+            raise ValueError(
+                f"at most {GRAPHQL_MAX_REPOS} repos per request, got {len(full_names)}"
+            )
+        if not full_names:
+            return []
+        declarations = list()
+        fields = list()
+        variables = dict()
+        for i, full_name in enumerate(full_names):
+            owner, repo = full_name.split("/", 1)
+            declarations.append(f"$o{i}: String!, $n{i}: String!")
+            fields.append(
+                f"r{i}: repository(owner: $o{i}, name: $n{i}) {{ {selection} }}"
+            )
+            variables[f"o{i}"] = owner
+            variables[f"n{i}"] = repo
+        query = f"query({', '.join(declarations)}) {{ {' '.join(fields)} }}"
+        body = self.graphql(query, variables)
+        # a missing repo is a NOT_FOUND error next to the other results, any
+        # other error, rate limit or bad credentials, makes the reply unusable
+        errors = [
+            error
+            for error in body.get("errors") or []
+            if error.get("type") != "NOT_FOUND"
+        ]
+        if errors:
+            raise GithubException(
+                200, {"message": errors[0].get("message"), "errors": errors}, {}
+            )
+        data = body.get("data") or {}
+        return [data.get(f"r{i}") for i in range(len(full_names))]
+
+    def resolve_repos(
+        self,
+        full_names: T.Sequence[str],
+    ) -> dict[str, T.Optional[str]]:
+        """
+        Look up up to :data:`GRAPHQL_MAX_REPOS` repos in one GraphQL request.
+
+        :param full_names: ``owner/repo`` names.
+
+        :return: ``{full_name: current owner/repo}``, the current name differs
+            from the given one for a renamed or transferred repo, ``None`` if
+            the repo doesn't exist or the token can't see it.
+        """
+        repos = self._lookup_repos(full_names, "nameWithOwner")
+        return {
+            full_name: (repo or {}).get("nameWithOwner")
+            for full_name, repo in zip(full_names, repos)
+        }
+
+    def resolve_repo_ids(
+        self,
+        full_names: T.Sequence[str],
+    ) -> dict[str, T.Optional[int]]:
+        """
+        Numeric ids of up to :data:`GRAPHQL_MAX_REPOS` repos in one GraphQL
+        request, instead of one :meth:`get_repo` per repo.
+
+        :return: ``{full_name: repository id}``, ``None`` if the repo doesn't
+            exist or the token can't see it.
+        """
+        repos = self._lookup_repos(full_names, "databaseId")
+        return {
+            full_name: (repo or {}).get("databaseId")
+            for full_name, repo in zip(full_names, repos)
+        }
+
+    # --------------------------------------------------------------------------
+    # Environments
+    # --------------------------------------------------------------------------
+    def get_environment(
+        self,
+        owner: str,
+        repo: str,
+        environment: str,
+    ) -> T.Optional[dict[str, T.Any]]:
+        """
+        Deployment environment of a repository, ``None`` if it doesn't exist.
+        """
+        return self._get_json_or_none(f"/repos/{owner}/{repo}/environments/{environment}")
+
+    def ensure_environment(self, owner: str, repo: str, environment: str) -> bool:
+        """
+        Create the deployment environment if it doesn't exist, an existing
+        environment and its protection rules are left untouched.
+
+        :return: ``True`` if the environment was created.
+        """
+        if self.get_environment(owner, repo, environment) is not None:
+            return False
+        self.request("PUT", f"/repos/{owner}/{repo}/environments/{environment}")
+        return True
+
+    # --------------------------------------------------------------------------
+    # Secrets, of the Actions, Dependabot and Codespaces stores
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def _secrets_path(
+        owner: str,
+        repo: str,
+        store: str = SECRET_STORE_ACTIONS,
+        environment: T.Optional[str] = None,
+    ) -> str:
+        if store not in SECRET_STORES:
+            raise ValueError(f"secret store must be one of {SECRET_STORES}, got {store!r}")
+        if environment is None:
+            return f"/repos/{owner}/{repo}/{store}/secrets"
+        if store != SECRET_STORE_ACTIONS:
+            raise ValueError(f"only {SECRET_STORE_ACTIONS!r} secrets have environments")
+        return f"/repos/{owner}/{repo}/environments/{environment}/secrets"
+
+    def get_secrets_public_key(
+        self,
+        owner: str,
+        repo: str,
+        environment: T.Optional[str] = None,
+        store: str = SECRET_STORE_ACTIONS,
+    ) -> PublicKey:
+        """
+        :param environment: the public key of this deployment environment
+            instead of the repository one.
+        :param store: ``"actions"``, ``"dependabot"`` or ``"codespaces"``, each
+            store has its own public key.
+        """
+        path = self._secrets_path(owner, repo, store, environment)
+        data = self.get_json(f"{path}/public-key")
+        return PublicKey(key_id=data["key_id"], key=data["key"])
+
+    def list_secrets(
+        self,
+        owner: str,
+        repo: str,
+        environment: T.Optional[str] = None,
+        store: str = SECRET_STORE_ACTIONS,
+    ) -> list[dict[str, T.Any]]:
+        """
+        Secret metadata, ``name``, ``created_at`` and ``updated_at``, never
+        the value.
+        """
+        path = self._secrets_path(owner, repo, store, environment)
+        secrets = list()
+        page = 1
+        per_page = 100
+        while True:
+            data = self.get_json(f"{path}?per_page={per_page}&page={page}")
+            items = data.get("secrets", [])
+            secrets.extend(items)
+            if len(items) < per_page:
+                break
+            page += 1
+        return secrets
+
+    def list_secret_names(
+        self,
+        owner: str,
+        repo: str,
+        environment: T.Optional[str] = None,
+        store: str = SECRET_STORE_ACTIONS,
+    ) -> list[str]:
+        return [
+            secret["name"]
+            for secret in self.list_secrets(owner, repo, environment, store)
+        ]
+
+    def put_secret(
+        self,
+        owner: str,
+        repo: str,
+        secret_name: str,
+        value: str,
+        public_key: T.Optional[PublicKey] = None,
+        environment: T.Optional[str] = None,
+        store: str = SECRET_STORE_ACTIONS,
+        encrypted_value: T.Optional[str] = None,
+    ):
+        """
+        Create or update a secret of the repository, of one of its deployment
+        environments or of another secret store.
+
+        :param public_key: the public key of the target, pass it in when
+            writing multiple secrets so it is only fetched once.
+        :param environment: write an environment secret of this deployment
+            environment.
+        :param store: ``"actions"``, ``"dependabot"`` or ``"codespaces"``.
+        :param encrypted_value: ``value`` already encrypted with ``public_key``.
+        """
+        if public_key is None:
+            public_key = self.get_secrets_public_key(owner, repo, environment, store)
+        if encrypted_value is None:
+            encrypted_value = public_key.encrypt(value)
+        self.request(
+            "PUT",
+            f"{self._secrets_path(owner, repo, store, environment)}/{secret_name}",
+            json_data={
+                "encrypted_value": encrypted_value,
+                "key_id": public_key.key_id,
+            },
+        )
+
+    def delete_secret(
+        self,
+        owner: str,
+        repo: str,
+        secret_name: str,
+        environment: T.Optional[str] = None,
+        store: str = SECRET_STORE_ACTIONS,
+    ):
+        self.request(
+            "DELETE",
+            f"{self._secrets_path(owner, repo, store, environment)}/{secret_name}",
+        )
+
+    # --------------------------------------------------------------------------
+    # Actions variables
+    # --------------------------------------------------------------------------
+    def _get_json_or_none(self, path: str) -> T.Optional[T.Any]:
+        try:
+            return self.get_json(path)
+        except GithubException as e:
+            if e.status == 404:
+                return None
+            raise e
+
+    def get_variable(self, owner: str, repo: str, name: str) -> T.Optional[str]:
+        """
+        Value of a repository variable, ``None`` if it doesn't exist.
+        """
+        data = self._get_json_or_none(f"/repos/{owner}/{repo}/actions/variables/{name}")
+        return None if data is None else data["value"]
+
+    def put_variable(self, owner: str, repo: str, name: str, value: str) -> bool:
+        """
+        Create or update a repository variable, unless it already has this value.
+
+        :return: ``True`` if the variable was written.
+        """
+        existing = self.get_variable(owner, repo, name)
+        if existing == value:
+            return False
+        if existing is None:
+            self.request(
+                "POST",
+                f"/repos/{owner}/{repo}/actions/variables",
+                json_data={"name": name, "value": value},
+            )
+        else:
+            self.request(
+                "PATCH",
+                f"/repos/{owner}/{repo}/actions/variables/{name}",
+                json_data={"name": name, "value": value},
+            )
+        return True
+
+    def delete_variable(self, owner: str, repo: str, name: str) -> bool:
+        """
+        :return: ``True`` if the variable existed.
+        """
+        try:
+            self.request("DELETE", f"/repos/{owner}/{repo}/actions/variables/{name}")
+        except GithubException as e:
+            if e.status == 404:
+                return False
+            raise e
+        return True
+
+    def get_org_variable(self, org: str, name: str) -> T.Optional[dict[str, T.Any]]:
+        """
+        Organization variable, with ``value`` and ``visibility``, ``None`` if
+        it doesn't exist.
+        """
+        return self._get_json_or_none(f"/orgs/{org}/actions/variables/{name}")
+
+    def list_org_variable_repo_ids(self, org: str, name: str) -> T.Set[int]:
+        """
+        Ids of the selected repositories of an organization variable.
+        """
+        ids = set()
+        page = 1
+        per_page = 100
+        while True:
+            data = self.get_json(
+                f"/orgs/{org}/actions/variables/{name}/repositories"
+                f"?per_page={per_page}&page={page}"
+            )
+            repositories = data.get("repositories", [])
+            ids.update(repository["id"] for repository in repositories)
+            if len(repositories) < per_page:
+                break
+            page += 1
+        return ids
+
+    def put_org_variable(
+        self,
+        org: str,
+        name: str,
+        value: str,
+        repo_ids: T.Iterable[int],
+    ) -> bool:
+        """
+        Create or update an organization variable visible to the selected
+        repositories. Repositories already selected stay selected. Nothing is
+        written if the value and the membership are already right.
+
+        Missing repositories are added one by one with
+        ``PUT .../repositories/{repository_id}``, never by replacing the whole
+        selection, so concurrent writers adding other repositories, e.g. other
+        shards, don't remove each other's.
+
+        :return: ``True`` if anything was written.
+        """
+        repo_ids = set(repo_ids)
+        existing = self.get_org_variable(org, name)
+        if existing is None:
+            try:
+                self.request(
+                    "POST",
+                    f"/orgs/{org}/actions/variables",
+                    json_data={
+                        "name": name,
+                        "value": value,
+                        "visibility": "selected",
+                        "selected_repository_ids": sorted(repo_ids),
+                    },
+                )
+                return True
+            except GithubException as e:
+                # created by another writer in the meantime
+                if e.status != 409:
+                    raise e
+                existing = self.get_org_variable(org, name)
+        changed = False
+        if existing["value"] != value:
+            self.request(
+                "PATCH",
+                f"/orgs/{org}/actions/variables/{name}",
+                json_data={"name": name, "value": value},
+            )
+            changed = True
+        if existing.get("visibility") == "selected":
+            selected = self.list_org_variable_repo_ids(org, name)
+            for repo_id in sorted(repo_ids - selected):
+                self.request(
+                    "PUT",
+                    f"/orgs/{org}/actions/variables/{name}/repositories/{repo_id}",
+                )
+                changed = True
+        return changed
+
+    def remove_org_variable_repo(self, org: str, name: str, repo_id: int):
+        self.request(
+            "DELETE",
+            f"/orgs/{org}/actions/variables/{name}/repositories/{repo_id}",
+        )
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+HTTP/2 transport for the GitHub secrets endpoints.
+
+:class:`~simple_gh_aws_creds.github_client.GitHubClient` sends its requests
+with ``requests``, HTTP/1.1, one request in flight per connection. Pushing
+secrets to thousands of repos from many workers then needs one socket, and
+one TLS handshake, per worker. :class:`Http2GitHubClient` sends the same
+requests through an ``httpx`` HTTP/2 client: requests from all workers
+sharing the client are multiplexed as concurrent streams over a few
+connections, reused across repos.
+
+Requires the optional ``httpx[http2]`` dependency::
+
+    pip install "simple_gh_aws_creds[http2]"
+
+Enable it with ``github_http2 = true`` in a fleet config, or
+``SetupGitHubRepo(..., github_http2=True)``, then raise ``--parallel``, each
+worker only costs a stream, not a connection.
+"""
+
+import typing as T
+import dataclasses
+from functools import cached_property
+
+from .github_client import GitHubClient
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    import httpx
+
+
+def _import_httpx():
+    try:
+        import httpx
+        import h2  # noqa: F401, httpx needs it for http2=True
+    except ImportError:
+        raise ImportError(
+            "the HTTP/2 GitHub transport requires httpx[http2], "
+            "run: pip install 'simple_gh_aws_creds[http2]'"
+        )
+    return httpx
+
+
+@dataclasses.dataclass
+class Http2GitHubClient(GitHubClient):
+    """
+    :class:`~simple_gh_aws_creds.github_client.GitHubClient` over HTTP/2.
+
+    The ``httpx`` client is thread safe, share one instance across workers.
+
+    :param max_connections: max number of connections to the API host, each
+        carries many concurrent streams.
+    :param transport: custom ``httpx`` transport, for testing.
+    """
+
+    max_connections: int = dataclasses.field(default=4)
+    transport: T.Optional["httpx.BaseTransport"] = dataclasses.field(default=None)
+
+    def __post_init__(self):
+        # fail when the client is created, not on the first secret write
+        _import_httpx()
+
+    @cached_property
+    def session(self) -> "httpx.Client":
+        httpx = _import_httpx()
+        return httpx.Client(
+            http2=True,
+            headers=self.default_headers,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            transport=self.transport,
+        )
+
+    def close(self):
+        if "session" in self.__dict__:
+            self.session.close()
+            del self.__dict__["session"]
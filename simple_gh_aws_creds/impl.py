@@ -38,8 +38,37 @@ import botocore.exceptions
 import boto3
 from github import Github, Repository
 
+from .concurrency import bounded_imap_unordered
+from .github_client import (
+    SECRET_STORE_ACTIONS,
+    SECRET_STORES,
+    ETagCache,
+    GitHubClient,
+    SecretTarget,
+)
+from .github_http2 import Http2GitHubClient
+from .policy import CompiledPolicy, compile_policy
+from .policy_arn import PolicyArnResolver
+from .secret_ledger import SecretLedger
+from .shared_policy import SharedPolicyManager, shared_policy_name_for
+from .tracing import traced
+from .verify import (
+    VerificationResult,
+    sample_policy_actions,
+    wait_until_credential_usable,
+)
+
 printer = print
 
+TAG_KEY_GITHUB_USER_NAME = "github_user_name"
+TAG_KEY_GITHUB_REPO_NAME = "github_repo_name"
+
+#: where the region is stored in GitHub, see ``SetupGitHubRepo.github_region_mode``
+REGION_AS_SECRET = "secret"
+REGION_AS_VARIABLE = "variable"
+REGION_AS_ORG_VARIABLE = "org-variable"
+REGION_MODES = (REGION_AS_SECRET, REGION_AS_VARIABLE, REGION_AS_ORG_VARIABLE)
+
 
 def mask_value(v: str) -> str:  # pragma: no cover
     if len(v) < 12:
@@ -82,7 +111,9 @@ class SetupGitHubRepo:
     :param iam_user_name: Name for the IAM user that will be created for GitHub Actions automation.
         Should follow AWS naming conventions and be descriptive of its purpose
     :param tags: Dictionary of key-value pairs for tagging the IAM user, useful for resource
-        management, cost tracking, and identifying the automation source
+        management, cost tracking, and identifying the automation source. The
+        ``github_user_name`` and ``github_repo_name`` tags are always added, they
+        identify the users managed by this library
     :param policy_document: IAM policy document as a dictionary defining the minimal permissions
         required for your GitHub Actions. Should follow principle of least privilege
     :param attached_policy_arn_list: List of AWS managed policy ARNs to attach to the IAM user
@@ -99,14 +130,39 @@ class SetupGitHubRepo:
         the AWS access key ID (default: "AWS_ACCESS_KEY_ID")
     :param github_secret_name_aws_secret_access_key: Name for the GitHub secret that will store
         the AWS secret access key (default: "AWS_SECRET_ACCESS_KEY")
+    :param github_cache_dir: Optional directory for the GitHub ``ETag`` cache. When set,
+        repository metadata, public keys and secret listings are fetched with
+        conditional requests, and ``304 Not Modified`` replies are served from disk
+    :param github_region_mode: Where ``github_secret_name_aws_default_region`` is
+        stored, the region is not sensitive. ``"secret"`` (default) encrypts it as
+        a secret, ``"variable"`` writes it as an Actions variable of the repo,
+        ``"org-variable"`` leaves it to an organization variable shared by the
+        fleet, see :func:`~simple_gh_aws_creds.fleet.sync_org_region_variables`
+    :param github_environments: Write the secrets to these GitHub deployment
+        environments, e.g. ``["dev", "prod"]``, instead of the repository secrets.
+        Missing environments are created. Teardown deletes the secrets, not
+        the environments
+    :param github_secret_stores: Secret stores receiving the credentials, any of
+        ``"actions"`` (default), ``"dependabot"`` and ``"codespaces"``, so
+        Dependabot triggered workflows and codespaces see them too. All stores
+        are written concurrently, secrets whose value didn't change are skipped,
+        see :mod:`simple_gh_aws_creds.secret_ledger`
+    :param github_http2: Send GitHub requests over HTTP/2 with ``httpx``, requires the
+        ``http2`` extra, see :mod:`simple_gh_aws_creds.github_http2`
+    :param use_shared_policy: Opt-in, store ``policy_document`` once as a customer
+        managed policy attached to every user sharing it, instead of one inline
+        policy per user, see :mod:`simple_gh_aws_creds.shared_policy`
+    :param shared_policy_name: Name of the shared policy, by default derived from
+        the hash of ``policy_document``
 
     .. note::
-        This tool does not create IAM policies - it only attaches existing AWS managed policies
-        specified in ``attached_policy_arn_list``. Policy creation is out of scope for this
-        simple automation tool designed for rapid IAM user setup. If your use case requires
-        complex permissions beyond a single inline policy, consider using dedicated IAM
-        management tools instead. This library is optimized for simple, come-and-go scenarios
-        where one inline policy should be sufficient.
+        By default ``policy_document`` is one inline policy per user, and the only managed
+        policies are the existing ones listed in ``attached_policy_arn_list``, attached as is.
+        With ``use_shared_policy``, the tool creates and versions one customer managed policy
+        per distinct document, named ``shared_policy_name`` or after the document hash, under
+        the ``/simple-gh-aws-creds/`` path, and attaches it to every user sharing the document.
+        Teardown detaches it but never deletes it, other users may still use it. For
+        permissions beyond that, consider dedicated IAM management tools.
 
     Setup Workflow:
 
@@ -114,6 +170,7 @@ class SetupGitHubRepo:
     - :meth:`s12_put_iam_policy`
     - :meth:`s13_create_or_get_access_key`
     - :meth:`s14_setup_github_secrets`
+    - :meth:`s15_verify_access_key` (optional)
 
     Teardown Workflow:
 
@@ -121,6 +178,8 @@ class SetupGitHubRepo:
     - :meth:`s22_delete_access_key`
     - :meth:`s23_delete_iam_policy`
     - :meth:`s24_delete_iam_user`
+
+    Use :meth:`setup_all` and :meth:`teardown_all` to run a whole workflow.
     """
 
     # fmt: off
@@ -137,17 +196,72 @@ class SetupGitHubRepo:
     github_secret_name_aws_default_region: str = field(default="AWS_DEFAULT_REGION")
     github_secret_name_aws_access_key_id: str = field(default="AWS_ACCESS_KEY_ID")
     github_secret_name_aws_secret_access_key: str = field(default="AWS_SECRET_ACCESS_KEY")
+    github_cache_dir: T.Optional[Path] = field(default=None)
+    github_region_mode: str = field(default=REGION_AS_SECRET)
+    github_environments: list[str] = field(default_factory=list)
+    github_secret_stores: list[str] = field(default_factory=lambda: [SECRET_STORE_ACTIONS])
+    github_http2: bool = field(default=False)
+    use_shared_policy: bool = field(default=False)
+    shared_policy_name: T.Optional[str] = field(default=None)
 
     # fmt: on
 
+    def __post_init__(self):
+        if not self.github_secret_stores:
+            raise ValueError(
+                "github_secret_stores must name at least one secret store, "
+                f"any of {SECRET_STORES}"
+            )
+
     @cached_property
     def iam_client(self):
         return self.boto_ses.client("iam")
 
+    @cached_property
+    def policy_arn_resolver(self) -> PolicyArnResolver:
+        """
+        Managed policy ARN cache, override it with a shared resolver when
+        managing many repos in the same account.
+        """
+        return PolicyArnResolver(iam_client=self.iam_client)
+
+    @cached_property
+    def shared_policy_manager(self) -> SharedPolicyManager:
+        """
+        Shared policy cache, override it with a shared manager when managing
+        many repos in the same account.
+        """
+        return SharedPolicyManager(iam_client=self.iam_client)
+
+    @property
+    def user_tags(self) -> dict[str, str]:
+        """
+        Tags written to the IAM user, ``tags`` plus the GitHub repo identity tags.
+        """
+        return {
+            **self.tags,
+            TAG_KEY_GITHUB_USER_NAME: self.github_user_name,
+            TAG_KEY_GITHUB_REPO_NAME: self.github_repo_name,
+        }
+
     @property
     def policy_document_name(self) -> str:
         return f"iam-user-{self.aws_region}-{self.iam_user_name}-inline-policy"
 
+    @property
+    def resolved_shared_policy_name(self) -> str:
+        if self.shared_policy_name:
+            return self.shared_policy_name
+        return shared_policy_name_for(self.policy_document)
+
+    @property
+    def compiled_policy(self) -> CompiledPolicy:
+        """
+        The validated, minified ``policy_document``, see
+        :func:`~simple_gh_aws_creds.policy.compile_policy`.
+        """
+        return compile_policy(self.policy_document)
+
     @property
     def github_secrets_url(self) -> str:
         return f"https://github.com/{self.github_user_name}/{self.github_repo_name}/settings/secrets/actions"
@@ -157,10 +271,74 @@ class SetupGitHubRepo:
     def gh(self) -> Github:  # pragma: no cover
         return Github(self.github_token)
 
+    @cached_property
+    def github_client(self) -> GitHubClient:
+        if self.github_cache_dir is None:
+            cache = None
+        else:
+            cache = ETagCache(dir_root=self.github_cache_dir)
+        if self.github_http2:
+            return Http2GitHubClient(token=self.github_token, cache=cache)
+        return GitHubClient(token=self.github_token, cache=cache)
+
     @cached_property
     def repo(self) -> Repository:  # pragma: no cover
-        return self.gh.get_repo(f"{self.github_user_name}/{self.github_repo_name}")
+        data = self.github_client.get_repo(self.github_user_name, self.github_repo_name)
+        return self.gh.create_from_raw_data(Repository.Repository, data)
+
+    @property
+    def github_secret_name_list(self) -> list[str]:
+        if self.github_region_mode == REGION_AS_SECRET:
+            return [
+                self.github_secret_name_aws_default_region,
+                self.github_secret_name_aws_access_key_id,
+                self.github_secret_name_aws_secret_access_key,
+            ]
+        return [
+            self.github_secret_name_aws_access_key_id,
+            self.github_secret_name_aws_secret_access_key,
+        ]
 
+    @property
+    def github_secret_targets(self) -> list[SecretTarget]:
+        """
+        Where the secrets are written, the Actions secrets of the repository
+        or of each of ``github_environments``, plus the other secret stores.
+        """
+        targets = list()
+        for store in self.github_secret_stores:
+            if store == SECRET_STORE_ACTIONS and self.github_environments:
+                targets.extend(
+                    SecretTarget(store=store, environment=environment)
+                    for environment in self.github_environments
+                )
+            else:
+                targets.append(SecretTarget(store=store))
+        return targets
+
+    @property
+    def path_secret_ledger_json(self) -> Path:
+        """
+        Fingerprints of the secret values last written, next to the local
+        access key file.
+        """
+        path = self.path_access_key_json
+        return path.with_name(f"{path.stem}.secrets.json")
+
+    @cached_property
+    def secret_ledger(self) -> SecretLedger:
+        return SecretLedger.load(self.path_secret_ledger_json)
+
+    @property
+    def github_variable_name_list(self) -> list[str]:
+        """
+        Repository variables written by :meth:`put_github_secrets`.
+        """
+        if self.github_region_mode == REGION_AS_VARIABLE:
+            return [self.github_secret_name_aws_default_region]
+        return []
+
+    @traced
     def s11_create_iam_user(self):
         """
         Create IAM user with proper tagging for resource management.
@@ -172,21 +350,23 @@ class SetupGitHubRepo:
 
         The idempotent design ensures this operation is safe to repeat, addressing
         the common scenario where setup scripts may be run multiple times during
-        project configuration or troubleshooting.
+        project configuration or troubleshooting. An existing user is tagged
+        again, so users created before the identity tags existed get them too.
         """
         printer(f"🆕Step 1.1: Create IAM User {self.iam_user_name!r}")
+        tags = [{"Key": key, "Value": value} for key, value in self.user_tags.items()]
         try:
-            self.iam_client.create_user(
-                UserName=self.iam_user_name,
-                Tags=[{"Key": key, "Value": value} for key, value in self.tags.items()],
-            )
+            self.iam_client.create_user(UserName=self.iam_user_name, Tags=tags)
             printer("  ✅Successfully created IAM User.")
         except botocore.exceptions.ClientError as e:
             if e.response["Error"]["Code"] == "EntityAlreadyExists":
-                printer("  ✅IAM User already exists, do nothing.")
+                # TagUser overwrites the given keys and leaves the others
+                self.iam_client.tag_user(UserName=self.iam_user_name, Tags=tags)
+                printer("  ✅IAM User already exists, tags are up to date.")
             else:  # pragma: no cover
                 raise e
 
+    @traced
     def s12_put_iam_policy(self):
         """
         Attach minimal-privilege inline policy and AWS managed policies to the IAM user.
@@ -204,16 +384,31 @@ class SetupGitHubRepo:
         The approach prevents the common security anti-pattern of using overly
         broad permissions for automation, reducing the blast radius if credentials
         are ever compromised.
+
+        The policy document is validated and minified locally first, so a
+        malformed or oversized document fails before any API call, see
+        :func:`~simple_gh_aws_creds.policy.compile_policy`. The managed policy
+        ARNs are checked with :attr:`policy_arn_resolver` before the inline
+        policy is put.
+
+        With ``use_shared_policy``, the document is attached as a shared customer
+        managed policy instead, see :mod:`simple_gh_aws_creds.shared_policy`.
         """
-        printer(f"🆕Step 1.2: Put IAM Policy {self.policy_document_name!r}")
+        if self.use_shared_policy:
+            self.policy_arn_resolver.validate(self.attached_policy_arn_list)
+            self._put_shared_iam_policy()
+        else:
+            printer(f"🆕Step 1.2: Put IAM Policy {self.policy_document_name!r}")
+            compiled_policy = self.compiled_policy
+            self.policy_arn_resolver.validate(self.attached_policy_arn_list)
 
-        # Attach inline policy
-        self.iam_client.put_user_policy(
-            UserName=self.iam_user_name,
-            PolicyName=self.policy_document_name,
-            PolicyDocument=json.dumps(self.policy_document),
-        )
-        printer("  ✅Successfully put IAM inline policy.")
+            # Attach inline policy
+            self.iam_client.put_user_policy(
+                UserName=self.iam_user_name,
+                PolicyName=self.policy_document_name,
+                PolicyDocument=compiled_policy.text,
+            )
+            printer("  ✅Successfully put IAM inline policy.")
 
         # Attach AWS managed policies if specified
         if self.attached_policy_arn_list:
@@ -224,6 +419,27 @@ class SetupGitHubRepo:
                 )
                 printer(f"  ✅Successfully attached policy {policy_arn}")
 
+    def _put_shared_iam_policy(self):
+        name = self.resolved_shared_policy_name
+        printer(f"🆕Step 1.2: Attach shared IAM Policy {name!r}")
+        policy_arn = self.shared_policy_manager.ensure(name, self.policy_document)
+        self.iam_client.attach_user_policy(
+            UserName=self.iam_user_name,
+            PolicyArn=policy_arn,
+        )
+        printer(f"  ✅Successfully attached shared policy {policy_arn}")
+        # users switching from the inline policy don't keep both
+        try:
+            self.iam_client.delete_user_policy(
+                UserName=self.iam_user_name,
+                PolicyName=self.policy_document_name,
+            )
+            printer("  ✅Deleted the former IAM inline policy.")
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchEntity":  # pragma: no cover
+                raise e
+
+    @traced
     def s13_create_or_get_access_key(
         self,
         verbose: bool = True,
@@ -268,7 +484,8 @@ class SetupGitHubRepo:
                 )
         return access_key, secret_key
 
-    def s14_setup_github_secrets(self):  # pragma: no cover
+    @traced
+    def s14_setup_github_secrets(self) -> bool:  # pragma: no cover
         """
         Configure GitHub repository secrets for seamless CI/CD integration.
 
@@ -288,24 +505,179 @@ class SetupGitHubRepo:
         printer("🆕Step 1.4: Setup GitHub Secrets")
         printer(f"  👀Preview at {self.github_secrets_url}")
         access_key, secret_key = self.s13_create_or_get_access_key(verbose=False)
+        return self.put_github_secrets(access_key, secret_key)
+
+    @traced
+    def put_github_secrets(
+        self,
+        access_key: str,
+        secret_key: str,
+    ) -> bool:  # pragma: no cover
+        """
+        Write the region and the given access key pair to GitHub Secrets.
+
+        The secrets are written to every target of :attr:`github_secret_targets`
+        concurrently, environments are created if missing, each target's public
+        key is fetched once and its values are encrypted as a batch. Secrets
+        whose value didn't change since the last write are skipped. Depending
+        on ``github_region_mode``, the region is written as a variable instead,
+        only if its value changed, or not at all.
+
+        :return: ``True`` if all secrets were written.
+        """
         key_value_pairs = [
-            (self.github_secret_name_aws_default_region, self.aws_region),
             (self.github_secret_name_aws_access_key_id, access_key),
             (self.github_secret_name_aws_secret_access_key, secret_key),
         ]
+        if self.github_region_mode == REGION_AS_SECRET:
+            key_value_pairs.insert(
+                0, (self.github_secret_name_aws_default_region, self.aws_region)
+            )
+        for variable_name in self.github_variable_name_list:
+            try:
+                written = self.github_client.put_variable(
+                    self.github_user_name,
+                    self.github_repo_name,
+                    name=variable_name,
+                    value=self.aws_region,
+                )
+                if written:
+                    printer(f"  ✅Successfully wrote GitHub Variable {variable_name!r}")
+                else:
+                    printer(f"  ✅GitHub Variable {variable_name!r} is up to date.")
+            except Exception as e:
+                printer(f"  ❌Failed to write GitHub Variable {variable_name!r}: {e}")
+                return False
+        targets = self.github_secret_targets
+        results = bounded_imap_unordered(
+            lambda target: self._put_github_secrets_to(target, key_value_pairs),
+            targets,
+            max_workers=len(targets),
+        )
+        # consume every result, a failed target doesn't stop the others
+        ok = all(list(results))
+        self.secret_ledger.save()
+        return ok
+
+    def _put_github_secrets_to(
+        self,
+        target: SecretTarget,
+        key_value_pairs: list[T.Tuple[str, str]],
+    ) -> bool:  # pragma: no cover
+        """
+        Write the secrets of one target with one public key fetch, skip the
+        secrets whose value didn't change since the last write.
+        """
+        owner, repo = self.github_user_name, self.github_repo_name
+        where = "" if target == SecretTarget() else f" to {target}"
+        try:
+            if target.environment is not None and self.github_client.ensure_environment(
+                owner, repo, target.environment
+            ):
+                printer(f"  ✅Successfully created GitHub environment {target.environment!r}")
+            updated_at = {
+                secret["name"]: secret.get("updated_at")
+                for secret in self.github_client.list_secrets(
+                    owner, repo, target.environment, target.store
+                )
+            }
+        except Exception as e:
+            printer(f"  ❌Failed to list GitHub Secrets{where}: {e}")
+            return False
+        todo = list()
         for secret_name, value in key_value_pairs:
+            key = f"{target}/{secret_name}"
+            if self.secret_ledger.is_unchanged(key, value, updated_at.get(secret_name)):
+                printer(f"  ✅GitHub Secret {secret_name!r}{where} is up to date.")
+            else:
+                todo.append((secret_name, value))
+        if not todo:
+            return True
+        try:
+            public_key = self.github_client.get_secrets_public_key(
+                owner, repo, target.environment, target.store
+            )
+            encrypted_values = public_key.encrypt_many(value for _, value in todo)
+        except Exception as e:
+            printer(f"  ❌Failed to get GitHub public key{where}: {e}")
+            return False
+        for (secret_name, value), encrypted_value in zip(todo, encrypted_values):
             try:
-                self.repo.create_secret(
+                self.github_client.put_secret(
+                    owner,
+                    repo,
                     secret_name=secret_name,
-                    unencrypted_value=value,
-                    secret_type="actions",
+                    value=value,
+                    public_key=public_key,
+                    environment=target.environment,
+                    store=target.store,
+                    encrypted_value=encrypted_value,
                 )
-                printer(f"  ✅Successfully created GitHub Secret {secret_name!r}")
+                printer(f"  ✅Successfully created GitHub Secret {secret_name!r}{where}")
             except Exception as e:
-                printer(f"  ❌Failed to create GitHub Secret {secret_name!r}: {e}")
-                return
+                printer(f"  ❌Failed to create GitHub Secret {secret_name!r}{where}: {e}")
+                return False
+        # read back ``updated_at``, a later change made outside of this
+        # library changes it and the secret is written again
+        try:
+            updated_at = {
+                secret["name"]: secret.get("updated_at")
+                for secret in self.github_client.list_secrets(
+                    owner, repo, target.environment, target.store
+                )
+            }
+        except Exception as e:
+            printer(f"  ⚠️Failed to list GitHub Secrets{where}, they are written again next time: {e}")
+            return True
+        for secret_name, value in todo:
+            self.secret_ledger.record(
+                f"{target}/{secret_name}", value, updated_at.get(secret_name)
+            )
+        return True
+
+    @traced
+    def s15_verify_access_key(
+        self,
+        timeout: float = 60,
+        action_sample_size: int = 0,
+        verbose: bool = True,
+    ) -> VerificationResult:
+        """
+        Wait until the access key and the inline policy are effective.
 
-    def s21_delete_github_secrets(self):  # pragma: no cover
+        IAM is eventually consistent, a new access key or policy can take several
+        seconds before it works, so CI pipelines triggered right after setup
+        often fail on the first run. This method polls with exponential backoff
+        instead of sleeping for a fixed time, and reports how long it took.
+
+        :param timeout: give up after this many seconds.
+        :param action_sample_size: number of concrete actions of
+            ``policy_document`` to dry run with ``simulate_principal_policy``,
+            0 means only check that the key authenticates.
+        """
+        if verbose:
+            printer("🆕Step 1.5: Verify access key")
+        access_key, secret_key = self.s13_create_or_get_access_key(verbose=False)
+        result = wait_until_credential_usable(
+            access_key=access_key,
+            secret_key=secret_key,
+            aws_region=self.aws_region,
+            iam_client=self.iam_client,
+            actions=sample_policy_actions(self.policy_document, k=action_sample_size)
+            if action_sample_size
+            else None,
+            timeout=timeout,
+        )
+        result.name = f"{self.github_user_name}/{self.github_repo_name}"
+        if verbose:
+            if result.ok:
+                printer(f"  ✅Access key is usable after {result.elapsed:.2f} seconds.")
+            else:
+                printer(f"  ❌Access key is not usable: {result.error}")
+        return result
+
+    @traced
+    def s21_delete_github_secrets(self):
         """
         Remove GitHub secrets to prevent credential accumulation.
 
@@ -321,18 +693,54 @@ class SetupGitHubRepo:
         """
         printer("🗑Step 2.1: Delete GitHub Secrets")
         printer(f"  👀Preview at {self.github_secrets_url}")
-        key_list = [
-            self.github_secret_name_aws_default_region,
-            self.github_secret_name_aws_access_key_id,
-            self.github_secret_name_aws_secret_access_key,
-        ]
-        for secret_name in key_list:
+        for target in self.github_secret_targets:
+            self._delete_github_secrets_from(target)
+        self.path_secret_ledger_json.unlink(missing_ok=True)
+        self.__dict__.pop("secret_ledger", None)
+        for variable_name in self.github_variable_name_list:
             try:
-                self.repo.delete_secret(secret_name)
-                printer(f"  ✅Successfully deleted GitHub Secret {secret_name!r}")
+                if self.github_client.delete_variable(
+                    self.github_user_name, self.github_repo_name, variable_name
+                ):
+                    printer(f"  ✅Successfully deleted GitHub Variable {variable_name!r}")
+                else:
+                    printer(
+                        f"  ✅GitHub Variable {variable_name!r} does not exist, nothing to delete."
+                    )
             except Exception as e:
-                printer(f"  ❌Failed to delete GitHub Secret {secret_name!r}: {e}")
+                printer(f"  ❌Failed to delete GitHub Variable {variable_name!r}: {e}")
 
+    def _delete_github_secrets_from(self, target: SecretTarget):  # pragma: no cover
+        owner, repo = self.github_user_name, self.github_repo_name
+        where = "" if target == SecretTarget() else f" of {target}"
+        try:
+            existing_secret_names = set(
+                self.github_client.list_secret_names(
+                    owner, repo, target.environment, target.store
+                )
+            )
+        except Exception as e:
+            printer(f"  ❌Failed to list GitHub Secrets{where}: {e}")
+            return
+        for secret_name in self.github_secret_name_list:
+            if secret_name not in existing_secret_names:
+                printer(
+                    f"  ✅GitHub Secret {secret_name!r}{where} does not exist, nothing to delete."
+                )
+                continue
+            try:
+                self.github_client.delete_secret(
+                    owner,
+                    repo,
+                    secret_name,
+                    environment=target.environment,
+                    store=target.store,
+                )
+                printer(f"  ✅Successfully deleted GitHub Secret {secret_name!r}{where}")
+            except Exception as e:
+                printer(f"  ❌Failed to delete GitHub Secret {secret_name!r}{where}: {e}")
+
+    @traced
     def s22_delete_access_key(self):
         """
         Remove AWS access key to complete credential lifecycle management.
@@ -356,17 +764,20 @@ class SetupGitHubRepo:
                 return
             else:  # pragma: no cover
                 raise e
+        # a rotated user also has the inactive old key, IAM refuses to delete
+        # a user with any key left
         access_key_list = res.get("AccessKeyMetadata", [])
-        if len(access_key_list):
-            access_key = access_key_list[0]["AccessKeyId"]
+        for metadata in access_key_list:
+            access_key = metadata["AccessKeyId"]
             self.iam_client.delete_access_key(
                 UserName=self.iam_user_name,
                 AccessKeyId=access_key,
             )
             printer(f"  ✅Successfully deleted access key {mask_value(access_key)!r}")
-        else:
+        if not access_key_list:
             printer("  ✅Access key does not exist, nothing to delete.")
 
+    @traced
     def s23_delete_iam_policy(self):
         """
         Remove IAM policies to clean up permissions and enable user deletion.
@@ -422,6 +833,7 @@ class SetupGitHubRepo:
             else:  # pragma: no cover
                 raise e
 
+    @traced
     def s24_delete_iam_user(self):
         """
         Remove IAM user to complete the full cleanup cycle.
@@ -445,3 +857,38 @@ class SetupGitHubRepo:
                 printer("  ✅IAM User does not exist, nothing to delete.")
             else:  # pragma: no cover
                 raise e
+
+    @traced
+    def setup_all(self) -> bool:
+        """
+        Run the complete setup workflow, from IAM user to GitHub Secrets.
+
+        The managed policy ARNs are validated first, a bad ARN fails before
+        the IAM user is created.
+
+        :return: ``True`` if the GitHub secrets were written.
+        """
+        self.setup_iam()
+        return self.s14_setup_github_secrets()
+
+    @traced
+    def setup_iam(self) -> tuple[str, str]:
+        """
+        Run the IAM part of the setup workflow, everything but GitHub.
+
+        :return: the access key pair, see :meth:`s13_create_or_get_access_key`.
+        """
+        self.policy_arn_resolver.validate(self.attached_policy_arn_list)
+        self.s11_create_iam_user()
+        self.s12_put_iam_policy()
+        return self.s13_create_or_get_access_key()
+
+    @traced
+    def teardown_all(self):
+        """
+        Run the complete teardown workflow, from GitHub Secrets to IAM user.
+        """
+        self.s21_delete_github_secrets()
+        self.s22_delete_access_key()
+        self.s23_delete_iam_policy()
+        self.s24_delete_iam_user()
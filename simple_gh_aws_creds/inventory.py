@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read-only inventory of the IAM users managed by this library.
+
+A managed user is an IAM user carrying both the ``github_user_name`` and
+``github_repo_name`` tags written by
+:meth:`~simple_gh_aws_creds.impl.SetupGitHubRepo.s11_create_iam_user`.
+
+:func:`iter_inventory` pages through ``list_users`` lazily and fetches the per
+user detail with bounded concurrency, records are yielded as soon as they are
+ready. Combined with the streaming writers :func:`write_jsonl` and
+:func:`write_csv`, memory stays flat no matter how many users there are.
+
+Example::
+
+    import boto3
+    from simple_gh_aws_creds.inventory import iter_inventory, write_csv
+
+    iam_client = boto3.Session().client("iam")
+    with open("inventory.csv", "w", newline="") as f:
+        write_csv(iter_inventory(iam_client, max_workers=16), f)
+"""
+
+import typing as T
+import csv
+import json
+import dataclasses
+from datetime import datetime, timezone
+
+import botocore.exceptions
+
+from .impl import TAG_KEY_GITHUB_USER_NAME, TAG_KEY_GITHUB_REPO_NAME
+from .concurrency import bounded_imap_unordered
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_iam.client import IAMClient
+
+
+@dataclasses.dataclass
+class AccessKeyRecord:
+    """
+    Access key metadata plus its last used information.
+    """
+
+    access_key_id: str = dataclasses.field()
+    status: str = dataclasses.field()
+    create_date: datetime = dataclasses.field()
+    last_used_date: T.Optional[datetime] = dataclasses.field(default=None)
+    last_used_service: T.Optional[str] = dataclasses.field(default=None)
+    last_used_region: T.Optional[str] = dataclasses.field(default=None)
+
+    def age_days(self, now: T.Optional[datetime] = None) -> float:
+        if now is None:
+            now = datetime.now(timezone.utc)
+        return (now - self.create_date).total_seconds() / 86400
+
+
+@dataclasses.dataclass
+class UserInventory:
+    """
+    Everything we know about one managed IAM user.
+    """
+
+    iam_user_name: str = dataclasses.field()
+    user_arn: str = dataclasses.field()
+    create_date: datetime = dataclasses.field()
+    github_user_name: str = dataclasses.field()
+    github_repo_name: str = dataclasses.field()
+    tags: dict[str, str] = dataclasses.field(default_factory=dict)
+    access_keys: list[AccessKeyRecord] = dataclasses.field(default_factory=list)
+    inline_policy_names: list[str] = dataclasses.field(default_factory=list)
+    attached_policy_arns: list[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def github_full_name(self) -> str:
+        return f"{self.github_user_name}/{self.github_repo_name}"
+
+    @property
+    def oldest_access_key(self) -> T.Optional[AccessKeyRecord]:
+        if self.access_keys:
+            return min(self.access_keys, key=lambda key: key.create_date)
+        return None
+
+    def to_dict(self) -> dict[str, T.Any]:
+        """
+        JSON serializable representation, datetimes are in ISO 8601 format.
+        """
+        return json.loads(json.dumps(dataclasses.asdict(self), default=_json_default))
+
+
+def _json_default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def iter_users(iam_client: "IAMClient") -> T.Iterator[dict[str, T.Any]]:
+    """
+    Page through all IAM users in the account, one page in memory at a time.
+    """
+    paginator = iam_client.get_paginator("list_users")
+    for page in paginator.paginate():
+        yield from page.get("Users", [])
+
+
+def get_user_inventory(
+    iam_client: "IAMClient",
+    user: dict[str, T.Any],
+) -> T.Optional[UserInventory]:
+    """
+    Fetch the detail of one IAM user.
+
+    :param user: an item of the ``list_users`` response.
+
+    :return: ``None`` if the user is not managed by this library, or if it was
+        deleted while we were reading it.
+    """
+    user_name = user["UserName"]
+    try:
+        res = iam_client.list_user_tags(UserName=user_name)
+        tags = {tag["Key"]: tag["Value"] for tag in res.get("Tags", [])}
+        if (TAG_KEY_GITHUB_USER_NAME not in tags) or (
+            TAG_KEY_GITHUB_REPO_NAME not in tags
+        ):
+            return None
+
+        access_keys = list()
+        res = iam_client.list_access_keys(UserName=user_name)
+        for metadata in res.get("AccessKeyMetadata", []):
+            access_key_id = metadata["AccessKeyId"]
+            res = iam_client.get_access_key_last_used(AccessKeyId=access_key_id)
+            last_used = res.get("AccessKeyLastUsed", {})
+            access_keys.append(
+                AccessKeyRecord(
+                    access_key_id=access_key_id,
+                    status=metadata["Status"],
+                    create_date=metadata["CreateDate"],
+                    last_used_date=last_used.get("LastUsedDate"),
+                    last_used_service=last_used.get("ServiceName"),
+                    last_used_region=last_used.get("Region"),
+                )
+            )
+
+        res = iam_client.list_user_policies(UserName=user_name)
+        inline_policy_names = res.get("PolicyNames", [])
+        res = iam_client.list_attached_user_policies(UserName=user_name)
+        attached_policy_arns = [
+            policy["PolicyArn"] for policy in res.get("AttachedPolicies", [])
+        ]
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchEntity":
+            return None
+        raise e  # pragma: no cover
+
+    return UserInventory(
+        iam_user_name=user_name,
+        user_arn=user["Arn"],
+        create_date=user["CreateDate"],
+        github_user_name=tags[TAG_KEY_GITHUB_USER_NAME],
+        github_repo_name=tags[TAG_KEY_GITHUB_REPO_NAME],
+        tags=tags,
+        access_keys=access_keys,
+        inline_policy_names=inline_policy_names,
+        attached_policy_arns=attached_policy_arns,
+    )
+
+
+def iter_inventory(
+    iam_client: "IAMClient",
+    max_workers: int = 8,
+) -> T.Iterator[UserInventory]:
+    """
+    Yield a :class:`UserInventory` for every managed IAM user, in completion order.
+
+    :param max_workers: max number of users whose detail is fetched concurrently.
+    """
+    for record in bounded_imap_unordered(
+        lambda user: get_user_inventory(iam_client, user),
+        iter_users(iam_client),
+        max_workers=max_workers,
+    ):
+        if record is not None:
+            yield record
+
+
+def write_jsonl(
+    records: T.Iterable[UserInventory],
+    fp: T.TextIO,
+) -> int:
+    """
+    Write one JSON object per user, return the number of records written.
+    """
+    n = 0
+    for record in records:
+        fp.write(json.dumps(record.to_dict()) + "\n")
+        n += 1
+    return n
+
+
+CSV_FIELDS = [
+    "iam_user_name",
+    "user_arn",
+    "github_user_name",
+    "github_repo_name",
+    "access_key_id",
+    "access_key_status",
+    "access_key_create_date",
+    "access_key_age_days",
+    "last_used_date",
+    "last_used_service",
+    "last_used_region",
+    "inline_policy_names",
+    "attached_policy_arns",
+]
+
+
+def write_csv(
+    records: T.Iterable[UserInventory],
+    fp: T.TextIO,
+) -> int:
+    """
+    Write one CSV row per access key (or one row for a user without key),
+    return the number of users written.
+    """
+    now = datetime.now(timezone.utc)
+    writer = csv.DictWriter(fp, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    n = 0
+    for record in records:
+        base = {
+            "iam_user_name": record.iam_user_name,
+            "user_arn": record.user_arn,
+            "github_user_name": record.github_user_name,
+            "github_repo_name": record.github_repo_name,
+            "inline_policy_names": ";".join(record.inline_policy_names),
+            "attached_policy_arns": ";".join(record.attached_policy_arns),
+        }
+        if record.access_keys:
+            for key in record.access_keys:
+                row = dict(base)
+                row.update(
+                    {
+                        "access_key_id": key.access_key_id,
+                        "access_key_status": key.status,
+                        "access_key_create_date": key.create_date.isoformat(),
+                        "access_key_age_days": f"{key.age_days(now):.2f}",
+                        "last_used_date": (
+                            key.last_used_date.isoformat()
+                            if key.last_used_date
+                            else ""
+                        ),
+                        "last_used_service": key.last_used_service or "",
+                        "last_used_region": key.last_used_region or "",
+                    }
+                )
+                writer.writerow(row)
+        else:
+            writer.writerow(base)
+        n += 1
+    return n
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+"""
+OIDC trust role mode, no IAM user, no access key, no secret.
+
+:class:`~simple_gh_aws_creds.impl.SetupGitHubRepo` creates an IAM user, an
+access key and pushes it to GitHub Secrets, then the key has to be rotated
+forever. :class:`SetupGitHubOidcRole` provisions the same permissions for
+GitHub Actions' OpenID Connect tokens instead:
+
+- the GitHub OIDC identity provider exists once per account, see
+  :class:`OidcProviderManager`
+- one IAM role per repo, or per group of repos, trusted by the provider for
+  ``repo:owner/name:*`` only, with ``policy_document`` as its inline policy
+- the role ARN is written as an Actions variable of each repo, it is not a
+  secret. Workflows assume the role with ``aws-actions/configure-aws-credentials``::
+
+      permissions:
+        id-token: write
+      steps:
+        - uses: aws-actions/configure-aws-credentials@v4
+          with:
+            role-to-assume: ${{ vars.AWS_ROLE_ARN }}
+            aws-region: us-east-1
+
+Credentials are short lived, nothing is stored locally or in GitHub, and a rerun
+only compares the role, its policies and a variable.
+
+This mode is only available from the Python API, the fleet config and the CLI
+provision IAM users.
+"""
+
+import typing as T
+import json
+import dataclasses
+from functools import cached_property
+
+import boto3
+import botocore.exceptions
+
+from .concurrency import bounded_imap_unordered
+from .github_client import GitHubClient
+from .policy import CompiledPolicy, compile_policy
+from .policy_arn import PolicyArnResolver
+from .single_flight import SingleFlight
+from .tracing import traced
+
+printer = print
+
+GITHUB_OIDC_HOST = "token.actions.githubusercontent.com"
+GITHUB_OIDC_URL = f"https://{GITHUB_OIDC_HOST}"
+GITHUB_OIDC_AUDIENCE = "sts.amazonaws.com"
+#: IAM ignores it for GitHub's provider, but older API versions require one
+GITHUB_OIDC_THUMBPRINT_LIST = [
+    "6938fd4d98bab03faadb97b34396831e3780aea1",
+    "1c58a3a8518e8759bf075b76b750d4f2df264fcd",
+]
+
+TAG_KEY_GITHUB_REPOS = "github_repos"
+
+
+@dataclasses.dataclass
+class OidcProviderManager:
+    """
+    Find or create the GitHub OIDC identity provider of an account, at most
+    once per manager. Share one manager across all setups of a run.
+    """
+
+    iam_client: T.Any = dataclasses.field()
+
+    def __post_init__(self):
+        self._single_flight = SingleFlight(ttl=float("inf"))
+
+    def _ensure(self) -> str:
+        res = self.iam_client.list_open_id_connect_providers()
+        for provider in res.get("OpenIDConnectProviderList", []):
+            if provider["Arn"].endswith(f"oidc-provider/{GITHUB_OIDC_HOST}"):
+                self._ensure_client_id(provider["Arn"])
+                return provider["Arn"]
+        try:
+            res = self.iam_client.create_open_id_connect_provider(
+                Url=GITHUB_OIDC_URL,
+                ClientIDList=[GITHUB_OIDC_AUDIENCE],
+                ThumbprintList=GITHUB_OIDC_THUMBPRINT_LIST,
+            )
+            return res["OpenIDConnectProviderArn"]
+        except botocore.exceptions.ClientError as e:  # pragma: no cover
+            if e.response["Error"]["Code"] != "EntityAlreadyExists":
+                raise e
+            # created by another process since the listing
+            return self._ensure()
+
+    def _ensure_client_id(self, provider_arn: str):
+        """
+        A provider created by hand, or for another audience, rejects the tokens
+        of ``aws-actions/configure-aws-credentials`` until it lists
+        ``sts.amazonaws.com``.
+        """
+        res = self.iam_client.get_open_id_connect_provider(
+            OpenIDConnectProviderArn=provider_arn,
+        )
+        if GITHUB_OIDC_AUDIENCE not in res.get("ClientIDList", []):
+            self.iam_client.add_client_id_to_open_id_connect_provider(
+                OpenIDConnectProviderArn=provider_arn,
+                ClientID=GITHUB_OIDC_AUDIENCE,
+            )
+
+    def ensure(self) -> str:
+        """
+        Also adds the ``sts.amazonaws.com`` audience to an existing provider
+        missing it.
+
+        :return: the ARN of the GitHub OIDC identity provider.
+        """
+        return self._single_flight.do("ensure", self._ensure)
+
+
+def trust_policy_document(
+    provider_arn: str,
+    github_repos: T.Iterable[str],
+) -> dict[str, T.Any]:
+    """
+    Trust policy letting the GitHub Actions workflows of these repos, and
+    only them, assume the role.
+
+    :param github_repos: ``owner/name`` of each repo.
+    """
+    subjects = sorted(f"repo:{full_name}:*" for full_name in github_repos)
+    return {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"Federated": provider_arn},
+                "Action": "sts:AssumeRoleWithWebIdentity",
+                "Condition": {
+                    "StringEquals": {f"{GITHUB_OIDC_HOST}:aud": GITHUB_OIDC_AUDIENCE},
+                    "StringLike": {f"{GITHUB_OIDC_HOST}:sub": subjects},
+                },
+            }
+        ],
+    }
+
+
+@dataclasses.dataclass
+class SetupGitHubOidcRole:
+    """
+    Provision one IAM role assumed by the GitHub Actions of one repo or a group
+    of repos through OIDC, see the module docstring.
+
+    :param boto_ses: Boto3 session of the AWS account
+    :param aws_region: AWS region the workflows will use, part of the inline
+        policy name
+    :param role_name: Name of the IAM role, e.g. ``gh-oidc-my-repo``
+    :param tags: Tags of the IAM role, the ``github_repos`` tag is always added
+    :param policy_document: Inline policy of the role, validated and minified
+        locally first, see :func:`~simple_gh_aws_creds.policy.compile_policy`
+    :param attached_policy_arn_list: Managed policy ARNs attached to the role
+    :param github_repos: ``owner/name`` of each repo allowed to assume the role
+    :param github_token: GitHub token with write access to the repos' variables
+    :param github_variable_name_role_arn: Name of the Actions variable holding
+        the role ARN (default: ``"AWS_ROLE_ARN"``)
+    :param max_session_duration: Max session duration of the role in seconds
+
+    Setup Workflow:
+
+    - :meth:`s11_ensure_oidc_provider`
+    - :meth:`s12_create_or_update_role`
+    - :meth:`s13_put_role_policy`
+    - :meth:`s14_put_github_variables`
+
+    Teardown Workflow:
+
+    - :meth:`s21_delete_github_variables`
+    - :meth:`s22_delete_role_policy`
+    - :meth:`s23_delete_role`
+
+    The OIDC provider is shared by every role of the account and never deleted.
+    """
+
+    # fmt: off
+    boto_ses: boto3.Session = dataclasses.field()
+    aws_region: str = dataclasses.field()
+    role_name: str = dataclasses.field()
+    tags: dict[str, str] = dataclasses.field()
+    policy_document: dict[str, T.Any] = dataclasses.field()
+    attached_policy_arn_list: list[str] = dataclasses.field()
+    github_repos: list[str] = dataclasses.field()
+    github_token: str = dataclasses.field()
+    github_variable_name_role_arn: str = dataclasses.field(default="AWS_ROLE_ARN")
+    max_session_duration: int = dataclasses.field(default=3600)
+    # fmt: on
+
+    def __post_init__(self):
+        for full_name in self.github_repos:
+            owner, _, name = full_name.partition("/")
+            if not owner or not name or "/" in name:
+                raise ValueError(f"github_repos must be 'owner/name', got {full_name!r}")
+
+    @cached_property
+    def iam_client(self):
+        return self.boto_ses.client("iam")
+
+    @cached_property
+    def github_client(self) -> GitHubClient:
+        return GitHubClient(token=self.github_token)
+
+    @cached_property
+    def oidc_provider_manager(self) -> OidcProviderManager:
+        """
+        Override it with a shared manager when managing many roles in the same
+        account.
+        """
+        return OidcProviderManager(iam_client=self.iam_client)
+
+    @cached_property
+    def policy_arn_resolver(self) -> PolicyArnResolver:
+        return PolicyArnResolver(iam_client=self.iam_client)
+
+    @property
+    def role_tags(self) -> dict[str, str]:
+        # tag values are limited to 256 characters, large groups only list the
+        # leading repos that fit, the tag is left out if not even one fits
+        names = []
+        for full_name in self.github_repos:
+            if len(" ".join([*names, full_name])) > 256:
+                break
+            names.append(full_name)
+        if not names:
+            return dict(self.tags)
+        return {**self.tags, TAG_KEY_GITHUB_REPOS: " ".join(names)}
+
+    @property
+    def policy_document_name(self) -> str:
+        return f"iam-role-{self.aws_region}-{self.role_name}-inline-policy"
+
+    @property
+    def compiled_policy(self) -> CompiledPolicy:
+        return compile_policy(self.policy_document)
+
+    @property
+    def role_arn(self) -> str:
+        return self.iam_client.get_role(RoleName=self.role_name)["Role"]["Arn"]
+
+    @traced
+    def s11_ensure_oidc_provider(self) -> str:
+        """
+        Make sure the account trusts GitHub's OIDC tokens, once per account.
+        """
+        printer("🆕Step 1.1: Ensure GitHub OIDC identity provider")
+        provider_arn = self.oidc_provider_manager.ensure()
+        printer(f"  ✅OIDC identity provider is {provider_arn}")
+        return provider_arn
+
+    @traced
+    def s12_create_or_update_role(self) -> str:
+        """
+        Create the role trusted for ``repo:owner/name:*`` of ``github_repos``,
+        or update the trust policy, max session duration and tags of an
+        existing role.
+
+        :return: the role ARN.
+        """
+        printer(f"🆕Step 1.2: Create or update IAM Role {self.role_name!r}")
+        provider_arn = self.oidc_provider_manager.ensure()
+        trust_policy = json.dumps(
+            trust_policy_document(provider_arn, self.github_repos),
+            separators=(",", ":"),
+        )
+        tags = [{"Key": key, "Value": value} for key, value in self.role_tags.items()]
+        try:
+            res = self.iam_client.create_role(
+                RoleName=self.role_name,
+                AssumeRolePolicyDocument=trust_policy,
+                Description="Assumed by GitHub Actions through OIDC",
+                MaxSessionDuration=self.max_session_duration,
+                Tags=tags,
+            )
+            printer("  ✅Successfully created IAM Role.")
+            return res["Role"]["Arn"]
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] != "EntityAlreadyExists":  # pragma: no cover
+                raise e
+        self.iam_client.update_assume_role_policy(
+            RoleName=self.role_name,
+            PolicyDocument=trust_policy,
+        )
+        self.iam_client.update_role(
+            RoleName=self.role_name,
+            MaxSessionDuration=self.max_session_duration,
+        )
+        self.iam_client.tag_role(RoleName=self.role_name, Tags=tags)
+        printer("  ✅IAM Role already exists, updated its trust policy and settings.")
+        return self.role_arn
+
+    @traced
+    def s13_put_role_policy(self):
+        """
+        Put ``policy_document`` as the inline policy of the role, attach the
+        managed policies, and detach the ones no longer in
+        ``attached_policy_arn_list``.
+        """
+        printer(f"🆕Step 1.3: Put IAM Role Policy {self.policy_document_name!r}")
+        compiled_policy = self.compiled_policy
+        self.policy_arn_resolver.validate(self.attached_policy_arn_list)
+        self.iam_client.put_role_policy(
+            RoleName=self.role_name,
+            PolicyName=self.policy_document_name,
+            PolicyDocument=compiled_policy.text,
+        )
+        printer("  ✅Successfully put IAM inline policy.")
+        for policy_arn in self.attached_policy_arn_list:
+            self.iam_client.attach_role_policy(
+                RoleName=self.role_name,
+                PolicyArn=policy_arn,
+            )
+            printer(f"  ✅Successfully attached policy {policy_arn}")
+        res = self.iam_client.list_attached_role_policies(RoleName=self.role_name)
+        for policy in res.get("AttachedPolicies", []):
+            if policy["PolicyArn"] in self.attached_policy_arn_list:
+                continue
+            self.iam_client.detach_role_policy(
+                RoleName=self.role_name,
+                PolicyArn=policy["PolicyArn"],
+            )
+            printer(f"  ✅Successfully detached stale policy {policy['PolicyArn']}")
+
+    @traced
+    def s14_put_github_variables(self, role_arn: str) -> bool:  # pragma: no cover
+        """
+        Write the role ARN as an Actions variable of every repo, concurrently,
+        only where the value changed.
+
+        :return: ``True`` if every repo has the variable.
+        """
+        printer(f"🆕Step 1.4: Put GitHub Variable {self.github_variable_name_role_arn!r}")
+
+        def put(full_name: str) -> bool:
+            owner, _, name = full_name.partition("/")
+            try:
+                written = self.github_client.put_variable(
+                    owner, name, name=self.github_variable_name_role_arn, value=role_arn
+                )
+                state = "written" if written else "up to date"
+                printer(f"  ✅{full_name}: {state}")
+                return True
+            except Exception as e:
+                printer(f"  ❌{full_name}: failed to write the variable: {e}")
+                return False
+
+        results = bounded_imap_unordered(put, self.github_repos, max_workers=8)
+        return all(list(results))
+
+    @traced
+    def s21_delete_github_variables(self):  # pragma: no cover
+        printer(f"🗑Step 2.1: Delete GitHub Variable {self.github_variable_name_role_arn!r}")
+        for full_name in self.github_repos:
+            owner, _, name = full_name.partition("/")
+            try:
+                if self.github_client.delete_variable(
+                    owner, name, self.github_variable_name_role_arn
+                ):
+                    printer(f"  ✅{full_name}: deleted")
+                else:
+                    printer(f"  ✅{full_name}: does not exist, nothing to delete.")
+            except Exception as e:
+                printer(f"  ❌{full_name}: failed to delete the variable: {e}")
+
+    @traced
+    def s22_delete_role_policy(self):
+        printer("🗑Step 2.2: Delete IAM Role Policies")
+        try:
+            res = self.iam_client.list_attached_role_policies(RoleName=self.role_name)
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchEntity":
+                printer("  ✅IAM Role does not exist, nothing to delete.")
+                return
+            raise e  # pragma: no cover
+        for policy in res.get("AttachedPolicies", []):
+            self.iam_client.detach_role_policy(
+                RoleName=self.role_name,
+                PolicyArn=policy["PolicyArn"],
+            )
+            printer(f"  ✅Successfully detached managed policy {policy['PolicyArn']}")
+        try:
+            self.iam_client.delete_role_policy(
+                RoleName=self.role_name,
+                PolicyName=self.policy_document_name,
+            )
+            printer(f"  ✅Successfully deleted inline policy {self.policy_document_name!r}.")
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchEntity":  # pragma: no cover
+                raise e
+            printer("  ✅Inline policy does not exist, nothing to delete.")
+
+    @traced
+    def s23_delete_role(self):
+        printer(f"🗑Step 2.3: Delete IAM Role {self.role_name!r}")
+        try:
+            self.iam_client.delete_role(RoleName=self.role_name)
+            printer("  ✅Successfully deleted IAM Role.")
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchEntity":  # pragma: no cover
+                raise e
+            printer("  ✅IAM Role does not exist, nothing to delete.")
+
+    @traced
+    def setup_iam(self) -> str:
+        """
+        Run the IAM part of the setup workflow.
+
+        :return: the role ARN.
+        """
+        self.policy_arn_resolver.validate(self.attached_policy_arn_list)
+        self.s11_ensure_oidc_provider()
+        role_arn = self.s12_create_or_update_role()
+        self.s13_put_role_policy()
+        return role_arn
+
+    @traced
+    def setup_all(self) -> bool:
+        """
+        Run the complete setup workflow.
+
+        :return: ``True`` if every repo has the role ARN variable.
+        """
+        return self.s14_put_github_variables(self.setup_iam())
+
+    @traced
+    def teardown_all(self):
+        self.s21_delete_github_variables()
+        self.s22_delete_role_policy()
+        self.s23_delete_role()
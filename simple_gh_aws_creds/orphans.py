@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+"""
+Garbage collection of the IAM users whose GitHub repo no longer exists.
+
+Repos get deleted, but the IAM users created for them by
+:meth:`~simple_gh_aws_creds.impl.SetupGitHubRepo.s11_create_iam_user` live on
+with active access keys. :func:`find_orphans` streams the managed users, the
+users tagged with ``github_user_name`` and ``github_repo_name``, from IAM in
+bulk, see :func:`~simple_gh_aws_creds.drift.iter_user_states`, and resolves the
+existence of their repos with batched GraphQL ``repository`` lookups, up to
+100 repos per request instead of one REST ``GET`` each, see
+:meth:`~simple_gh_aws_creds.github_client.GitHubClient.resolve_repos`.
+
+Each managed user ends up in one of three groups:
+
+- **alive**: the repo exists.
+- **renamed**: the repo was renamed or transferred, GitHub still resolves the
+  old name. The user is kept, its secrets moved with the repo and CI still
+  uses them, update the fleet config to the new name.
+- **orphan**: the repo doesn't exist. :func:`delete_orphans` deletes the access
+  keys, inline policies, managed policy attachments and the user, in parallel.
+
+A repo the token can't see looks deleted, run :func:`find_orphans` with a token
+that can read every repo of the fleet, and review the dry run report before
+deleting. ``simple-gh-aws-creds gc`` only reports, ``gc --delete`` deletes.
+"""
+
+import typing as T
+import fnmatch
+import itertools
+import dataclasses
+from pathlib import Path
+
+import botocore.exceptions
+
+from .impl import TAG_KEY_GITHUB_USER_NAME, TAG_KEY_GITHUB_REPO_NAME
+from .drift import UserState, iter_user_states
+from .concurrency import bounded_imap_unordered
+from .github_client import GRAPHQL_MAX_REPOS, GitHubClient
+from .tracing import traced
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_iam.client import IAMClient
+    from .sharding import Shard
+
+STATUS_ALIVE = "alive"
+STATUS_RENAMED = "renamed"
+STATUS_ORPHAN = "orphan"
+
+
+@dataclasses.dataclass
+class ManagedUser:
+    """
+    A managed IAM user and the existence of its repo.
+
+    :param current_full_name: the repo name GitHub resolves to, ``None`` for
+        an orphan.
+    """
+
+    user: UserState = dataclasses.field()
+    github_full_name: str = dataclasses.field()
+    current_full_name: T.Optional[str] = dataclasses.field(default=None)
+
+    @property
+    def iam_user_name(self) -> str:
+        return self.user.iam_user_name
+
+    @property
+    def status(self) -> str:
+        if self.current_full_name is None:
+            return STATUS_ORPHAN
+        if self.current_full_name.lower() != self.github_full_name.lower():
+            return STATUS_RENAMED
+        return STATUS_ALIVE
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return {
+            "iam_user_name": self.iam_user_name,
+            "repo": self.github_full_name,
+            "status": self.status,
+            "current_repo": self.current_full_name,
+        }
+
+
+def iter_managed_users(
+    iam_client: "IAMClient",
+    only: T.Optional[T.Iterable[str]] = None,
+    shard: T.Optional["Shard"] = None,
+) -> T.Iterator[T.Tuple[UserState, str]]:
+    """
+    Stream ``(user, "owner/repo")`` of the managed IAM users.
+
+    :param only: glob patterns on ``owner/repo``, all managed users by default.
+    :param shard: only the users whose repo is in this shard.
+    """
+    patterns = list(only or [])
+    for user in iter_user_states(iam_client):
+        tags = user.tags or {}
+        owner = tags.get(TAG_KEY_GITHUB_USER_NAME)
+        repo = tags.get(TAG_KEY_GITHUB_REPO_NAME)
+        if owner is None or repo is None:
+            continue
+        full_name = f"{owner}/{repo}"
+        if patterns and not any(
+            fnmatch.fnmatch(full_name, pattern) for pattern in patterns
+        ):
+            continue
+        if shard is not None and not shard.contains(full_name):
+            continue
+        yield user, full_name
+
+
+def _batches(
+    iterable: T.Iterable[T.Any],
+    size: int,
+) -> T.Iterator[list[T.Any]]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def find_orphans(
+    iam_client: "IAMClient",
+    github_client: GitHubClient,
+    only: T.Optional[T.Iterable[str]] = None,
+    shard: T.Optional["Shard"] = None,
+    batch_size: int = GRAPHQL_MAX_REPOS,
+    parallel: int = 4,
+) -> T.Iterator[ManagedUser]:
+    """
+    Yield every managed user with the existence of its repo, read-only.
+
+    Users are streamed from IAM and resolved in batches, each distinct repo of
+    a batch is looked up once, ``parallel`` GraphQL requests at a time.
+    """
+
+    def resolve(batch: list[T.Tuple[UserState, str]]) -> list[ManagedUser]:
+        full_names = sorted({full_name for _, full_name in batch})
+        current = github_client.resolve_repos(full_names)
+        return [
+            ManagedUser(
+                user=user,
+                github_full_name=full_name,
+                current_full_name=current[full_name],
+            )
+            for user, full_name in batch
+        ]
+
+    for managed_users in bounded_imap_unordered(
+        resolve,
+        _batches(iter_managed_users(iam_client, only=only, shard=shard), batch_size),
+        max_workers=parallel,
+    ):
+        yield from managed_users
+
+
+@dataclasses.dataclass
+class GcResult:
+    """
+    Outcome of deleting one orphan.
+    """
+
+    iam_user_name: str = dataclasses.field()
+    repo: str = dataclasses.field()
+    ok: bool = dataclasses.field(default=False)
+    actions: list[str] = dataclasses.field(default_factory=list)
+    error: T.Optional[str] = dataclasses.field(default=None)
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return dataclasses.asdict(self)
+
+
+def _ignore_no_such_entity(func: T.Callable, **kwargs) -> bool:
+    try:
+        func(**kwargs)
+        return True
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchEntity":
+            return False
+        raise e
+
+
+@traced
+def delete_orphan(
+    iam_client: "IAMClient",
+    orphan: ManagedUser,
+    dir_access_key: T.Optional[Path] = None,
+) -> GcResult:
+    """
+    Delete the access keys, inline policies, managed policy attachments and
+    the IAM user of an orphan, never raises. A user deleted in the meantime
+    counts as deleted.
+
+    :param dir_access_key: also delete the local access key file of the repo
+        in this directory, see
+        :attr:`~simple_gh_aws_creds.fleet.FleetConfig.dir_access_key`.
+    """
+    name = orphan.iam_user_name
+    result = GcResult(iam_user_name=name, repo=orphan.github_full_name)
+    try:
+        try:
+            res = iam_client.list_access_keys(UserName=name)
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchEntity":  # pragma: no cover
+                raise e
+            result.ok = True
+            return result
+        for metadata in res.get("AccessKeyMetadata", []):
+            if _ignore_no_such_entity(
+                iam_client.delete_access_key,
+                UserName=name,
+                AccessKeyId=metadata["AccessKeyId"],
+            ):
+                result.actions.append("delete_access_key")
+        # the live lists, a policy may have been added since the bulk read
+        res = iam_client.list_user_policies(UserName=name)
+        for policy_name in res.get("PolicyNames", []):
+            if _ignore_no_such_entity(
+                iam_client.delete_user_policy, UserName=name, PolicyName=policy_name
+            ):
+                result.actions.append("delete_inline_policy")
+        res = iam_client.list_attached_user_policies(UserName=name)
+        for policy in res.get("AttachedPolicies", []):
+            if _ignore_no_such_entity(
+                iam_client.detach_user_policy,
+                UserName=name,
+                PolicyArn=policy["PolicyArn"],
+            ):
+                result.actions.append(f"detach_managed_policy:{policy['PolicyArn']}")
+        if _ignore_no_such_entity(iam_client.delete_user, UserName=name):
+            result.actions.append("delete_iam_user")
+        if dir_access_key is not None:
+            owner, repo = orphan.github_full_name.split("/", 1)
+            path = Path(dir_access_key).joinpath(f"{owner}__{repo}.json")
+            for path in [path, path.with_name(f"{path.stem}.secrets.json")]:
+                if path.exists():
+                    path.unlink()
+                    result.actions.append(f"delete_local_file:{path.name}")
+        result.ok = True
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+def delete_orphans(
+    iam_client: "IAMClient",
+    orphans: T.Iterable[ManagedUser],
+    parallel: int = 8,
+    dir_access_key: T.Optional[Path] = None,
+) -> T.Iterator[GcResult]:
+    """
+    Delete orphans ``parallel`` at a time, yield results as they complete.
+    Users that aren't orphans are skipped.
+    """
+    yield from bounded_imap_unordered(
+        lambda orphan: delete_orphan(
+            iam_client, orphan, dir_access_key=dir_access_key
+        ),
+        (orphan for orphan in orphans if orphan.status == STATUS_ORPHAN),
+        max_workers=parallel,
+    )
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+"""
+Inline policy compiler and local preflight.
+
+:meth:`~simple_gh_aws_creds.impl.SetupGitHubRepo.s12_put_iam_policy` used to
+send ``json.dumps(policy_document)`` with default separators, and oversized or
+malformed documents were only rejected by IAM after a round trip. The size is
+measured the way IAM does it, see :func:`policy_size`.
+:func:`compile_policy` runs locally, in milliseconds, before any API call:
+
+- merge ``Allow`` / ``Deny`` statements sharing the same ``Effect`` and ``Resource``
+- deduplicate and sort actions
+- validate the basic grammar and the size
+- minify the JSON and compute a stable hash
+"""
+
+import typing as T
+import json
+import hashlib
+import dataclasses
+
+#: max size of an inline policy attached to an IAM user
+USER_INLINE_POLICY_MAX_SIZE = 2048
+#: max size of a customer managed policy
+MANAGED_POLICY_MAX_SIZE = 6144
+
+VALID_VERSIONS = ("2012-10-17", "2008-10-17")
+VALID_EFFECTS = ("Allow", "Deny")
+KNOWN_STATEMENT_KEYS = {
+    "Sid",
+    "Effect",
+    "Principal",
+    "NotPrincipal",
+    "Action",
+    "NotAction",
+    "Resource",
+    "NotResource",
+    "Condition",
+}
+
+
+class PolicyValidationError(ValueError):
+    """
+    Raised when a policy document is malformed or too large.
+    """
+
+
+def _as_list(value: T.Union[str, T.List[str]]) -> T.List[str]:
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def _to_json(policy_document: dict[str, T.Any]) -> str:
+    return json.dumps(policy_document, separators=(",", ":"), sort_keys=True)
+
+
+def policy_size(text: str) -> int:
+    """
+    Size of a policy document against the IAM limits,
+    :data:`USER_INLINE_POLICY_MAX_SIZE` and :data:`MANAGED_POLICY_MAX_SIZE`.
+    IAM doesn't count whitespace, inside strings or not.
+    """
+    return sum(not char.isspace() for char in text)
+
+
+def validate_policy_document(policy_document: dict[str, T.Any]):
+    """
+    Check the basic grammar of an identity based policy document.
+
+    :raises PolicyValidationError: on the first problem found.
+    """
+    if not isinstance(policy_document, dict):
+        raise PolicyValidationError("policy document must be a JSON object")
+    version = policy_document.get("Version")
+    if version not in VALID_VERSIONS:
+        raise PolicyValidationError(
+            f"Version must be one of {VALID_VERSIONS}, got {version!r}"
+        )
+    statements = policy_document.get("Statement")
+    if isinstance(statements, dict):
+        statements = [statements]
+    if not isinstance(statements, list) or not statements:
+        raise PolicyValidationError("Statement must be a non empty list")
+    for i, statement in enumerate(statements):
+        if not isinstance(statement, dict):
+            raise PolicyValidationError(f"Statement[{i}] must be a JSON object")
+        unknown = set(statement) - KNOWN_STATEMENT_KEYS
+        if unknown:
+            raise PolicyValidationError(
+                f"Statement[{i}] has unknown keys {sorted(unknown)}"
+            )
+        if statement.get("Effect") not in VALID_EFFECTS:
+            raise PolicyValidationError(
+                f"Statement[{i}].Effect must be one of {VALID_EFFECTS}"
+            )
+        if ("Action" in statement) == ("NotAction" in statement):
+            raise PolicyValidationError(
+                f"Statement[{i}] must have exactly one of Action, NotAction"
+            )
+        if ("Resource" in statement) == ("NotResource" in statement):
+            raise PolicyValidationError(
+                f"Statement[{i}] must have exactly one of Resource, NotResource"
+            )
+        if "Principal" in statement or "NotPrincipal" in statement:
+            raise PolicyValidationError(
+                f"Statement[{i}] identity based policy can't have a Principal"
+            )
+        for key in ("Action", "NotAction"):
+            for action in _as_list(statement.get(key, [])):
+                if not isinstance(action, str) or (
+                    action != "*" and ":" not in action
+                ):
+                    raise PolicyValidationError(
+                        f"Statement[{i}].{key} has invalid action {action!r}"
+                    )
+
+
+def _is_mergeable(statement: dict[str, T.Any]) -> bool:
+    # only simple Effect + Action + Resource statements are merged, anything
+    # with a condition or a negation keeps its own statement
+    return set(statement) <= {"Sid", "Effect", "Action", "Resource"}
+
+
+def optimize_policy_document(policy_document: dict[str, T.Any]) -> dict[str, T.Any]:
+    """
+    Return a semantically equivalent, smaller policy document.
+
+    Simple statements sharing the same ``Effect`` and ``Resource`` are merged
+    into one (their ``Sid`` is dropped), actions are deduplicated and sorted,
+    a single action or resource is written as a plain string.
+    """
+    statements = policy_document["Statement"]
+    if isinstance(statements, dict):
+        statements = [statements]
+    merged: dict[T.Tuple[str, T.Tuple[str, ...]], T.Set[str]] = dict()
+    order: T.List[T.Union[T.Tuple[str, T.Tuple[str, ...]], dict]] = list()
+    for statement in statements:
+        if _is_mergeable(statement):
+            key = (
+                statement["Effect"],
+                tuple(sorted(set(_as_list(statement["Resource"])))),
+            )
+            if key not in merged:
+                merged[key] = set()
+                order.append(key)
+            merged[key].update(_as_list(statement["Action"]))
+        else:
+            order.append(statement)
+
+    def simplify(values: T.Iterable[str]) -> T.Union[str, T.List[str]]:
+        values = sorted(set(values))
+        return values[0] if len(values) == 1 else values
+
+    new_statements = list()
+    for item in order:
+        if isinstance(item, tuple):
+            effect, resources = item
+            actions = merged[item]
+            if "*" in actions:
+                actions = {"*"}
+            new_statements.append(
+                {
+                    "Effect": effect,
+                    "Action": simplify(actions),
+                    "Resource": simplify(resources),
+                }
+            )
+        else:
+            statement = dict(item)
+            for key in ("Action", "NotAction", "Resource", "NotResource"):
+                if key in statement:
+                    statement[key] = simplify(_as_list(statement[key]))
+            new_statements.append(statement)
+    return {
+        "Version": policy_document["Version"],
+        "Statement": new_statements,
+    }
+
+
+@dataclasses.dataclass(frozen=True)
+class CompiledPolicy:
+    """
+    Result of :func:`compile_policy`.
+
+    :param document: the optimized policy document.
+    :param text: minified JSON, what is sent to IAM.
+    :param sha256: stable hash of ``text``, usable as a cache key.
+    """
+
+    document: dict[str, T.Any] = dataclasses.field()
+    text: str = dataclasses.field()
+    sha256: str = dataclasses.field()
+
+    @property
+    def size(self) -> int:
+        """
+        See :func:`policy_size`.
+        """
+        return policy_size(self.text)
+
+
+def compile_policy(
+    policy_document: dict[str, T.Any],
+    max_size: int = USER_INLINE_POLICY_MAX_SIZE,
+    optimize: bool = True,
+) -> CompiledPolicy:
+    """
+    Validate, optimize and minify a policy document.
+
+    :param max_size: size limit in characters, measured by :func:`policy_size`.
+    :param optimize: merge statements and deduplicate actions, see
+        :func:`optimize_policy_document`.
+
+    :raises PolicyValidationError: if the document is malformed or too large.
+    """
+    validate_policy_document(policy_document)
+    if optimize:
+        policy_document = optimize_policy_document(policy_document)
+    text = _to_json(policy_document)
+    size = policy_size(text)
+    if size > max_size:
+        raise PolicyValidationError(
+            f"policy document is {size} characters without whitespace, "
+            f"exceeds the {max_size} characters limit"
+        )
+    return CompiledPolicy(
+        document=policy_document,
+        text=text,
+        sha256=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    )
+
+
+def canonical_policy_hash(policy_document: dict[str, T.Any]) -> str:
+    """
+    Hash of the canonical form of a policy document. Two documents granting the
+    same permissions with different statement grouping, action order or
+    whitespace have the same hash.
+    """
+    try:
+        validate_policy_document(policy_document)
+        policy_document = optimize_policy_document(policy_document)
+    except PolicyValidationError:
+        pass
+    return hashlib.sha256(_to_json(policy_document).encode("utf-8")).hexdigest()
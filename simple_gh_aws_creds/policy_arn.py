@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Validate and cache managed policy ARNs once per account.
+
+``s12_put_iam_policy`` attaches each ARN of ``attached_policy_arn_list`` with no
+prior check, a typo'd ARN used to fail only after the user and the inline
+policy were created, and again for every repo sharing the config.
+:class:`PolicyArnResolver` checks the syntax of each distinct ARN locally, then
+calls ``get_policy`` once per ARN, and keeps the result for the whole run. Share
+one resolver across all :class:`~simple_gh_aws_creds.impl.SetupGitHubRepo` of an
+account, as :func:`~simple_gh_aws_creds.fleet.run_fleet` does.
+"""
+
+import typing as T
+import re
+import dataclasses
+
+import botocore.exceptions
+
+from .single_flight import SingleFlight
+from .concurrency import bounded_imap_unordered
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_iam.client import IAMClient
+
+POLICY_ARN_PATTERN = re.compile(r"^arn:aws[a-z\-]*:iam::(aws|\d{12}):policy/.+$")
+
+
+class InvalidPolicyArnError(ValueError):
+    """
+    Raised when some managed policy ARNs are malformed, missing or not attachable.
+    """
+
+
+@dataclasses.dataclass(frozen=True)
+class PolicyArnInfo:
+    """
+    Resolution result of one managed policy ARN.
+
+    :param error: ``None`` if the policy exists and is attachable.
+    """
+
+    arn: str = dataclasses.field()
+    policy_name: T.Optional[str] = dataclasses.field(default=None)
+    default_version_id: T.Optional[str] = dataclasses.field(default=None)
+    error: T.Optional[str] = dataclasses.field(default=None)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclasses.dataclass
+class PolicyArnResolver:
+    """
+    Per account cache of managed policy ARN lookups.
+
+    :param iam_client: IAM client of the account.
+    :param max_workers: concurrency of :meth:`validate`.
+    """
+
+    iam_client: "IAMClient" = dataclasses.field()
+    max_workers: int = dataclasses.field(default=8)
+
+    def __post_init__(self):
+        # results live as long as the resolver, concurrent lookups of the same
+        # ARN share one get_policy call
+        self._single_flight = SingleFlight(ttl=float("inf"))
+
+    @property
+    def n_api_calls(self) -> int:
+        return self._single_flight.n_calls
+
+    def _get_policy(self, arn: str) -> PolicyArnInfo:
+        if not POLICY_ARN_PATTERN.match(arn):
+            return PolicyArnInfo(arn=arn, error="malformed policy ARN")
+        try:
+            res = self.iam_client.get_policy(PolicyArn=arn)
+        except botocore.exceptions.ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in ("NoSuchEntity", "InvalidInput"):
+                return PolicyArnInfo(arn=arn, error=f"{code}: policy not found")
+            raise e  # pragma: no cover
+        policy = res["Policy"]
+        return PolicyArnInfo(
+            arn=arn,
+            policy_name=policy["PolicyName"],
+            default_version_id=policy.get("DefaultVersionId"),
+            error=(None if policy.get("IsAttachable", True) else "not attachable"),
+        )
+
+    def resolve(self, arn: str) -> PolicyArnInfo:
+        """
+        Resolve one ARN, at most one ``get_policy`` call per ARN per resolver.
+        """
+        return self._single_flight.do(arn, lambda: self._get_policy(arn))
+
+    def validate(self, arns: T.Iterable[str]):
+        """
+        Resolve all distinct ARNs concurrently.
+
+        :raises InvalidPolicyArnError: listing every bad ARN.
+        """
+        arns = sorted(set(arns))
+        errors = [
+            f"{info.arn} ({info.error})"
+            for info in bounded_imap_unordered(
+                self.resolve,
+                arns,
+                max_workers=self.max_workers,
+            )
+            if not info.ok
+        ]
+        if errors:
+            raise InvalidPolicyArnError(
+                "invalid managed policy ARN: " + ", ".join(sorted(errors))
+            )
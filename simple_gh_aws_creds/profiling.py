@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+"""
+Profiling of runs and of the import time.
+
+When a run is slow, :func:`profile_run` tells where the time goes, network
+waits, botocore model loading, PyGithub object construction or our own code.
+It writes three files to a directory:
+
+- ``<name>.prof``: a :mod:`cProfile` dump of the run, CPU time of every
+  function in every worker thread, open it with :mod:`pstats` or ``snakeviz``.
+- ``<name>.collapsed``: wall time split by repo command, step and API call, one
+  ``apply;setup_iam;s11_create_iam_user;iam.CreateUser 1234`` line per stack
+  with its self time in microseconds, built from the spans of
+  :mod:`simple_gh_aws_creds.tracing`. Feed it to ``flamegraph.pl`` or
+  https://www.speedscope.app.
+- ``imports.json`` and ``imports.txt``: :func:`import_time_breakdown` of
+  :mod:`simple_gh_aws_creds.api`, per module and per top level package, to
+  compare versions.
+
+The fleet CLI commands take ``--profile DIR``, a single repo is profiled with::
+
+    with profile_run(Path("profile"), name="setup_all"):
+        setup.setup_all()
+
+Before Python 3.12 a :mod:`cProfile` profiler only sees the thread that enabled
+it, the worker pools of :mod:`simple_gh_aws_creds.concurrency` then profile each
+work item in its own thread, see :func:`profile_work_item`, the results are
+merged into one dump.
+"""
+
+import typing as T
+import io
+import re
+import sys
+import json
+import pstats
+import cProfile
+import threading
+import contextlib
+import contextvars
+import subprocess
+import dataclasses
+from pathlib import Path
+
+from .tracing import Span, Tracer, InMemoryExporter, get_tracer, set_tracer
+
+#: one profiler sees all threads since Python 3.12, see :mod:`sys.monitoring`
+PROFILER_SEES_ALL_THREADS = sys.version_info >= (3, 12)
+
+_current_session: "contextvars.ContextVar[T.Optional[ProfileSession]]" = (
+    contextvars.ContextVar("simple_gh_aws_creds_profile_session", default=None)
+)
+
+
+class ProfileSession:
+    """
+    The profilers and spans of one :func:`profile_run`. Thread safe.
+    """
+
+    def __init__(self):
+        self.profiles: list[cProfile.Profile] = list()
+        self.exporter = InMemoryExporter()
+        self._lock = threading.Lock()
+
+    def add(self, profile: cProfile.Profile):
+        with self._lock:
+            self.profiles.append(profile)
+
+    def stats(self) -> T.Optional[pstats.Stats]:
+        """
+        All profiles merged, ``None`` if nothing was profiled.
+        """
+        stats = None
+        with self._lock:
+            profiles = list(self.profiles)
+        for profile in profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile, stream=io.StringIO())
+            else:
+                stats.add(profile)
+        return stats
+
+
+@contextlib.contextmanager
+def profile_work_item() -> T.Iterator[None]:
+    """
+    Profile a work item running in a pool thread, if a :func:`profile_run` is
+    active in its context and the profiler of the session can't see this
+    thread.
+    """
+    session = _current_session.get()
+    if session is None or PROFILER_SEES_ALL_THREADS:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        session.add(profile)
+
+
+def _span_stacks(spans: T.Iterable[Span]) -> dict[str, int]:
+    """
+    ``{"root;child;leaf": self time in microseconds}``, root spans are named
+    after their ``command`` attribute, so the repos of a run add up. The self
+    time of a span is its duration minus the time of its children, at least 0
+    since children can overlap.
+    """
+    spans = list(spans)
+    by_id = {span.span_id: span for span in spans}
+    child_ns: dict[str, int] = dict()
+    for span in spans:
+        if span.parent_id is not None:
+            child_ns[span.parent_id] = (
+                child_ns.get(span.parent_id, 0) + span.duration_ns
+            )
+
+    def frame(span: Span) -> str:
+        if span.parent_id is None:
+            name = span.attributes.get("command", span.name)
+        else:
+            name = span.name
+        return name.replace(";", ":").replace(" ", "_")
+
+    stacks: dict[str, int] = dict()
+    for span in spans:
+        frames = [frame(span)]
+        parent = by_id.get(span.parent_id)
+        while parent is not None:
+            frames.append(frame(parent))
+            parent = by_id.get(parent.parent_id)
+        key = ";".join(reversed(frames))
+        self_us = max(0, span.duration_ns - child_ns.get(span.span_id, 0)) // 1000
+        stacks[key] = stacks.get(key, 0) + self_us
+    return stacks
+
+
+def write_collapsed_stacks(spans: T.Iterable[Span], path: Path):
+    stacks = _span_stacks(spans)
+    path.write_text(
+        "".join(f"{key} {value}\n" for key, value in sorted(stacks.items()))
+    )
+
+
+@dataclasses.dataclass
+class ImportTime:
+    """
+    One line of ``python -X importtime``, times in microseconds.
+    """
+
+    module: str = dataclasses.field()
+    self_us: int = dataclasses.field()
+    cumulative_us: int = dataclasses.field()
+    depth: int = dataclasses.field()
+
+    @property
+    def package(self) -> str:
+        return self.module.split(".", 1)[0]
+
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_import_time(text: str) -> list[ImportTime]:
+    """
+    Parse the ``-X importtime`` output, modules imported by others come first.
+    """
+    results = list()
+    for line in text.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        results.append(
+            ImportTime(
+                module=module,
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=(len(indent) - 1) // 2,
+            )
+        )
+    return results
+
+
+def import_time_breakdown(
+    module: str = "simple_gh_aws_creds.api",
+) -> list[ImportTime]:
+    """
+    Import ``module`` in a fresh interpreter with ``-X importtime``, modules
+    already imported by the current process would otherwise cost nothing.
+    """
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_import_time(res.stderr)
+
+
+def write_import_time(import_times: list[ImportTime], dir_out: Path):
+    """
+    Write ``imports.json``, every module and the self time per top level
+    package, and ``imports.txt``, the top packages and modules by time.
+    """
+    by_package: dict[str, int] = dict()
+    for import_time in import_times:
+        by_package[import_time.package] = (
+            by_package.get(import_time.package, 0) + import_time.self_us
+        )
+    total_us = sum(
+        import_time.cumulative_us
+        for import_time in import_times
+        if import_time.depth == 0
+    )
+    dir_out.joinpath("imports.json").write_text(
+        json.dumps(
+            {
+                "total_us": total_us,
+                "packages": by_package,
+                "modules": [dataclasses.asdict(i) for i in import_times],
+            },
+            indent=2,
+        )
+    )
+    lines = [f"total: {total_us / 1000:.1f} ms", "", "self time per package:"]
+    for package, self_us in sorted(by_package.items(), key=lambda x: -x[1])[:20]:
+        lines.append(f"  {self_us / 1000:8.1f} ms  {package}")
+    lines += ["", "slowest modules, self time:"]
+    for import_time in sorted(import_times, key=lambda x: -x.self_us)[:30]:
+        lines.append(f"  {import_time.self_us / 1000:8.1f} ms  {import_time.module}")
+    dir_out.joinpath("imports.txt").write_text("\n".join(lines) + "\n")
+
+
+@contextlib.contextmanager
+def profile_run(
+    dir_out: Path,
+    name: str = "run",
+    import_time: bool = True,
+) -> T.Iterator[ProfileSession]:
+    """
+    Profile the ``with`` block, see the module docstring for the files
+    written to ``dir_out``.
+
+    Spans are recorded with the current tracer's exporters plus an in memory
+    one, so ``--trace`` and ``--profile`` work together.
+
+    :param import_time: also write the import time breakdown of
+        :mod:`simple_gh_aws_creds.api`.
+    """
+    dir_out = Path(dir_out)
+    dir_out.mkdir(parents=True, exist_ok=True)
+    session = ProfileSession()
+    tracer = get_tracer()
+    previous_tracer = set_tracer(Tracer(tracer.exporters + [session.exporter]))
+    token = _current_session.set(session)
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield session
+    finally:
+        profile.disable()
+        _current_session.reset(token)
+        set_tracer(previous_tracer)
+        session.add(profile)
+        stats = session.stats()
+        if stats is not None:
+            stats.dump_stats(str(dir_out.joinpath(f"{name}.prof")))
+        write_collapsed_stacks(
+            session.exporter.spans, dir_out.joinpath(f"{name}.collapsed")
+        )
+        if import_time:
+            write_import_time(import_time_breakdown(), dir_out)
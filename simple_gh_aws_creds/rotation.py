@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+"""
+Zero downtime access key rotation for a fleet of :class:`~simple_gh_aws_creds.impl.SetupGitHubRepo`.
+
+IAM allows two access keys per user, so a key can be rotated without breaking CI:
+
+1. create the second key and store it in the local access key JSON file
+2. push it to GitHub Secrets, the same way as ``s14_setup_github_secrets`` does
+3. wait until the new key is usable
+4. deactivate the old key, it is deleted by the next rotation, until then it
+   can be reactivated if something besides CI still used it
+
+If the push or the verification fails, the new key is deleted and the old key
+is put back in GitHub and in the local file. A rotation interrupted between
+creating and deactivating leaves two active keys, the next rotation finishes it
+with the key named by the local access key JSON file.
+
+:class:`RotationScheduler` rotates the oldest keys first (priority queue ordered
+by key creation date) and spreads the IAM calls under a calls per minute budget,
+so thousands of keys can be rotated continuously without throttling bursts.
+"""
+
+import typing as T
+import json
+import time
+import heapq
+import dataclasses
+from datetime import datetime, timezone, timedelta
+
+from .impl import printer, mask_value
+from .concurrency import RateLimiter, bounded_imap_unordered
+from .verify import wait_until_credential_usable
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .impl import SetupGitHubRepo
+
+
+@dataclasses.dataclass
+class RotationResult:
+    """
+    Outcome of rotating the access key of one IAM user.
+    """
+
+    iam_user_name: str = dataclasses.field()
+    github_full_name: str = dataclasses.field()
+    old_access_key_id: T.Optional[str] = dataclasses.field(default=None)
+    new_access_key_id: T.Optional[str] = dataclasses.field(default=None)
+    ok: bool = dataclasses.field(default=False)
+    error: T.Optional[str] = dataclasses.field(default=None)
+    elapsed: float = dataclasses.field(default=0.0)
+
+
+def _acquire(limiter: T.Optional[RateLimiter], n: int = 1):
+    if limiter is not None:
+        limiter.acquire(n)
+
+
+def _read_access_key_json(setup: "SetupGitHubRepo") -> T.Optional[dict[str, str]]:
+    if setup.path_access_key_json.exists():
+        return json.loads(setup.path_access_key_json.read_text())
+    return None
+
+
+def rotate_access_key(
+    setup: "SetupGitHubRepo",
+    limiter: T.Optional[RateLimiter] = None,
+    verify_timeout: float = 60,
+) -> RotationResult:
+    """
+    Rotate the access key of one IAM user without a window where CI is broken.
+
+    If the new key can't be pushed to GitHub or fails verification, the new
+    key is deleted, the old key is pushed to GitHub again and the local access
+    key JSON file is restored, so the user is left with one active key. The old
+    key of a successful rotation is deactivated, not deleted, the next rotation
+    deletes it.
+
+    Never raises, an IAM or GitHub error is reported in the result. An error
+    after the new key was created leaves two active keys at worst, the next
+    rotation finishes it.
+
+    :param limiter: optional :class:`~simple_gh_aws_creds.concurrency.RateLimiter`,
+        every IAM call acquires one token.
+    :param verify_timeout: max seconds to wait for the new key to become usable.
+    """
+    start = time.monotonic()
+    result = RotationResult(
+        iam_user_name=setup.iam_user_name,
+        github_full_name=f"{setup.github_user_name}/{setup.github_repo_name}",
+    )
+    printer(f"🔄Rotate access key of IAM User {setup.iam_user_name!r}")
+    try:
+        _rotate_access_key(setup, result, limiter, verify_timeout)
+    except Exception as e:
+        result.ok = False
+        result.error = f"{type(e).__name__}: {e}"
+        printer(f"  ❌{result.error}")
+    result.elapsed = time.monotonic() - start
+    return result
+
+
+def _rotate_access_key(
+    setup: "SetupGitHubRepo",
+    result: RotationResult,
+    limiter: T.Optional[RateLimiter],
+    verify_timeout: float,
+) -> RotationResult:
+    iam_client = setup.iam_client
+
+    def fail(message: str) -> RotationResult:
+        printer(f"  ❌{message}")
+        result.error = message
+        return result
+
+    def verify(access_key: str, secret_key: str) -> bool:
+        verification = wait_until_credential_usable(
+            access_key=access_key,
+            secret_key=secret_key,
+            aws_region=setup.aws_region,
+            timeout=verify_timeout,
+        )
+        return verification.ok
+
+    def finish(old_access_key_id: T.Optional[str]) -> RotationResult:
+        if old_access_key_id is not None:
+            _acquire(limiter)
+            iam_client.update_access_key(
+                UserName=setup.iam_user_name,
+                AccessKeyId=old_access_key_id,
+                Status="Inactive",
+            )
+            printer(
+                f"  ✅Deactivated old access key {mask_value(old_access_key_id)!r}, "
+                "the next rotation deletes it"
+            )
+        result.ok = True
+        return result
+
+    _acquire(limiter)
+    res = iam_client.list_access_keys(UserName=setup.iam_user_name)
+    access_key_list = res.get("AccessKeyMetadata", [])
+
+    # the old key of the previous rotation, kept inactive until now
+    for metadata in list(access_key_list):
+        if metadata["Status"] == "Inactive":
+            _acquire(limiter)
+            iam_client.delete_access_key(
+                UserName=setup.iam_user_name,
+                AccessKeyId=metadata["AccessKeyId"],
+            )
+            access_key_list.remove(metadata)
+            printer(
+                "  ✅Deleted inactive access key "
+                f"{mask_value(metadata['AccessKeyId'])!r}"
+            )
+
+    old_access_key_json = _read_access_key_json(setup)
+    if len(access_key_list) >= 2:
+        # a rotation was interrupted after creating the new key, the local
+        # file names the new key, finish the rotation with it
+        access_key_id_list = [dct["AccessKeyId"] for dct in access_key_list]
+        if (
+            old_access_key_json is None
+            or old_access_key_json["access_key"] not in access_key_id_list
+        ):
+            return fail(
+                "IAM User has two active access keys and the local access key "
+                "file names neither, resolve manually."
+            )
+        access_key = old_access_key_json["access_key"]
+        secret_key = old_access_key_json["secret_key"]
+        access_key_id_list.remove(access_key)
+        result.old_access_key_id = access_key_id_list[0]
+        result.new_access_key_id = access_key
+        printer(
+            "  ⚠️Two active access keys, finish the interrupted rotation with "
+            f"{mask_value(access_key)!r}"
+        )
+        if setup.put_github_secrets(access_key, secret_key) is False:
+            return fail("Failed to push access key to GitHub, kept both keys active.")
+        if verify(access_key, secret_key) is False:
+            return fail("Access key is not usable yet, kept both keys active.")
+        return finish(result.old_access_key_id)
+
+    old_access_key_id = access_key_list[0]["AccessKeyId"] if access_key_list else None
+    result.old_access_key_id = old_access_key_id
+
+    _acquire(limiter)
+    response = iam_client.create_access_key(UserName=setup.iam_user_name)
+    access_key = response["AccessKey"]["AccessKeyId"]
+    secret_key = response["AccessKey"]["SecretAccessKey"]
+    result.new_access_key_id = access_key
+    data = {"access_key": access_key, "secret_key": secret_key}
+    setup.path_access_key_json.write_text(json.dumps(data, indent=4))
+    printer(f"  ✅Created new access key {mask_value(access_key)!r}")
+
+    def rollback(message: str) -> RotationResult:
+        _acquire(limiter)
+        iam_client.delete_access_key(
+            UserName=setup.iam_user_name,
+            AccessKeyId=access_key,
+        )
+        result.new_access_key_id = None
+        if old_access_key_json is None:
+            setup.path_access_key_json.unlink()
+            return fail(f"{message}, rolled back.")
+        setup.path_access_key_json.write_text(json.dumps(old_access_key_json, indent=4))
+        # some secrets may hold the new key already
+        if (
+            setup.put_github_secrets(
+                old_access_key_json["access_key"], old_access_key_json["secret_key"]
+            )
+            is False
+        ):
+            return fail(f"{message}, rolled back, but failed to push the old key.")
+        return fail(f"{message}, rolled back.")
+
+    if setup.put_github_secrets(access_key, secret_key) is False:
+        return rollback("Failed to push new access key to GitHub")
+    if verify(access_key, secret_key) is False:
+        return rollback("New access key is not usable")
+    return finish(old_access_key_id)
+
+
+@dataclasses.dataclass
+class RotationScheduler:
+    """
+    Rotate the access keys of many repos, oldest keys first.
+
+    :param setups: the fleet.
+    :param max_key_age_days: keys younger than this are not rotated.
+    :param calls_per_minute: IAM call budget shared by all workers.
+    :param max_workers: number of rotations running concurrently.
+    :param verify_timeout: see :func:`rotate_access_key`.
+    """
+
+    setups: T.List["SetupGitHubRepo"] = dataclasses.field()
+    max_key_age_days: float = dataclasses.field(default=90)
+    calls_per_minute: float = dataclasses.field(default=60)
+    max_workers: int = dataclasses.field(default=4)
+    verify_timeout: float = dataclasses.field(default=60)
+
+    def __post_init__(self):
+        self.limiter = RateLimiter(calls_per_minute=self.calls_per_minute)
+        self._queue: T.List[T.Tuple[datetime, int, "SetupGitHubRepo"]] = list()
+
+    def scan(self, now: T.Optional[datetime] = None) -> int:
+        """
+        Find the repos whose oldest active key is older than ``max_key_age_days``
+        and push them into the priority queue.
+
+        :return: number of repos queued.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        threshold = now - timedelta(days=self.max_key_age_days)
+        n = 0
+        for seq, setup in enumerate(self.setups):
+            self.limiter.acquire()
+            # create the client in the calling thread, boto3 sessions are not
+            # thread safe
+            res = setup.iam_client.list_access_keys(UserName=setup.iam_user_name)
+            create_dates = [
+                metadata["CreateDate"]
+                for metadata in res.get("AccessKeyMetadata", [])
+                if metadata["Status"] == "Active"
+            ]
+            if create_dates and min(create_dates) <= threshold:
+                heapq.heappush(self._queue, (min(create_dates), seq, setup))
+                n += 1
+        return n
+
+    def _iter_queue(self) -> T.Iterator["SetupGitHubRepo"]:
+        while self._queue:
+            _, _, setup = heapq.heappop(self._queue)
+            yield setup
+
+    def run(self) -> T.Iterator[RotationResult]:
+        """
+        Rotate everything in the queue, yield results as they complete.
+
+        Repos are dispatched in key age order, the rate limiter spreads the
+        IAM calls evenly, so the run never bursts.
+        """
+        yield from bounded_imap_unordered(
+            lambda setup: rotate_access_key(
+                setup,
+                limiter=self.limiter,
+                verify_timeout=self.verify_timeout,
+            ),
+            self._iter_queue(),
+            max_workers=self.max_workers,
+        )
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Skip writing secrets whose value didn't change.
+
+GitHub never returns a secret value, so a rerun of ``apply`` used to encrypt and
+``PUT`` every secret of every store again. :class:`SecretLedger` remembers, per
+secret, a fingerprint of the value last written and the secret's ``updated_at``
+as GitHub reported it right after the write. A secret is skipped only if both
+still match: same value, and nobody changed the secret since, in the UI or with
+another tool.
+
+The ledger is a small JSON file next to the local access key file of the repo,
+see :attr:`~simple_gh_aws_creds.impl.SetupGitHubRepo.path_secret_ledger_json`.
+Only fingerprints are stored, never values.
+"""
+
+import typing as T
+import os
+import json
+import hashlib
+import threading
+import dataclasses
+from pathlib import Path
+
+LEDGER_FORMAT_VERSION = 1
+
+
+def fingerprint(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+@dataclasses.dataclass
+class SecretLedger:
+    """
+    ``{"<target>/<secret name>": {"fingerprint": ..., "updated_at": ...}}``
+    stored as JSON, where ``<target>`` is the secret store, or
+    ``actions@<environment>``.
+
+    :meth:`record` is thread safe and only changes memory, call :meth:`save`
+    to write the file.
+    """
+
+    path: Path = dataclasses.field()
+    secrets: dict[str, dict[str, str]] = dataclasses.field(default_factory=dict)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> "SecretLedger":
+        """
+        Read the ledger file, an empty ledger if it doesn't exist or can't
+        be read, which only means every secret is written once.
+        """
+        try:
+            data = json.loads(Path(path).read_text())
+        except (FileNotFoundError, ValueError):
+            return cls(path=Path(path))
+        return cls(path=Path(path), secrets=data.get("secrets", {}))
+
+    def save(self):
+        with self._lock:
+            text = json.dumps(
+                {"version": LEDGER_FORMAT_VERSION, "secrets": self.secrets},
+                indent=2,
+                sort_keys=True,
+            )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        path_tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        path_tmp.write_text(text)
+        os.replace(path_tmp, self.path)
+
+    def is_unchanged(
+        self,
+        key: str,
+        value: str,
+        updated_at: T.Optional[str],
+    ) -> bool:
+        """
+        :param updated_at: the secret's current ``updated_at``, ``None`` if
+            the secret doesn't exist.
+        """
+        if updated_at is None:
+            return False
+        with self._lock:
+            entry = self.secrets.get(key)
+        return (
+            entry is not None
+            and entry.get("fingerprint") == fingerprint(value)
+            and entry.get("updated_at") == updated_at
+        )
+
+    def record(self, key: str, value: str, updated_at: T.Optional[str]):
+        with self._lock:
+            if updated_at is None:
+                self.secrets.pop(key, None)
+            else:
+                self.secrets[key] = {
+                    "fingerprint": fingerprint(value),
+                    "updated_at": updated_at,
+                }
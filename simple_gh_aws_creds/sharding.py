@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deterministic sharding of a fleet across machines.
+
+One host is limited by one process and one egress IP's GitHub secondary rate
+limits. :class:`Shard` partitions the repos of a fleet config into ``K``
+shards by a stable hash of ``owner/repo``, so ``K`` nodes can run the same
+config independently::
+
+    # on node i, for i in 0 .. 3
+    simple-gh-aws-creds apply -c fleet.toml --shard i/4 --output jsonl > results-i.jsonl
+
+    # anywhere, once all shards are done
+    simple-gh-aws-creds merge results-*.jsonl .fleet_state.shard-*-of-4.json \\
+        --state-out .fleet_state.json
+
+A repo always lands in the same shard for the same ``K``, and each shard keeps
+its own state file, see :meth:`Shard.state_file`, so resume and
+``--changed-only`` work per shard. Changing ``K`` reassigns repos, the first
+``--changed-only`` run after that applies every repo once.
+"""
+
+import typing as T
+import json
+import hashlib
+import dataclasses
+from pathlib import Path
+
+from .state import ApplyState
+
+
+def shard_of(full_name: str, count: int) -> int:
+    """
+    Shard index of a repo, stable across processes, machines and Python versions
+    (unlike the built-in ``hash``).
+    """
+    digest = hashlib.sha256(full_name.encode("utf-8")).hexdigest()
+    return int(digest[:16], 16) % count
+
+
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    """
+    Shard ``index`` of ``count``, ``index`` starts at 0.
+    """
+
+    index: int = dataclasses.field()
+    count: int = dataclasses.field()
+
+    def __post_init__(self):
+        if self.count < 1 or not (0 <= self.index < self.count):
+            raise ValueError(f"invalid shard {self.index}/{self.count}")
+
+    @classmethod
+    def parse(cls, text: str) -> "Shard":
+        """
+        Parse ``"i/K"``, e.g. ``"0/4"``.
+        """
+        try:
+            index, count = text.split("/")
+            return cls(index=int(index), count=int(count))
+        except ValueError:
+            raise ValueError(f"shard must look like 'i/K' with 0 <= i < K, got {text!r}")
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    def contains(self, full_name: str) -> bool:
+        return shard_of(full_name, self.count) == self.index
+
+    def state_file(self, path: Path) -> Path:
+        """
+        Per shard state file, ``.fleet_state.json`` becomes
+        ``.fleet_state.shard-0-of-4.json``.
+        """
+        return path.with_name(f"{path.stem}.shard-{self.index}-of-{self.count}{path.suffix}")
+
+
+def merge_results(paths: T.Iterable[Path]) -> list[dict[str, T.Any]]:
+    """
+    Merge per shard JSONL result files into one list sorted by repo. If a repo
+    appears more than once, for example after a shard was re-run, the last
+    line read wins.
+    """
+    results = dict()
+    for path in paths:
+        with Path(path).open() as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    data = json.loads(line)
+                    results[data["repo"]] = data
+    return [results[repo] for repo in sorted(results)]
+
+
+def merge_states(paths: T.Iterable[Path], path_out: Path) -> ApplyState:
+    """
+    Merge per shard state files into one, the most recent apply of a repo wins.
+    """
+    merged = ApplyState(path=Path(path_out))
+    for path in paths:
+        state = ApplyState.load(path)
+        for full_name, entry in state.repos.items():
+            existing = merged.repos.get(full_name)
+            if existing is None or entry.get("applied_at", "") > existing.get(
+                "applied_at", ""
+            ):
+                merged.repos[full_name] = entry
+    merged.save()
+    return merged
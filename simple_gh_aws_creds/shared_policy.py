@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+Consolidate identical inline policies into shared customer managed policies.
+
+By default :meth:`~simple_gh_aws_creds.impl.SetupGitHubRepo.s12_put_iam_policy`
+writes the ``policy_document`` as an inline policy of each IAM user, hundreds of
+users carry byte identical copies, and a permission change is one
+``put_user_policy`` call per user. With ``use_shared_policy=True`` the document is
+stored once, as a customer managed policy, and attached to every user sharing it:
+
+- the policy is named after the canonical hash of the document, see
+  :func:`shared_policy_name_for`, or after the fleet policy template, see
+  :attr:`~simple_gh_aws_creds.fleet.FleetConfig.shared_policies`
+- :meth:`SharedPolicyManager.ensure` creates the policy, or adds a new default
+  version with ``create_policy_version`` when the document changed, pruning the
+  oldest versions to stay under the limit of 5 versions per policy
+- concurrent and repeated ``ensure`` calls for the same policy in a run share
+  one result, changing the permissions of 300 repos is one API call.
+"""
+
+import typing as T
+import json
+import urllib.parse
+import dataclasses
+
+import botocore.exceptions
+
+from .single_flight import SingleFlight
+from .policy import MANAGED_POLICY_MAX_SIZE, compile_policy, canonical_policy_hash
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_iam.client import IAMClient
+
+#: IAM path of all shared policies, keeps them apart from other managed policies
+SHARED_POLICY_PATH = "/simple-gh-aws-creds/"
+SHARED_POLICY_NAME_PREFIX = "gh-ci-shared-"
+#: max number of versions of a managed policy
+POLICY_MAX_VERSIONS = 5
+
+
+def shared_policy_name_for(policy_document: dict[str, T.Any]) -> str:
+    """
+    Content addressed name, documents granting the same permissions get the
+    same name.
+    """
+    return SHARED_POLICY_NAME_PREFIX + canonical_policy_hash(policy_document)[:16]
+
+
+def _decode_document(document: T.Union[str, dict]) -> dict[str, T.Any]:
+    if isinstance(document, str):  # pragma: no cover
+        return json.loads(urllib.parse.unquote(document))
+    return document
+
+
+@dataclasses.dataclass(frozen=True)
+class SharedPolicyState:
+    """
+    Current state of a shared policy.
+
+    :param document_hash: canonical hash of the default version document.
+    """
+
+    name: str = dataclasses.field()
+    arn: str = dataclasses.field()
+    default_version_id: str = dataclasses.field()
+    document_hash: str = dataclasses.field()
+
+
+@dataclasses.dataclass
+class SharedPolicyManager:
+    """
+    Create, update and look up the shared policies of one account.
+
+    Share one manager across all setups of a run, all lookups and updates are
+    cached for the manager's lifetime.
+
+    :param iam_client: IAM client of the account.
+    :param path: IAM path of the shared policies.
+    """
+
+    iam_client: "IAMClient" = dataclasses.field()
+    path: str = dataclasses.field(default=SHARED_POLICY_PATH)
+
+    def __post_init__(self):
+        self._single_flight = SingleFlight(ttl=float("inf"))
+
+    def _list_policies(self) -> dict[str, dict[str, T.Any]]:
+        paginator = self.iam_client.get_paginator("list_policies")
+        return {
+            policy["PolicyName"]: policy
+            for page in paginator.paginate(Scope="Local", PathPrefix=self.path)
+            for policy in page.get("Policies", [])
+        }
+
+    def _describe(self, name: str) -> T.Optional[SharedPolicyState]:
+        # one paginated listing per run instead of one get_policy per name
+        policies = self._single_flight.do(("list",), self._list_policies)
+        policy = policies.get(name)
+        if policy is None:
+            return None
+        res = self.iam_client.get_policy_version(
+            PolicyArn=policy["Arn"],
+            VersionId=policy["DefaultVersionId"],
+        )
+        document = _decode_document(res["PolicyVersion"]["Document"])
+        return SharedPolicyState(
+            name=name,
+            arn=policy["Arn"],
+            default_version_id=policy["DefaultVersionId"],
+            document_hash=canonical_policy_hash(document),
+        )
+
+    def describe(self, name: str) -> T.Optional[SharedPolicyState]:
+        """
+        Read-only, ``None`` if the shared policy doesn't exist.
+        """
+        return self._single_flight.do(("describe", name), lambda: self._describe(name))
+
+    def _forget(self, name: str):
+        self._single_flight.forget(("list",))
+        self._single_flight.forget(("describe", name))
+
+    def _prune_versions(self, arn: str):
+        res = self.iam_client.list_policy_versions(PolicyArn=arn)
+        versions = sorted(
+            (
+                version
+                for version in res.get("Versions", [])
+                if not version["IsDefaultVersion"]
+            ),
+            key=lambda version: version["CreateDate"],
+        )
+        # leave room for the version about to be created
+        n_delete = len(res.get("Versions", [])) - (POLICY_MAX_VERSIONS - 1)
+        for version in versions[: max(0, n_delete)]:
+            self.iam_client.delete_policy_version(
+                PolicyArn=arn,
+                VersionId=version["VersionId"],
+            )
+
+    def _ensure(self, name: str, policy_document: dict[str, T.Any]) -> str:
+        compiled = compile_policy(policy_document, max_size=MANAGED_POLICY_MAX_SIZE)
+        state = self.describe(name)
+        if state is None:
+            try:
+                res = self.iam_client.create_policy(
+                    PolicyName=name,
+                    Path=self.path,
+                    PolicyDocument=compiled.text,
+                    Description="Shared by simple_gh_aws_creds managed IAM users",
+                )
+                self._forget(name)
+                return res["Policy"]["Arn"]
+            except botocore.exceptions.ClientError as e:  # pragma: no cover
+                if e.response["Error"]["Code"] != "EntityAlreadyExists":
+                    raise e
+                # created by another process since the listing, read it again
+                self._forget(name)
+                state = self.describe(name)
+        if state.document_hash == canonical_policy_hash(compiled.document):
+            return state.arn
+        self._prune_versions(state.arn)
+        self.iam_client.create_policy_version(
+            PolicyArn=state.arn,
+            PolicyDocument=compiled.text,
+            SetAsDefault=True,
+        )
+        self._forget(name)
+        return state.arn
+
+    def ensure(self, name: str, policy_document: dict[str, T.Any]) -> str:
+        """
+        Make sure the shared policy exists with this document as its default
+        version, return its ARN. At most one create or update per name per
+        manager.
+
+        :raises PolicyValidationError: if the document is malformed or too large.
+        """
+        key = ("ensure", name, canonical_policy_hash(policy_document))
+        return self._single_flight.do(key, lambda: self._ensure(name, policy_document))
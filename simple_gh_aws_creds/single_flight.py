@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Single flight request coalescing.
+
+When many workers process repos in the same account or org, they issue the
+same read at the same time, for example ``get_policy`` for a shared managed
+policy ARN or a repository metadata fetch. :class:`SingleFlight` lets
+concurrent identical calls share one in flight call and its result, with an
+optional short TTL cache, so duplicate reads drop from one per worker to one
+per key.
+
+Example::
+
+    sf = SingleFlight(ttl=60)
+    policy = sf.do(
+        ("get_policy", arn),
+        lambda: iam_client.get_policy(PolicyArn=arn),
+    )
+
+The result object is shared by all callers, treat it as read-only.
+"""
+
+import typing as T
+import time
+import threading
+import dataclasses
+
+ResultT = T.TypeVar("ResultT")
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "expires_at")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: T.Optional[BaseException] = None
+        self.expires_at: float = 0.0
+
+
+@dataclasses.dataclass
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing the same key.
+
+    :param ttl: seconds a successful result is reused after the call finished,
+        0 means only calls overlapping in time are coalesced. Failed calls
+        are never cached.
+    """
+
+    ttl: float = dataclasses.field(default=0)
+    clock: T.Callable[[], float] = dataclasses.field(default=time.monotonic)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[T.Hashable, _Call] = dict()
+        self.n_calls = 0
+        self.n_shared = 0
+
+    def do(
+        self,
+        key: T.Hashable,
+        func: T.Callable[[], ResultT],
+    ) -> ResultT:
+        """
+        Return ``func()``, unless an identical call is in flight or cached,
+        then return (or raise) its outcome instead.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.event.is_set():
+                if call.error is None and call.expires_at > self.clock():
+                    self.n_shared += 1
+                    return call.result
+                call = None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+                self.n_calls += 1
+            else:
+                leader = False
+                self.n_shared += 1
+
+        if leader is False:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                call.expires_at = self.clock() + self.ttl
+                if call.error is not None or self.ttl <= 0:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                call.event.set()
+        return call.result
+
+    def forget(self, key: T.Hashable):
+        """
+        Drop the cached result of a key, e.g. after a write invalidated it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.event.is_set():
+                del self._calls[key]
+
+    def clear(self):
+        with self._lock:
+            for key in [key for key, call in self._calls.items() if call.event.is_set()]:
+                del self._calls[key]
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Last applied state, for incremental fleet apply.
+
+A fleet ``apply`` used to process every repo even when only one policy template
+changed. :func:`spec_hash` hashes the fully resolved spec of a repo, what
+``apply`` would write: the canonical policy document, managed policy ARNs, user
+tags, secret names, region and IAM user name. A template edit changes the hash
+of every repo using it, and only those. :class:`ApplyState` stores the hash of
+each successfully applied repo in a JSON file, ``apply --changed-only`` skips
+the repos whose hash didn't change.
+"""
+
+import typing as T
+import os
+import json
+import hashlib
+import threading
+import dataclasses
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .policy import canonical_policy_hash
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .impl import SetupGitHubRepo
+
+STATE_FORMAT_VERSION = 1
+
+
+def spec_hash(setup: "SetupGitHubRepo") -> str:
+    """
+    Stable hash of everything ``apply`` writes for a repo.
+    """
+    spec = {
+        "aws_region": setup.aws_region,
+        "iam_user_name": setup.iam_user_name,
+        "policy_document": canonical_policy_hash(setup.policy_document),
+        "attached_policy_arn_list": sorted(setup.attached_policy_arn_list),
+        "tags": setup.user_tags,
+        "github_secret_name_list": setup.github_secret_name_list,
+        "github_variable_name_list": setup.github_variable_name_list,
+        "github_environments": setup.github_environments,
+        "github_secret_stores": setup.github_secret_stores,
+        "shared_policy": (
+            setup.resolved_shared_policy_name if setup.use_shared_policy else None
+        ),
+    }
+    text = json.dumps(spec, separators=(",", ":"), sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclasses.dataclass
+class ApplyState:
+    """
+    ``{"owner/repo": {"spec_hash": ..., "applied_at": ...}}`` stored as JSON.
+
+    :meth:`record` and :meth:`forget` are thread safe and only change memory,
+    call :meth:`save` to write the file.
+    """
+
+    path: Path = dataclasses.field()
+    repos: dict[str, dict[str, str]] = dataclasses.field(default_factory=dict)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> "ApplyState":
+        """
+        Read the state file, an empty state if it doesn't exist.
+        """
+        try:
+            data = json.loads(Path(path).read_text())
+        except FileNotFoundError:
+            return cls(path=Path(path))
+        return cls(path=Path(path), repos=data.get("repos", {}))
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            text = json.dumps(
+                {"version": STATE_FORMAT_VERSION, "repos": self.repos},
+                indent=2,
+                sort_keys=True,
+            )
+        # write to a temp file then rename, an interrupted run never leaves
+        # a truncated state file
+        path_tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        path_tmp.write_text(text)
+        os.replace(path_tmp, self.path)
+
+    def is_changed(self, full_name: str, new_hash: str) -> bool:
+        with self._lock:
+            entry = self.repos.get(full_name)
+        return entry is None or entry.get("spec_hash") != new_hash
+
+    def record(self, full_name: str, new_hash: str):
+        with self._lock:
+            self.repos[full_name] = {
+                "spec_hash": new_hash,
+                "applied_at": datetime.now(timezone.utc).isoformat(),
+            }
+
+    def forget(self, full_name: str):
+        with self._lock:
+            self.repos.pop(full_name, None)
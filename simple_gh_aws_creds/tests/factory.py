@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+Factory of :class:`~simple_gh_aws_creds.impl.SetupGitHubRepo` objects for unit tests.
+"""
+
+from pathlib import Path
+
+import boto3
+
+from ..impl import SetupGitHubRepo
+
+
+def make_setup_github_repo(
+    boto_ses: "boto3.Session",
+    dir_root: Path,
+    i: int,
+    **kwargs,
+) -> SetupGitHubRepo:
+    """
+    Create a ``SetupGitHubRepo`` for ``alice/repo{i}``. Its GitHub requests are
+    real HTTP requests, serve them with
+    :class:`~simple_gh_aws_creds.tests.fake_github.FakeGitHub`.
+    """
+    params = dict(
+        boto_ses=boto_ses,
+        aws_region="us-east-1",
+        iam_user_name=f"gh-ci-repo{i}",
+        tags={},
+        policy_document={
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Action": "iam:ListAccountAliases",
+                    "Resource": "*",
+                }
+            ],
+        },
+        attached_policy_arn_list=[],
+        path_access_key_json=dir_root.joinpath(f"access_key_{i}.json"),
+        github_user_name="alice",
+        github_repo_name=f"repo{i}",
+        github_token="github_token_here",
+    )
+    params.update(kwargs)
+    return SetupGitHubRepo(**params)
@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-memory GitHub REST and GraphQL fake for unit tests.
+
+Tests of the AWS side used to replace
+:meth:`~simple_gh_aws_creds.impl.SetupGitHubRepo.put_github_secrets` with a
+``lambda``, so the GitHub write and its failures were never exercised.
+:class:`FakeGitHub` serves, through ``responses``, the endpoints
+:class:`~simple_gh_aws_creds.github_client.GitHubClient` calls: repositories,
+environments, secrets of every store with real public keys, repository and
+organization variables, and the ``repository`` GraphQL lookup. Secrets are
+stored encrypted, :meth:`FakeGitHub.get_secret_value` decrypts them.
+
+Failures are injected per request with :meth:`FakeGitHub.fail`::
+
+    with FakeGitHub() as github:
+        github.fail("PUT", r"/secrets/AWS_ACCESS_KEY_ID$", status=502)
+        assert setup.put_github_secrets("AKIA...", "...") is False
+
+``moto`` intercepts ``requests`` too, the fake is started after it, only
+answers the requests to ``base_url`` and lets the others through.
+"""
+
+import typing as T
+import re
+import json
+import base64
+import threading
+import dataclasses
+from datetime import datetime, timezone, timedelta
+from urllib.parse import urlsplit, parse_qs
+
+import responses
+import nacl.public
+
+from ..github_client import GITHUB_API_URL, SECRET_STORES
+
+_EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+#: a response, ``(status, headers, body)``
+_Reply = T.Tuple[int, dict[str, str], str]
+
+
+def _reply(status: int, data: T.Any = None) -> _Reply:
+    body = "" if data is None else json.dumps(data)
+    return status, {"Content-Type": "application/json"}, body
+
+
+def _not_found() -> _Reply:
+    return _reply(404, {"message": "Not Found"})
+
+
+def _in_store(handler):
+    def func(self, owner, repo, store, *args, **kwargs):
+        return handler(self, owner, repo, store, None, *args, **kwargs)
+
+    return func
+
+
+def _in_environment(handler):
+    def func(self, owner, repo, environment, *args, **kwargs):
+        return handler(self, owner, repo, "actions", environment, *args, **kwargs)
+
+    return func
+
+
+@dataclasses.dataclass
+class _Failure:
+    method: str
+    pattern: "re.Pattern"
+    status: int
+    times: T.Optional[int]
+    after: int
+
+
+@dataclasses.dataclass
+class _OrgVariable:
+    name: str
+    value: str
+    visibility: str
+    repo_ids: T.Set[int]
+
+
+class FakeGitHub:
+    """
+    In-memory GitHub, see the module docstring. Thread safe.
+
+    :param repos: the repositories that exist, ``owner/repo`` names. ``None``
+        means every repository exists, it is created when first used.
+    :param base_url: the API url served.
+    """
+
+    def __init__(
+        self,
+        repos: T.Optional[T.Iterable[str]] = None,
+        base_url: str = GITHUB_API_URL,
+    ):
+        self.base_url = base_url
+        self.auto_create_repos = repos is None
+        self._lock = threading.Lock()
+        self._n_ids = 0
+        self._n_writes = 0
+        self.repo_ids: dict[str, int] = dict()
+        self.renamed: dict[str, str] = dict()
+        self.environments: T.Set[T.Tuple[str, str]] = set()
+        # (owner/repo, scope) -> {name: secret}, scope is a store or
+        # "environments/<name>"
+        self.secrets: dict[T.Tuple[str, str], dict[str, dict[str, T.Any]]] = dict()
+        self._private_keys: dict[T.Tuple[str, str], nacl.public.PrivateKey] = dict()
+        self.variables: dict[str, dict[str, str]] = dict()
+        self.org_variables: dict[T.Tuple[str, str], _OrgVariable] = dict()
+        self._failures: list[_Failure] = list()
+        self.mock = responses.RequestsMock(assert_all_requests_are_fired=False)
+        pattern = re.compile(rf"^{re.escape(base_url)}/.*")
+        for method in ["GET", "POST", "PUT", "PATCH", "DELETE"]:
+            self.mock.add_callback(method, pattern, callback=self._handle)
+        # let the other hosts through, e.g. a local webhook server
+        self.mock.add_passthru(re.compile(rf"^(?!{re.escape(base_url)}/)"))
+        for full_name in repos or []:
+            self.add_repo(full_name)
+
+    def __enter__(self) -> "FakeGitHub":
+        self.mock.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.mock.stop()
+        self.mock.reset()
+
+    @property
+    def calls(self) -> list[T.Tuple[str, str]]:
+        """
+        ``(method, path)`` of every request served, query string included.
+        """
+        n = len(self.base_url)
+        return [(call.request.method, call.request.url[n:]) for call in self.mock.calls]
+
+    # --------------------------------------------------------------------------
+    # setup and inspection
+    # --------------------------------------------------------------------------
+    def add_repo(self, full_name: str) -> int:
+        """
+        Create a repository, return its id.
+        """
+        with self._lock:
+            return self._repo_id(full_name, create=True)
+
+    def rename_repo(self, old_full_name: str, new_full_name: str):
+        """
+        Rename a repository, GraphQL resolves the old name to the new one.
+        """
+        with self._lock:
+            self.repo_ids[new_full_name] = self.repo_ids.pop(old_full_name)
+            self.renamed[old_full_name] = new_full_name
+
+    def delete_repo(self, full_name: str):
+        with self._lock:
+            self.auto_create_repos = False
+            self.repo_ids.pop(full_name, None)
+
+    def fail(
+        self,
+        method: str,
+        pattern: str,
+        status: int = 500,
+        times: T.Optional[int] = None,
+        after: int = 0,
+    ):
+        """
+        Answer the requests whose path matches the ``pattern`` regex with
+        ``status``, ``times`` requests, or all of them, once ``after`` matching
+        requests went through.
+        """
+        with self._lock:
+            self._failures.append(
+                _Failure(
+                    method=method,
+                    pattern=re.compile(pattern),
+                    status=status,
+                    times=times,
+                    after=after,
+                )
+            )
+
+    def clear_failures(self):
+        with self._lock:
+            self._failures.clear()
+
+    def get_secret_names(self, full_name: str, scope: str = "actions") -> list[str]:
+        return sorted(self.secrets.get((full_name, scope), {}))
+
+    def get_secret_value(
+        self,
+        full_name: str,
+        name: str,
+        scope: str = "actions",
+    ) -> T.Optional[str]:
+        """
+        The decrypted value of a secret, ``None`` if it doesn't exist.
+
+        :param scope: ``"actions"``, ``"dependabot"``, ``"codespaces"`` or
+            ``"environments/<name>"``.
+        """
+        secret = self.secrets.get((full_name, scope), {}).get(name)
+        if secret is None:
+            return None
+        sealed_box = nacl.public.SealedBox(self._private_keys[(full_name, scope)])
+        return sealed_box.decrypt(base64.b64decode(secret["encrypted_value"])).decode()
+
+    # --------------------------------------------------------------------------
+    # request handling
+    # --------------------------------------------------------------------------
+    def _new_id(self) -> int:
+        self._n_ids += 1
+        return 1000 + self._n_ids
+
+    def _now(self) -> str:
+        # every write is one second later, so ``updated_at`` always changes
+        self._n_writes += 1
+        now = _EPOCH + timedelta(seconds=self._n_writes)
+        return now.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def _repo_id(self, full_name: str, create: bool = False) -> T.Optional[int]:
+        if full_name not in self.repo_ids and (create or self.auto_create_repos):
+            self.repo_ids[full_name] = self._new_id()
+        return self.repo_ids.get(full_name)
+
+    def _handle(self, request) -> _Reply:
+        url = urlsplit(request.url)
+        path = url.path[len(urlsplit(self.base_url).path) :]
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = json.loads(request.body) if request.body else {}
+        with self._lock:
+            for failure in self._failures:
+                if failure.method == request.method and failure.pattern.search(path):
+                    if failure.after > 0:
+                        failure.after -= 1
+                        continue
+                    if failure.times is not None:
+                        if failure.times == 0:
+                            continue
+                        failure.times -= 1
+                    return _reply(failure.status, {"message": "injected failure"})
+            for method, pattern, handler in self._routes:
+                if method != request.method:
+                    continue
+                match = re.fullmatch(pattern, path)
+                if match is not None:
+                    return handler(self, *match.groups(), query=query, body=body)
+        return _not_found()
+
+    def _page(self, key: str, items: list[T.Any], query: dict[str, str]) -> _Reply:
+        per_page = int(query.get("per_page", 30))
+        page = int(query.get("page", 1))
+        start = (page - 1) * per_page
+        return _reply(
+            200,
+            {"total_count": len(items), key: items[start : start + per_page]},
+        )
+
+    def _get_repo(self, owner, repo, query, body) -> _Reply:
+        repo_id = self._repo_id(f"{owner}/{repo}")
+        if repo_id is None:
+            return _not_found()
+        return _reply(
+            200,
+            {
+                "id": repo_id,
+                "name": repo,
+                "full_name": f"{owner}/{repo}",
+                "owner": {"login": owner},
+            },
+        )
+
+    def _get_environment(self, owner, repo, environment, query, body) -> _Reply:
+        if (f"{owner}/{repo}", environment) not in self.environments:
+            return _not_found()
+        return _reply(200, {"name": environment})
+
+    def _put_environment(self, owner, repo, environment, query, body) -> _Reply:
+        if self._repo_id(f"{owner}/{repo}") is None:
+            return _not_found()
+        self.environments.add((f"{owner}/{repo}", environment))
+        return _reply(200, {"name": environment})
+
+    def _scope(self, owner, repo, store, environment) -> T.Optional[str]:
+        if self._repo_id(f"{owner}/{repo}") is None:
+            return None
+        if environment is not None:
+            if (f"{owner}/{repo}", environment) not in self.environments:
+                return None
+            return f"environments/{environment}"
+        if store not in SECRET_STORES:
+            return None
+        return store
+
+    def _get_public_key(self, owner, repo, store, environment, query, body):
+        scope = self._scope(owner, repo, store, environment)
+        if scope is None:
+            return _not_found()
+        key = (f"{owner}/{repo}", scope)
+        if key not in self._private_keys:
+            self._private_keys[key] = nacl.public.PrivateKey.generate()
+        public_key = bytes(self._private_keys[key].public_key)
+        return _reply(
+            200,
+            {"key_id": f"{scope}-key", "key": base64.b64encode(public_key).decode()},
+        )
+
+    def _list_secrets(self, owner, repo, store, environment, query, body):
+        scope = self._scope(owner, repo, store, environment)
+        if scope is None:
+            return _not_found()
+        secrets = self.secrets.get((f"{owner}/{repo}", scope), {})
+        items = [
+            {key: secret[key] for key in ["name", "created_at", "updated_at"]}
+            for _, secret in sorted(secrets.items())
+        ]
+        return self._page("secrets", items, query)
+
+    def _put_secret(self, owner, repo, store, environment, name, query, body):
+        scope = self._scope(owner, repo, store, environment)
+        if scope is None or (f"{owner}/{repo}", scope) not in self._private_keys:
+            return _not_found()
+        if body.get("key_id") != f"{scope}-key":
+            return _reply(422, {"message": "Bad key_id"})
+        secrets = self.secrets.setdefault((f"{owner}/{repo}", scope), {})
+        now = self._now()
+        created = name not in secrets
+        secrets[name] = {
+            "name": name,
+            "created_at": secrets.get(name, {}).get("created_at", now),
+            "updated_at": now,
+            "encrypted_value": body["encrypted_value"],
+        }
+        return _reply(201 if created else 204)
+
+    def _delete_secret(self, owner, repo, store, environment, name, query, body):
+        scope = self._scope(owner, repo, store, environment)
+        if scope is None:
+            return _not_found()
+        if self.secrets.get((f"{owner}/{repo}", scope), {}).pop(name, None) is None:
+            return _not_found()
+        return _reply(204)
+
+    def _get_variable(self, owner, repo, name, query, body) -> _Reply:
+        value = self.variables.get(f"{owner}/{repo}", {}).get(name)
+        if value is None:
+            return _not_found()
+        return _reply(200, {"name": name, "value": value})
+
+    def _create_variable(self, owner, repo, query, body) -> _Reply:
+        if self._repo_id(f"{owner}/{repo}") is None:
+            return _not_found()
+        variables = self.variables.setdefault(f"{owner}/{repo}", {})
+        if body["name"] in variables:
+            return _reply(409, {"message": "Already exists"})
+        variables[body["name"]] = body["value"]
+        return _reply(201)
+
+    def _update_variable(self, owner, repo, name, query, body) -> _Reply:
+        variables = self.variables.get(f"{owner}/{repo}", {})
+        if name not in variables:
+            return _not_found()
+        variables[name] = body["value"]
+        return _reply(204)
+
+    def _delete_variable(self, owner, repo, name, query, body) -> _Reply:
+        if self.variables.get(f"{owner}/{repo}", {}).pop(name, None) is None:
+            return _not_found()
+        return _reply(204)
+
+    def _get_org_variable(self, org, name, query, body) -> _Reply:
+        variable = self.org_variables.get((org, name))
+        if variable is None:
+            return _not_found()
+        return _reply(
+            200,
+            {
+                "name": name,
+                "value": variable.value,
+                "visibility": variable.visibility,
+            },
+        )
+
+    def _create_org_variable(self, org, query, body) -> _Reply:
+        if (org, body["name"]) in self.org_variables:
+            return _reply(409, {"message": "Already exists"})
+        self.org_variables[(org, body["name"])] = _OrgVariable(
+            name=body["name"],
+            value=body["value"],
+            visibility=body.get("visibility", "private"),
+            repo_ids=set(body.get("selected_repository_ids", [])),
+        )
+        return _reply(201)
+
+    def _update_org_variable(self, org, name, query, body) -> _Reply:
+        variable = self.org_variables.get((org, name))
+        if variable is None:
+            return _not_found()
+        variable.value = body.get("value", variable.value)
+        variable.visibility = body.get("visibility", variable.visibility)
+        return _reply(204)
+
+    def _list_org_variable_repos(self, org, name, query, body) -> _Reply:
+        variable = self.org_variables.get((org, name))
+        if variable is None:
+            return _not_found()
+        names = {repo_id: name for name, repo_id in self.repo_ids.items()}
+        items = [
+            {"id": repo_id, "full_name": names.get(repo_id)}
+            for repo_id in sorted(variable.repo_ids)
+        ]
+        return self._page("repositories", items, query)
+
+    def _set_org_variable_repos(self, org, name, query, body) -> _Reply:
+        variable = self.org_variables.get((org, name))
+        if variable is None:
+            return _not_found()
+        variable.repo_ids = set(body["selected_repository_ids"])
+        return _reply(204)
+
+    def _add_org_variable_repo(self, org, name, repo_id, query, body) -> _Reply:
+        variable = self.org_variables.get((org, name))
+        if variable is None:
+            return _not_found()
+        variable.repo_ids.add(int(repo_id))
+        return _reply(204)
+
+    def _remove_org_variable_repo(self, org, name, repo_id, query, body) -> _Reply:
+        variable = self.org_variables.get((org, name))
+        if variable is None:
+            return _not_found()
+        variable.repo_ids.discard(int(repo_id))
+        return _reply(204)
+
+    def _graphql(self, query, body) -> _Reply:
+        # only the aliased ``repository(owner: $o<i>, name: $n<i>)`` lookups
+        # of GitHubClient.resolve_repos
+        variables = body.get("variables", {})
+        data = dict()
+        errors = list()
+        i = 0
+        while f"o{i}" in variables:
+            full_name = f"{variables[f'o{i}']}/{variables[f'n{i}']}"
+            full_name = self.renamed.get(full_name, full_name)
+            repo_id = self._repo_id(full_name)
+            if repo_id is None:
+                data[f"r{i}"] = None
+                errors.append(
+                    {
+                        "type": "NOT_FOUND",
+                        "path": [f"r{i}"],
+                        "message": f"Could not resolve to a Repository {full_name}",
+                    }
+                )
+            else:
+                data[f"r{i}"] = {"nameWithOwner": full_name, "databaseId": repo_id}
+            i += 1
+        reply = {"data": data}
+        if errors:
+            reply["errors"] = errors
+        return _reply(200, reply)
+
+    _SEGMENT = r"([^/]+)"
+    _STORE = rf"/repos/{_SEGMENT}/{_SEGMENT}/{_SEGMENT}/secrets"
+    _ENV = rf"/repos/{_SEGMENT}/{_SEGMENT}/environments/{_SEGMENT}/secrets"
+
+    _routes = [
+        ("POST", r"/graphql", lambda self, query, body: self._graphql(query, body)),
+        ("GET", rf"/repos/{_SEGMENT}/{_SEGMENT}", _get_repo),
+        ("GET", f"{_ENV}/public-key", _in_environment(_get_public_key)),
+        ("GET", _ENV, _in_environment(_list_secrets)),
+        ("PUT", f"{_ENV}/{_SEGMENT}", _in_environment(_put_secret)),
+        ("DELETE", f"{_ENV}/{_SEGMENT}", _in_environment(_delete_secret)),
+        ("GET", f"{_STORE}/public-key", _in_store(_get_public_key)),
+        ("GET", _STORE, _in_store(_list_secrets)),
+        ("PUT", f"{_STORE}/{_SEGMENT}", _in_store(_put_secret)),
+        ("DELETE", f"{_STORE}/{_SEGMENT}", _in_store(_delete_secret)),
+        (
+            "GET",
+            rf"/repos/{_SEGMENT}/{_SEGMENT}/environments/{_SEGMENT}",
+            _get_environment,
+        ),
+        (
+            "PUT",
+            rf"/repos/{_SEGMENT}/{_SEGMENT}/environments/{_SEGMENT}",
+            _put_environment,
+        ),
+        (
+            "GET",
+            rf"/repos/{_SEGMENT}/{_SEGMENT}/actions/variables/{_SEGMENT}",
+            _get_variable,
+        ),
+        ("POST", rf"/repos/{_SEGMENT}/{_SEGMENT}/actions/variables", _create_variable),
+        (
+            "PATCH",
+            rf"/repos/{_SEGMENT}/{_SEGMENT}/actions/variables/{_SEGMENT}",
+            _update_variable,
+        ),
+        (
+            "DELETE",
+            rf"/repos/{_SEGMENT}/{_SEGMENT}/actions/variables/{_SEGMENT}",
+            _delete_variable,
+        ),
+        (
+            "GET",
+            rf"/orgs/{_SEGMENT}/actions/variables/{_SEGMENT}/repositories",
+            _list_org_variable_repos,
+        ),
+        (
+            "PUT",
+            rf"/orgs/{_SEGMENT}/actions/variables/{_SEGMENT}/repositories",
+            _set_org_variable_repos,
+        ),
+        (
+            "PUT",
+            rf"/orgs/{_SEGMENT}/actions/variables/{_SEGMENT}/repositories/(\d+)",
+            _add_org_variable_repo,
+        ),
+        (
+            "DELETE",
+            rf"/orgs/{_SEGMENT}/actions/variables/{_SEGMENT}/repositories/(\d+)",
+            _remove_org_variable_repo,
+        ),
+        ("GET", rf"/orgs/{_SEGMENT}/actions/variables/{_SEGMENT}", _get_org_variable),
+        ("POST", rf"/orgs/{_SEGMENT}/actions/variables", _create_org_variable),
+        (
+            "PATCH",
+            rf"/orgs/{_SEGMENT}/actions/variables/{_SEGMENT}",
+            _update_org_variable,
+        ),
+    ]
@@ -0,0 +1,1174 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fast in-memory IAM fake for load tests.
+
+moto is a faithful IAM, but slow and with no notion of latency, throttling or
+quotas, so it can't tell how a 50k repo fleet run behaves when IAM answers in
+200 ms, throttles 2% of the calls, or runs out of users. :class:`FakeIamClient`
+implements, in memory, the IAM operations this library calls, and on each call:
+
+1. emits the botocore ``before-call`` event, a circuit breaker attached with
+   :func:`~simple_gh_aws_creds.circuit_breaker.attach_to_boto_client` works
+   as with a real client,
+2. sleeps the latency drawn for the operation,
+3. fails with ``Throttling`` at the configured rate,
+4. runs the operation, account quotas raise ``LimitExceeded`` like IAM does,
+5. emits ``after-call``.
+
+Everything random is drawn from a seed and the call itself, operation name,
+parameters and how many times the same call was made before, never from the
+order threads happen to run in. The same seed gives the same latencies and
+the same throttled calls at any ``parallel``.
+
+Plug it in with :class:`FakeBotoSession`::
+
+    iam_client = FakeIamClient(
+        latency=lognormal_latency(median=0.05, sigma=0.5),
+        throttle_rate=0.02,
+        quota=FakeIamQuota(users=100),
+    )
+    results = list(run_fleet("apply", config, boto_ses=FakeBotoSession(iam_client)))
+"""
+
+import typing as T
+import json
+import math
+import time
+import random
+import fnmatch
+import hashlib
+import threading
+import collections
+import collections.abc
+import dataclasses
+from datetime import datetime, timezone
+
+import botocore.exceptions
+from botocore.hooks import HierarchicalEmitter
+from botocore.model import ServiceId
+
+from ..policy import USER_INLINE_POLICY_MAX_SIZE, policy_size
+
+#: draws one latency in seconds from a random generator
+LatencyFunc = T.Callable[[random.Random], float]
+
+
+def constant_latency(seconds: float) -> LatencyFunc:
+    return lambda rng: seconds
+
+
+def uniform_latency(low: float, high: float) -> LatencyFunc:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal_latency(median: float, sigma: float) -> LatencyFunc:
+    """
+    Long tailed latency, most calls close to ``median``, a few much slower.
+    """
+    return lambda rng: median * math.exp(rng.gauss(0.0, sigma))
+
+
+@dataclasses.dataclass
+class FakeIamQuota:
+    """
+    Account quotas enforced by :class:`FakeIamClient`, IAM defaults.
+    """
+
+    users: int = dataclasses.field(default=5000)
+    roles: int = dataclasses.field(default=1000)
+    policies: int = dataclasses.field(default=1500)
+    access_keys_per_user: int = dataclasses.field(default=2)
+    attached_policies_per_user: int = dataclasses.field(default=10)
+    attached_policies_per_role: int = dataclasses.field(default=10)
+    policy_versions: int = dataclasses.field(default=5)
+    inline_policy_size_per_user: int = dataclasses.field(
+        default=USER_INLINE_POLICY_MAX_SIZE
+    )
+
+    def to_summary_map(self) -> dict[str, int]:
+        return {
+            "UsersQuota": self.users,
+            "RolesQuota": self.roles,
+            "PoliciesQuota": self.policies,
+            "AccessKeysPerUserQuota": self.access_keys_per_user,
+            "AttachedPoliciesPerUserQuota": self.attached_policies_per_user,
+            "AttachedPoliciesPerRoleQuota": self.attached_policies_per_role,
+            "PolicyVersionsInUseQuota": self.policy_versions,
+            "UserPolicySizeQuota": self.inline_policy_size_per_user,
+        }
+
+
+def _client_error(
+    operation_name: str,
+    code: str,
+    message: str,
+    status_code: int = 400,
+) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {
+            "Error": {"Code": code, "Message": message},
+            "ResponseMetadata": {"HTTPStatusCode": status_code},
+        },
+        operation_name,
+    )
+
+
+def _no_such_entity(operation_name: str, message: str):
+    return _client_error(operation_name, "NoSuchEntity", message, 404)
+
+
+def _operation_name(method_name: str) -> str:
+    return (
+        "".join(word.title() for word in method_name.split("_"))
+        .replace("OpenIdConnect", "OpenIDConnect")
+        .replace("ClientId", "ClientID")
+    )
+
+
+def _parse_document(operation_name: str, document: str) -> dict[str, T.Any]:
+    try:
+        data = json.loads(document)
+    except ValueError:
+        raise _client_error(
+            operation_name, "MalformedPolicyDocument", "Syntax errors in policy."
+        )
+    if not isinstance(data, dict):
+        raise _client_error(
+            operation_name, "MalformedPolicyDocument", "Syntax errors in policy."
+        )
+    return data
+
+
+@dataclasses.dataclass
+class _FakeHttpResponse:
+    status_code: int
+
+
+class _FakeServiceModel:
+    service_id = ServiceId("IAM")
+    service_name = "iam"
+
+
+class _FakeMeta:
+    def __init__(self):
+        self.events = HierarchicalEmitter()
+        self.service_model = _FakeServiceModel()
+        self.region_name = "aws-global"
+
+
+@dataclasses.dataclass
+class _User:
+    name: str
+    arn: str
+    user_id: str
+    create_date: datetime
+    tags: list[dict[str, str]]
+    path: str = "/"
+    inline_policies: dict[str, str] = dataclasses.field(default_factory=dict)
+    attached_policies: list[str] = dataclasses.field(default_factory=list)
+    access_keys: list[dict[str, T.Any]] = dataclasses.field(default_factory=list)
+
+    def to_dict(self) -> dict[str, T.Any]:
+        data = {
+            "Path": self.path,
+            "UserName": self.name,
+            "UserId": self.user_id,
+            "Arn": self.arn,
+            "CreateDate": self.create_date,
+        }
+        if self.tags:
+            data["Tags"] = list(self.tags)
+        return data
+
+
+@dataclasses.dataclass
+class _Role:
+    name: str
+    arn: str
+    role_id: str
+    create_date: datetime
+    assume_role_policy: str
+    tags: list[dict[str, str]]
+    max_session_duration: int = 3600
+    inline_policies: dict[str, str] = dataclasses.field(default_factory=dict)
+    attached_policies: list[str] = dataclasses.field(default_factory=list)
+
+    def to_dict(self) -> dict[str, T.Any]:
+        data = {
+            "Path": "/",
+            "RoleName": self.name,
+            "RoleId": self.role_id,
+            "Arn": self.arn,
+            "CreateDate": self.create_date,
+            "AssumeRolePolicyDocument": json.loads(self.assume_role_policy),
+            "MaxSessionDuration": self.max_session_duration,
+        }
+        if self.tags:
+            data["Tags"] = list(self.tags)
+        return data
+
+
+@dataclasses.dataclass
+class _Policy:
+    name: str
+    arn: str
+    policy_id: str
+    path: str
+    create_date: datetime
+    versions: dict[str, str]
+    default_version_id: str = "v1"
+    next_version: int = 2
+    attachment_count: int = 0
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return {
+            "PolicyName": self.name,
+            "PolicyId": self.policy_id,
+            "Arn": self.arn,
+            "Path": self.path,
+            "DefaultVersionId": self.default_version_id,
+            "AttachmentCount": self.attachment_count,
+            "IsAttachable": True,
+            "CreateDate": self.create_date,
+        }
+
+
+class _FakePaginator:
+    def __init__(self, client: "FakeIamClient", method_name: str):
+        self._client = client
+        self._method_name = method_name
+
+    def paginate(self, **kwargs) -> T.Iterator[dict[str, T.Any]]:
+        method = getattr(self._client, self._method_name)
+        kwargs = dict(kwargs)
+        kwargs.pop("PaginationConfig", None)
+        while True:
+            page = method(**kwargs)
+            yield page
+            if not page.get("IsTruncated"):
+                return
+            kwargs["Marker"] = page["Marker"]
+
+
+#: operations of :class:`FakeIamClient`, each backed by a ``_<name>`` method
+OPERATIONS = [
+    "create_user",
+    "get_user",
+    "delete_user",
+    "list_users",
+    "list_user_tags",
+    "tag_user",
+    "create_access_key",
+    "list_access_keys",
+    "update_access_key",
+    "delete_access_key",
+    "get_access_key_last_used",
+    "put_user_policy",
+    "get_user_policy",
+    "delete_user_policy",
+    "list_user_policies",
+    "attach_user_policy",
+    "detach_user_policy",
+    "list_attached_user_policies",
+    "create_policy",
+    "get_policy",
+    "delete_policy",
+    "list_policies",
+    "create_policy_version",
+    "get_policy_version",
+    "list_policy_versions",
+    "delete_policy_version",
+    "create_role",
+    "get_role",
+    "delete_role",
+    "update_assume_role_policy",
+    "update_role",
+    "tag_role",
+    "put_role_policy",
+    "delete_role_policy",
+    "attach_role_policy",
+    "detach_role_policy",
+    "list_attached_role_policies",
+    "create_open_id_connect_provider",
+    "list_open_id_connect_providers",
+    "get_open_id_connect_provider",
+    "add_client_id_to_open_id_connect_provider",
+    "get_account_summary",
+    "get_account_authorization_details",
+    "simulate_principal_policy",
+]
+
+#: operations that support :meth:`FakeIamClient.get_paginator`
+PAGINATED_OPERATIONS = {
+    "list_users",
+    "list_policies",
+    "get_account_authorization_details",
+}
+
+
+class FakeIamClient:
+    """
+    In-memory IAM client with latency, throttling and quota injection, see the
+    module docstring. Thread safe.
+
+    :param account_id: AWS account id used in ARNs.
+    :param latency: latency of every operation, or ``{operation: latency}``
+        with the key ``"*"`` as default, see :func:`lognormal_latency`.
+        No latency by default.
+    :param throttle_rate: share of the calls failing with ``Throttling``, or
+        ``{operation: rate}`` with the key ``"*"`` as default.
+    :param quota: account quotas, IAM defaults by default.
+    :param seed: seed of every random draw.
+    :param page_size: items per page of the paginated operations.
+    :param sleep: called with the drawn latency, replace it to simulate time
+        without waiting.
+    """
+
+    def __init__(
+        self,
+        account_id: str = "123456789012",
+        latency: T.Union[None, LatencyFunc, T.Mapping[str, LatencyFunc]] = None,
+        throttle_rate: T.Union[float, T.Mapping[str, float]] = 0.0,
+        quota: T.Optional[FakeIamQuota] = None,
+        seed: int = 0,
+        page_size: int = 100,
+        sleep: T.Callable[[float], None] = time.sleep,
+    ):
+        self.account_id = account_id
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.quota = quota or FakeIamQuota()
+        self.seed = seed
+        self.page_size = page_size
+        self.sleep = sleep
+        self.meta = _FakeMeta()
+
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._users: dict[str, _User] = dict()
+        self._roles: dict[str, _Role] = dict()
+        self._policies: dict[str, _Policy] = dict()
+        self._oidc_providers: dict[str, dict[str, T.Any]] = dict()
+        self._n_ids = 0
+        self._attempts: T.Counter[str] = collections.Counter()
+
+        #: calls per operation, throttled calls included
+        self.n_calls: T.Counter[str] = collections.Counter()
+        #: throttled calls per operation
+        self.n_throttled: T.Counter[str] = collections.Counter()
+        #: total latency slept, in seconds
+        self.total_latency = 0.0
+        self.n_in_flight = 0
+        #: highest number of concurrent calls seen
+        self.max_in_flight = 0
+
+    # --------------------------------------------------------------------------
+    # call machinery
+    # --------------------------------------------------------------------------
+    def _pick(self, setting, method_name: str, default):
+        if isinstance(setting, collections.abc.Mapping):
+            return setting.get(method_name, setting.get("*", default))
+        return setting if setting is not None else default
+
+    def _rng(self, method_name: str, params: dict[str, T.Any]) -> random.Random:
+        """
+        Random generator of one call, seeded by the call itself and its
+        attempt number, independent of the thread scheduling.
+        """
+        key = json.dumps(
+            [method_name, params], sort_keys=True, separators=(",", ":"), default=str
+        )
+        with self._stats_lock:
+            attempt = self._attempts[key]
+            self._attempts[key] += 1
+        digest = hashlib.sha256(f"{self.seed}:{attempt}:{key}".encode("utf-8"))
+        return random.Random(int.from_bytes(digest.digest()[:8], "big"))
+
+    def _call(self, method_name: str, params: dict[str, T.Any]) -> dict[str, T.Any]:
+        operation_name = _operation_name(method_name)
+        event_suffix = f"iam.{operation_name}"
+        context = {}
+        self.meta.events.emit(
+            f"before-call.{event_suffix}",
+            model=None,
+            params=params,
+            request_signer=None,
+            context=context,
+        )
+        rng = self._rng(method_name, params)
+        latency_func = self._pick(self.latency, method_name, None)
+        throttle_rate = self._pick(self.throttle_rate, method_name, 0.0)
+
+        with self._stats_lock:
+            self.n_calls[method_name] += 1
+            self.n_in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.n_in_flight)
+        try:
+            if latency_func is not None:
+                seconds = max(0.0, latency_func(rng))
+                with self._stats_lock:
+                    self.total_latency += seconds
+                self.sleep(seconds)
+            try:
+                if rng.random() < throttle_rate:
+                    with self._stats_lock:
+                        self.n_throttled[method_name] += 1
+                    raise _client_error(operation_name, "Throttling", "Rate exceeded")
+                with self._lock:
+                    result = getattr(self, f"_{method_name}")(**params)
+            except botocore.exceptions.ClientError as e:
+                self.meta.events.emit(
+                    f"after-call.{event_suffix}",
+                    http_response=_FakeHttpResponse(
+                        e.response["ResponseMetadata"]["HTTPStatusCode"]
+                    ),
+                    parsed=e.response,
+                    model=None,
+                    context=context,
+                )
+                raise
+        finally:
+            with self._stats_lock:
+                self.n_in_flight -= 1
+        result["ResponseMetadata"] = {"HTTPStatusCode": 200}
+        self.meta.events.emit(
+            f"after-call.{event_suffix}",
+            http_response=_FakeHttpResponse(200),
+            parsed=result,
+            model=None,
+            context=context,
+        )
+        return result
+
+    def get_paginator(self, operation_name: str) -> _FakePaginator:
+        if operation_name not in PAGINATED_OPERATIONS:
+            raise NotImplementedError(f"no fake paginator for {operation_name!r}")
+        return _FakePaginator(self, operation_name)
+
+    def can_paginate(self, operation_name: str) -> bool:
+        return operation_name in PAGINATED_OPERATIONS
+
+    def _new_id(self, prefix: str, length: int = 16) -> str:
+        self._n_ids += 1
+        digest = hashlib.sha256(f"{self.seed}:{prefix}:{self._n_ids}".encode())
+        return prefix + digest.hexdigest().upper()[:length]
+
+    def _page(
+        self,
+        key: str,
+        items: list[T.Any],
+        Marker: T.Optional[str] = None,
+        MaxItems: T.Optional[int] = None,
+    ) -> dict[str, T.Any]:
+        start = int(Marker or 0)
+        end = start + (MaxItems or self.page_size)
+        result = {key: items[start:end], "IsTruncated": end < len(items)}
+        if result["IsTruncated"]:
+            result["Marker"] = str(end)
+        return result
+
+    def _get_user_entity(self, operation_name: str, UserName: str) -> _User:
+        try:
+            return self._users[UserName]
+        except KeyError:
+            raise _no_such_entity(
+                operation_name, f"The user with name {UserName} cannot be found."
+            )
+
+    def _get_role_entity(self, operation_name: str, RoleName: str) -> _Role:
+        try:
+            return self._roles[RoleName]
+        except KeyError:
+            raise _no_such_entity(
+                operation_name, f"The role with name {RoleName} cannot be found."
+            )
+
+    def _get_policy_entity(self, operation_name: str, PolicyArn: str) -> _Policy:
+        try:
+            return self._policies[PolicyArn]
+        except KeyError:
+            raise _no_such_entity(
+                operation_name, f"Policy {PolicyArn} does not exist or is not attachable."
+            )
+
+    def add_aws_managed_policy(self, policy_name: str, policy_document: str) -> str:
+        """
+        Seed an AWS managed policy, ``arn:aws:iam::aws:policy/<name>``, IAM
+        has them, a fresh fake doesn't. Not counted as a call.
+        """
+        arn = f"arn:aws:iam::aws:policy/{policy_name}"
+        with self._lock:
+            self._policies[arn] = _Policy(
+                name=policy_name,
+                arn=arn,
+                policy_id=self._new_id("ANPA"),
+                path="/",
+                create_date=datetime.now(timezone.utc),
+                versions={"v1": policy_document},
+            )
+        return arn
+
+    # --------------------------------------------------------------------------
+    # users and access keys
+    # --------------------------------------------------------------------------
+    def _create_user(self, UserName: str, Path: str = "/", Tags=None):
+        if UserName in self._users:
+            raise _client_error(
+                "CreateUser",
+                "EntityAlreadyExists",
+                f"User with name {UserName} already exists.",
+                409,
+            )
+        if len(self._users) >= self.quota.users:
+            raise _client_error(
+                "CreateUser",
+                "LimitExceeded",
+                f"Cannot exceed quota for UsersPerAccount: {self.quota.users}",
+                409,
+            )
+        user = _User(
+            name=UserName,
+            arn=f"arn:aws:iam::{self.account_id}:user{Path}{UserName}",
+            user_id=self._new_id("AIDA"),
+            create_date=datetime.now(timezone.utc),
+            tags=[dict(tag) for tag in Tags or []],
+            path=Path,
+        )
+        self._users[UserName] = user
+        return {"User": user.to_dict()}
+
+    def _get_user(self, UserName: str):
+        return {"User": self._get_user_entity("GetUser", UserName).to_dict()}
+
+    def _delete_user(self, UserName: str):
+        user = self._get_user_entity("DeleteUser", UserName)
+        if user.access_keys or user.inline_policies or user.attached_policies:
+            raise _client_error(
+                "DeleteUser",
+                "DeleteConflict",
+                "Cannot delete entity, must delete policies and access keys first.",
+                409,
+            )
+        del self._users[UserName]
+        return {}
+
+    def _list_users(self, PathPrefix: str = "/", Marker=None, MaxItems=None):
+        users = [
+            user.to_dict()
+            for user in self._users.values()
+            if user.path.startswith(PathPrefix)
+        ]
+        # ListUsers doesn't return tags
+        for user in users:
+            user.pop("Tags", None)
+        return self._page("Users", users, Marker, MaxItems)
+
+    def _list_user_tags(self, UserName: str):
+        user = self._get_user_entity("ListUserTags", UserName)
+        return {"Tags": list(user.tags), "IsTruncated": False}
+
+    def _tag_user(self, UserName: str, Tags):
+        user = self._get_user_entity("TagUser", UserName)
+        tags = {tag["Key"]: tag["Value"] for tag in user.tags}
+        tags.update({tag["Key"]: tag["Value"] for tag in Tags})
+        user.tags = [{"Key": key, "Value": value} for key, value in tags.items()]
+        return {}
+
+    def _create_access_key(self, UserName: str):
+        user = self._get_user_entity("CreateAccessKey", UserName)
+        if len(user.access_keys) >= self.quota.access_keys_per_user:
+            raise _client_error(
+                "CreateAccessKey",
+                "LimitExceeded",
+                "Cannot exceed quota for AccessKeysPerUser: "
+                f"{self.quota.access_keys_per_user}",
+                409,
+            )
+        access_key = {
+            "UserName": UserName,
+            "AccessKeyId": self._new_id("AKIA"),
+            "Status": "Active",
+            "CreateDate": datetime.now(timezone.utc),
+        }
+        user.access_keys.append(access_key)
+        return {
+            "AccessKey": dict(
+                access_key, SecretAccessKey=self._new_id("", length=40).lower()
+            )
+        }
+
+    def _list_access_keys(self, UserName: str):
+        user = self._get_user_entity("ListAccessKeys", UserName)
+        return {
+            "AccessKeyMetadata": [dict(key) for key in user.access_keys],
+            "IsTruncated": False,
+        }
+
+    def _get_access_key_entity(
+        self,
+        operation_name: str,
+        AccessKeyId: str,
+        UserName: T.Optional[str] = None,
+    ) -> T.Tuple[_User, dict[str, T.Any]]:
+        users = (
+            [self._get_user_entity(operation_name, UserName)]
+            if UserName
+            else self._users.values()
+        )
+        for user in users:
+            for access_key in user.access_keys:
+                if access_key["AccessKeyId"] == AccessKeyId:
+                    return user, access_key
+        raise _no_such_entity(
+            operation_name, f"The Access Key with id {AccessKeyId} cannot be found."
+        )
+
+    def _update_access_key(self, AccessKeyId: str, Status: str, UserName=None):
+        _, access_key = self._get_access_key_entity(
+            "UpdateAccessKey", AccessKeyId, UserName
+        )
+        access_key["Status"] = Status
+        return {}
+
+    def _delete_access_key(self, AccessKeyId: str, UserName=None):
+        user, access_key = self._get_access_key_entity(
+            "DeleteAccessKey", AccessKeyId, UserName
+        )
+        user.access_keys.remove(access_key)
+        return {}
+
+    def _get_access_key_last_used(self, AccessKeyId: str):
+        user, _ = self._get_access_key_entity("GetAccessKeyLastUsed", AccessKeyId)
+        return {
+            "UserName": user.name,
+            "AccessKeyLastUsed": {"ServiceName": "N/A", "Region": "N/A"},
+        }
+
+    # --------------------------------------------------------------------------
+    # user policies
+    # --------------------------------------------------------------------------
+    def _put_user_policy(self, UserName: str, PolicyName: str, PolicyDocument: str):
+        user = self._get_user_entity("PutUserPolicy", UserName)
+        _parse_document("PutUserPolicy", PolicyDocument)
+        inline_policies = dict(user.inline_policies)
+        inline_policies[PolicyName] = PolicyDocument
+        size = sum(policy_size(doc) for doc in inline_policies.values())
+        if size > self.quota.inline_policy_size_per_user:
+            raise _client_error(
+                "PutUserPolicy",
+                "LimitExceeded",
+                "Maximum policy size of "
+                f"{self.quota.inline_policy_size_per_user} bytes exceeded for "
+                f"user {UserName}",
+                409,
+            )
+        user.inline_policies = inline_policies
+        return {}
+
+    def _get_user_policy(self, UserName: str, PolicyName: str):
+        user = self._get_user_entity("GetUserPolicy", UserName)
+        try:
+            document = user.inline_policies[PolicyName]
+        except KeyError:
+            raise _no_such_entity(
+                "GetUserPolicy",
+                f"The user policy with name {PolicyName} cannot be found.",
+            )
+        return {
+            "UserName": UserName,
+            "PolicyName": PolicyName,
+            "PolicyDocument": json.loads(document),
+        }
+
+    def _delete_user_policy(self, UserName: str, PolicyName: str):
+        user = self._get_user_entity("DeleteUserPolicy", UserName)
+        if user.inline_policies.pop(PolicyName, None) is None:
+            raise _no_such_entity(
+                "DeleteUserPolicy",
+                f"The user policy with name {PolicyName} cannot be found.",
+            )
+        return {}
+
+    def _list_user_policies(self, UserName: str):
+        user = self._get_user_entity("ListUserPolicies", UserName)
+        return {"PolicyNames": list(user.inline_policies), "IsTruncated": False}
+
+    def _attach_user_policy(self, UserName: str, PolicyArn: str):
+        user = self._get_user_entity("AttachUserPolicy", UserName)
+        policy = self._get_policy_entity("AttachUserPolicy", PolicyArn)
+        if PolicyArn in user.attached_policies:
+            return {}
+        if len(user.attached_policies) >= self.quota.attached_policies_per_user:
+            raise _client_error(
+                "AttachUserPolicy",
+                "LimitExceeded",
+                "Cannot exceed quota for PoliciesPerUser: "
+                f"{self.quota.attached_policies_per_user}",
+                409,
+            )
+        user.attached_policies.append(PolicyArn)
+        policy.attachment_count += 1
+        return {}
+
+    def _detach_user_policy(self, UserName: str, PolicyArn: str):
+        user = self._get_user_entity("DetachUserPolicy", UserName)
+        if PolicyArn not in user.attached_policies:
+            raise _no_such_entity(
+                "DetachUserPolicy", f"Policy {PolicyArn} was not found."
+            )
+        user.attached_policies.remove(PolicyArn)
+        self._policies[PolicyArn].attachment_count -= 1
+        return {}
+
+    def _attached_policies(self, arns: list[str]) -> list[dict[str, str]]:
+        return [
+            {"PolicyName": self._policies[arn].name, "PolicyArn": arn} for arn in arns
+        ]
+
+    def _list_attached_user_policies(self, UserName: str):
+        user = self._get_user_entity("ListAttachedUserPolicies", UserName)
+        return {
+            "AttachedPolicies": self._attached_policies(user.attached_policies),
+            "IsTruncated": False,
+        }
+
+    # --------------------------------------------------------------------------
+    # managed policies
+    # --------------------------------------------------------------------------
+    def _create_policy(
+        self,
+        PolicyName: str,
+        PolicyDocument: str,
+        Path: str = "/",
+        Description: str = "",
+        Tags=None,
+    ):
+        arn = f"arn:aws:iam::{self.account_id}:policy{Path}{PolicyName}"
+        if arn in self._policies:
+            raise _client_error(
+                "CreatePolicy",
+                "EntityAlreadyExists",
+                f"A policy called {PolicyName} already exists.",
+                409,
+            )
+        n_policies = sum(
+            1 for policy_arn in self._policies if ":aws:policy/" not in policy_arn
+        )
+        if n_policies >= self.quota.policies:
+            raise _client_error(
+                "CreatePolicy",
+                "LimitExceeded",
+                f"Cannot exceed quota for PoliciesPerAccount: {self.quota.policies}",
+                409,
+            )
+        _parse_document("CreatePolicy", PolicyDocument)
+        policy = _Policy(
+            name=PolicyName,
+            arn=arn,
+            policy_id=self._new_id("ANPA"),
+            path=Path,
+            create_date=datetime.now(timezone.utc),
+            versions={"v1": PolicyDocument},
+        )
+        self._policies[arn] = policy
+        return {"Policy": policy.to_dict()}
+
+    def _get_policy(self, PolicyArn: str):
+        return {"Policy": self._get_policy_entity("GetPolicy", PolicyArn).to_dict()}
+
+    def _delete_policy(self, PolicyArn: str):
+        policy = self._get_policy_entity("DeletePolicy", PolicyArn)
+        if policy.attachment_count or len(policy.versions) > 1:
+            raise _client_error(
+                "DeletePolicy",
+                "DeleteConflict",
+                "Cannot delete a policy attached to entities or with versions.",
+                409,
+            )
+        del self._policies[PolicyArn]
+        return {}
+
+    def _list_policies(
+        self,
+        Scope: str = "All",
+        PathPrefix: str = "/",
+        OnlyAttached: bool = False,
+        Marker=None,
+        MaxItems=None,
+    ):
+        policies = []
+        for policy in self._policies.values():
+            is_aws = ":aws:policy/" in policy.arn
+            if (Scope == "Local" and is_aws) or (Scope == "AWS" and not is_aws):
+                continue
+            if not policy.path.startswith(PathPrefix):
+                continue
+            if OnlyAttached and not policy.attachment_count:
+                continue
+            policies.append(policy.to_dict())
+        return self._page("Policies", policies, Marker, MaxItems)
+
+    def _create_policy_version(
+        self,
+        PolicyArn: str,
+        PolicyDocument: str,
+        SetAsDefault: bool = False,
+    ):
+        policy = self._get_policy_entity("CreatePolicyVersion", PolicyArn)
+        if len(policy.versions) >= self.quota.policy_versions:
+            raise _client_error(
+                "CreatePolicyVersion",
+                "LimitExceeded",
+                "A managed policy can have up to "
+                f"{self.quota.policy_versions} versions.",
+                409,
+            )
+        _parse_document("CreatePolicyVersion", PolicyDocument)
+        version_id = f"v{policy.next_version}"
+        policy.next_version += 1
+        policy.versions[version_id] = PolicyDocument
+        if SetAsDefault:
+            policy.default_version_id = version_id
+        return {
+            "PolicyVersion": {
+                "VersionId": version_id,
+                "IsDefaultVersion": SetAsDefault,
+                "CreateDate": datetime.now(timezone.utc),
+            }
+        }
+
+    def _get_policy_version(self, PolicyArn: str, VersionId: str):
+        policy = self._get_policy_entity("GetPolicyVersion", PolicyArn)
+        try:
+            document = policy.versions[VersionId]
+        except KeyError:
+            raise _no_such_entity(
+                "GetPolicyVersion", f"Policy version {VersionId} does not exist."
+            )
+        return {
+            "PolicyVersion": {
+                "Document": json.loads(document),
+                "VersionId": VersionId,
+                "IsDefaultVersion": VersionId == policy.default_version_id,
+            }
+        }
+
+    def _list_policy_versions(self, PolicyArn: str):
+        policy = self._get_policy_entity("ListPolicyVersions", PolicyArn)
+        # newest first, like IAM
+        return {
+            "Versions": [
+                {
+                    "VersionId": version_id,
+                    "IsDefaultVersion": version_id == policy.default_version_id,
+                }
+                for version_id in reversed(list(policy.versions))
+            ],
+            "IsTruncated": False,
+        }
+
+    def _delete_policy_version(self, PolicyArn: str, VersionId: str):
+        policy = self._get_policy_entity("DeletePolicyVersion", PolicyArn)
+        if VersionId == policy.default_version_id:
+            raise _client_error(
+                "DeletePolicyVersion",
+                "DeleteConflict",
+                "Cannot delete the default version of a policy.",
+                409,
+            )
+        if policy.versions.pop(VersionId, None) is None:
+            raise _no_such_entity(
+                "DeletePolicyVersion", f"Policy version {VersionId} does not exist."
+            )
+        return {}
+
+    # --------------------------------------------------------------------------
+    # roles and OIDC providers
+    # --------------------------------------------------------------------------
+    def _create_role(
+        self,
+        RoleName: str,
+        AssumeRolePolicyDocument: str,
+        Path: str = "/",
+        Description: str = "",
+        MaxSessionDuration: int = 3600,
+        Tags=None,
+    ):
+        if RoleName in self._roles:
+            raise _client_error(
+                "CreateRole",
+                "EntityAlreadyExists",
+                f"Role with name {RoleName} already exists.",
+                409,
+            )
+        if len(self._roles) >= self.quota.roles:
+            raise _client_error(
+                "CreateRole",
+                "LimitExceeded",
+                f"Cannot exceed quota for RolesPerAccount: {self.quota.roles}",
+                409,
+            )
+        _parse_document("CreateRole", AssumeRolePolicyDocument)
+        role = _Role(
+            name=RoleName,
+            arn=f"arn:aws:iam::{self.account_id}:role{Path}{RoleName}",
+            role_id=self._new_id("AROA"),
+            create_date=datetime.now(timezone.utc),
+            assume_role_policy=AssumeRolePolicyDocument,
+            tags=[dict(tag) for tag in Tags or []],
+            max_session_duration=MaxSessionDuration,
+        )
+        self._roles[RoleName] = role
+        return {"Role": role.to_dict()}
+
+    def _get_role(self, RoleName: str):
+        return {"Role": self._get_role_entity("GetRole", RoleName).to_dict()}
+
+    def _delete_role(self, RoleName: str):
+        role = self._get_role_entity("DeleteRole", RoleName)
+        if role.inline_policies or role.attached_policies:
+            raise _client_error(
+                "DeleteRole",
+                "DeleteConflict",
+                "Cannot delete entity, must delete policies first.",
+                409,
+            )
+        del self._roles[RoleName]
+        return {}
+
+    def _update_assume_role_policy(self, RoleName: str, PolicyDocument: str):
+        role = self._get_role_entity("UpdateAssumeRolePolicy", RoleName)
+        _parse_document("UpdateAssumeRolePolicy", PolicyDocument)
+        role.assume_role_policy = PolicyDocument
+        return {}
+
+    def _update_role(self, RoleName: str, Description=None, MaxSessionDuration=None):
+        role = self._get_role_entity("UpdateRole", RoleName)
+        if MaxSessionDuration is not None:
+            role.max_session_duration = MaxSessionDuration
+        return {}
+
+    def _tag_role(self, RoleName: str, Tags):
+        role = self._get_role_entity("TagRole", RoleName)
+        tags = {tag["Key"]: tag["Value"] for tag in role.tags}
+        tags.update({tag["Key"]: tag["Value"] for tag in Tags})
+        role.tags = [{"Key": key, "Value": value} for key, value in tags.items()]
+        return {}
+
+    def _put_role_policy(self, RoleName: str, PolicyName: str, PolicyDocument: str):
+        role = self._get_role_entity("PutRolePolicy", RoleName)
+        _parse_document("PutRolePolicy", PolicyDocument)
+        role.inline_policies[PolicyName] = PolicyDocument
+        return {}
+
+    def _delete_role_policy(self, RoleName: str, PolicyName: str):
+        role = self._get_role_entity("DeleteRolePolicy", RoleName)
+        if role.inline_policies.pop(PolicyName, None) is None:
+            raise _no_such_entity(
+                "DeleteRolePolicy",
+                f"The role policy with name {PolicyName} cannot be found.",
+            )
+        return {}
+
+    def _attach_role_policy(self, RoleName: str, PolicyArn: str):
+        role = self._get_role_entity("AttachRolePolicy", RoleName)
+        policy = self._get_policy_entity("AttachRolePolicy", PolicyArn)
+        if PolicyArn in role.attached_policies:
+            return {}
+        if len(role.attached_policies) >= self.quota.attached_policies_per_role:
+            raise _client_error(
+                "AttachRolePolicy",
+                "LimitExceeded",
+                "Cannot exceed quota for PoliciesPerRole: "
+                f"{self.quota.attached_policies_per_role}",
+                409,
+            )
+        role.attached_policies.append(PolicyArn)
+        policy.attachment_count += 1
+        return {}
+
+    def _detach_role_policy(self, RoleName: str, PolicyArn: str):
+        role = self._get_role_entity("DetachRolePolicy", RoleName)
+        if PolicyArn not in role.attached_policies:
+            raise _no_such_entity(
+                "DetachRolePolicy", f"Policy {PolicyArn} was not found."
+            )
+        role.attached_policies.remove(PolicyArn)
+        self._policies[PolicyArn].attachment_count -= 1
+        return {}
+
+    def _list_attached_role_policies(self, RoleName: str):
+        role = self._get_role_entity("ListAttachedRolePolicies", RoleName)
+        return {
+            "AttachedPolicies": self._attached_policies(role.attached_policies),
+            "IsTruncated": False,
+        }
+
+    def _create_open_id_connect_provider(
+        self,
+        Url: str,
+        ClientIDList=None,
+        ThumbprintList=None,
+        Tags=None,
+    ):
+        host = Url.split("://", 1)[-1]
+        arn = f"arn:aws:iam::{self.account_id}:oidc-provider/{host}"
+        if arn in self._oidc_providers:
+            raise _client_error(
+                "CreateOpenIDConnectProvider",
+                "EntityAlreadyExists",
+                f"Provider with url {Url} already exists.",
+                409,
+            )
+        self._oidc_providers[arn] = {
+            "Url": host,
+            "ClientIDList": list(ClientIDList or []),
+            "ThumbprintList": list(ThumbprintList or []),
+        }
+        return {"OpenIDConnectProviderArn": arn}
+
+    def _list_open_id_connect_providers(self):
+        return {"OpenIDConnectProviderList": [{"Arn": arn} for arn in self._oidc_providers]}
+
+    def _get_oidc_provider_entity(self, operation_name: str, arn: str):
+        try:
+            return self._oidc_providers[arn]
+        except KeyError:
+            raise _no_such_entity(operation_name, f"OpenIDConnect Provider {arn} not found.")
+
+    def _get_open_id_connect_provider(self, OpenIDConnectProviderArn: str):
+        provider = self._get_oidc_provider_entity(
+            "GetOpenIDConnectProvider", OpenIDConnectProviderArn
+        )
+        return {
+            "Url": provider["Url"],
+            "ClientIDList": list(provider["ClientIDList"]),
+            "ThumbprintList": list(provider["ThumbprintList"]),
+        }
+
+    def _add_client_id_to_open_id_connect_provider(
+        self,
+        OpenIDConnectProviderArn: str,
+        ClientID: str,
+    ):
+        provider = self._get_oidc_provider_entity(
+            "AddClientIDToOpenIDConnectProvider", OpenIDConnectProviderArn
+        )
+        if ClientID not in provider["ClientIDList"]:
+            provider["ClientIDList"].append(ClientID)
+        return {}
+
+    # --------------------------------------------------------------------------
+    # account
+    # --------------------------------------------------------------------------
+    def _get_account_summary(self):
+        summary_map = self.quota.to_summary_map()
+        summary_map.update(
+            {
+                "Users": len(self._users),
+                "Roles": len(self._roles),
+                "Policies": sum(
+                    1 for arn in self._policies if ":aws:policy/" not in arn
+                ),
+            }
+        )
+        return {"SummaryMap": summary_map}
+
+    def _get_account_authorization_details(
+        self,
+        Filter=None,
+        Marker=None,
+        MaxItems=None,
+    ):
+        filter_ = set(Filter or ["User"])
+        details = []
+        if "User" in filter_:
+            for user in self._users.values():
+                data = user.to_dict()
+                data["UserPolicyList"] = [
+                    {"PolicyName": name, "PolicyDocument": json.loads(document)}
+                    for name, document in user.inline_policies.items()
+                ]
+                data["AttachedManagedPolicies"] = self._attached_policies(
+                    user.attached_policies
+                )
+                data["Tags"] = list(user.tags)
+                details.append(data)
+        result = self._page("UserDetailList", details, Marker, MaxItems)
+        result.update({"GroupDetailList": [], "RoleDetailList": [], "Policies": []})
+        return result
+
+    def _simulate_principal_policy(
+        self,
+        PolicySourceArn: str,
+        ActionNames: list[str],
+        ResourceArns=None,
+    ):
+        user_name = PolicySourceArn.rsplit("/", 1)[-1]
+        user = self._get_user_entity("SimulatePrincipalPolicy", user_name)
+        documents = list(user.inline_policies.values()) + [
+            self._policies[arn].versions[self._policies[arn].default_version_id]
+            for arn in user.attached_policies
+        ]
+        patterns = []
+        for document in documents:
+            statements = json.loads(document).get("Statement", [])
+            if isinstance(statements, dict):
+                statements = [statements]
+            for statement in statements:
+                if statement.get("Effect") != "Allow":
+                    continue
+                actions = statement.get("Action", [])
+                if isinstance(actions, str):
+                    actions = [actions]
+                patterns.extend(action.lower() for action in actions)
+        return {
+            "EvaluationResults": [
+                {
+                    "EvalActionName": action,
+                    "EvalDecision": "allowed"
+                    if any(
+                        fnmatch.fnmatchcase(action.lower(), pattern)
+                        for pattern in patterns
+                    )
+                    else "implicitDeny",
+                }
+                for action in ActionNames
+            ],
+            "IsTruncated": False,
+        }
+
+
+def _make_operation(method_name: str):
+    def operation(self: FakeIamClient, **kwargs) -> dict[str, T.Any]:
+        return self._call(method_name, kwargs)
+
+    operation.__name__ = method_name
+    operation.__doc__ = f"Fake of IAM ``{_operation_name(method_name)}``."
+    return operation
+
+
+for _method_name in OPERATIONS:
+    setattr(FakeIamClient, _method_name, _make_operation(_method_name))
+
+
+class FakeBotoSession:
+    """
+    Stand-in for a ``boto3.Session`` whose IAM client is a
+    :class:`FakeIamClient`, pass it as ``boto_ses``. Other services aren't
+    faked.
+    """
+
+    def __init__(
+        self,
+        iam_client: T.Optional[FakeIamClient] = None,
+        region_name: str = "us-east-1",
+    ):
+        self.iam_client = iam_client or FakeIamClient()
+        self.region_name = region_name
+
+    def client(self, service_name: str, *args, **kwargs):
+        if service_name == "iam":
+            return self.iam_client
+        raise NotImplementedError(f"{service_name!r} is not faked, only 'iam' is")
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sample fleet config for unit tests.
+"""
+
+FLEET_CONFIG_TOML = """
+aws_region = "us-east-1"
+dir_access_key = ".access_keys"
+
+[tags]
+"tech:use_case" = "unit test"
+
+[secret_names]
+aws_default_region = "DEV_ACC_AWS_REGION"
+
+[policies.list_aliases.policy_document]
+Version = "2012-10-17"
+
+[[policies.list_aliases.policy_document.Statement]]
+Effect = "Allow"
+Action = ["iam:ListAccountAliases"]
+Resource = "*"
+
+[policies.read_s3.policy_document]
+Version = "2012-10-17"
+
+[[policies.read_s3.policy_document.Statement]]
+Effect = "Allow"
+Action = ["s3:GetObject", "s3:ListBucket"]
+Resource = "*"
+
+[[repos]]
+github_user_name = "alice"
+github_repo_name = "repo1"
+policy = "list_aliases"
+
+[[repos]]
+github_user_name = "alice"
+github_repo_name = "repo2"
+policy = "list_aliases"
+
+[[repos]]
+github_user_name = "bob"
+github_repo_name = "repo3"
+policy = "read_s3"
+iam_user_name = "bob-repo3-ci"
+"""
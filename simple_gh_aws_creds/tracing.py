@@ -0,0 +1,597 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tracing of repo runs, steps and API calls.
+
+Timing totals don't tell why one repo of a fleet run took 40 seconds. With a
+:class:`Tracer` set, see :func:`set_tracer`, every repo run records a timeline:
+
+- a root span per repo, ``apply owner/repo``,
+- a child span per step, ``s11_create_iam_user``, ``put_github_secrets``, ...,
+  see :func:`traced`,
+- a leaf span per IAM request, ``iam.CreateUser``, with the botocore retry
+  count as ``aws.retry_attempts`` and the time slept between attempts as
+  ``aws.retry_backoff_ms``, see :func:`attach_to_boto_client`, and per GitHub
+  request, ``github.PUT``, with ``github.retry_attempts`` and
+  ``github.retry_backoff_ms``, see
+  :class:`~simple_gh_aws_creds.github_client.GitHubClient`.
+
+The current span is kept in a :mod:`contextvars` variable, the worker pools of
+:mod:`simple_gh_aws_creds.concurrency` copy it into their threads, so spans of
+concurrent secret writes still have the step as parent. Fleet ``apply`` records
+the time a repo waited for a GitHub worker as ``github.queue_wait_ms``.
+
+Finished spans go to exporters:
+
+- :class:`ChromeTraceExporter` writes a Chrome trace event JSON file, open it in
+  ``chrome://tracing`` or https://ui.perfetto.dev, one row per worker thread.
+- :class:`OtlpHttpExporter` sends OTLP/JSON to an OpenTelemetry collector
+  from a background thread.
+
+Without a tracer, the default, spans cost one attribute lookup.
+"""
+
+import typing as T
+import os
+import json
+import time
+import queue
+import random
+import threading
+import functools
+import contextlib
+import contextvars
+import dataclasses
+from pathlib import Path
+
+import requests
+
+from ._version import __version__
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from botocore.client import BaseClient
+
+SPAN_KIND_INTERNAL = "internal"
+SPAN_KIND_CLIENT = "client"
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+_CONTEXT_KEY = "simple_gh_aws_creds.span"
+_RETRY_AT_KEY = "simple_gh_aws_creds.retry_at"
+_BACKOFF_KEY = "simple_gh_aws_creds.backoff_ns"
+
+_current_span: "contextvars.ContextVar[T.Optional[Span]]" = contextvars.ContextVar(
+    "simple_gh_aws_creds_current_span", default=None
+)
+
+#: ``parent`` of :meth:`Tracer.start_span`, the current span
+CURRENT = object()
+
+
+def _new_id(n_bits: int) -> str:
+    return f"{random.getrandbits(n_bits):0{n_bits // 4}x}"
+
+
+@dataclasses.dataclass
+class Span:
+    """
+    One timed operation. Times are Unix epoch nanoseconds.
+    """
+
+    name: str = dataclasses.field()
+    trace_id: str = dataclasses.field()
+    span_id: str = dataclasses.field()
+    parent_id: T.Optional[str] = dataclasses.field(default=None)
+    kind: str = dataclasses.field(default=SPAN_KIND_INTERNAL)
+    start_ns: int = dataclasses.field(default_factory=time.time_ns)
+    end_ns: T.Optional[int] = dataclasses.field(default=None)
+    attributes: dict[str, T.Any] = dataclasses.field(default_factory=dict)
+    status: str = dataclasses.field(default=STATUS_OK)
+    thread_id: int = dataclasses.field(default_factory=threading.get_ident)
+    thread_name: str = dataclasses.field(
+        default_factory=lambda: threading.current_thread().name
+    )
+    tracer: T.Optional["Tracer"] = dataclasses.field(default=None, repr=False)
+
+    @property
+    def duration_ns(self) -> int:
+        return (self.end_ns or time.time_ns()) - self.start_ns
+
+    def set_attribute(self, key: str, value: T.Any):
+        self.attributes[key] = value
+
+    def set_status(self, status: str, message: T.Optional[str] = None):
+        self.status = status
+        if message is not None:
+            self.attributes["error.message"] = message
+
+    def record_exception(self, e: BaseException):
+        self.attributes["error.type"] = type(e).__name__
+        self.set_status(STATUS_ERROR, str(e))
+
+    def end(self):
+        """
+        End the span and hand it to the exporters, only the first call counts.
+        """
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.tracer is not None:
+            self.tracer._export(self)
+
+
+class _NoopSpan:
+    """
+    Returned while tracing is off, accepts and drops everything.
+    """
+
+    def set_attribute(self, key: str, value: T.Any):
+        pass
+
+    def set_status(self, status: str, message: T.Optional[str] = None):
+        pass
+
+    def record_exception(self, e: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class SpanExporter:
+    """
+    Receives each finished span, :meth:`shutdown` is called once at the end
+    of the run.
+    """
+
+    def export(self, span: Span):  # pragma: no cover
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class Tracer:
+    """
+    Creates spans and hands finished ones to the ``exporters``. A tracer
+    without exporters is off, see :attr:`enabled`. Thread safe.
+    """
+
+    def __init__(self, exporters: T.Iterable[SpanExporter] = ()):
+        self.exporters = list(exporters)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def start_span(
+        self,
+        name: str,
+        attributes: T.Optional[dict[str, T.Any]] = None,
+        parent: T.Union[None, Span, object] = CURRENT,
+        kind: str = SPAN_KIND_INTERNAL,
+    ) -> T.Union[Span, _NoopSpan]:
+        """
+        Start a span without making it current, call its ``end()``.
+
+        :param parent: the parent span, the current span by default, ``None``
+            starts a new trace.
+        """
+        if not self.exporters:
+            return NOOP_SPAN
+        if parent is CURRENT:
+            parent = _current_span.get()
+        if isinstance(parent, Span):
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = _new_id(128), None
+        return Span(
+            name=name,
+            trace_id=trace_id,
+            span_id=_new_id(64),
+            parent_id=parent_id,
+            kind=kind,
+            attributes=dict(attributes or {}),
+            tracer=self,
+        )
+
+    @contextlib.contextmanager
+    def span(
+        self,
+        name: str,
+        attributes: T.Optional[dict[str, T.Any]] = None,
+        parent: T.Union[None, Span, object] = CURRENT,
+        kind: str = SPAN_KIND_INTERNAL,
+    ) -> T.Iterator[T.Union[Span, _NoopSpan]]:
+        """
+        Start a span, make it current in the ``with`` block, end it after.
+        An exception escaping the block is recorded on the span.
+        """
+        span = self.start_span(name, attributes=attributes, parent=parent, kind=kind)
+        if span is NOOP_SPAN:
+            yield span
+            return
+        with use_span(span):
+            try:
+                yield span
+            except BaseException as e:
+                span.record_exception(e)
+                raise
+            finally:
+                span.end()
+
+    def _export(self, span: Span):
+        for exporter in self.exporters:
+            exporter.export(span)
+
+    def shutdown(self):
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> Tracer:
+    """
+    Set the process wide tracer, return the previous one.
+    """
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+def current_span() -> T.Union[Span, _NoopSpan]:
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextlib.contextmanager
+def use_span(span: T.Union[Span, _NoopSpan]) -> T.Iterator[T.Union[Span, _NoopSpan]]:
+    """
+    Make a span current in the ``with`` block without ending it, to continue
+    a trace in another thread.
+    """
+    if not isinstance(span, Span):
+        yield span
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+def traced(func: T.Callable) -> T.Callable:
+    """
+    Run a method in a span named after it, for the ``s1x`` / ``s2x`` steps.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tracer = _tracer
+        if not tracer.exporters:
+            return func(*args, **kwargs)
+        with tracer.span(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def attach_to_boto_client(client: "BaseClient"):
+    """
+    Record a span per API call of a boto3 client, with the HTTP status, the
+    error code, the number of retries botocore made and the time it slept
+    between them. The process wide tracer at call time is used, a call made
+    while tracing is off costs one attribute lookup.
+    """
+    service_id = client.meta.service_model.service_id.hyphenize()
+
+    def before_call(event_name: str, context: T.Optional[dict] = None, **kwargs):
+        if context is None or not _tracer.exporters:
+            return
+        operation = event_name.rsplit(".", 1)[-1]
+        context[_CONTEXT_KEY] = _tracer.start_span(
+            f"{service_id}.{operation}",
+            attributes={
+                "rpc.system": "aws-api",
+                "rpc.service": service_id,
+                "rpc.method": operation,
+            },
+            kind=SPAN_KIND_CLIENT,
+        )
+
+    def needs_retry(request_dict: T.Optional[dict] = None, **kwargs):
+        # after each attempt, botocore sleeps before the next one if it retries
+        context = (request_dict or {}).get("context") or {}
+        if _CONTEXT_KEY in context:
+            context[_RETRY_AT_KEY] = time.monotonic_ns()
+
+    def request_created(request=None, **kwargs):
+        # before each attempt, the first one included
+        context = getattr(request, "context", None) or {}
+        retry_at = context.pop(_RETRY_AT_KEY, None)
+        if retry_at is not None:
+            context[_BACKOFF_KEY] = (
+                context.get(_BACKOFF_KEY, 0) + time.monotonic_ns() - retry_at
+            )
+
+    def set_backoff(span: Span, context: dict):
+        backoff_ns = context.pop(_BACKOFF_KEY, None)
+        if backoff_ns is not None:
+            span.set_attribute("aws.retry_backoff_ms", round(backoff_ns / 1e6, 3))
+
+    def after_call(http_response, parsed, context: T.Optional[dict] = None, **kwargs):
+        span = (context or {}).pop(_CONTEXT_KEY, None)
+        if span is None:
+            return
+        set_backoff(span, context)
+        metadata = parsed.get("ResponseMetadata", {})
+        span.set_attribute("http.status_code", http_response.status_code)
+        if "RetryAttempts" in metadata:
+            span.set_attribute("aws.retry_attempts", metadata["RetryAttempts"])
+        if "RequestId" in metadata:
+            span.set_attribute("aws.request_id", metadata["RequestId"])
+        error_code = parsed.get("Error", {}).get("Code")
+        if error_code is not None:
+            span.set_attribute("aws.error_code", error_code)
+            span.set_status(STATUS_ERROR, parsed["Error"].get("Message"))
+        span.end()
+
+    def after_call_error(exception, context: T.Optional[dict] = None, **kwargs):
+        # connection error or timeout, no reply at all
+        span = (context or {}).pop(_CONTEXT_KEY, None)
+        if span is None:
+            return
+        set_backoff(span, context)
+        span.record_exception(exception)
+        span.end()
+
+    events = client.meta.events
+    events.register(f"before-call.{service_id}", before_call)
+    events.register(f"needs-retry.{service_id}", needs_retry)
+    events.register(f"request-created.{service_id}", request_created)
+    events.register(f"after-call.{service_id}", after_call)
+    events.register(f"after-call-error.{service_id}", after_call_error)
+
+
+class InMemoryExporter(SpanExporter):
+    """
+    Keeps the finished spans in :attr:`spans`.
+    """
+
+    def __init__(self):
+        self.spans: list[Span] = list()
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+
+class ChromeTraceExporter(InMemoryExporter):
+    """
+    Write the spans as a Chrome trace event JSON file on :meth:`shutdown`,
+    one complete event (``"ph": "X"``) per span, one row per thread.
+    """
+
+    def __init__(self, path: T.Union[str, Path]):
+        super().__init__()
+        self.path = Path(path)
+
+    def to_trace_events(self) -> list[dict[str, T.Any]]:
+        pid = os.getpid()
+        events = list()
+        thread_names = dict()
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            thread_names[span.thread_id] = span.thread_name
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.kind,
+                    "ph": "X",
+                    "ts": span.start_ns / 1000,
+                    "dur": span.duration_ns / 1000,
+                    "pid": pid,
+                    "tid": span.thread_id,
+                    "args": dict(
+                        span.attributes,
+                        trace_id=span.trace_id,
+                        span_id=span.span_id,
+                        parent_id=span.parent_id,
+                        status=span.status,
+                    ),
+                }
+            )
+        for thread_id, thread_name in thread_names.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": thread_id,
+                    "args": {"name": thread_name},
+                }
+            )
+        return events
+
+    def shutdown(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(
+            json.dumps(
+                {"traceEvents": self.to_trace_events(), "displayTimeUnit": "ms"}
+            )
+        )
+
+
+def _otlp_value(value: T.Any) -> dict[str, T.Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: T.Mapping[str, T.Any]) -> list[dict[str, T.Any]]:
+    return [
+        {"key": key, "value": _otlp_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+_OTLP_SPAN_KIND = {SPAN_KIND_INTERNAL: 1, SPAN_KIND_CLIENT: 3}
+_OTLP_STATUS_CODE = {STATUS_OK: 1, STATUS_ERROR: 2}
+
+
+def to_otlp_span(span: Span) -> dict[str, T.Any]:
+    data = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": _OTLP_SPAN_KIND[span.kind],
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns or span.start_ns),
+        "attributes": _otlp_attributes(
+            dict(span.attributes, **{"thread.name": span.thread_name})
+        ),
+        "status": {"code": _OTLP_STATUS_CODE[span.status]},
+    }
+    if span.parent_id is not None:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+
+class OtlpHttpExporter(SpanExporter):
+    """
+    Send spans to an OpenTelemetry collector with OTLP/HTTP and JSON encoding,
+    in batches of ``batch_size``, the rest on :meth:`shutdown`. Batches are
+    posted by a background thread, the workers ending spans never wait for
+    the collector. Export errors, and batches dropped while ``max_queue_size``
+    batches are already waiting, are reported in :attr:`n_failed` and never
+    fail the run.
+
+    :param endpoint: traces endpoint of the collector.
+    :param headers: extra HTTP headers, for example an API key.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = "http://localhost:4318/v1/traces",
+        headers: T.Optional[dict[str, str]] = None,
+        service_name: str = "simple_gh_aws_creds",
+        batch_size: int = 512,
+        timeout: float = 10.0,
+        max_queue_size: int = 64,
+    ):
+        self.endpoint = endpoint
+        self.headers = dict(headers or {})
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.n_exported = 0
+        self.n_failed = 0
+        self._buffer: list[Span] = list()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[T.Optional[list[Span]]]" = queue.Queue(
+            maxsize=max_queue_size
+        )
+        self._thread: T.Optional[threading.Thread] = None
+
+    def to_payload(self, spans: T.Iterable[Span]) -> dict[str, T.Any]:
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes(
+                            {"service.name": self.service_name}
+                        )
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {
+                                "name": "simple_gh_aws_creds",
+                                "version": __version__,
+                            },
+                            "spans": [to_otlp_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def _start(self):
+        """
+        Start the sender thread, if not running. Call it with the lock held.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._worker, name="otlp-exporter", daemon=True
+            )
+            self._thread.start()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._buffer.append(span)
+            if len(self._buffer) < self.batch_size:
+                return
+            batch, self._buffer = self._buffer, list()
+            self._start()
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            # the collector is slower than the run, drop instead of blocking
+            with self._lock:
+                self.n_failed += len(batch)
+
+    def _worker(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            self._send(batch)
+
+    def _send(self, batch: list[Span]):
+        try:
+            res = self.session.post(
+                self.endpoint,
+                json=self.to_payload(batch),
+                headers=self.headers,
+                timeout=self.timeout,
+            )
+            res.raise_for_status()
+        except requests.RequestException:
+            with self._lock:
+                self.n_failed += len(batch)
+        else:
+            with self._lock:
+                self.n_exported += len(batch)
+
+    def shutdown(self):
+        """
+        Send the buffered spans, wait until every queued batch was posted and
+        stop the sender thread. Spans exported after it start a new one.
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, list()
+            thread, self._thread = self._thread, None
+        if thread is None:
+            if batch:
+                self._send(batch)
+            return
+        if batch:
+            self._queue.put(batch)
+        self._queue.put(None)
+        thread.join()
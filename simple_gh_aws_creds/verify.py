@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+Post setup credential verification aware of IAM eventual consistency.
+
+A fresh access key, or a freshly put policy, can take several seconds to become
+effective. Instead of a fixed ``sleep(10)``, :func:`wait_until_credential_usable`
+polls ``sts.get_caller_identity`` with the new key, and optionally simulates a
+sample of the policy actions, with exponential backoff until it succeeds. The
+result reports how long it took until the key was usable.
+"""
+
+import typing as T
+import time
+import random
+import dataclasses
+
+import boto3
+import botocore.exceptions
+
+from .concurrency import bounded_imap_unordered
+from .tracing import current_span
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from mypy_boto3_iam.client import IAMClient
+    from .impl import SetupGitHubRepo
+
+# error codes returned while a new key or policy is still propagating
+RETRYABLE_ERROR_CODES = {
+    "InvalidClientTokenId",
+    "SignatureDoesNotMatch",
+    "AccessDenied",
+    "AuthFailure",
+    "UnrecognizedClientException",
+}
+
+
+@dataclasses.dataclass
+class VerificationResult:
+    """
+    Outcome of verifying one access key.
+
+    :param elapsed: seconds until the key was usable (or until we gave up).
+    :param attempts: number of polling rounds.
+    :param identity_arn: the ARN returned by ``get_caller_identity``.
+    :param denied_actions: sampled actions that were still denied when we gave up.
+    """
+
+    ok: bool = dataclasses.field(default=False)
+    elapsed: float = dataclasses.field(default=0.0)
+    attempts: int = dataclasses.field(default=0)
+    identity_arn: T.Optional[str] = dataclasses.field(default=None)
+    denied_actions: T.List[str] = dataclasses.field(default_factory=list)
+    error: T.Optional[str] = dataclasses.field(default=None)
+    name: T.Optional[str] = dataclasses.field(default=None)
+
+
+def sample_policy_actions(
+    policy_document: dict[str, T.Any],
+    k: int = 3,
+) -> list[str]:
+    """
+    Pick up to ``k`` concrete (no wildcard) actions from the ``Allow``
+    statements of a policy document, in document order.
+    """
+    statements = policy_document.get("Statement", [])
+    if isinstance(statements, dict):
+        statements = [statements]
+    actions = list()
+    for statement in statements:
+        if statement.get("Effect") != "Allow":
+            continue
+        action = statement.get("Action", [])
+        if isinstance(action, str):
+            action = [action]
+        for name in action:
+            if "*" not in name and name not in actions:
+                actions.append(name)
+                if len(actions) >= k:
+                    return actions
+    return actions
+
+
+def wait_until_credential_usable(
+    access_key: str,
+    secret_key: str,
+    aws_region: str,
+    iam_client: T.Optional["IAMClient"] = None,
+    actions: T.Optional[T.List[str]] = None,
+    timeout: float = 60,
+    base_delay: float = 0.5,
+    max_delay: float = 8,
+    sleep: T.Callable[[float], None] = time.sleep,
+) -> VerificationResult:
+    """
+    Poll until the access key authenticates, and optionally until the given
+    actions are allowed for the key owner.
+
+    :param iam_client: an IAM client of the *admin* session, only required when
+        ``actions`` is given. It is used to call ``simulate_principal_policy``,
+        so the key under test doesn't need any IAM permission.
+    :param actions: actions to dry run, see :func:`sample_policy_actions`.
+    :param timeout: give up after this many seconds.
+    :param base_delay: first backoff delay, doubled after each attempt with jitter.
+    :param max_delay: cap of the backoff delay.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    result = VerificationResult()
+    sts_client = boto3.Session(
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name=aws_region,
+    ).client("sts")
+    delay = base_delay
+    backoff = 0.0
+    while True:
+        result.attempts += 1
+        try:
+            if result.identity_arn is None:
+                result.identity_arn = sts_client.get_caller_identity()["Arn"]
+            if actions:
+                res = iam_client.simulate_principal_policy(
+                    PolicySourceArn=result.identity_arn,
+                    ActionNames=actions,
+                )
+                result.denied_actions = [
+                    dct["EvalActionName"]
+                    for dct in res["EvaluationResults"]
+                    if dct["EvalDecision"] != "allowed"
+                ]
+            if not result.denied_actions:
+                result.ok = True
+                result.error = None
+                break
+            result.error = f"actions not allowed yet: {result.denied_actions}"
+        except botocore.exceptions.ClientError as e:
+            result.error = str(e)
+            if e.response["Error"]["Code"] not in RETRYABLE_ERROR_CODES:
+                break
+        wait_seconds = delay * random.uniform(0.5, 1.0)
+        if time.monotonic() + wait_seconds > deadline:
+            break
+        sleep(wait_seconds)
+        backoff += wait_seconds
+        delay = min(delay * 2, max_delay)
+    result.elapsed = time.monotonic() - start
+    span = current_span()
+    span.set_attribute("verify.attempts", result.attempts)
+    span.set_attribute("verify.backoff_seconds", round(backoff, 3))
+    return result
+
+
+def verify_many(
+    setups: T.Iterable["SetupGitHubRepo"],
+    max_workers: int = 8,
+    **kwargs,
+) -> T.Iterator[VerificationResult]:
+    """
+    Verify the access keys of many repos concurrently, yield results as they
+    complete. ``kwargs`` are passed to
+    :meth:`~simple_gh_aws_creds.impl.SetupGitHubRepo.s15_verify_access_key`.
+
+    Each result's ``name`` is the ``owner/repo`` full name.
+    """
+    setups = list(setups)
+    # create the IAM clients in the calling thread, boto3 sessions are not
+    # thread safe
+    for setup in setups:
+        _ = setup.iam_client
+    yield from bounded_imap_unordered(
+        lambda setup: setup.s15_verify_access_key(verbose=False, **kwargs),
+        setups,
+        max_workers=max_workers,
+    )
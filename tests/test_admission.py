@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from simple_gh_aws_creds.admission import (
+    MODE_REFUSE,
+    MODE_PARTITION,
+    AdmissionError,
+    AccountQuota,
+    AdmissionBudget,
+    UserUsage,
+    admit,
+)
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.factory import make_setup_github_repo
+
+
+class TestAdmission(BaseMockAwsTest):
+    def test_account_quota(self):
+        quota = AccountQuota.from_iam(self.bsm.iam_client)
+        assert quota.users_quota > 0
+        assert quota.access_keys_per_user_quota == 2
+
+    def test_admit(self, tmp_path):
+        setups = [
+            make_setup_github_repo(self.boto_ses, tmp_path, i) for i in range(7)
+        ]
+        new_user = ["create_iam_user", "create_access_key"]
+        plans = [
+            (setups[0], new_user, None),
+            (setups[1], [], UserUsage(access_keys=2, attached_policies=10)),
+            (setups[2], new_user, None),
+            (setups[3], new_user, None),
+            # 11 policies
+            (setups[4], [f"attach_policy:arn:{i}" for i in range(11)], None),
+            # already attached policies count too
+            (setups[5], ["attach_policy:arn:0"], UserUsage(attached_policies=10)),
+            # the user already holds 2 keys
+            (setups[6], ["create_access_key"], UserUsage(access_keys=2)),
+        ]
+        quota = AccountQuota(
+            users=8,
+            users_quota=10,
+            access_keys_per_user_quota=2,
+            attached_policies_per_user_quota=10,
+        )
+        decision = admit(plans, quota, mode=MODE_PARTITION)
+        assert decision.admitted == setups[:3]
+        assert [setup for setup, _ in decision.rejected] == setups[3:]
+        reasons = [reason for _, reason in decision.rejected]
+        assert "IAM user quota of 10 reached" in reasons[0]
+        assert reasons[1].startswith("11 attached policies")
+        assert reasons[2].startswith("11 attached policies")
+        assert reasons[3].startswith("3 access keys exceed")
+        assert decision.planned_user_creations == 2
+
+        with pytest.raises(AdmissionError, match="4 of 7 repos"):
+            admit(plans, quota, mode=MODE_REFUSE)
+        decision = admit(plans[:3], quota, mode=MODE_REFUSE)
+        assert len(decision.admitted) == 3
+        with pytest.raises(ValueError):
+            admit(plans, quota, mode="off")
+
+        # one repo at a time
+        budget = AdmissionBudget(quota)
+        assert budget.admit(setups[0], new_user) is None
+        assert budget.admit(setups[2], new_user) is None
+        assert budget.admit(setups[3], new_user) is not None
+        assert budget.users_available == 0
+        assert budget.first_rejection[0] == setups[3].iam_user_name
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.admission",
+        preview=False,
+    )
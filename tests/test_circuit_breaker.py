@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import responses
+from botocore.stub import Stubber
+
+from simple_gh_aws_creds.circuit_breaker import (
+    STATE_CLOSED,
+    STATE_OPEN,
+    STATE_HALF_OPEN,
+    CircuitOpenError,
+    CircuitBreaker,
+    attach_to_boto_client,
+)
+from simple_gh_aws_creds.github_client import GITHUB_API_URL, GitHubClient
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        name="test",
+        failure_rate=0.5,
+        window=4,
+        min_calls=4,
+        cooldown=10,
+        clock=clock,
+    )
+    for ok in [True, False, True]:
+        breaker.before_call()
+        breaker.record(ok)
+    assert breaker.state == STATE_CLOSED
+    breaker.record(False)
+    assert breaker.state == STATE_OPEN
+    with pytest.raises(CircuitOpenError, match="retry in 10.0"):
+        breaker.before_call()
+    assert breaker.n_rejected == 1
+
+    # one probe after the cooldown, a failed probe opens it again
+    clock.now = 10
+    assert breaker.state == STATE_HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(False)
+    assert breaker.state == STATE_OPEN
+    assert breaker.n_opened == 2
+
+    # a successful probe closes it
+    clock.now = 20
+    breaker.before_call()
+    breaker.record(True)
+    assert breaker.state == STATE_CLOSED
+    breaker.before_call()
+
+    with pytest.raises(ValueError):
+        CircuitBreaker(name="test", failure_rate=0)
+
+
+@responses.activate
+def test_github_client():
+    clock = FakeClock()
+    breaker = CircuitBreaker(name="github", min_calls=2, cooldown=5, clock=clock)
+    client = GitHubClient(token="t0ken", circuit_breaker=breaker)
+    url = f"{GITHUB_API_URL}/repos/alice/my-repo"
+    responses.get(url, status=502, json={})
+    for _ in range(2):
+        with pytest.raises(Exception):
+            client.get_repo("alice", "my-repo")
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        client.get_repo("alice", "my-repo")
+    assert len(responses.calls) == 2
+
+    # a 404 is the backend working
+    clock.now = 5
+    responses.replace(responses.GET, url, status=404, json={})
+    with pytest.raises(Exception):
+        client.get_repo("alice", "my-repo")
+    assert breaker.state == STATE_CLOSED
+
+
+class TestBotoClient(BaseMockAwsTest):
+    def test(self):
+        breaker = CircuitBreaker(name="iam", min_calls=2, cooldown=60)
+        iam_client = self.boto_ses.client("iam")
+        attach_to_boto_client(iam_client, breaker)
+        iam_client.list_users()
+        with pytest.raises(Exception):
+            iam_client.get_user(UserName="no-such-user")
+        assert breaker.state == STATE_CLOSED
+
+        with Stubber(iam_client) as stubber:
+            for _ in range(2):
+                stubber.add_client_error(
+                    "list_users",
+                    service_error_code="ServiceFailure",
+                    http_status_code=500,
+                )
+                with pytest.raises(Exception):
+                    iam_client.list_users()
+        assert breaker.is_open()
+        with pytest.raises(CircuitOpenError):
+            iam_client.list_users()
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.circuit_breaker",
+        preview=False,
+    )
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+
+import pytest
+
+from simple_gh_aws_creds.cli import build_parser, run
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.fake_github import FakeGitHub
+from simple_gh_aws_creds.tests.fleet_config import FLEET_CONFIG_TOML
+
+
+@pytest.fixture
+def github():
+    with FakeGitHub() as github:
+        yield github
+
+
+class TestCli(BaseMockAwsTest):
+    def test(self, tmp_path, github):
+        path = tmp_path.joinpath("fleet.toml")
+        path.write_text(FLEET_CONFIG_TOML)
+        kwargs = dict(boto_ses=self.boto_ses, github_token="t", check_github=False)
+        parser = build_parser()
+
+        args = parser.parse_args(
+            ["apply", "-c", str(path), "--parallel", "2", "--only", "alice/*"]
+        )
+        stdout = io.StringIO()
+        assert run(args, stdout, **kwargs) == 0
+        assert "2 repos, 2 ok, 0 failed" in stdout.getvalue()
+
+        args = parser.parse_args(["plan", "-c", str(path), "--output", "jsonl"])
+        stdout = io.StringIO()
+        assert run(args, stdout, **kwargs) == 0
+        results = {
+            dct["repo"]: dct
+            for dct in map(json.loads, stdout.getvalue().splitlines())
+        }
+        assert results["alice/repo1"]["actions"] == []
+        assert "create_iam_user" in results["bob/repo3"]["actions"]
+
+        args = parser.parse_args(["plan", "-c", str(path), "--destroy"])
+        stdout = io.StringIO()
+        assert run(args, stdout, **kwargs) == 0
+        assert "delete_iam_user" in stdout.getvalue()
+
+        args = parser.parse_args(["drift", "-c", str(path)])
+        stdout = io.StringIO()
+        assert run(args, stdout, **kwargs) == 1
+        assert "alice/repo1: no drift" in stdout.getvalue()
+        assert "bob/repo3: missing_iam_user" in stdout.getvalue()
+
+        with pytest.raises(SystemExit):
+            parser.parse_args(["apply"])
+
+    def test_shard_and_merge(self, tmp_path, github):
+        path = tmp_path.joinpath("fleet.toml")
+        path.write_text(FLEET_CONFIG_TOML)
+        kwargs = dict(boto_ses=self.boto_ses, github_token="t", check_github=False)
+        parser = build_parser()
+        # start from an empty account, the class shares one mocked account
+        args = parser.parse_args(["destroy", "-c", str(path)])
+        assert run(args, io.StringIO(), **kwargs) == 0
+
+        result_files = list()
+        for i in range(2):
+            args = parser.parse_args(
+                ["apply", "-c", str(path), "--shard", f"{i}/2", "--output", "jsonl"]
+            )
+            stdout = io.StringIO()
+            assert run(args, stdout, **kwargs) == 0
+            path_result = tmp_path.joinpath(f"results-{i}.jsonl")
+            path_result.write_text(stdout.getvalue())
+            result_files.append(str(path_result))
+        assert tmp_path.joinpath(".fleet_state.shard-1-of-2.json").exists()
+
+        args = parser.parse_args(
+            ["merge", *result_files, *map(str, tmp_path.glob(".fleet_state.shard-*"))]
+        )
+        assert run(args, io.StringIO()) == 2
+        args = parser.parse_args(
+            [
+                "merge",
+                *result_files,
+                *map(str, tmp_path.glob(".fleet_state.shard-*")),
+                "--state-out",
+                str(tmp_path.joinpath(".fleet_state.json")),
+            ]
+        )
+        stdout = io.StringIO()
+        assert run(args, stdout) == 0
+        assert "3 repos, 0 failed or drifted" in stdout.getvalue()
+
+        # the merged state file makes an unsharded incremental run a no-op
+        args = parser.parse_args(["apply", "-c", str(path), "--changed-only"])
+        stdout = io.StringIO()
+        assert run(args, stdout, **kwargs) == 0
+        assert "0 repos" in stdout.getvalue()
+
+        with pytest.raises(SystemExit):
+            parser.parse_args(["apply", "-c", str(path), "--shard", "2/2"])
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.cli",
+        preview=False,
+    )
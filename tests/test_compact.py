@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from simple_gh_aws_creds.compact import Interner
+
+
+def test_interner():
+    interner = Interner()
+    tags1 = interner.tags({"a": "1", "b": "2"})
+    tags2 = interner.tags({"b": "2", "a": "1"})
+    assert tags1 is tags2
+    assert tags1 == {"a": "1", "b": "2"}
+    with pytest.raises(TypeError):
+        tags1["a"] = "3"
+    assert interner.tags(None) is interner.tags({})
+
+    arns = interner.arn_list(["arn:1", "arn:2"])
+    assert interner.arn_list(("arn:1", "arn:2")) is arns
+    assert arns == ("arn:1", "arn:2")
+
+    doc1 = {"Version": "2012-10-17", "Statement": []}
+    doc2 = {"Statement": [], "Version": "2012-10-17"}
+    assert interner.policy_document(doc1) is doc1
+    assert interner.policy_document(doc2) is doc1
+
+    owner = "".join(["ali", "ce"])
+    assert interner.string(owner) is interner.string("alice")
+    assert interner.object("k", 1) == 1
+    assert interner.object("k", 2) == 1
+    assert interner.n_distinct == 5
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.compact",
+        preview=False,
+    )
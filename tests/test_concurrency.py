@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from simple_gh_aws_creds.concurrency import (
+    bounded_imap_unordered,
+    pipeline_imap_unordered,
+    RateLimiter,
+)
+
+
+def test_bounded_imap_unordered():
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def func(i):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        with lock:
+            state["running"] -= 1
+        return i * 2
+
+    results = list(bounded_imap_unordered(func, range(100), max_workers=4))
+    assert sorted(results) == [i * 2 for i in range(100)]
+    assert state["peak"] <= 4
+    assert list(bounded_imap_unordered(func, [], max_workers=4)) == []
+
+
+def test_pipeline_imap_unordered():
+    lock = threading.Lock()
+    first_threads = set()
+    second_threads = set()
+    release = threading.Event()
+
+    def first(i):
+        with lock:
+            first_threads.add(threading.current_thread().name)
+        return i + 1
+
+    def second(i):
+        with lock:
+            second_threads.add(threading.current_thread().name)
+        # a stuck second stage doesn't stop the first one from running
+        release.wait(timeout=5)
+        return i * 2
+
+    iterator = pipeline_imap_unordered(
+        first, second, range(20), max_workers_first=2, max_workers_second=2
+    )
+    threading.Timer(0.2, release.set).start()
+    results = list(iterator)
+    assert sorted(results) == [(i + 1) * 2 for i in range(20)]
+    assert len(second_threads) <= 2
+    assert first_threads.isdisjoint(second_threads)
+    assert list(pipeline_imap_unordered(first, second, [])) == []
+    with pytest.raises(ValueError):
+        list(pipeline_imap_unordered(first, second, [], max_workers_second=0))
+
+
+def test_rate_limiter():
+    state = {"now": 0.0, "slept": 0.0}
+
+    def sleep(seconds):
+        state["slept"] += seconds
+        state["now"] += seconds
+
+    limiter = RateLimiter(
+        calls_per_minute=60,
+        clock=lambda: state["now"],
+        sleep=sleep,
+    )
+    limiter.acquire()  # burst of 1
+    assert state["slept"] == 0
+    for _ in range(10):
+        limiter.acquire()
+    assert state["slept"] == 10
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.concurrency",
+        preview=False,
+    )
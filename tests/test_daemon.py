@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import json
+import http.client
+
+import pytest
+import requests
+
+from simple_gh_aws_creds.fleet import FleetConfig
+from simple_gh_aws_creds.daemon import (
+    MAX_BODY_SIZE,
+    STATUS_QUEUED,
+    STATUS_IGNORED,
+    STATUS_DUPLICATE,
+    ProvisionJob,
+    ProvisioningDaemon,
+    compute_signature,
+    verify_signature,
+)
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.fake_github import FakeGitHub
+from simple_gh_aws_creds.tests.fleet_config import FLEET_CONFIG_TOML
+
+RULES_TOML = """
+[[rules]]
+policy = "read_s3"
+topic = "aws-s3"
+
+[[rules]]
+policy = "list_aliases"
+pattern = "carol/ci-*"
+"""
+
+SECRET = "webhook-secret"
+
+
+@pytest.fixture
+def github():
+    with FakeGitHub() as github:
+        yield github
+
+
+def make_config(tmp_path) -> FleetConfig:
+    path = tmp_path.joinpath("fleet.toml")
+    path.write_text(FLEET_CONFIG_TOML + RULES_TOML)
+    return FleetConfig.from_file(path)
+
+
+def make_payload(
+    full_name: str,
+    topics=None,
+    action: str = "created",
+    changes=None,
+) -> dict:
+    payload = {
+        "action": action,
+        "repository": {"full_name": full_name, "topics": topics or []},
+    }
+    if changes is not None:
+        payload["changes"] = changes
+    return payload
+
+
+def test_verify_signature():
+    body = b'{"zen": "Keep it logically awesome."}'
+    signature = compute_signature(SECRET, body)
+    assert signature.startswith("sha256=")
+    assert verify_signature(SECRET, body, signature) is True
+    assert verify_signature(SECRET, body + b" ", signature) is False
+    assert verify_signature(SECRET, body, None) is False
+    assert verify_signature("", body, signature) is False
+
+
+def test_match_repo(tmp_path):
+    config = make_config(tmp_path)
+    assert config.match_repo("bob", "repo3").iam_user_name == "bob-repo3-ci"
+    assert config.match_repo("dave", "x", topics=["aws-s3"]).policy == "read_s3"
+    assert config.match_repo("carol", "ci-tool").policy == "list_aliases"
+    assert config.match_repo("carol", "web") is None
+    with pytest.raises(ValueError):
+        FleetConfig.from_dict(
+            {"aws_region": "us-east-1", "rules": [{"policy": "x", "topic": "y"}]}
+        )
+
+
+class TestProvisioningDaemon(BaseMockAwsTest):
+    def test(self, tmp_path, github):
+        daemon = ProvisioningDaemon(
+            config=make_config(tmp_path),
+            boto_ses=self.boto_ses,
+            github_token="t",
+            webhook_secret=SECRET,
+            port=0,
+            n_workers=2,
+        )
+
+        # handle_event deduplicates redeliveries of a repo still in the queue
+        payload = make_payload("dave/data", topics=["aws-s3"])
+        assert daemon.handle_event("repository", payload) == STATUS_QUEUED
+        assert daemon.handle_event("repository", payload) == STATUS_DUPLICATE
+        assert daemon.handle_event("ping", {}) == STATUS_IGNORED
+        job: ProvisionJob = daemon.queue.get_nowait()
+        daemon.queue.task_done()
+        assert daemon.provision(job).ok
+
+        # a topic added later can match a rule
+        payload = make_payload(
+            "erin/lake",
+            topics=["aws-s3"],
+            action="edited",
+            changes={"topics": {"from": []}},
+        )
+        assert daemon.handle_event("repository", payload) == STATUS_QUEUED
+        job = daemon.queue.get_nowait()
+        daemon.queue.task_done()
+        assert daemon.provision(job).ok
+        payload = make_payload(
+            "erin/lake", action="edited", changes={"description": {"from": ""}}
+        )
+        assert daemon.handle_event("repository", payload) == STATUS_IGNORED
+
+        # matching runs in the worker, nothing matches this one
+        assert daemon.handle_event("repository", make_payload("carol/x")) == (
+            STATUS_QUEUED
+        )
+        job = daemon.queue.get_nowait()
+        daemon.queue.task_done()
+        assert daemon.provision(job) is None
+
+        # a broken repos_file fails the job, not the worker
+        path = tmp_path.joinpath("repos.jsonl")
+        path.write_text("{}\n")
+        daemon.config.repos_file = path
+        assert daemon.handle_event("repository", make_payload("carol/y")) == (
+            STATUS_QUEUED
+        )
+        job = daemon.queue.get_nowait()
+        daemon.queue.task_done()
+        assert "repos.jsonl:1" in daemon.provision(job).error
+        daemon.config.repos_file = None
+
+        daemon.start()
+        host, port = daemon.server_address
+        url = f"http://{host}:{port}"
+
+        def post(event: str, payload: dict, secret: str = SECRET):
+            body = json.dumps(payload).encode("utf-8")
+            return requests.post(
+                f"{url}/webhook",
+                data=body,
+                headers={
+                    "X-GitHub-Event": event,
+                    "X-Hub-Signature-256": compute_signature(secret, body),
+                    "Content-Type": "application/json",
+                },
+            )
+
+        try:
+            res = post("repository", make_payload("carol/ci-tool"), secret="wrong")
+            assert res.status_code == 401
+            res = post("repository", make_payload("carol/web"))
+            assert res.status_code == 202
+            res = post("repository", make_payload("carol/ci-a", action="deleted"))
+            assert res.status_code == 200
+            assert res.text.strip() == STATUS_IGNORED
+
+            # too large, refused before the body is read
+            conn = http.client.HTTPConnection(host, port)
+            conn.putrequest("POST", "/webhook")
+            conn.putheader("Content-Length", str(MAX_BODY_SIZE + 1))
+            conn.endheaders()
+            assert conn.getresponse().status == 413
+            conn.close()
+            for name in ["carol/ci-a", "carol/ci-b", "alice/repo1"]:
+                res = post("repository", make_payload(name))
+                assert res.status_code == 202
+            daemon.queue.join()
+
+            metrics = requests.get(f"{url}/metrics").text
+            assert "simple_gh_aws_creds_webhooks_rejected_total 2" in metrics
+            assert 'simple_gh_aws_creds_jobs_done_total{result="ok"} 5' in metrics
+            assert 'simple_gh_aws_creds_jobs_done_total{result="failed"} 1' in metrics
+            assert "simple_gh_aws_creds_jobs_ignored_total 2" in metrics
+            assert "simple_gh_aws_creds_queue_depth 0" in metrics
+            assert "simple_gh_aws_creds_time_to_provision_seconds_count 6" in metrics
+            assert requests.get(f"{url}/healthz").text == "ok\n"
+            assert requests.get(f"{url}/nothing").status_code == 404
+        finally:
+            daemon.stop()
+
+        iam_client = self.bsm.iam_client
+        for user_name in [
+            "gh-ci-data",
+            "gh-ci-lake",
+            "gh-ci-ci-a",
+            "gh-ci-ci-b",
+            "gh-ci-repo1",
+        ]:
+            iam_client.get_user(UserName=user_name)
+        for full_name in [
+            "dave/data",
+            "erin/lake",
+            "carol/ci-a",
+            "carol/ci-b",
+            "alice/repo1",
+        ]:
+            assert "AWS_ACCESS_KEY_ID" in github.get_secret_names(full_name)
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.daemon",
+        preview=False,
+    )
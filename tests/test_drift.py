@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from simple_gh_aws_creds.drift import scan_drift
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.factory import make_setup_github_repo
+
+
+class TestDrift(BaseMockAwsTest):
+    def test(self, tmp_path):
+        iam_client = self.bsm.iam_client
+        setups = [
+            make_setup_github_repo(self.boto_ses, tmp_path, i) for i in range(1, 5)
+        ]
+        for setup in setups[:3]:
+            setup.s11_create_iam_user()
+            setup.s12_put_iam_policy()
+
+        # hand edit the inline policy of repo2
+        policy_document = dict(setups[1].policy_document)
+        policy_document["Statement"] = [
+            {"Effect": "Allow", "Action": "*", "Resource": "*"}
+        ]
+        iam_client.put_user_policy(
+            UserName=setups[1].iam_user_name,
+            PolicyName=setups[1].policy_document_name,
+            PolicyDocument=json.dumps(policy_document),
+        )
+        # attach an extra managed policy and change a tag of repo3
+        res = iam_client.create_policy(
+            PolicyName="Extra",
+            PolicyDocument=json.dumps(policy_document),
+        )
+        extra_arn = res["Policy"]["Arn"]
+        iam_client.attach_user_policy(
+            UserName=setups[2].iam_user_name,
+            PolicyArn=extra_arn,
+        )
+        iam_client.tag_user(
+            UserName=setups[2].iam_user_name,
+            Tags=[{"Key": "github_repo_name", "Value": "renamed"}],
+        )
+
+        drifts = {
+            drift.repo: drift
+            for drift in scan_drift(
+                setups,
+                iam_client=iam_client,
+                max_workers=2,
+                check_github=False,
+            )
+        }
+        assert drifts["alice/repo1"].drifted is False
+        assert drifts["alice/repo2"].issues == ["inline_policy_changed"]
+        assert drifts["alice/repo3"].issues == [
+            f"extra_attached_policy:{extra_arn}",
+            "tag_changed:github_repo_name",
+        ]
+        assert drifts["alice/repo4"].issues == ["missing_iam_user"]
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.drift",
+        preview=False,
+    )
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+import botocore.exceptions
+
+from simple_gh_aws_creds.fleet import FleetConfig, RepoSpec, run_fleet, scan_fleet_drift
+from simple_gh_aws_creds.admission import AccountQuota, AdmissionError
+from simple_gh_aws_creds.circuit_breaker import CircuitBreaker, attach_to_boto_client
+from simple_gh_aws_creds.tests.fleet_config import FLEET_CONFIG_TOML
+from simple_gh_aws_creds.tests.fake_github import FakeGitHub
+from simple_gh_aws_creds.tests.fake_iam import (
+    FakeIamQuota,
+    FakeIamClient,
+    FakeBotoSession,
+    constant_latency,
+    uniform_latency,
+    lognormal_latency,
+)
+
+POLICY_DOCUMENT = json.dumps(
+    {
+        "Version": "2012-10-17",
+        "Statement": [{"Effect": "Allow", "Action": "s3:Get*", "Resource": "*"}],
+    }
+)
+
+
+@pytest.fixture
+def github():
+    with FakeGitHub() as github:
+        yield github
+
+
+def make_config(tmp_path, n_repos: int = 0) -> FleetConfig:
+    path = tmp_path.joinpath("fleet.toml")
+    path.write_text(FLEET_CONFIG_TOML)
+    config = FleetConfig.from_file(path)
+    for ith in range(n_repos):
+        config.repos.append(
+            RepoSpec(
+                github_user_name="load",
+                github_repo_name=f"load{ith}",
+                policy="read_s3",
+            )
+        )
+    return config
+
+
+def error_code(e: botocore.exceptions.ClientError) -> str:
+    return e.response["Error"]["Code"]
+
+
+def test_operations():
+    client = FakeIamClient()
+    client.create_user(UserName="u1", Tags=[{"Key": "k", "Value": "v"}])
+    with pytest.raises(botocore.exceptions.ClientError) as e:
+        client.create_user(UserName="u1")
+    assert error_code(e.value) == "EntityAlreadyExists"
+    with pytest.raises(botocore.exceptions.ClientError) as e:
+        client.get_user(UserName="u2")
+    assert error_code(e.value) == "NoSuchEntity"
+
+    client.put_user_policy(UserName="u1", PolicyName="p", PolicyDocument=POLICY_DOCUMENT)
+    res = client.get_user_policy(UserName="u1", PolicyName="p")
+    assert res["PolicyDocument"] == json.loads(POLICY_DOCUMENT)
+    arn = client.create_policy(PolicyName="m", PolicyDocument=POLICY_DOCUMENT)[
+        "Policy"
+    ]["Arn"]
+    client.attach_user_policy(UserName="u1", PolicyArn=arn)
+    assert client.get_policy(PolicyArn=arn)["Policy"]["AttachmentCount"] == 1
+    key_id = client.create_access_key(UserName="u1")["AccessKey"]["AccessKeyId"]
+
+    res = client.simulate_principal_policy(
+        PolicySourceArn=client.get_user(UserName="u1")["User"]["Arn"],
+        ActionNames=["s3:GetObject", "s3:PutObject"],
+    )
+    assert [r["EvalDecision"] for r in res["EvaluationResults"]] == [
+        "allowed",
+        "implicitDeny",
+    ]
+
+    with pytest.raises(botocore.exceptions.ClientError) as e:
+        client.delete_user(UserName="u1")
+    assert error_code(e.value) == "DeleteConflict"
+    client.delete_access_key(UserName="u1", AccessKeyId=key_id)
+    client.detach_user_policy(UserName="u1", PolicyArn=arn)
+    client.delete_user_policy(UserName="u1", PolicyName="p")
+    client.delete_user(UserName="u1")
+    assert client.n_calls["create_user"] == 2
+
+
+def test_quota():
+    client = FakeIamClient(
+        quota=FakeIamQuota(users=2, access_keys_per_user=1, policy_versions=2)
+    )
+    client.create_user(UserName="u1")
+    client.create_user(UserName="u2")
+    with pytest.raises(botocore.exceptions.ClientError) as e:
+        client.create_user(UserName="u3")
+    assert error_code(e.value) == "LimitExceeded"
+
+    client.create_access_key(UserName="u1")
+    with pytest.raises(botocore.exceptions.ClientError) as e:
+        client.create_access_key(UserName="u1")
+    assert error_code(e.value) == "LimitExceeded"
+
+    arn = client.create_policy(PolicyName="m", PolicyDocument=POLICY_DOCUMENT)[
+        "Policy"
+    ]["Arn"]
+    client.create_policy_version(PolicyArn=arn, PolicyDocument=POLICY_DOCUMENT)
+    with pytest.raises(botocore.exceptions.ClientError) as e:
+        client.create_policy_version(PolicyArn=arn, PolicyDocument=POLICY_DOCUMENT)
+    assert error_code(e.value) == "LimitExceeded"
+
+    quota = AccountQuota.from_iam(client)
+    assert quota.users_quota == 2
+    assert quota.access_keys_per_user_quota == 1
+
+    with pytest.raises(botocore.exceptions.ClientError) as e:
+        client.put_user_policy(UserName="u1", PolicyName="p", PolicyDocument="{")
+    assert error_code(e.value) == "MalformedPolicyDocument"
+
+
+def test_pagination():
+    client = FakeIamClient(page_size=3)
+    for ith in range(7):
+        client.create_user(UserName=f"u{ith}")
+    pages = list(client.get_paginator("list_users").paginate())
+    assert [len(page["Users"]) for page in pages] == [3, 3, 1]
+    assert client.n_calls["list_users"] == 3
+
+
+def test_latency_and_throttling():
+    slept = list()
+    kwargs = dict(
+        latency={
+            "*": constant_latency(0.01),
+            "create_user": lognormal_latency(median=0.2, sigma=0.5),
+            "get_user": uniform_latency(0.1, 0.3),
+        },
+        throttle_rate={"create_user": 0.3},
+        seed=7,
+    )
+
+    def run(sleep) -> list[str]:
+        client = FakeIamClient(sleep=sleep, **kwargs)
+        outcomes = list()
+        for ith in range(50):
+            try:
+                client.create_user(UserName=f"u{ith}")
+                outcomes.append("ok")
+            except botocore.exceptions.ClientError as e:
+                outcomes.append(error_code(e))
+        client.list_users()
+        return outcomes
+
+    outcomes = run(slept.append)
+    assert 5 <= outcomes.count("Throttling") <= 25
+    assert slept[-1] == 0.01
+    # same seed, same latencies and same throttled calls
+    slept_again = list()
+    assert run(slept_again.append) == outcomes
+    assert slept_again == slept
+
+
+def test_circuit_breaker():
+    client = FakeIamClient(throttle_rate=1.0)
+    breaker = CircuitBreaker(name="iam", min_calls=3, cooldown=60)
+    attach_to_boto_client(client, breaker)
+    for ith in range(3):
+        with pytest.raises(botocore.exceptions.ClientError):
+            client.get_user(UserName=f"u{ith}")
+    assert breaker.is_open()
+    assert client.n_throttled["get_user"] == 3
+
+
+def test_run_fleet(tmp_path, github):
+    config = make_config(tmp_path, n_repos=200)
+    iam_client = FakeIamClient(latency=constant_latency(0.001))
+    kwargs = dict(
+        boto_ses=FakeBotoSession(iam_client),
+        github_token="t",
+        check_github=False,
+    )
+    results = list(run_fleet("apply", config, parallel=16, **kwargs))
+    assert len(results) == 203
+    assert all(result.ok for result in results), [r for r in results if not r.ok]
+    assert iam_client.n_calls["create_user"] == 203
+    assert iam_client.max_in_flight > 1
+
+    drifts = list(scan_fleet_drift(config, parallel=16, **kwargs))
+    assert len(drifts) == 203
+    assert not any(drift.drifted or drift.error for drift in drifts), drifts
+
+    results = list(run_fleet("destroy", config, parallel=16, **kwargs))
+    assert all(result.ok for result in results)
+    assert iam_client.get_account_summary()["SummaryMap"]["Users"] == 0
+
+
+def test_run_fleet_quota(tmp_path, github):
+    config = make_config(tmp_path, n_repos=10)
+    iam_client = FakeIamClient(quota=FakeIamQuota(users=5))
+    kwargs = dict(
+        boto_ses=FakeBotoSession(iam_client),
+        github_token="t",
+        check_github=False,
+    )
+    results = list(run_fleet("apply", config, **kwargs))
+    assert sum(result.ok for result in results) == 5
+    assert all("LimitExceeded" in result.error for result in results if not result.ok)
+    # only the repos with an IAM user got secrets
+    assert all(
+        bool(github.get_secret_names(result.repo)) is result.ok for result in results
+    )
+
+
+def test_run_fleet_admission(tmp_path, github):
+    config = make_config(tmp_path, n_repos=10)
+    iam_client = FakeIamClient(quota=FakeIamQuota(users=5))
+    kwargs = dict(
+        boto_ses=FakeBotoSession(iam_client),
+        github_token="t",
+        check_github=False,
+    )
+    # nothing is created when the whole run doesn't fit
+    with pytest.raises(AdmissionError):
+        list(run_fleet("apply", config, admission="refuse", **kwargs))
+    assert iam_client.n_calls["create_user"] == 0
+    assert iam_client.n_calls["get_user"] == 13
+    assert github.calls == []
+
+    results = list(run_fleet("apply", config, admission="partition", **kwargs))
+    assert len(results) == 13
+    rejected = [result for result in results if not result.ok]
+    assert len(rejected) == 8
+    assert all("rejected by admission control" in r.error for r in rejected)
+    assert all(github.get_secret_names(r.repo) == [] for r in rejected)
+    assert iam_client.n_calls["create_user"] == 5
+    # each repo is planned once, the IAM part reuses the admission plan
+    assert iam_client.n_calls["get_user"] == 26
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.tests.fake_iam",
+        preview=False,
+    )
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+import json
+import tracemalloc
+
+import pytest
+
+from simple_gh_aws_creds.impl import (
+    REGION_AS_VARIABLE,
+    REGION_AS_ORG_VARIABLE,
+    SetupGitHubRepo,
+)
+from simple_gh_aws_creds.fleet import (
+    FleetConfig,
+    load_config_data,
+    run_fleet,
+    scan_fleet_drift,
+    sync_org_region_variables,
+)
+from simple_gh_aws_creds.github_client import GitHubClient
+from simple_gh_aws_creds.policy import PolicyValidationError
+from simple_gh_aws_creds.policy_arn import InvalidPolicyArnError
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.fake_github import FakeGitHub
+from simple_gh_aws_creds.tests.fleet_config import FLEET_CONFIG_TOML
+
+
+@pytest.fixture
+def github():
+    with FakeGitHub() as github:
+        yield github
+
+
+def make_config(tmp_path) -> FleetConfig:
+    path = tmp_path.joinpath("fleet.toml")
+    path.write_text(FLEET_CONFIG_TOML)
+    return FleetConfig.from_file(path)
+
+
+def test_fleet_config(tmp_path):
+    config = make_config(tmp_path)
+    assert len(config.repos) == 3
+    assert config.dir_access_key == tmp_path.joinpath(".access_keys")
+    assert [repo.full_name for repo in config.select(["alice/*"])] == [
+        "alice/repo1",
+        "alice/repo2",
+    ]
+    assert [repo.full_name for repo in config.select(["read_s3"])] == ["bob/repo3"]
+    assert config.get_iam_user_name(config.repos[0]) == "gh-ci-repo1"
+    assert config.get_iam_user_name(config.repos[2]) == "bob-repo3-ci"
+
+    setup = config.to_setup(config.repos[0], boto_ses=None, github_token="t")
+    assert setup.github_secret_name_aws_default_region == "DEV_ACC_AWS_REGION"
+    assert setup.github_secret_name_aws_access_key_id == "AWS_ACCESS_KEY_ID"
+    assert setup.user_tags["github_repo_name"] == "repo1"
+    assert setup.tags == {"tech:use_case": "unit test"}
+    assert setup.github_environments == []
+    assert setup.github_secret_stores == ["actions"]
+    config.github_environments = ["dev"]
+    config.repos[0].environments = ("dev", "prod")
+    assert config.to_setup(config.repos[0], None, "t").github_environments == ["dev", "prod"]
+    assert config.to_setup(config.repos[1], None, "t").github_environments == ["dev"]
+
+    config.preflight()
+    config.policies["read_s3"].policy_document["Version"] = "2020-01-01"
+    with pytest.raises(PolicyValidationError, match="read_s3"):
+        config.preflight()
+    with pytest.raises(PolicyValidationError):
+        list(run_fleet("apply", config, boto_ses=None, github_token="t"))
+
+    with pytest.raises(ValueError):
+        FleetConfig.from_dict(
+            {
+                "aws_region": "us-east-1",
+                "repos": [
+                    {"github_user_name": "a", "github_repo_name": "b", "policy": "x"}
+                ],
+            }
+        )
+    with pytest.raises(ValueError, match="github_secret_stores"):
+        FleetConfig.from_dict({"aws_region": "us-east-1", "github_secret_stores": []})
+
+
+def test_repos_file(tmp_path):
+    n_repos = 20_000
+    path = tmp_path.joinpath("repos.jsonl")
+    with path.open("w") as f:
+        f.write("# generated\n")
+        for i in range(n_repos):
+            dct = {
+                "github_user_name": f"org{i % 10}",
+                "github_repo_name": f"repo{i}",
+                "policy": "list_aliases" if i % 2 else "read_s3",
+                "tags": {"team": f"team{i % 3}"},
+            }
+            if i % 5 == 0:
+                dct["secret_names"] = {"aws_default_region": "AWS_REGION"}
+            f.write(json.dumps(dct) + "\n")
+    config_path = tmp_path.joinpath("fleet.toml")
+    # top level keys must come before the first table
+    config_path.write_text('repos_file = "repos.jsonl"\n' + FLEET_CONFIG_TOML)
+    config = FleetConfig.from_file(config_path)
+
+    repos = config.select(["org1/*"])
+    assert len(repos) == n_repos // 10
+    assert repos[0].tags is repos[3].tags
+    assert repos[0].tags == {"team": "team1"}
+    assert repos[0].github_user_name is repos[1].github_user_name
+    assert not hasattr(repos[0], "__dict__")
+    assert config.match_repo("org3", "repo13").policy == "list_aliases"
+
+    # streaming: the specs aren't kept, only the duplicate index of the
+    # selected repos grows
+    tracemalloc.start()
+    n = sum(1 for _ in config.iter_select(["org1/*"]))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert n == n_repos // 10
+    assert peak < 1_000_000
+    tracemalloc.start()
+    n = sum(1 for _ in config.iter_select())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert n == n_repos + 3
+    assert peak < 400 * n_repos
+
+    path.write_text('{"github_user_name": "a", "github_repo_name": "b", "policy": "x"}\n')
+    with pytest.raises(ValueError, match="repos.jsonl:1"):
+        config.select()
+
+
+def test_duplicate_repos(tmp_path):
+    path = tmp_path.joinpath("repos.jsonl")
+    config_path = tmp_path.joinpath("fleet.toml")
+    config_path.write_text('repos_file = "repos.jsonl"\n' + FLEET_CONFIG_TOML)
+    repo1 = {
+        "github_user_name": "alice",
+        "github_repo_name": "repo1",
+        "policy": "list_aliases",
+    }
+    repo4 = {
+        "github_user_name": "carol",
+        "github_repo_name": "repo4",
+        "policy": "read_s3",
+        "tags": {"a": "1", "b": "2"},
+    }
+    # the same repo inline and in the file, and twice in the file, kept once
+    lines = [repo1, repo4, {**repo4, "tags": {"b": "2", "a": "1"}}]
+    path.write_text("".join(json.dumps(dct) + "\n" for dct in lines))
+    config = FleetConfig.from_file(config_path)
+    assert [repo.full_name for repo in config.select()] == [
+        "alice/repo1",
+        "alice/repo2",
+        "bob/repo3",
+        "carol/repo4",
+    ]
+
+    # only the selected repos are remembered
+    assert [repo.full_name for repo in config.select(only=["carol/*"])] == [
+        "carol/repo4",
+    ]
+
+    # the same repo with different settings, found while streaming
+    path.write_text(json.dumps({**repo1, "policy": "read_s3"}) + "\n")
+    config = FleetConfig.from_file(config_path)
+    with pytest.raises(ValueError, match="'alice/repo1' is listed twice"):
+        config.select()
+
+    data = load_config_data(config_path)
+    data.pop("repos_file")
+    data["repos"].append(dict(data["repos"][0]))
+    assert len(FleetConfig.from_dict(data).repos) == 3
+    data["repos"][-1]["iam_user_name"] = "other"
+    with pytest.raises(ValueError, match="listed twice"):
+        FleetConfig.from_dict(data)
+
+
+def test_region_mode(tmp_path):
+    config = make_config(tmp_path)
+    setup = config.to_setup(config.repos[0], boto_ses=None, github_token="t")
+    assert "DEV_ACC_AWS_REGION" in setup.github_secret_name_list
+    assert setup.github_variable_name_list == []
+
+    config.github_region_mode = REGION_AS_VARIABLE
+    setup = config.to_setup(config.repos[0], boto_ses=None, github_token="t")
+    assert "DEV_ACC_AWS_REGION" not in setup.github_secret_name_list
+    assert setup.github_variable_name_list == ["DEV_ACC_AWS_REGION"]
+
+    config.github_region_mode = REGION_AS_ORG_VARIABLE
+    config.repos[1].aws_region = "us-west-2"
+    setup = config.to_setup(config.repos[0], boto_ses=None, github_token="t")
+    assert setup.github_variable_name_list == []
+    assert "DEV_ACC_AWS_REGION" not in setup.github_secret_name_list
+    # a repo overriding the fleet region gets a repository variable
+    setup = config.to_setup(config.repos[1], boto_ses=None, github_token="t")
+    assert setup.github_variable_name_list == ["DEV_ACC_AWS_REGION"]
+
+    # one org variable per owner, covering the repos in the fleet region, the
+    # repository ids are resolved in one GraphQL request
+    with FakeGitHub() as github:
+        ids = {name: github.add_repo(name) for name in ["alice/repo1", "bob/repo3"]}
+        written = sync_org_region_variables(
+            config, GitHubClient(token="t"), config.iter_select()
+        )
+        assert written == {"alice": True, "bob": True}
+        assert [call for call in github.calls if call[0] != "GET"] == [
+            ("POST", "/graphql"),
+            ("POST", "/orgs/alice/actions/variables"),
+            ("POST", "/orgs/bob/actions/variables"),
+        ]
+    for owner, full_name in [("alice", "alice/repo1"), ("bob", "bob/repo3")]:
+        variable = github.org_variables[(owner, "DEV_ACC_AWS_REGION")]
+        assert variable.value == "us-east-1"
+        assert variable.repo_ids == {ids[full_name]}
+
+    with FakeGitHub(repos=["alice/repo1"]):
+        with pytest.raises(ValueError, match="'bob/repo3'"):
+            sync_org_region_variables(
+                config, GitHubClient(token="t"), config.iter_select()
+            )
+
+    with pytest.raises(ValueError, match="github_region_mode"):
+        FleetConfig.from_dict({"aws_region": "us-east-1", "github_region_mode": "env"})
+
+
+class TestRunFleet(BaseMockAwsTest):
+    def test(self, tmp_path, github):
+        config = make_config(tmp_path)
+        kwargs = dict(boto_ses=self.boto_ses, github_token="t", check_github=False)
+
+        results = list(run_fleet("plan", config, parallel=2, **kwargs))
+        assert len(results) == 3
+        assert all(result.ok for result in results)
+        assert all("create_iam_user" in result.actions for result in results)
+
+        results = list(
+            run_fleet("apply", config, only=["alice/*"], admission="partition", **kwargs)
+        )
+        assert len(results) == 2
+        assert all(result.ok for result in results), results
+        assert github.get_secret_names("alice/repo1") == [
+            "AWS_ACCESS_KEY_ID",
+            "AWS_SECRET_ACCESS_KEY",
+            "DEV_ACC_AWS_REGION",
+        ]
+        assert github.get_secret_names("bob/repo3") == []
+
+        results = {
+            result.repo: result
+            for result in run_fleet("plan", config, parallel=2, **kwargs)
+        }
+        assert results["alice/repo1"].actions == []
+        assert "create_iam_user" in results["bob/repo3"].actions
+
+        results = list(run_fleet("plan-destroy", config, only=["alice/repo1"], **kwargs))
+        assert results[0].actions == [
+            "delete_access_key",
+            "delete_inline_policy",
+            "delete_iam_user",
+        ]
+
+        config.policies["read_s3"].attached_policy_arn_list = [
+            "arn:aws:iam::aws:policy/NoSuchPolicy"
+        ]
+        with pytest.raises(InvalidPolicyArnError):
+            list(run_fleet("apply", config, **kwargs))
+        results = {
+            result.repo: result for result in run_fleet("plan", config, **kwargs)
+        }
+        assert "create_iam_user" in results["bob/repo3"].actions
+
+        results = list(run_fleet("destroy", config, parallel=3, **kwargs))
+        assert all(result.ok for result in results), results
+        assert github.get_secret_names("alice/repo1") == []
+        results = list(run_fleet("plan-destroy", config, **kwargs))
+        assert all(result.actions == [] for result in results)
+
+    def test_org_variable(self, tmp_path, github):
+        config = make_config(tmp_path)
+        config.github_region_mode = REGION_AS_ORG_VARIABLE
+        kwargs = dict(boto_ses=self.boto_ses, github_token="t", check_github=False)
+        results = list(run_fleet("apply", config, only=["alice/*"], **kwargs))
+        assert all(result.ok for result in results), results
+        variable = github.org_variables[("alice", "DEV_ACC_AWS_REGION")]
+        assert variable.repo_ids == {
+            github.repo_ids["alice/repo1"],
+            github.repo_ids["alice/repo2"],
+        }
+        assert github.get_secret_names("alice/repo1") == [
+            "AWS_ACCESS_KEY_ID",
+            "AWS_SECRET_ACCESS_KEY",
+        ]
+        results = list(run_fleet("destroy", config, **kwargs))
+        assert all(result.ok for result in results), results
+
+    def test_changed_only(self, tmp_path, github):
+        config = make_config(tmp_path)
+        kwargs = dict(boto_ses=self.boto_ses, github_token="t", check_github=False)
+
+        results = list(run_fleet("apply", config, changed_only=True, **kwargs))
+        assert len(results) == 3
+        assert all(result.ok for result in results), results
+        assert list(run_fleet("apply", config, changed_only=True, **kwargs)) == []
+
+        # only the repo using the edited template is applied again
+        config.policies["read_s3"].policy_document["Statement"][0]["Action"] = [
+            "s3:GetObject"
+        ]
+        results = list(run_fleet("apply", config, changed_only=True, **kwargs))
+        assert [result.repo for result in results] == ["bob/repo3"]
+        assert results[0].actions == ["put_inline_policy"]
+
+        results = list(run_fleet("destroy", config, only=["bob/*"], **kwargs))
+        assert all(result.ok for result in results), results
+        results = list(run_fleet("apply", config, changed_only=True, **kwargs))
+        assert [result.repo for result in results] == ["bob/repo3"]
+        results = list(run_fleet("destroy", config, **kwargs))
+        assert all(result.ok for result in results), results
+
+    def test_shared_policies(self, tmp_path, github):
+        config = make_config(tmp_path)
+        config.shared_policies = True
+        kwargs = dict(boto_ses=self.boto_ses, github_token="t", check_github=False)
+
+        results = list(run_fleet("plan", config, only=["alice/repo1"], **kwargs))
+        assert results[0].actions[:3] == [
+            "put_shared_policy:gh-ci-shared-list_aliases",
+            "create_iam_user",
+            "attach_shared_policy:gh-ci-shared-list_aliases",
+        ]
+        results = list(run_fleet("apply", config, only=["alice/*"], **kwargs))
+        assert all(result.ok for result in results), results
+        results = list(run_fleet("plan", config, only=["alice/*"], **kwargs))
+        assert all(result.actions == [] for result in results), results
+
+        # one new policy version for all repos sharing the template
+        config.policies["list_aliases"].policy_document["Statement"][0]["Action"] = [
+            "iam:ListUsers"
+        ]
+        results = list(run_fleet("plan", config, only=["alice/*"], **kwargs))
+        assert all(
+            result.actions == ["put_shared_policy:gh-ci-shared-list_aliases"]
+            for result in results
+        ), results
+        results = list(run_fleet("apply", config, only=["alice/*"], **kwargs))
+        assert all(result.ok for result in results), results
+        res = self.bsm.iam_client.list_policies(Scope="Local", PathPrefix="/simple")
+        assert [
+            policy["DefaultVersionId"]
+            for policy in res["Policies"]
+            if policy["PolicyName"] == "gh-ci-shared-list_aliases"
+        ] == ["v2"]
+        drifts = list(scan_fleet_drift(config, only=["alice/*"], **kwargs))
+        assert all(drift.drifted is False for drift in drifts), drifts
+        results = list(run_fleet("destroy", config, **kwargs))
+        assert all(result.ok for result in results), results
+
+    def test_circuit_breaker(self, tmp_path, github, monkeypatch):
+        config = make_config(tmp_path)
+        kwargs = dict(boto_ses=self.boto_ses, github_token="t", check_github=False)
+        new_github_client = FleetConfig.new_github_client
+
+        def new_broken_github_client(self, github_token):
+            github_client = new_github_client(self, github_token)
+            for _ in range(github_client.circuit_breaker.min_calls):
+                github_client.circuit_breaker.record(False)
+            return github_client
+
+        monkeypatch.setattr(FleetConfig, "new_github_client", new_broken_github_client)
+        results = list(run_fleet("apply", config, github_parallel=1, **kwargs))
+        # IAM is done, the GitHub part is deferred and not recorded as applied
+        assert all("deferred" in result.error for result in results), results
+        assert all(result.ok is False for result in results)
+        assert github.calls == []
+        results = list(run_fleet("plan", config, **kwargs))
+        assert all(result.actions == [] for result in results), results
+
+        monkeypatch.setattr(FleetConfig, "new_github_client", new_github_client)
+        results = list(run_fleet("apply", config, changed_only=True, **kwargs))
+        assert len(results) == 3
+        assert all(result.ok for result in results), results
+        results = list(run_fleet("destroy", config, **kwargs))
+        assert all(result.ok for result in results), results
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.fleet",
+        preview=False,
+    )
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import json
+import base64
+
+import pytest
+import responses
+from nacl.public import PrivateKey, SealedBox
+
+from simple_gh_aws_creds.github_client import (
+    GITHUB_API_URL,
+    ETagCache,
+    GitHubClient,
+)
+from simple_gh_aws_creds.tests.fake_github import FakeGitHub
+
+url_repo = f"{GITHUB_API_URL}/repos/alice/my-repo"
+url_public_key = f"{url_repo}/actions/secrets/public-key"
+
+
+class TestGitHubClient:
+    @responses.activate
+    def test_get_json_with_etag_cache(self, tmp_path):
+        client = GitHubClient(token="t0ken", cache=ETagCache(dir_root=tmp_path))
+
+        responses.get(
+            url_repo,
+            json={"full_name": "alice/my-repo"},
+            headers={"ETag": '"abc"'},
+        )
+        assert client.get_repo("alice", "my-repo") == {"full_name": "alice/my-repo"}
+        assert "If-None-Match" not in responses.calls[0].request.headers
+
+        responses.replace(responses.GET, url_repo, status=304)
+        assert client.get_repo("alice", "my-repo") == {"full_name": "alice/my-repo"}
+        assert responses.calls[1].request.headers["If-None-Match"] == '"abc"'
+
+        # the cache is persistent, a new client reuses it
+        client = GitHubClient(token="t0ken", cache=ETagCache(dir_root=tmp_path))
+        assert client.get_repo("alice", "my-repo") == {"full_name": "alice/my-repo"}
+        assert responses.calls[2].request.headers["If-None-Match"] == '"abc"'
+
+        # a different token never reuses the cache entry
+        client = GitHubClient(token="other", cache=ETagCache(dir_root=tmp_path))
+        responses.replace(
+            responses.GET,
+            url_repo,
+            json={"full_name": "alice/my-repo", "private": True},
+            headers={"ETag": '"def"'},
+        )
+        assert client.get_repo("alice", "my-repo")["private"] is True
+        assert "If-None-Match" not in responses.calls[3].request.headers
+
+    @responses.activate
+    def test_secrets(self):
+        client = GitHubClient(token="t0ken")
+        private_key = PrivateKey.generate()
+        public_key_b64 = base64.b64encode(bytes(private_key.public_key)).decode()
+        responses.get(url_public_key, json={"key_id": "k1", "key": public_key_b64})
+        responses.put(f"{url_repo}/actions/secrets/MY_SECRET", status=201)
+        responses.get(
+            f"{url_repo}/actions/secrets?per_page=100&page=1",
+            json={"total_count": 1, "secrets": [{"name": "MY_SECRET"}]},
+        )
+        responses.delete(f"{url_repo}/actions/secrets/MY_SECRET", status=204)
+
+        public_key = client.get_secrets_public_key("alice", "my-repo")
+        assert public_key.key_id == "k1"
+        client.put_secret("alice", "my-repo", "MY_SECRET", "v", public_key=public_key)
+        assert client.list_secret_names("alice", "my-repo") == ["MY_SECRET"]
+        client.delete_secret("alice", "my-repo", "MY_SECRET")
+
+    @responses.activate
+    def test_secret_stores(self):
+        client = GitHubClient(token="t0ken")
+        private_key = PrivateKey.generate()
+        public_key_b64 = base64.b64encode(bytes(private_key.public_key)).decode()
+        url_dependabot = f"{url_repo}/dependabot/secrets"
+        responses.get(
+            f"{url_dependabot}/public-key",
+            json={"key_id": "d1", "key": public_key_b64},
+        )
+        responses.put(f"{url_dependabot}/MY_SECRET", status=201)
+        client.put_secret("alice", "my-repo", "MY_SECRET", "v", store="dependabot")
+        body = json.loads(responses.calls[-1].request.body)
+        assert body["key_id"] == "d1"
+        sealed_box = SealedBox(private_key)
+        assert sealed_box.decrypt(base64.b64decode(body["encrypted_value"])) == b"v"
+
+        public_key = client.get_secrets_public_key("alice", "my-repo", store="dependabot")
+        encrypted = public_key.encrypt_many(["a", "b"])
+        assert [sealed_box.decrypt(base64.b64decode(v)) for v in encrypted] == [b"a", b"b"]
+
+        with pytest.raises(ValueError):
+            client.list_secrets("alice", "my-repo", store="npm")
+        with pytest.raises(ValueError):
+            client.list_secrets("alice", "my-repo", environment="dev", store="dependabot")
+
+    @responses.activate
+    def test_variables(self):
+        client = GitHubClient(token="t0ken")
+        url_variable = f"{url_repo}/actions/variables/AWS_REGION"
+        responses.get(url_variable, status=404, json={"message": "Not Found"})
+        responses.post(f"{url_repo}/actions/variables", status=201)
+        assert client.put_variable("alice", "my-repo", "AWS_REGION", "us-east-1") is True
+        assert responses.calls[1].request.method == "POST"
+
+        # unchanged value, nothing written
+        responses.replace(responses.GET, url_variable, json={"value": "us-east-1"})
+        assert client.put_variable("alice", "my-repo", "AWS_REGION", "us-east-1") is False
+        assert len(responses.calls) == 3
+
+        responses.patch(url_variable, status=204)
+        assert client.put_variable("alice", "my-repo", "AWS_REGION", "us-west-2") is True
+        assert responses.calls[4].request.method == "PATCH"
+
+        responses.delete(url_variable, status=204)
+        assert client.delete_variable("alice", "my-repo", "AWS_REGION") is True
+        responses.replace(responses.DELETE, url_variable, status=404, json={})
+        assert client.delete_variable("alice", "my-repo", "AWS_REGION") is False
+
+    @responses.activate
+    def test_org_variable(self):
+        client = GitHubClient(token="t0ken")
+        url_variables = f"{GITHUB_API_URL}/orgs/alice/actions/variables"
+        url_variable = f"{url_variables}/AWS_REGION"
+        url_repositories = f"{url_variable}/repositories"
+        responses.get(url_variable, status=404, json={"message": "Not Found"})
+        responses.post(url_variables, status=201)
+        assert client.put_org_variable("alice", "AWS_REGION", "us-east-1", [2, 1])
+        assert json.loads(responses.calls[1].request.body) == {
+            "name": "AWS_REGION",
+            "value": "us-east-1",
+            "visibility": "selected",
+            "selected_repository_ids": [1, 2],
+        }
+
+        # same value, all repos already selected
+        responses.replace(
+            responses.GET,
+            url_variable,
+            json={"value": "us-east-1", "visibility": "selected"},
+        )
+        responses.get(
+            f"{url_repositories}?per_page=100&page=1",
+            json={"repositories": [{"id": 1}, {"id": 2}]},
+        )
+        assert not client.put_org_variable("alice", "AWS_REGION", "us-east-1", [1])
+
+        # new value and a new repo, added alone, existing repos stay selected
+        responses.patch(url_variable, status=204)
+        responses.put(f"{url_repositories}/3", status=204)
+        assert client.put_org_variable("alice", "AWS_REGION", "us-west-2", [3])
+        assert responses.calls[-1].request.method == "PUT"
+        assert responses.calls[-1].request.url == f"{url_repositories}/3"
+
+        responses.delete(f"{url_repositories}/3", status=204)
+        client.remove_org_variable_repo("alice", "AWS_REGION", 3)
+
+
+
+def test_org_variable_concurrent_writers():
+    with FakeGitHub() as github:
+        ids = [github.add_repo(f"acme/repo{i}") for i in range(4)]
+        writer_a = GitHubClient(token="t")
+        writer_b = GitHubClient(token="t")
+        assert writer_a.put_org_variable("acme", "AWS_REGION", "us-east-1", ids[:1])
+
+        # b adds its repos between a's read of the selection and a's write
+        list_repo_ids = writer_a.list_org_variable_repo_ids
+
+        def list_then_b_writes(org, name):
+            selected = list_repo_ids(org, name)
+            assert writer_b.put_org_variable(org, name, "us-east-1", ids[2:])
+            return selected
+
+        writer_a.list_org_variable_repo_ids = list_then_b_writes
+        assert writer_a.put_org_variable("acme", "AWS_REGION", "us-east-1", ids[1:2])
+        assert github.org_variables[("acme", "AWS_REGION")].repo_ids == set(ids)
+        writer_a.list_org_variable_repo_ids = list_repo_ids
+
+        # both see no variable, the second create fails, it adds its repos
+        get_org_variable = writer_a.get_org_variable
+
+        def b_creates_first(org, name):
+            writer_a.get_org_variable = get_org_variable
+            assert writer_b.put_org_variable(org, name, "x", ids[:1])
+            return None
+
+        writer_a.get_org_variable = b_creates_first
+        assert writer_a.put_org_variable("acme", "OTHER", "x", ids[1:2])
+        assert github.org_variables[("acme", "OTHER")].repo_ids == set(ids[:2])
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.github_client",
+        preview=False,
+    )
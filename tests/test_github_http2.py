@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import base64
+import threading
+
+import pytest
+from nacl.public import PrivateKey
+from github import GithubException
+
+from simple_gh_aws_creds.github_client import ETagCache
+from simple_gh_aws_creds.github_http2 import Http2GitHubClient
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("h2")
+
+
+def test_import_error(monkeypatch):
+    monkeypatch.setitem(sys.modules, "h2", None)
+    with pytest.raises(ImportError, match="http2"):
+        Http2GitHubClient(token="t0ken")
+
+
+def test_http2_github_client(tmp_path):
+    private_key = PrivateKey.generate()
+    public_key_b64 = base64.b64encode(bytes(private_key.public_key)).decode()
+    lock = threading.Lock()
+    requests = list()
+    secrets = dict()
+
+    def handler(request: "httpx.Request") -> "httpx.Response":
+        with lock:
+            requests.append(request)
+        assert request.headers["Authorization"] == "Bearer t0ken"
+        path = request.url.path
+        if path.endswith("/actions/secrets/public-key"):
+            if request.headers.get("If-None-Match") == '"k1"':
+                return httpx.Response(304)
+            return httpx.Response(
+                200,
+                json={"key_id": "k1", "key": public_key_b64},
+                headers={"ETag": '"k1"'},
+            )
+        if path.endswith("/actions/secrets"):
+            return httpx.Response(
+                200, json={"secrets": [{"name": name} for name in sorted(secrets)]}
+            )
+        name = path.rsplit("/", 1)[-1]
+        if request.method == "PUT":
+            secrets[name] = json.loads(request.content)
+            return httpx.Response(201)
+        if request.method == "DELETE":
+            secrets.pop(name)
+            return httpx.Response(204)
+        return httpx.Response(404, json={"message": "Not Found"})
+
+    client = Http2GitHubClient(
+        token="t0ken",
+        cache=ETagCache(dir_root=tmp_path),
+        transport=httpx.MockTransport(handler),
+    )
+    assert client.session.is_closed is False
+    public_key = client.get_secrets_public_key("alice", "repo")
+    for name in ["A", "B"]:
+        client.put_secret("alice", "repo", name, "v", public_key=public_key)
+    assert secrets["A"]["key_id"] == "k1"
+    assert client.list_secret_names("alice", "repo") == ["A", "B"]
+    client.delete_secret("alice", "repo", "A")
+    assert list(secrets) == ["B"]
+
+    # served from the ETag cache on a 304
+    assert client.get_secrets_public_key("alice", "repo").key_id == "k1"
+    assert requests[-1].headers["If-None-Match"] == '"k1"'
+
+    with pytest.raises(GithubException):
+        client.request("POST", "/repos/alice/repo/nothing")
+    client.close()
+    client.close()
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.github_http2",
+        preview=False,
+    )
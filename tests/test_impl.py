@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import json
+import base64
+import dataclasses
+
+import pytest
+import responses
+from nacl.public import PrivateKey
+
 from simple_gh_aws_creds.impl import SetupGitHubRepo
+from simple_gh_aws_creds.github_client import GITHUB_API_URL
 
 from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
-from simple_gh_aws_creds.paths import dir_project_root
 
 
 class TestSetupGitHubRepo(BaseMockAwsTest):
@@ -62,7 +69,7 @@ class TestSetupGitHubRepo(BaseMockAwsTest):
         # Call parent teardown
         super().teardown_class()
 
-    def test(self):
+    def test(self, tmp_path):
         aws_region = "us-east-1"
         github_user_name = "MacHu-GWU"
         github_repo_name = "simple_gh_aws_creds-project"
@@ -92,7 +99,7 @@ class TestSetupGitHubRepo(BaseMockAwsTest):
             attached_policy_arn_list=[
                 self.test_managed_policy_arn,  # Use the test managed policy we created
             ] if self.test_managed_policy_arn else [],
-            path_access_key_json=(dir_project_root.joinpath("dev_access_key.json")),
+            path_access_key_json=tmp_path.joinpath("dev_access_key.json"),
             github_user_name=github_user_name,
             github_repo_name=github_repo_name,
             github_token="github_token_here",
@@ -147,6 +154,88 @@ class TestSetupGitHubRepo(BaseMockAwsTest):
         setup.s24_delete_iam_user()
 
 
+@responses.activate
+def test_put_github_secrets(tmp_path):
+    setup = SetupGitHubRepo(
+        boto_ses=None,
+        aws_region="us-east-1",
+        iam_user_name="gh-ci-my-repo",
+        tags={},
+        policy_document={},
+        attached_policy_arn_list=[],
+        path_access_key_json=tmp_path.joinpath("access_key.json"),
+        github_user_name="alice",
+        github_repo_name="my-repo",
+        github_token="t0ken",
+        github_environments=["dev", "prod"],
+        github_secret_stores=["actions", "dependabot"],
+    )
+    assert [str(target) for target in setup.github_secret_targets] == [
+        "actions@dev",
+        "actions@prod",
+        "dependabot",
+    ]
+    public_key_b64 = base64.b64encode(bytes(PrivateKey.generate().public_key)).decode()
+    url_repo = f"{GITHUB_API_URL}/repos/alice/my-repo"
+    responses.get(f"{url_repo}/environments/dev", json={"name": "dev"})
+    responses.get(f"{url_repo}/environments/prod", status=404, json={})
+    responses.put(f"{url_repo}/environments/prod", json={"name": "prod"})
+    url_secrets_list = [
+        f"{url_repo}/environments/dev/secrets",
+        f"{url_repo}/environments/prod/secrets",
+        f"{url_repo}/dependabot/secrets",
+    ]
+    listed = {
+        "secrets": [
+            {"name": name, "updated_at": "2026-01-01T00:00:00Z"}
+            for name in setup.github_secret_name_list
+        ]
+    }
+    for url_secrets in url_secrets_list:
+        # nothing before the write, all secrets after it
+        responses.get(f"{url_secrets}?per_page=100&page=1", json={"secrets": []})
+        responses.get(f"{url_secrets}?per_page=100&page=1", json=listed)
+        responses.get(
+            f"{url_secrets}/public-key",
+            json={"key_id": url_secrets, "key": public_key_b64},
+        )
+        for name in setup.github_secret_name_list:
+            responses.put(f"{url_secrets}/{name}", status=201)
+
+    assert setup.put_github_secrets("AKIA", "secret") is True
+    calls = [(call.request.method, call.request.url) for call in responses.calls]
+    # only the missing environment is created
+    assert calls.count(("PUT", f"{url_repo}/environments/prod")) == 1
+    assert ("PUT", f"{url_repo}/environments/dev") not in calls
+    for url_secrets in url_secrets_list:
+        # one public key fetch per target, every secret written
+        assert calls.count(("GET", f"{url_secrets}/public-key")) == 1
+        for name in setup.github_secret_name_list:
+            assert ("PUT", f"{url_secrets}/{name}") in calls
+    assert setup.path_secret_ledger_json.exists()
+    assert "AKIA" not in setup.path_secret_ledger_json.read_text()
+
+    with pytest.raises(ValueError, match="github_secret_stores"):
+        dataclasses.replace(setup, github_secret_stores=[])
+
+    # same values, nothing is written again, even by a new process
+    responses.replace(responses.GET, f"{url_repo}/environments/prod", json={})
+    del setup.secret_ledger
+    n_calls = len(responses.calls)
+    assert setup.put_github_secrets("AKIA", "secret") is True
+    methods = {call.request.method for call in responses.calls[n_calls:]}
+    assert methods == {"GET"}
+    assert not any(
+        call.request.url.endswith("public-key") for call in responses.calls[n_calls:]
+    )
+
+    # a new access key is written
+    n_calls = len(responses.calls)
+    assert setup.put_github_secrets("AKIA2", "secret2") is True
+    puts = [c for c in responses.calls[n_calls:] if c.request.method == "PUT"]
+    assert len(puts) == 6
+
+
 if __name__ == "__main__":
     from simple_gh_aws_creds.tests import run_cov_test
 
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+import json
+
+from simple_gh_aws_creds.inventory import iter_inventory, write_jsonl, write_csv
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.factory import make_setup_github_repo
+from simple_gh_aws_creds.tests.fake_iam import FakeIamClient, FakeBotoSession
+
+
+class TestInventory(BaseMockAwsTest):
+    @classmethod
+    def setup_mock_post_process(cls):
+        iam_client = cls.bsm.iam_client
+        for i in range(5):
+            iam_client.create_user(
+                UserName=f"gh-ci-repo{i}",
+                Tags=[
+                    {"Key": "github_user_name", "Value": "alice"},
+                    {"Key": "github_repo_name", "Value": f"repo{i}"},
+                ],
+            )
+            iam_client.create_access_key(UserName=f"gh-ci-repo{i}")
+        res = iam_client.create_policy(
+            PolicyName="TestPolicy",
+            PolicyDocument=json.dumps(
+                {
+                    "Version": "2012-10-17",
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "iam:Get*", "Resource": "*"}
+                    ],
+                }
+            ),
+        )
+        cls.policy_arn = res["Policy"]["Arn"]
+        iam_client.attach_user_policy(UserName="gh-ci-repo0", PolicyArn=cls.policy_arn)
+        iam_client.create_user(UserName="human")
+
+    def test(self):
+        records = list(iter_inventory(self.bsm.iam_client, max_workers=2))
+        assert len(records) == 5
+        records = {record.iam_user_name: record for record in records}
+        assert "human" not in records
+        record = records["gh-ci-repo0"]
+        assert record.github_full_name == "alice/repo0"
+        assert len(record.access_keys) == 1
+        assert record.oldest_access_key.status == "Active"
+        assert record.attached_policy_arns == [self.policy_arn]
+
+        buffer = io.StringIO()
+        assert write_jsonl(records.values(), buffer) == 5
+        lines = buffer.getvalue().splitlines()
+        assert json.loads(lines[0])["github_user_name"] == "alice"
+
+        buffer = io.StringIO()
+        assert write_csv(records.values(), buffer) == 5
+        rows = list(csv.DictReader(io.StringIO(buffer.getvalue())))
+        assert len(rows) == 5
+        assert rows[0]["access_key_status"] == "Active"
+
+
+def test_tag_existing_user(tmp_path):
+    # a user created before the identity tags, only the tags given back then
+    iam_client = FakeIamClient()
+    iam_client.create_user(
+        UserName="gh-ci-repo1",
+        Tags=[{"Key": "tech:use_case", "Value": "legacy"}],
+    )
+    assert list(iter_inventory(iam_client)) == []
+
+    setup = make_setup_github_repo(FakeBotoSession(iam_client), tmp_path, 1)
+    setup.s11_create_iam_user()
+    (record,) = list(iter_inventory(iam_client))
+    assert record.github_full_name == "alice/repo1"
+    tags = iam_client.list_user_tags(UserName="gh-ci-repo1")["Tags"]
+    assert {"Key": "tech:use_case", "Value": "legacy"} in tags
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.inventory",
+        preview=False,
+    )
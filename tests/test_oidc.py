@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import json
+import typing as T
+import urllib.parse
+
+import pytest
+
+from simple_gh_aws_creds.oidc import (
+    GITHUB_OIDC_HOST,
+    OidcProviderManager,
+    SetupGitHubOidcRole,
+    trust_policy_document,
+)
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.fake_iam import FakeIamClient
+
+
+def test_trust_policy_document():
+    document = trust_policy_document(
+        "arn:aws:iam::111122223333:oidc-provider/token.actions.githubusercontent.com",
+        ["bob/repo2", "alice/repo1"],
+    )
+    condition = document["Statement"][0]["Condition"]
+    assert condition["StringLike"][f"{GITHUB_OIDC_HOST}:sub"] == [
+        "repo:alice/repo1:*",
+        "repo:bob/repo2:*",
+    ]
+    assert condition["StringEquals"][f"{GITHUB_OIDC_HOST}:aud"] == "sts.amazonaws.com"
+
+
+def _decode(document):
+    if isinstance(document, str):
+        return json.loads(urllib.parse.unquote(document))
+    return document
+
+
+def test_ensure_client_id():
+    # created by hand for another audience
+    iam_client = FakeIamClient()
+    provider_arn = iam_client.create_open_id_connect_provider(
+        Url=f"https://{GITHUB_OIDC_HOST}",
+        ClientIDList=["my-audience"],
+    )["OpenIDConnectProviderArn"]
+    assert OidcProviderManager(iam_client=iam_client).ensure() == provider_arn
+    res = iam_client.get_open_id_connect_provider(OpenIDConnectProviderArn=provider_arn)
+    assert res["ClientIDList"] == ["my-audience", "sts.amazonaws.com"]
+
+    assert OidcProviderManager(iam_client=iam_client).ensure() == provider_arn
+    assert iam_client.n_calls["add_client_id_to_open_id_connect_provider"] == 1
+
+
+class TestSetupGitHubOidcRole(BaseMockAwsTest):
+    def make_setup(
+        self,
+        github_repos: list[str],
+        attached_policy_arn_list: T.Optional[list[str]] = None,
+        **kwargs,
+    ) -> SetupGitHubOidcRole:
+        return SetupGitHubOidcRole(
+            boto_ses=self.boto_ses,
+            aws_region="us-east-1",
+            role_name="gh-oidc-repo1",
+            tags={"tech:use_case": "unit test"},
+            policy_document={
+                "Version": "2012-10-17",
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Action": ["iam:ListAccountAliases"],
+                        "Resource": "*",
+                    }
+                ],
+            },
+            attached_policy_arn_list=attached_policy_arn_list or [],
+            github_repos=github_repos,
+            github_token="t",
+            **kwargs,
+        )
+
+    def test(self):
+        iam_client = self.bsm.iam_client
+        setup = self.make_setup(["alice/repo1"])
+        role_arn = setup.setup_iam()
+        assert role_arn.endswith(":role/gh-oidc-repo1")
+
+        # the provider is created once per account, shared by every role
+        providers = iam_client.list_open_id_connect_providers()
+        assert len(providers["OpenIDConnectProviderList"]) == 1
+        assert (
+            OidcProviderManager(iam_client=iam_client).ensure()
+            == providers["OpenIDConnectProviderList"][0]["Arn"]
+        )
+
+        role = iam_client.get_role(RoleName="gh-oidc-repo1")["Role"]
+        tags = {tag["Key"]: tag["Value"] for tag in role["Tags"]}
+        assert tags["github_repos"] == "alice/repo1"
+        res = iam_client.get_role_policy(
+            RoleName="gh-oidc-repo1",
+            PolicyName=setup.policy_document_name,
+        )
+        assert _decode(res["PolicyDocument"]) == setup.compiled_policy.document
+
+        # rerun for a group of repos, the trust policy, the max session
+        # duration and the tags are updated in place
+        setup = self.make_setup(
+            ["alice/repo1", "alice/repo2"], max_session_duration=7200
+        )
+        assert setup.setup_iam() == role_arn
+        role = iam_client.get_role(RoleName="gh-oidc-repo1")["Role"]
+        assert role["MaxSessionDuration"] == 7200
+        tags = {tag["Key"]: tag["Value"] for tag in role["Tags"]}
+        assert tags["github_repos"] == "alice/repo1 alice/repo2"
+        condition = _decode(role["AssumeRolePolicyDocument"])["Statement"][0]["Condition"]
+        assert condition["StringLike"][f"{GITHUB_OIDC_HOST}:sub"] == [
+            "repo:alice/repo1:*",
+            "repo:alice/repo2:*",
+        ]
+
+        setup.s22_delete_role_policy()
+        setup.s23_delete_role()
+        setup.s22_delete_role_policy()
+        setup.s23_delete_role()
+        assert iam_client.list_roles()["Roles"] == []
+
+        with pytest.raises(ValueError):
+            self.make_setup(["alice"])
+
+    def test_stale_managed_policies(self):
+        iam_client = self.bsm.iam_client
+        policy_arn_list = [
+            iam_client.create_policy(
+                PolicyName=f"gh-oidc-managed-{i}",
+                PolicyDocument=json.dumps(
+                    {
+                        "Version": "2012-10-17",
+                        "Statement": [
+                            {"Effect": "Allow", "Action": "s3:ListBucket", "Resource": "*"}
+                        ],
+                    }
+                ),
+            )["Policy"]["Arn"]
+            for i in range(2)
+        ]
+
+        def attached() -> list[str]:
+            res = iam_client.list_attached_role_policies(RoleName="gh-oidc-repo1")
+            return sorted(policy["PolicyArn"] for policy in res["AttachedPolicies"])
+
+        setup = self.make_setup(["alice/repo1"], policy_arn_list)
+        setup.setup_iam()
+        assert attached() == sorted(policy_arn_list)
+
+        # a policy removed from the list is detached on the rerun
+        setup = self.make_setup(["alice/repo1"], policy_arn_list[:1])
+        setup.setup_iam()
+        assert attached() == policy_arn_list[:1]
+
+        setup.s22_delete_role_policy()
+        setup.s23_delete_role()
+
+    def test_role_tags(self):
+        # the tag only lists the whole repo names that fit in 256 characters
+        github_repos = [f"alice/repo-{i:03d}" for i in range(30)]
+        tag = self.make_setup(github_repos).role_tags["github_repos"]
+        assert len(tag) <= 256
+        assert tag.split(" ") == github_repos[: len(tag.split(" "))]
+        assert len(tag.split(" ")) == 256 // len("alice/repo-000 ")
+
+        # left out when not even one repo fits
+        tags = self.make_setup([f"alice/{'r' * 300}"]).role_tags
+        assert tags == {"tech:use_case": "unit test"}
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.oidc",
+        preview=False,
+    )
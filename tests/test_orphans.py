@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+
+import pytest
+import responses
+from github import GithubException
+
+from simple_gh_aws_creds.cli import build_parser, run
+from simple_gh_aws_creds.github_client import GITHUB_API_URL, GitHubClient
+from simple_gh_aws_creds.sharding import Shard
+from simple_gh_aws_creds.orphans import (
+    STATUS_ALIVE,
+    STATUS_RENAMED,
+    STATUS_ORPHAN,
+    iter_managed_users,
+    find_orphans,
+    delete_orphans,
+)
+from simple_gh_aws_creds.tests.fleet_config import FLEET_CONFIG_TOML
+from simple_gh_aws_creds.tests.fake_iam import FakeIamClient, FakeBotoSession
+
+GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+
+# owner/repo -> current owner/repo, None for a deleted repo
+REPOS = {
+    "alice/repo1": "alice/repo1",
+    "alice/gone": None,
+    "bob/old-name": "bob/new-name",
+    "bob/also-gone": None,
+}
+
+
+def graphql_callback(request):
+    variables = json.loads(request.body)["variables"]
+    data = dict()
+    errors = list()
+    i = 0
+    while f"o{i}" in variables:
+        full_name = f"{variables[f'o{i}']}/{variables[f'n{i}']}"
+        current = REPOS.get(full_name)
+        if current is None:
+            data[f"r{i}"] = None
+            errors.append({"type": "NOT_FOUND", "path": [f"r{i}"]})
+        else:
+            data[f"r{i}"] = {"nameWithOwner": current}
+        i += 1
+    return 200, {}, json.dumps({"data": data, "errors": errors})
+
+
+def mock_graphql():
+    responses.add_callback(responses.POST, GRAPHQL_URL, callback=graphql_callback)
+
+
+def new_iam_client() -> FakeIamClient:
+    iam_client = FakeIamClient()
+    policy_arn = iam_client.create_policy(
+        PolicyName="shared", PolicyDocument="{}"
+    )["Policy"]["Arn"]
+    for full_name in REPOS:
+        owner, repo = full_name.split("/")
+        user_name = f"{owner}-{repo}"
+        iam_client.create_user(
+            UserName=user_name,
+            Tags=[
+                {"Key": "github_user_name", "Value": owner},
+                {"Key": "github_repo_name", "Value": repo},
+            ],
+        )
+        iam_client.put_user_policy(
+            UserName=user_name, PolicyName="p", PolicyDocument="{}"
+        )
+        iam_client.attach_user_policy(UserName=user_name, PolicyArn=policy_arn)
+        iam_client.create_access_key(UserName=user_name)
+    # not managed, never touched
+    iam_client.create_user(UserName="human")
+    return iam_client
+
+
+@responses.activate
+def test_resolve_repos():
+    mock_graphql()
+    client = GitHubClient(token="t")
+    assert client.resolve_repos([]) == {}
+    assert client.resolve_repos(list(REPOS)) == REPOS
+    assert len(responses.calls) == 1
+    with pytest.raises(ValueError):
+        client.resolve_repos([f"alice/repo{i}" for i in range(101)])
+
+    responses.replace(
+        responses.POST,
+        GRAPHQL_URL,
+        json={"errors": [{"type": "RATE_LIMITED", "message": "slow down"}]},
+    )
+    with pytest.raises(GithubException):
+        client.resolve_repos(["alice/repo1"])
+
+
+def test_graphql_url():
+    client = GitHubClient(token="t", base_url="https://ghe.example.com/api/v3")
+    assert client.graphql_url == "https://ghe.example.com/api/graphql"
+
+
+def test_iter_managed_users():
+    iam_client = new_iam_client()
+    full_names = {full_name for _, full_name in iter_managed_users(iam_client)}
+    assert full_names == set(REPOS)
+    full_names = {
+        full_name for _, full_name in iter_managed_users(iam_client, only=["bob/*"])
+    }
+    assert full_names == {"bob/old-name", "bob/also-gone"}
+    shard = Shard(index=0, count=2)
+    for _, full_name in iter_managed_users(iam_client, shard=shard):
+        assert shard.contains(full_name)
+
+
+@responses.activate
+def test_find_and_delete_orphans(tmp_path):
+    mock_graphql()
+    iam_client = new_iam_client()
+    github_client = GitHubClient(token="t")
+    managed_users = list(find_orphans(iam_client, github_client, batch_size=3))
+    # 4 users in batches of 3
+    assert len(responses.calls) == 2
+    status = {m.github_full_name: m.status for m in managed_users}
+    assert status == {
+        "alice/repo1": STATUS_ALIVE,
+        "alice/gone": STATUS_ORPHAN,
+        "bob/old-name": STATUS_RENAMED,
+        "bob/also-gone": STATUS_ORPHAN,
+    }
+
+    tmp_path.joinpath("alice__gone.json").write_text("{}")
+    results = list(delete_orphans(iam_client, managed_users, dir_access_key=tmp_path))
+    assert sorted(result.repo for result in results) == ["alice/gone", "bob/also-gone"]
+    assert all(result.ok for result in results), results
+    result = [result for result in results if result.repo == "alice/gone"][0]
+    assert "delete_iam_user" in result.actions
+    assert "delete_local_file:alice__gone.json" in result.actions
+    assert not tmp_path.joinpath("alice__gone.json").exists()
+
+    user_names = {
+        user["UserName"] for user in iam_client.list_users()["Users"]
+    }
+    assert user_names == {"alice-repo1", "bob-old-name", "human"}
+
+    # deleted in the meantime
+    orphans = [m for m in managed_users if m.status == STATUS_ORPHAN]
+    results = list(delete_orphans(iam_client, orphans))
+    assert all(result.ok and not result.actions for result in results)
+
+
+@responses.activate
+def test_cli_gc(tmp_path):
+    mock_graphql()
+    path = tmp_path.joinpath("fleet.toml")
+    path.write_text(FLEET_CONFIG_TOML)
+    iam_client = new_iam_client()
+    kwargs = dict(boto_ses=FakeBotoSession(iam_client), github_token="t")
+
+    # dry run
+    stdout = io.StringIO()
+    args = build_parser().parse_args(["gc", "-c", str(path)])
+    assert run(args, stdout, **kwargs) == 1
+    lines = stdout.getvalue().splitlines()
+    assert lines[-1] == "4 managed users, 2 orphans, 1 renamed"
+    assert len(iam_client.list_users()["Users"]) == 5
+
+    stdout = io.StringIO()
+    args = build_parser().parse_args(
+        ["gc", "-c", str(path), "--delete", "--output", "jsonl"]
+    )
+    assert run(args, stdout, **kwargs) == 0
+    lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert sorted(line["status"] for line in lines if "status" in line) == [
+        STATUS_ORPHAN,
+        STATUS_ORPHAN,
+        STATUS_RENAMED,
+    ]
+    assert all(line["ok"] for line in lines if "ok" in line)
+    assert len(iam_client.list_users()["Users"]) == 3
+
+    stdout = io.StringIO()
+    args = build_parser().parse_args(["gc", "-c", str(path), "--delete"])
+    assert run(args, stdout, **kwargs) == 0
+    assert stdout.getvalue().splitlines()[-1] == "0 deleted, 0 failed"
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.orphans",
+        preview=False,
+    )
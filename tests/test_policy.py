@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+import botocore.exceptions
+
+from simple_gh_aws_creds.policy import (
+    USER_INLINE_POLICY_MAX_SIZE,
+    PolicyValidationError,
+    policy_size,
+    validate_policy_document,
+    optimize_policy_document,
+    compile_policy,
+    canonical_policy_hash,
+)
+from simple_gh_aws_creds.tests.fake_iam import FakeIamClient
+
+
+def test_validate_policy_document():
+    validate_policy_document(
+        {
+            "Version": "2012-10-17",
+            "Statement": {"Effect": "Allow", "Action": "s3:*", "Resource": "*"},
+        }
+    )
+    bad_documents = [
+        [],
+        {"Statement": [{"Effect": "Allow", "Action": "s3:*", "Resource": "*"}]},
+        {"Version": "2012-10-17", "Statement": []},
+        {"Version": "2012-10-17", "Statement": [{"Effect": "allow"}]},
+        {"Version": "2012-10-17", "Statement": [{"Effect": "Allow", "Resource": "*"}]},
+        {"Version": "2012-10-17", "Statement": [{"Effect": "Allow", "Action": "s3:*"}]},
+        {
+            "Version": "2012-10-17",
+            "Statement": [{"Effect": "Allow", "Action": "s3", "Resource": "*"}],
+        },
+        {
+            "Version": "2012-10-17",
+            "Statement": [
+                {"Effect": "Allow", "Action": "s3:*", "Resource": "*", "Foo": 1}
+            ],
+        },
+        {
+            "Version": "2012-10-17",
+            "Statement": [
+                {"Effect": "Allow", "Action": "s3:*", "Resource": "*", "Principal": "*"}
+            ],
+        },
+    ]
+    for policy_document in bad_documents:
+        with pytest.raises(PolicyValidationError):
+            validate_policy_document(policy_document)
+
+
+def test_optimize_policy_document():
+    policy_document = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {"Sid": "A", "Effect": "Allow", "Action": "s3:GetObject", "Resource": "*"},
+            {
+                "Effect": "Allow",
+                "Action": ["sqs:Send", "s3:GetObject"],
+                "Resource": ["*"],
+            },
+            {
+                "Effect": "Allow",
+                "Action": "s3:PutObject",
+                "Resource": "arn:aws:s3:::b/*",
+                "Condition": {"Bool": {"aws:SecureTransport": "true"}},
+            },
+            {"Effect": "Deny", "Action": "s3:DeleteObject", "Resource": "*"},
+        ],
+    }
+    assert optimize_policy_document(policy_document) == {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Action": ["s3:GetObject", "sqs:Send"],
+                "Resource": "*",
+            },
+            {
+                "Effect": "Allow",
+                "Action": "s3:PutObject",
+                "Resource": "arn:aws:s3:::b/*",
+                "Condition": {"Bool": {"aws:SecureTransport": "true"}},
+            },
+            {"Effect": "Deny", "Action": "s3:DeleteObject", "Resource": "*"},
+        ],
+    }
+
+
+def test_compile_policy():
+    policy_document = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {"Effect": "Allow", "Action": ["s3:GetObject"], "Resource": "*"},
+            {"Effect": "Allow", "Action": ["s3:GetObject"], "Resource": "*"},
+        ],
+    }
+    compiled = compile_policy(policy_document)
+    assert " " not in compiled.text
+    assert compiled.size < len(json.dumps(policy_document))
+    assert json.loads(compiled.text) == compiled.document
+    assert compiled.sha256 == compile_policy(compiled.document).sha256
+
+    policy_document = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Action": [f"s3:Action{i:04d}" for i in range(200)],
+                "Resource": "*",
+            },
+        ],
+    }
+    with pytest.raises(PolicyValidationError):
+        compile_policy(policy_document)
+    compile_policy(policy_document, max_size=6144)
+
+
+def test_policy_size():
+    def make_document(n_spaces: int, n_chars: int) -> dict:
+        value = "a" * n_chars + " " * n_spaces
+        return {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Action": "s3:GetObject",
+                    "Resource": "*",
+                    "Condition": {"StringEquals": {"aws:UserAgent": value}},
+                }
+            ],
+        }
+
+    n_base = compile_policy(make_document(0, 0)).size
+    assert policy_size(" a\tb\n") == 2
+    # whitespace, inside strings too, doesn't count, the compiler and the
+    # IAM fake agree at the limit
+    iam_client = FakeIamClient()
+    iam_client.create_user(UserName="u1")
+    n_chars = USER_INLINE_POLICY_MAX_SIZE - n_base
+    compiled = compile_policy(make_document(100, n_chars))
+    assert compiled.size == USER_INLINE_POLICY_MAX_SIZE
+    assert len(compiled.text) > USER_INLINE_POLICY_MAX_SIZE
+    iam_client.put_user_policy(
+        UserName="u1", PolicyName="p", PolicyDocument=compiled.text
+    )
+
+    document = make_document(100, n_chars + 1)
+    with pytest.raises(PolicyValidationError):
+        compile_policy(document)
+    with pytest.raises(botocore.exceptions.ClientError):
+        iam_client.put_user_policy(
+            UserName="u1", PolicyName="p", PolicyDocument=json.dumps(document)
+        )
+
+
+def test_canonical_policy_hash():
+    a = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {"Effect": "Allow", "Action": ["b:B", "a:A"], "Resource": "*"},
+        ],
+    }
+    b = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {"Effect": "Allow", "Action": "a:A", "Resource": "*"},
+            {"Effect": "Allow", "Action": "b:B", "Resource": ["*"]},
+        ],
+    }
+    assert canonical_policy_hash(a) == canonical_policy_hash(b)
+    assert canonical_policy_hash({"a": 1}) == canonical_policy_hash({"a": 1})
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.policy",
+        preview=False,
+    )
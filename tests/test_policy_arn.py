@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from simple_gh_aws_creds.policy_arn import (
+    InvalidPolicyArnError,
+    PolicyArnResolver,
+)
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.factory import make_setup_github_repo
+
+
+class TestPolicyArnResolver(BaseMockAwsTest):
+    def test(self, tmp_path):
+        res = self.bsm.iam_client.create_policy(
+            PolicyName="read-only",
+            PolicyDocument=json.dumps(
+                {
+                    "Version": "2012-10-17",
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "s3:GetObject", "Resource": "*"}
+                    ],
+                }
+            ),
+        )
+        good_arn = res["Policy"]["Arn"]
+        missing_arn = good_arn.replace("read-only", "no-such-policy")
+
+        resolver = PolicyArnResolver(iam_client=self.bsm.iam_client)
+        info = resolver.resolve(good_arn)
+        assert info.ok
+        assert info.policy_name == "read-only"
+        assert resolver.resolve(missing_arn).ok is False
+        assert resolver.resolve("arn:aws:s3:::bucket").error == "malformed policy ARN"
+
+        resolver.validate([good_arn] * 10)
+        with pytest.raises(InvalidPolicyArnError, match="no-such-policy"):
+            resolver.validate([good_arn, missing_arn])
+        assert resolver.n_api_calls == 3
+
+        # a bad ARN fails before the IAM user is created, a shared resolver
+        # doesn't look up the same ARN again
+        setups = [
+            make_setup_github_repo(self.boto_ses, tmp_path, i) for i in range(3)
+        ]
+        for setup in setups:
+            setup.policy_arn_resolver = resolver
+            setup.attached_policy_arn_list = [good_arn]
+        for setup in setups:
+            setup.s11_create_iam_user()
+            setup.s12_put_iam_policy()
+        assert resolver.n_api_calls == 3
+
+        setups[0].attached_policy_arn_list = [missing_arn]
+        setups[0].iam_user_name = "gh-ci-never-created"
+        with pytest.raises(InvalidPolicyArnError):
+            setups[0].setup_all()
+        users = self.bsm.iam_client.list_users()["Users"]
+        assert "gh-ci-never-created" not in [user["UserName"] for user in users]
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.policy_arn",
+        preview=False,
+    )
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import pstats
+
+from simple_gh_aws_creds.cli import build_parser, run
+from simple_gh_aws_creds.tracing import Span, get_tracer
+from simple_gh_aws_creds.profiling import (
+    _span_stacks,
+    parse_import_time,
+    profile_run,
+)
+from simple_gh_aws_creds.tests.fake_github import FakeGitHub
+from simple_gh_aws_creds.tests.fleet_config import FLEET_CONFIG_TOML
+from simple_gh_aws_creds.tests.fake_iam import FakeIamClient, FakeBotoSession
+
+IMPORT_TIME = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |     botocore.utils
+import time:       400 |        500 |   botocore
+import time:        50 |         50 |   simple_gh_aws_creds.tracing
+import time:        20 |        570 | simple_gh_aws_creds.api
+"""
+
+
+def test_parse_import_time():
+    import_times = parse_import_time(IMPORT_TIME)
+    assert [i.module for i in import_times] == [
+        "botocore.utils",
+        "botocore",
+        "simple_gh_aws_creds.tracing",
+        "simple_gh_aws_creds.api",
+    ]
+    assert [i.depth for i in import_times] == [2, 1, 1, 0]
+    assert import_times[1].package == "botocore"
+    assert import_times[3].cumulative_us == 570
+
+
+def test_span_stacks():
+    def span(name, span_id, parent_id, start_ms, end_ms, **attributes):
+        return Span(
+            name=name,
+            trace_id="t",
+            span_id=span_id,
+            parent_id=parent_id,
+            start_ns=start_ms * 1_000_000,
+            end_ns=end_ms * 1_000_000,
+            attributes=attributes,
+        )
+
+    spans = [
+        span("apply a/r1", "1", None, 0, 100, command="apply"),
+        span("setup_iam", "2", "1", 10, 60),
+        span("iam.CreateUser", "3", "2", 10, 50),
+        span("apply a/r2", "4", None, 0, 20, command="apply"),
+    ]
+    assert _span_stacks(spans) == {
+        "apply": 70_000,
+        "apply;setup_iam": 10_000,
+        "apply;setup_iam;iam.CreateUser": 40_000,
+    }
+
+
+def test_profile_run(tmp_path):
+    path = tmp_path.joinpath("fleet.toml")
+    path.write_text(FLEET_CONFIG_TOML)
+    dir_profile = tmp_path.joinpath("profile")
+    kwargs = dict(
+        boto_ses=FakeBotoSession(FakeIamClient()),
+        github_token="t",
+        check_github=False,
+    )
+    args = build_parser().parse_args(
+        ["apply", "-c", str(path), "--parallel", "2", "--profile", str(dir_profile)]
+    )
+    with FakeGitHub():
+        assert run(args, io.StringIO(), **kwargs) == 0
+    assert get_tracer().enabled is False
+
+    # worker threads are profiled too
+    stats = pstats.Stats(str(dir_profile.joinpath("apply.prof")))
+    functions = {name for _, _, name in stats.stats}
+    assert "s11_create_iam_user" in functions
+
+    collapsed = dir_profile.joinpath("apply.collapsed").read_text().splitlines()
+    stacks = {line.rsplit(" ", 1)[0] for line in collapsed}
+    assert "apply;setup_iam;s11_create_iam_user;iam.CreateUser" in stacks
+
+    imports = json.loads(dir_profile.joinpath("imports.json").read_text())
+    assert "simple_gh_aws_creds" in imports["packages"]
+    assert imports["total_us"] > 0
+    assert "self time per package" in dir_profile.joinpath("imports.txt").read_text()
+
+
+def test_profile_run_single_repo(tmp_path):
+    with profile_run(tmp_path, name="single", import_time=False) as session:
+        sum(range(1000))
+    assert session.stats() is not None
+    assert tmp_path.joinpath("single.prof").exists()
+    assert tmp_path.joinpath("single.collapsed").read_text() == ""
+    assert not tmp_path.joinpath("imports.json").exists()
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.profiling",
+        preview=False,
+    )
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from simple_gh_aws_creds.secret_ledger import SecretLedger, fingerprint
+
+
+def test_secret_ledger(tmp_path):
+    path = tmp_path.joinpath("repo.secrets.json")
+    ledger = SecretLedger.load(path)
+    key = "actions/AWS_ACCESS_KEY_ID"
+    assert ledger.is_unchanged(key, "AKIA", "t1") is False
+
+    ledger.record(key, "AKIA", "t1")
+    assert ledger.is_unchanged(key, "AKIA", "t1") is True
+    # changed value, changed outside of this library, deleted
+    assert ledger.is_unchanged(key, "AKIA2", "t1") is False
+    assert ledger.is_unchanged(key, "AKIA", "t2") is False
+    assert ledger.is_unchanged(key, "AKIA", None) is False
+
+    ledger.save()
+    assert "AKIA" not in path.read_text()
+    assert fingerprint("AKIA") in path.read_text()
+    ledger = SecretLedger.load(path)
+    assert ledger.is_unchanged(key, "AKIA", "t1") is True
+
+    ledger.record(key, "AKIA", None)
+    assert ledger.secrets == {}
+
+    path.write_text("not json")
+    assert SecretLedger.load(path).secrets == {}
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.secret_ledger",
+        preview=False,
+    )
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import json
+from pathlib import Path
+
+import pytest
+
+from simple_gh_aws_creds.state import ApplyState
+from simple_gh_aws_creds.sharding import (
+    Shard,
+    shard_of,
+    merge_results,
+    merge_states,
+)
+
+
+def test_shard():
+    # the assignment must never change between releases
+    assert shard_of("MacHu-GWU/simple_gh_aws_creds-project", 8) == 2
+
+    names = [f"owner{i % 7}/repo{i}" for i in range(1000)]
+    shards = [Shard(index=i, count=4) for i in range(4)]
+    counts = [sum(shard.contains(name) for name in names) for shard in shards]
+    assert sum(counts) == 1000
+    assert min(counts) > 200
+
+    shard = Shard.parse("1/4")
+    assert shard == Shard(index=1, count=4)
+    assert str(shard) == "1/4"
+    assert shard.state_file(Path("/tmp/.fleet_state.json")) == Path(
+        "/tmp/.fleet_state.shard-1-of-4.json"
+    )
+    for text in ["4/4", "-1/4", "1", "a/b", "0/0"]:
+        with pytest.raises(ValueError):
+            Shard.parse(text)
+
+
+def test_merge(tmp_path):
+    path1 = tmp_path.joinpath("results-0.jsonl")
+    path2 = tmp_path.joinpath("results-1.jsonl")
+    path1.write_text(
+        json.dumps({"repo": "b/2", "ok": False})
+        + "\n\n"
+        + json.dumps({"repo": "a/1", "ok": True})
+        + "\n"
+    )
+    path2.write_text(json.dumps({"repo": "b/2", "ok": True}) + "\n")
+    assert merge_results([path1, path2]) == [
+        {"repo": "a/1", "ok": True},
+        {"repo": "b/2", "ok": True},
+    ]
+
+    state1 = ApplyState(path=tmp_path.joinpath("s.shard-0-of-2.json"))
+    state1.repos = {
+        "a/1": {"spec_hash": "h1", "applied_at": "2026-01-01"},
+        "b/2": {"spec_hash": "old", "applied_at": "2026-01-01"},
+    }
+    state1.save()
+    state2 = ApplyState(path=tmp_path.joinpath("s.shard-1-of-2.json"))
+    state2.repos = {"b/2": {"spec_hash": "new", "applied_at": "2026-02-01"}}
+    state2.save()
+    merge_states([state2.path, state1.path], tmp_path.joinpath("s.json"))
+    merged = ApplyState.load(tmp_path.joinpath("s.json"))
+    assert merged.repos["a/1"]["spec_hash"] == "h1"
+    assert merged.repos["b/2"]["spec_hash"] == "new"
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.sharding",
+        preview=False,
+    )
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from simple_gh_aws_creds.shared_policy import (
+    POLICY_MAX_VERSIONS,
+    SharedPolicyManager,
+    shared_policy_name_for,
+)
+from simple_gh_aws_creds.drift import scan_drift
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+from simple_gh_aws_creds.tests.fake_github import FakeGitHub
+from simple_gh_aws_creds.tests.factory import make_setup_github_repo
+
+
+def make_document(*actions: str) -> dict:
+    return {
+        "Version": "2012-10-17",
+        "Statement": [
+            {"Effect": "Allow", "Action": list(actions), "Resource": "*"}
+        ],
+    }
+
+
+def test_shared_policy_name_for():
+    assert shared_policy_name_for(
+        make_document("s3:GetObject", "s3:ListBucket")
+    ) == shared_policy_name_for(make_document("s3:ListBucket", "s3:GetObject"))
+
+
+class TestSharedPolicyManager(BaseMockAwsTest):
+    def test_ensure(self):
+        iam_client = self.bsm.iam_client
+        manager = SharedPolicyManager(iam_client=iam_client)
+        assert manager.describe("p1") is None
+        arn = manager.ensure("p1", make_document("s3:GetObject"))
+        assert manager.ensure("p1", make_document("s3:GetObject")) == arn
+        assert manager.describe("p1").default_version_id == "v1"
+
+        # every update is a new default version, at most 5 versions are kept
+        for i in range(POLICY_MAX_VERSIONS + 2):
+            manager = SharedPolicyManager(iam_client=iam_client)
+            assert manager.ensure("p1", make_document(f"s3:Action{i}")) == arn
+        res = iam_client.list_policy_versions(PolicyArn=arn)
+        assert len(res["Versions"]) == POLICY_MAX_VERSIONS
+        state = manager.describe("p1")
+        assert state.default_version_id == f"v{POLICY_MAX_VERSIONS + 3}"
+
+    def test_setup(self, tmp_path):
+        iam_client = self.bsm.iam_client
+        manager = SharedPolicyManager(iam_client=iam_client)
+        setups = [
+            make_setup_github_repo(self.boto_ses, tmp_path, i) for i in range(3)
+        ]
+        # repo0 starts with an inline policy, then switches to the shared one
+        setups[0].s11_create_iam_user()
+        setups[0].s12_put_iam_policy()
+        for setup in setups:
+            setup.use_shared_policy = True
+            setup.shared_policy_manager = manager
+            setup.s11_create_iam_user()
+            setup.s12_put_iam_policy()
+
+        name = setups[0].resolved_shared_policy_name
+        arn = manager.describe(name).arn
+        assert iam_client.get_policy(PolicyArn=arn)["Policy"]["AttachmentCount"] == 3
+        for setup in setups:
+            res = iam_client.list_attached_user_policies(UserName=setup.iam_user_name)
+            assert [dct["PolicyArn"] for dct in res["AttachedPolicies"]] == [arn]
+            res = iam_client.list_user_policies(UserName=setup.iam_user_name)
+            assert res["PolicyNames"] == []
+
+        drifts = list(scan_drift(setups, iam_client=iam_client, check_github=False))
+        assert all(drift.drifted is False for drift in drifts), drifts
+
+        with FakeGitHub() as github:
+            assert setups[0].put_github_secrets("AKIA", "secret") is True
+            for setup in setups:
+                setup.teardown_all()
+        assert github.get_secret_names("alice/repo0") == []
+        assert manager.describe(name) is not None
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.shared_policy",
+        preview=False,
+    )
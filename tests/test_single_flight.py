@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from simple_gh_aws_creds.single_flight import SingleFlight
+
+
+def test_coalesce_concurrent_calls():
+    sf = SingleFlight()
+    counter = {"n": 0}
+    started = threading.Event()
+
+    def func():
+        counter["n"] += 1
+        started.set()
+        time.sleep(0.1)
+        return {"value": 1}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(sf.do, "key", func) for _ in range(8)]
+        results = [future.result() for future in futures]
+    assert counter["n"] == 1
+    assert all(result is results[0] for result in results)
+    assert sf.n_calls == 1
+    assert sf.n_shared == 7
+
+    # ttl = 0, a later call runs again
+    sf.do("key", func)
+    assert counter["n"] == 2
+
+
+def test_ttl_and_errors():
+    now = {"t": 0.0}
+    sf = SingleFlight(ttl=10, clock=lambda: now["t"])
+    counter = {"n": 0}
+
+    def func():
+        counter["n"] += 1
+        return counter["n"]
+
+    assert sf.do("a", func) == 1
+    assert sf.do("a", func) == 1
+    now["t"] = 11
+    assert sf.do("a", func) == 2
+    sf.forget("a")
+    assert sf.do("a", func) == 3
+    sf.clear()
+    assert sf.do("a", func) == 4
+
+    def fail():
+        counter["n"] += 1
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        sf.do("b", fail)
+    with pytest.raises(ValueError):
+        sf.do("b", fail)
+    assert counter["n"] == 6
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.single_flight",
+        preview=False,
+    )
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from simple_gh_aws_creds.state import ApplyState, spec_hash
+from simple_gh_aws_creds.tests.factory import make_setup_github_repo
+
+
+def test_spec_hash(tmp_path):
+    setup = make_setup_github_repo(None, tmp_path, 1)
+    hash1 = spec_hash(setup)
+    assert spec_hash(make_setup_github_repo(None, tmp_path, 1)) == hash1
+    assert spec_hash(make_setup_github_repo(None, tmp_path, 2)) != hash1
+
+    # same permissions written differently, same hash
+    setup.policy_document = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Action": ["iam:ListAccountAliases", "iam:ListAccountAliases"],
+                "Resource": ["*"],
+            }
+        ],
+    }
+    assert spec_hash(setup) == hash1
+    setup.github_secret_name_aws_default_region = "AWS_REGION"
+    assert spec_hash(setup) != hash1
+
+
+def test_apply_state(tmp_path):
+    path = tmp_path.joinpath("state.json")
+    state = ApplyState.load(path)
+    assert state.is_changed("alice/repo1", "h1")
+    state.record("alice/repo1", "h1")
+    state.record("alice/repo2", "h2")
+    state.forget("alice/repo2")
+    state.save()
+
+    state = ApplyState.load(path)
+    assert state.is_changed("alice/repo1", "h1") is False
+    assert state.is_changed("alice/repo1", "h2")
+    assert list(state.repos) == ["alice/repo1"]
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.state",
+        preview=False,
+    )
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import threading
+
+import pytest
+import responses
+import botocore.awsrequest
+import botocore.exceptions
+from github import GithubException
+
+from simple_gh_aws_creds.fleet import FleetConfig, run_fleet
+from simple_gh_aws_creds.cli import build_parser, run
+from simple_gh_aws_creds.concurrency import bounded_imap_unordered
+from simple_gh_aws_creds.github_client import GITHUB_API_URL, GitHubClient
+from simple_gh_aws_creds.tracing import (
+    NOOP_SPAN,
+    STATUS_ERROR,
+    Tracer,
+    InMemoryExporter,
+    OtlpHttpExporter,
+    attach_to_boto_client,
+    current_span,
+    get_tracer,
+    set_tracer,
+)
+from simple_gh_aws_creds.tests.fake_github import FakeGitHub
+from simple_gh_aws_creds.tests.fleet_config import FLEET_CONFIG_TOML
+from simple_gh_aws_creds.tests.fake_iam import FakeIamClient, FakeBotoSession
+from simple_gh_aws_creds.tests.mock_aws import BaseMockAwsTest
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemoryExporter()
+    previous = set_tracer(Tracer([exporter]))
+    yield exporter
+    set_tracer(previous)
+
+
+@pytest.fixture
+def github():
+    with FakeGitHub() as github:
+        yield github
+
+
+def test_disabled():
+    tracer = Tracer()
+    assert tracer.enabled is False
+    with tracer.span("noop") as span:
+        assert span is NOOP_SPAN
+        assert current_span() is NOOP_SPAN
+
+
+def test_span(exporter):
+    tracer = get_tracer()
+    with tracer.span("root", parent=None) as root:
+        with tracer.span("child") as child:
+            assert current_span() is child
+        with pytest.raises(ValueError):
+            with tracer.span("failed"):
+                raise ValueError("boom")
+        # the current span follows work items into the pool threads
+        children = list(
+            bounded_imap_unordered(lambda i: current_span(), range(4), max_workers=2)
+        )
+        assert all(span is root for span in children)
+    spans = {span.name: span for span in exporter.spans}
+    assert spans["child"].parent_id == root.span_id
+    assert spans["child"].trace_id == root.trace_id
+    assert spans["root"].parent_id is None
+    assert spans["failed"].status == STATUS_ERROR
+    assert spans["failed"].attributes["error.type"] == "ValueError"
+    assert [span.name for span in exporter.spans] == ["child", "failed", "root"]
+
+
+def test_boto_client(exporter):
+    client = FakeIamClient()
+    attach_to_boto_client(client)
+    client.create_user(UserName="u1")
+    with pytest.raises(botocore.exceptions.ClientError):
+        client.get_user(UserName="u2")
+    ok, failed = exporter.spans
+    assert ok.name == "iam.CreateUser"
+    assert ok.attributes["http.status_code"] == 200
+    assert failed.status == STATUS_ERROR
+    assert failed.attributes["aws.error_code"] == "NoSuchEntity"
+
+
+class _RawResponse:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+THROTTLING_BODY = b"""<ErrorResponse>
+<Error><Type>Sender</Type><Code>Throttling</Code><Message>Rate exceeded</Message></Error>
+<RequestId>r1</RequestId>
+</ErrorResponse>"""
+
+
+class TestBotoRetry(BaseMockAwsTest):
+    def test(self, exporter):
+        client = self.boto_ses.client("iam")
+        attach_to_boto_client(client)
+        n_throttled = list()
+
+        def throttle_once(request, **kwargs):
+            if not n_throttled:
+                n_throttled.append(request)
+                return botocore.awsrequest.AWSResponse(
+                    request.url, 400, {}, _RawResponse(THROTTLING_BODY)
+                )
+
+        # before moto, which answers every request
+        client.meta.events.register_first("before-send.iam", throttle_once)
+        client.list_users()
+        client.list_users()
+        retried, ok = exporter.spans
+        assert retried.attributes["aws.retry_attempts"] == 1
+        assert retried.attributes["aws.retry_backoff_ms"] >= 0
+        assert ok.attributes["aws.retry_attempts"] == 0
+        assert "aws.retry_backoff_ms" not in ok.attributes
+
+
+@responses.activate
+def test_github_client(exporter):
+    url = f"{GITHUB_API_URL}/repos/alice/repo1"
+    responses.add(
+        responses.GET,
+        url,
+        json={"id": 1},
+        headers={"x-ratelimit-remaining": "4999"},
+    )
+    GitHubClient(token="t").get_repo("alice", "repo1")
+    (span,) = exporter.spans
+    assert span.name == "github.GET"
+    assert span.attributes["http.status_code"] == 200
+    assert span.attributes["github.ratelimit_remaining"] == 4999
+    assert span.attributes["github.retry_attempts"] == 0
+
+    # secondary rate limit, retried after the time GitHub asks for
+    responses.replace(
+        responses.GET, url, status=429, headers={"retry-after": "0.01"}
+    )
+    responses.add(responses.GET, url, json={"id": 1})
+    GitHubClient(token="t").get_repo("alice", "repo1")
+    span = exporter.spans[-1]
+    assert span.attributes["http.status_code"] == 200
+    assert span.attributes["github.retry_attempts"] == 1
+    assert span.attributes["github.retry_backoff_ms"] == 10
+
+    # too long to wait, or too many retries
+    responses.replace(
+        responses.GET, url, status=429, headers={"retry-after": "3600"}
+    )
+    with pytest.raises(GithubException):
+        GitHubClient(token="t").get_repo("alice", "repo1")
+    assert exporter.spans[-1].attributes["github.retry_attempts"] == 0
+    responses.replace(responses.GET, url, status=429, headers={"retry-after": "0"})
+    with pytest.raises(GithubException):
+        GitHubClient(token="t", max_retries=2).get_repo("alice", "repo1")
+    assert exporter.spans[-1].attributes["github.retry_attempts"] == 2
+
+
+def test_run_fleet(tmp_path, exporter, github):
+    path = tmp_path.joinpath("fleet.toml")
+    path.write_text(FLEET_CONFIG_TOML)
+    config = FleetConfig.from_file(path)
+    kwargs = dict(
+        boto_ses=FakeBotoSession(FakeIamClient()),
+        github_token="t",
+        check_github=False,
+    )
+    results = list(run_fleet("apply", config, only=["alice/repo1"], **kwargs))
+    assert results[0].ok, results
+
+    spans = {span.name: span for span in exporter.spans}
+    root = spans["apply alice/repo1"]
+    assert root.parent_id is None
+    assert "github.queue_wait_ms" in root.attributes
+    assert spans["setup_iam"].parent_id == root.span_id
+    assert spans["put_github_secrets"].parent_id == root.span_id
+    assert spans["github.PUT"].parent_id == spans["put_github_secrets"].span_id
+    assert spans["s11_create_iam_user"].parent_id == spans["setup_iam"].span_id
+    assert spans["iam.CreateUser"].parent_id == spans["s11_create_iam_user"].span_id
+    assert {span.trace_id for span in exporter.spans} == {root.trace_id}
+
+
+def test_chrome_trace_exporter(tmp_path, github):
+    path = tmp_path.joinpath("fleet.toml")
+    path.write_text(FLEET_CONFIG_TOML)
+    path_trace = tmp_path.joinpath("trace.json")
+    kwargs = dict(
+        boto_ses=FakeBotoSession(FakeIamClient()),
+        github_token="t",
+        check_github=False,
+    )
+    args = build_parser().parse_args(
+        ["apply", "-c", str(path), "--only", "bob/*", "--trace", str(path_trace)]
+    )
+    assert run(args, io.StringIO(), **kwargs) == 0
+    assert get_tracer().enabled is False
+
+    events = json.loads(path_trace.read_text())["traceEvents"]
+    names = {event["name"] for event in events if event["ph"] == "X"}
+    assert {"apply bob/repo3", "s12_put_iam_policy", "iam.PutUserPolicy"} <= names
+    assert any(event["ph"] == "M" for event in events)
+
+
+@responses.activate
+def test_otlp_http_exporter():
+    endpoint = "http://collector:4318/v1/traces"
+    responses.add(responses.POST, endpoint, status=200)
+    exporter = OtlpHttpExporter(endpoint=endpoint, batch_size=2)
+    tracer = Tracer([exporter])
+    with tracer.span("root", attributes={"n": 1, "ok": True}):
+        with tracer.span("child"):
+            pass
+    with tracer.span("last"):
+        pass
+    tracer.shutdown()
+    assert len(responses.calls) == 2
+    assert exporter.n_exported == 3
+
+    payload = json.loads(responses.calls[0].request.body)
+    scope_spans = payload["resourceSpans"][0]["scopeSpans"][0]
+    child, root = scope_spans["spans"]
+    assert child["parentSpanId"] == root["spanId"]
+    assert {"key": "n", "value": {"intValue": "1"}} in root["attributes"]
+    assert {"key": "ok", "value": {"boolValue": True}} in root["attributes"]
+
+    responses.replace(responses.POST, endpoint, status=503)
+    with tracer.span("lost"):
+        pass
+    tracer.shutdown()
+    assert exporter.n_failed == 1
+
+
+@responses.activate
+def test_otlp_http_exporter_background():
+    endpoint = "http://collector:4318/v1/traces"
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_collector(request):
+        started.set()
+        release.wait(timeout=10)
+        return 200, {}, ""
+
+    responses.add_callback(responses.POST, endpoint, callback=slow_collector)
+    exporter = OtlpHttpExporter(endpoint=endpoint, batch_size=1, max_queue_size=1)
+    tracer = Tracer([exporter])
+    # the collector hangs, ending spans doesn't wait for it
+    with tracer.span("sent"):
+        pass
+    assert started.wait(timeout=10)
+    with tracer.span("queued"):
+        pass
+    with tracer.span("dropped"):
+        pass
+    assert exporter.n_exported == 0
+    assert exporter.n_failed == 1
+    release.set()
+    tracer.shutdown()
+    assert exporter.n_exported == 2
+    assert len(responses.calls) == 2
+
+
+if __name__ == "__main__":
+    from simple_gh_aws_creds.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "simple_gh_aws_creds.tracing",
+        preview=False,
+    )